@@ -4,6 +4,7 @@ in the askbot.models module, but
 api must become a place to manupulate the data in the askbot application
 so that other implementations of the data storage could be possible
 """
+from django.core import cache
 from django.db.models import Q
 from askbot import models
 from askbot import const
@@ -18,14 +19,16 @@ def get_info_on_moderation_items(user):
     if not(user.is_moderator() or user.is_administrator()):
         return None
 
-    content_types = (
-        const.TYPE_ACTIVITY_MARK_OFFENSIVE,
-        const.TYPE_ACTIVITY_MODERATED_NEW_POST,
-        const.TYPE_ACTIVITY_MODERATED_POST_EDIT,
-    )
+    #counts are cached until any moderation item changes
+    key = 'moderation-items-%s-%d' % (
+                        models.get_moderation_items_version(), user.id
+                    )
+    info = cache.cache.get(key)
+    if info is not None:
+        return info
 
     messages = models.ActivityAuditStatus.objects.filter(
-        activity__activity_type__in = content_types,
+        activity__activity_type__in = models.MODERATION_ACTIVITY_TYPES,
         user = user
     )
 
@@ -35,10 +38,12 @@ def get_info_on_moderation_items(user):
     new_count = messages.filter(
                     status = models.ActivityAuditStatus.STATUS_NEW
                 ).count()
-    return {
+    info = {
         'seen_count': seen_count,
         'new_count': new_count
     }
+    cache.cache.set(key, info)
+    return info
 
 def get_admin(seed_user_id = None):
     """returns user objects with id == seed_user_id
@@ -8,8 +8,12 @@ Many of these functions are being replaced with assertions:
 User.assert_can...
 """
 import datetime
+from django.contrib.auth.models import User
 from django.db import transaction
-from askbot.models import Repute
+from django.db.models import F
+from askbot import const
+from askbot.models import Post, Repute, Thread
+from askbot.models import user_directory
 #from askbot.models import Answer
 from askbot.models import signals
 from askbot.conf import settings as askbot_settings
@@ -255,16 +259,73 @@ def onAnswerAcceptCanceled(answer, user, timestamp=None):
                reputation=user.reputation)
     reputation.save()
 
+def change_reputation(user, points):
+    """changes reputation of the user with an atomic update,
+    same as :meth:`User.receive_reputation` followed by the save,
+    ``user.reputation`` is set to the stored value"""
+    #the user is moved from the position of this reputation
+    #in the cached lists of the users
+    old_reputation = user.reputation
+    users = User.objects.filter(id=user.id)
+    users.update(reputation=F('reputation') + points)
+    if points < 0:
+        users.filter(
+            reputation__lt=const.MIN_REPUTATION
+        ).update(
+            reputation=const.MIN_REPUTATION
+        )
+    user.reputation = users.values_list('reputation', flat=True)[0]
+    if user_directory.is_enabled():
+        user_directory.update_reputation(user, old_reputation)
+
+def change_post_score(post, up_votes=0, down_votes=0):
+    """changes counts of the votes and the score of the post
+    and of the thread of the question with atomic updates,
+    the counts of the votes do not go below zero"""
+    points = up_votes - down_votes
+    if post.post_type == 'comment':
+        #comments count only the score
+        up_votes = 0
+    posts = Post.objects.filter(id=post.id)
+    posts.update(
+            points=F('points') + points,
+            vote_up_count=F('vote_up_count') + up_votes,
+            vote_down_count=F('vote_down_count') + down_votes
+        )
+    if up_votes < 0:
+        posts.filter(vote_up_count__lt=0).update(vote_up_count=0)
+    if down_votes < 0:
+        posts.filter(vote_down_count__lt=0).update(vote_down_count=0)
+    post.points = int(post.points) + points
+    post.vote_up_count = max(int(post.vote_up_count) + up_votes, 0)
+    post.vote_down_count = max(int(post.vote_down_count) + down_votes, 0)
+
+    if post.post_type == 'question':
+        #denormalize the question post score on the thread
+        Thread.objects.filter(id=post.thread_id).update(
+                                        points=F('points') + points
+                                    )
+
+def queue_summary_html_update(post):
+    """queues re-rendering of the question summary, called
+    after the vote is committed, so that the task reads
+    the new score"""
+    if post.post_type == 'question':
+        from askbot.tasks import update_thread_summary_html_celery_task
+        update_thread_summary_html_celery_task.delay(post.thread_id)
+
+def get_question(post):
+    if post.post_type == 'question':
+        return post
+    return post.thread._question_post()
+
 @transaction.commit_on_success
 def onUpVoted(vote, post, user, timestamp=None):
     if timestamp is None:
         timestamp = datetime.datetime.now()
     vote.save()
 
-    if post.post_type != 'comment':
-        post.vote_up_count = int(post.vote_up_count) + 1
-    post.points = int(post.points) + 1
-    post.save()
+    change_post_score(post, up_votes=1)
 
     if post.post_type == 'comment':
         #reputation is not affected by the comment votes
@@ -274,16 +335,14 @@ def onUpVoted(vote, post, user, timestamp=None):
         author = post.author
         todays_rep_gain = Repute.objects.get_reputation_by_upvoted_today(author)
         if todays_rep_gain <  askbot_settings.MAX_REP_GAIN_PER_USER_PER_DAY:
-            author.receive_reputation(
+            change_reputation(
+                author,
                 askbot_settings.REP_GAIN_FOR_RECEIVING_UPVOTE
             )
-            author.save()
-
-            question = post.thread._question_post() # TODO: this is suboptimal if post is already a question
 
             reputation = Repute(user=author,
                        positive=askbot_settings.REP_GAIN_FOR_RECEIVING_UPVOTE,
-                       question=question,
+                       question=get_question(post),
                        reputed_at=timestamp,
                        reputation_type=1,
                        reputation=author.reputation)
@@ -295,13 +354,7 @@ def onUpVotedCanceled(vote, post, user, timestamp=None):
         timestamp = datetime.datetime.now()
     vote.delete()
 
-    if post.post_type != 'comment':
-        post.vote_up_count = int(post.vote_up_count) - 1
-        if post.vote_up_count < 0:
-            post.vote_up_count  = 0
-
-    post.points = int(post.points) - 1
-    post.save()
+    change_post_score(post, up_votes=-1)
 
     if post.post_type == 'comment':
         #comment votes do not affect reputation
@@ -309,17 +362,15 @@ def onUpVotedCanceled(vote, post, user, timestamp=None):
 
     if not (post.wiki or post.is_anonymous):
         author = post.author
-        author.receive_reputation(
+        change_reputation(
+            author,
             askbot_settings.REP_LOSS_FOR_RECEIVING_UPVOTE_CANCELATION
         )
-        author.save()
-
-        question = post.thread._question_post() # TODO: this is suboptimal if post is already a question
 
         reputation = Repute(
             user=author,
             negative=askbot_settings.REP_LOSS_FOR_RECEIVING_UPVOTE_CANCELATION,
-            question=question,
+            question=get_question(post),
             reputed_at=timestamp,
             reputation_type=-8,
             reputation=author.reputation
@@ -332,18 +383,16 @@ def onDownVoted(vote, post, user, timestamp=None):
         timestamp = datetime.datetime.now()
     vote.save()
 
-    post.vote_down_count = int(post.vote_down_count) + 1
-    post.points = int(post.points) - 1
-    post.save()
+    change_post_score(post, down_votes=1)
 
     if not (post.wiki or post.is_anonymous):
         author = post.author
-        author.receive_reputation(
+        change_reputation(
+            author,
             askbot_settings.REP_LOSS_FOR_RECEIVING_DOWNVOTE
         )
-        author.save()
 
-        question = post.thread._question_post() # TODO: this is suboptimal if post is already a question
+        question = get_question(post)
 
         reputation = Repute(user=author,
                    negative=askbot_settings.REP_LOSS_FOR_RECEIVING_DOWNVOTE,
@@ -353,10 +402,10 @@ def onDownVoted(vote, post, user, timestamp=None):
                    reputation=author.reputation)
         reputation.save()
 
-        user.receive_reputation(
+        change_reputation(
+            user,
             askbot_settings.REP_LOSS_FOR_DOWNVOTING,
         )
-        user.save()
 
         reputation = Repute(user=user,
                    negative=askbot_settings.REP_LOSS_FOR_DOWNVOTING,
@@ -372,20 +421,16 @@ def onDownVotedCanceled(vote, post, user, timestamp=None):
         timestamp = datetime.datetime.now()
     vote.delete()
 
-    post.vote_down_count = int(post.vote_down_count) - 1
-    if post.vote_down_count < 0:
-        post.vote_down_count  = 0
-    post.points = post.points + 1
-    post.save()
+    change_post_score(post, down_votes=-1)
 
     if not (post.wiki or post.is_anonymous):
         author = post.author
-        author.receive_reputation(
+        change_reputation(
+            author,
             askbot_settings.REP_GAIN_FOR_RECEIVING_DOWNVOTE_CANCELATION
         )
-        author.save()
 
-        question = post.thread._question_post() # TODO: this is suboptimal if post is already a question
+        question = get_question(post)
 
         reputation = Repute(user=author,
                 positive=\
@@ -397,8 +442,7 @@ def onDownVotedCanceled(vote, post, user, timestamp=None):
             )
         reputation.save()
 
-        user.receive_reputation(askbot_settings.REP_GAIN_FOR_CANCELING_DOWNVOTE)
-        user.save()
+        change_reputation(user, askbot_settings.REP_GAIN_FOR_CANCELING_DOWNVOTE)
 
         reputation = Repute(user=user,
                    positive=askbot_settings.REP_GAIN_FOR_CANCELING_DOWNVOTE,
@@ -37,7 +37,13 @@ def should_show_sort_by_relevance():
     """True if configuration support sorting
     questions by search relevance
     """
-    return ('postgresql_psycopg2' in askbot.get_database_engine_name())
+    from askbot.search import backends
+    backend = backends.get_backend()
+    if isinstance(backend, backends.HaystackSearchBackend):
+        #haystack results keep the order of the search engine,
+        #the option is offered on postgresql, as before
+        return ('postgresql_psycopg2' in askbot.get_database_engine_name())
+    return backend.supports_relevance
 
 def get_tag_display_filter_strategy_choices():
     from askbot.conf import settings as askbot_settings
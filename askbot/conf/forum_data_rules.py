@@ -449,6 +449,21 @@ settings.register(
     )
 )
 
+settings.register(
+    livesettings.BooleanValue(
+        FORUM_DATA_RULES,
+        'QUESTIONS_KEYSET_PAGINATION_ENABLED',
+        default=False,
+        description=_('Use fast pagination of the question lists'),
+        help_text=_(
+            'When enabled, "next" and "previous" pages of the questions '
+            'are retrieved by position in the list rather than by '
+            'the page number and the total number of questions '
+            'is cached for a few minutes. Recommended for large sites.'
+        )
+    )
+)
+
 settings.register(
     livesettings.StringValue(
         FORUM_DATA_RULES,
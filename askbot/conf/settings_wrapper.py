@@ -19,12 +19,30 @@ for the most part, so actual values are reliably available only
 at run time
 
 askbot.deps.livesettings is a module developed for satchmo project
+
+Values of all settings are read from a snapshot - dictionary
+kept in the process memory. Version of the settings is stored
+in the shared cache, it is checked once per request (and at least
+every few seconds outside of the requests) and the snapshot is rebuilt
+when the version changes - when any setting is updated
+in any process.
 """
+import random
+import time
 from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import DatabaseError
+from askbot import const
 from askbot.deps.livesettings import SortedDotDict, config_register
 from askbot.deps.livesettings.functions import config_get
+from askbot.deps.livesettings.models import Setting, LongSetting, SettingNotSet
+from askbot.deps.livesettings.overrides import get_overrides
 from askbot.deps.livesettings import signals
 
+VERSION_CACHE_KEY = 'askbot-livesettings-version'
+#seconds between the version checks outside of the requests
+VERSION_CHECK_INTERVAL = 5
+
 class ConfigSettings(object):
     """A very simple Singleton wrapper for settings
     a limitation is that all settings names using this class
@@ -33,6 +51,9 @@ class ConfigSettings(object):
     """
     __instance = None
     __group_map = {}
+    __snapshot = None
+    __snapshot_version = None
+    __version_checked_at = 0
 
     def __init__(self):
         """assigns SortedDotDict to self.__instance if not set"""
@@ -47,7 +68,11 @@ class ConfigSettings(object):
         will be required in code to convert an app
         depending on django.conf.settings to askbot.deps.livesettings
         """
-        return getattr(self.__instance, key).value
+        snapshot = self.get_snapshot()
+        try:
+            return snapshot[key]
+        except KeyError:
+            return getattr(self.__instance, key).value
 
     def get_default(self, key):
         """return the defalut value for the setting"""
@@ -64,13 +89,26 @@ class ConfigSettings(object):
     def update(self, key, value):
         try:
             setting = config_get(self.__group_map[key], key) 
+            self.clear_cached_setting(setting)
             setting.update(value)
         except:
-            from askbot.deps.livesettings.models import Setting
             setting = Setting.objects.get(key=key)
             setting.value = value
             setting.save()
-        #self.prime_cache()
+        #the snapshot is rebuilt even if livesettings did not
+        #find the change, the snapshot could be outdated too
+        self.invalidate_snapshot()
+
+    def clear_cached_setting(self, value):
+        """deletes stored setting from the livesettings cache,
+        the cached copy may be outdated, e.g. after a transaction
+        rollback, then livesettings would skip the update"""
+        try:
+            stored_setting = value.setting
+        except SettingNotSet:
+            return
+        if hasattr(stored_setting, 'cache_delete'):
+            stored_setting.cache_delete()
 
     def register(self, value):
         """registers the setting
@@ -91,26 +129,80 @@ class ConfigSettings(object):
         if key not in self.__instance:
             self.__instance[key] = config_register(value)
             self.__group_map[key] = group_key
+            ConfigSettings.__snapshot = None
 
     def as_dict(self):
-        settings = cache.get('askbot-livesettings')
-        if settings:
-            return settings
-        else:
-            self.prime_cache()
-            return cache.get('askbot-livesettings')
+        """returns copy of the dictionary of all settings"""
+        return dict(self.get_snapshot())
+
+    @classmethod
+    def get_snapshot(cls):
+        """returns dictionary of all settings,
+        rebuilt when the version of the settings changes"""
+        now = time.time()
+        if cls.__version_checked_at < now - VERSION_CHECK_INTERVAL:
+            cls.__version_checked_at = now
+            version = cache.get(VERSION_CACHE_KEY)
+            if version is None:
+                version = random.getrandbits(32)
+                if not cache.add(VERSION_CACHE_KEY, version, const.LONG_TIME):
+                    version = cache.get(VERSION_CACHE_KEY)
+            if version != cls.__snapshot_version:
+                cls.__snapshot = None
+                cls.__snapshot_version = version
+
+        snapshot = cls.__snapshot
+        if snapshot is None:
+            snapshot = cls.read_values()
+            cls.__snapshot = snapshot
+        return snapshot
 
     @classmethod
-    def prime_cache(cls, **kwargs):
-        """reload all settings into cache as dictionary
+    def read_values(cls):
+        """returns dictionary of values of all settings,
+        stored settings are found with two queries,
+        settings which are not stored take the default values
         """
-        out = dict()
+        use_db, overrides = get_overrides()
+        try:
+            stored_keys = set(Setting.objects.values_list('group', 'key'))
+            stored_keys.update(LongSetting.objects.values_list('group', 'key'))
+        except DatabaseError:
+            #tables are not created yet
+            use_db = False
+
+        values = dict()
         for key in cls.__instance.keys():
             #todo: this is odd that I could not use self.__instance.items() mapping here
-            out[key] = cls.__instance[key].value
-        cache.set('askbot-livesettings', out)
+            value = cls.__instance[key]
+            group_key = value.group.key
+            if use_db and value.use_default \
+                and (group_key, key) not in stored_keys \
+                and key not in overrides.get(group_key, {}):
+                values[key] = value.to_python(value.default)
+            else:
+                values[key] = value.value
+        return values
+
+    @classmethod
+    def check_version(cls, **kwargs):
+        """version of the settings will be checked
+        on the next read of any setting"""
+        cls.__version_checked_at = 0
+
+    @classmethod
+    def invalidate_snapshot(cls, **kwargs):
+        """increments the version of the settings, so that
+        all processes rebuild the snapshots"""
+        try:
+            cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            pass
+        cls.__snapshot = None
+        cls.__version_checked_at = 0
 
 
-signals.configuration_value_changed.connect(ConfigSettings.prime_cache)
+signals.configuration_value_changed.connect(ConfigSettings.invalidate_snapshot)
+request_started.connect(ConfigSettings.check_version)
 #settings instance to be used elsewhere in the project
 settings = ConfigSettings()
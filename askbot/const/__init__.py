@@ -20,6 +20,7 @@ CLOSE_REASONS = (
 )
 
 LONG_TIME = 60*60*24*30 #30 days is a lot of time
+THREAD_LISTING_COUNT_CACHE_TIMEOUT = 60*5 #question counts on the main page
 DATETIME_FORMAT = '%I:%M %p, %d %b %Y'
 
 SHARE_NOTHING = 0
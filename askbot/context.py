@@ -4,6 +4,7 @@ and the application available for the templates
 """
 import sys
 from django.conf import settings
+from django.core import cache
 from django.core.urlresolvers import reverse
 from django.utils import simplejson
 from django.utils.translation import get_language
@@ -85,35 +86,50 @@ def application_settings(request):
     }
 
     if askbot_settings.GROUPS_ENABLED:
-        #calculate context needed to list all the groups
-        def _get_group_url(group):
-            """calculates url to the group based on its id and name"""
-            group_slug = slugify(group['name'])
-            return reverse(
-                'users_by_group',
-                kwargs={'group_id': group['id'], 'group_slug': group_slug}
-            )
-
-        #load id's and names of all groups
-        global_group = models.Group.objects.get_global_group()
-        groups = models.Group.objects.exclude_personal()
-        groups = groups.exclude(id=global_group.id)
-        groups_data = list(groups.values('id', 'name'))
-
-        #sort groups_data alphanumerically, but case-insensitive
-        groups_data = sorted(
-                        groups_data,
-                        lambda x, y: cmp(x['name'].lower(), y['name'].lower())
-                    )
-
-        #insert data for the global group at the first position
-        groups_data.insert(0, {'id': global_group.id, 'name': global_group.name})
-
-        #build group_list for the context
-        group_list = list()
-        for group in groups_data:
-            link = _get_group_url(group)
-            group_list.append({'name': group['name'], 'link': link})
-        context['group_list'] = simplejson.dumps(group_list)
+        context['group_list'] = get_group_list_json()
 
     return context
+
+
+def get_group_list_json():
+    """returns json encoded list of names and urls of all groups,
+    except the personal ones, the list is cached per language
+    until any group is saved or deleted"""
+    key = 'group-list-%s-%s' % (models.get_group_list_version(), get_language())
+    group_list_json = cache.cache.get(key)
+    if group_list_json is not None:
+        return group_list_json
+
+    #calculate context needed to list all the groups
+    def _get_group_url(group):
+        """calculates url to the group based on its id and name"""
+        group_slug = slugify(group['name'])
+        return reverse(
+            'users_by_group',
+            kwargs={'group_id': group['id'], 'group_slug': group_slug}
+        )
+
+    #load id's and names of all groups
+    global_group = models.Group.objects.get_global_group()
+    groups = models.Group.objects.exclude_personal()
+    groups = groups.exclude(id=global_group.id)
+    groups_data = list(groups.values('id', 'name'))
+
+    #sort groups_data alphanumerically, but case-insensitive
+    groups_data = sorted(
+                    groups_data,
+                    lambda x, y: cmp(x['name'].lower(), y['name'].lower())
+                )
+
+    #insert data for the global group at the first position
+    groups_data.insert(0, {'id': global_group.id, 'name': global_group.name})
+
+    #build group_list for the context
+    group_list = list()
+    for group in groups_data:
+        link = _get_group_url(group)
+        group_list.append({'name': group['name'], 'link': link})
+
+    group_list_json = simplejson.dumps(group_list)
+    cache.cache.set(key, group_list_json)
+    return group_list_json
@@ -21,12 +21,54 @@ from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext as _
 from django.core.exceptions import ObjectDoesNotExist
 from django.http import Http404
+from django.utils.hashcompat import md5_constructor
+from django.views.decorators.http import condition
 
 from askbot.conf import settings as askbot_settings
-from askbot.models import Post
+from askbot.models import Post, Thread
 from askbot.utils.html import site_url
 
-class RssIndividualQuestionFeed(Feed):
+class ConditionalFeed(Feed):
+    """feed responding with ``ETag`` and ``Last-Modified`` headers,
+    and with "304 Not Modified" to the clients having the
+    current version of the feed, in which case the feed is not built
+
+    subclasses define method ``get_last_modified``
+    """
+
+    def __call__(self, request, *args, **kwargs):
+        view = condition(
+                    etag_func=self.get_etag,
+                    last_modified_func=self.get_cached_last_modified
+                )(super(ConditionalFeed, self).__call__)
+        return view(request, *args, **kwargs)
+
+    def get_last_modified(self, request, *args, **kwargs):
+        raise NotImplementedError()
+
+    def get_cached_last_modified(self, request, *args, **kwargs):
+        """calculates time of the last modification once per request,
+        returns ``None`` when rss is disabled, so that the feed
+        view raises the 404 error"""
+        if askbot_settings.RSS_ENABLED is False:
+            return None
+        if not hasattr(request, '_feed_last_modified'):
+            request._feed_last_modified = self.get_last_modified(
+                                                        request, *args, **kwargs
+                                                    )
+        return request._feed_last_modified
+
+    def get_etag(self, request, *args, **kwargs):
+        """etag depends on the url, with the query parameters,
+        and on the time of the last modification"""
+        last_modified = self.get_cached_last_modified(request, *args, **kwargs)
+        if last_modified is None:
+            return None
+        etag_data = request.get_full_path() + last_modified.isoformat()
+        return md5_constructor(etag_data.encode('utf-8')).hexdigest()
+
+
+class RssIndividualQuestionFeed(ConditionalFeed):
     """rss feed class for particular questions
     """
 
@@ -47,6 +89,14 @@ class RssIndividualQuestionFeed(Feed):
         self.request = request
         return Post.objects.get_questions().get(id__exact = pk)
 
+    def get_last_modified(self, request, pk):
+        """time of the latest activity in the thread"""
+        questions = Post.objects.get_questions().filter(id=pk)
+        dates = questions.values_list('thread__last_activity_at', flat=True)
+        if len(dates) == 0:
+            return None
+        return dates[0]
+
     def item_link(self, item):
         """get full url to the item
         """
@@ -68,17 +118,22 @@ class RssIndividualQuestionFeed(Feed):
         """
         chain_elements = list()
         chain_elements.append([item,])
-        chain_elements.append(
-            Post.objects.get_comments().filter(parent=item)
-        )
+        #comments of all posts are loaded with one query
+        comments = Post.objects.get_comments().filter(
+                                            thread=item.thread
+                                        ).select_related('author')
+        comments_by_parent = dict()
+        for comment in comments.order_by('added_at'):
+            comments_by_parent.setdefault(comment.parent_id, []).append(comment)
+
+        chain_elements.append(comments_by_parent.get(item.id, []))
 
         answers = Post.objects.get_answers().filter(thread = item.thread)
+        answers = answers.select_related('author')
 
         for answer in answers:
             chain_elements.append([answer,])
-            chain_elements.append(
-                Post.objects.get_comments().filter(parent=answer)
-            )
+            chain_elements.append(comments_by_parent.get(answer.id, []))
 
         return itertools.chain(*chain_elements)
 
@@ -100,7 +155,7 @@ class RssIndividualQuestionFeed(Feed):
         return item.text
 
 
-class RssLastestQuestionsFeed(Feed):
+class RssLastestQuestionsFeed(ConditionalFeed):
     """rss feed class for the latest questions
     """
 
@@ -122,6 +177,10 @@ class RssLastestQuestionsFeed(Feed):
     def link(self):
         return site_url(reverse('questions'))
 
+    def get_last_modified(self, request):
+        """time of the latest activity on the site"""
+        return Thread.objects.get_last_activity_at()
+
     def item_author_name(self, item):
         """get name of author
         """
@@ -162,8 +221,9 @@ class RssLastestQuestionsFeed(Feed):
 
         if query:
             #if there's a search string, use the
-            #question search method
-            qs = qs.get_by_text_query(query)
+            #search backend to find the threads
+            threads = Thread.objects.get_for_query(query)
+            qs = qs.filter(thread__in=threads.values('id'))
 
         if tags:
             #if there are tags in GET, filter the
@@ -171,6 +231,7 @@ class RssLastestQuestionsFeed(Feed):
             for tag in tags:
                 qs = qs.filter(thread__tags__name = tag)
 
+        qs = qs.select_related('thread', 'author')
         return qs.order_by('-thread__last_activity_at')[:30]
 
     #hack to get the request object into the Feed class
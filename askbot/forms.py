@@ -1486,6 +1486,8 @@ class TagFilterSelectionForm(forms.ModelForm):
         super(TagFilterSelectionForm, self).save()
         after = self.instance.email_tag_filter_strategy
         if before != after:
+            from askbot.models import subscription_index
+            subscription_index.record_change(self.instance.id)
             return True
         return False
 
@@ -108,6 +108,7 @@ def send_mail(
             related_object = None,
             headers = None,
             raise_on_failure = False,
+            connection = None
         ):
     """
     todo: remove parameters not relevant to the function
@@ -121,6 +122,9 @@ def send_mail(
     the activity record)
 
     if raise_on_failure is True, exceptions.EmailNotSent is raised
+
+    connection - optional open email backend connection,
+    for sending many messages over one connection
     """
     body_text = absolutize_urls(body_text)
     try:
@@ -131,7 +135,8 @@ def send_mail(
                         clean_html_email(body_text),
                         from_email,
                         recipient_list,
-                        headers = headers
+                        headers = headers,
+                        connection = connection
                     )
         msg.attach_alternative(body_text, "text/html")
         msg.send()
@@ -38,8 +38,10 @@ class NoArgsJob(NoArgsCommand):
         then runs the job and finally restores the listerers
         """
         signal_data = signals.pop_all_db_signal_receivers()
-        self.run_command(**options)
-        signals.set_all_db_signal_receivers(signal_data)
+        try:
+            self.run_command(**options)
+        finally:
+            signals.set_all_db_signal_receivers(signal_data)
 
     def run_command(self, **options):
         """runs the batches"""
@@ -73,8 +75,7 @@ class NoArgsJob(NoArgsCommand):
                 changed_count += 1
             checked_count += 1
 
-            progress = 100*float(checked_count)/float(total_count)
-            console.print_progress(FORMAT_STRING, progress)
+            console.print_progress(checked_count, total_count)
         print FORMAT_STRING % 100
 
         if changed_count:
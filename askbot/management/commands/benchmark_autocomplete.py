@@ -0,0 +1,88 @@
+"""benchmark_autocomplete management command
+measures latency of the "similar questions" requests
+(``api_get_questions``) sent while the titles of the existing
+questions are typed, letter by letter, and of the tag name
+requests, with and without the autocomplete index
+(``ASKBOT_USE_AUTOCOMPLETE_INDEX``), prints the median
+and the 99th percentile
+
+python manage.py benchmark_autocomplete --questions=50
+"""
+import optparse
+import time
+from django.conf import settings as django_settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import NoArgsCommand
+from django.test.client import RequestFactory
+from askbot import models
+from askbot.views import commands
+
+def get_percentile(durations, percent):
+    durations = sorted(durations)
+    index = min(int(len(durations) * percent / 100.0), len(durations) - 1)
+    return durations[index]
+
+
+class Command(NoArgsCommand):
+    help = 'Measures latency of the autocompletion requests'
+
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option(
+            '--questions',
+            action = 'store',
+            type = 'int',
+            dest = 'questions',
+            default = 50,
+            help = 'Number of the question titles typed'
+        ),
+    )
+
+    def get_typed_queries(self, question_count):
+        """prefixes of the first two words of the titles,
+        as they are typed"""
+        queries = list()
+        threads = models.Thread.objects.filter(deleted=False).order_by('-id')
+        for title in threads.values_list('title', flat=True)[:question_count]:
+            text = ' '.join(title.split()[:2])
+            for length in range(2, len(text) + 1):
+                if text[length - 1] != ' ':
+                    queries.append(text[:length])
+        return queries
+
+    def run(self, title, view, parameter_name, queries):
+        factory = RequestFactory()
+        durations = list()
+        for query in queries:
+            request = factory.get('/', {parameter_name: query})
+            request.user = AnonymousUser()
+            start_time = time.time()
+            view(request)
+            durations.append(time.time() - start_time)
+        print '%-35s %10.2f ms %10.2f ms' % (
+                            title,
+                            get_percentile(durations, 50) * 1000,
+                            get_percentile(durations, 99) * 1000
+                        )
+
+    def handle_noargs(self, **options):
+        queries = self.get_typed_queries(options['questions'])
+        if len(queries) == 0:
+            print 'There are no questions to type the titles of'
+            return
+        tag_wildcards = [query.split()[0].lower() + '*' for query in queries]
+        print 'Sending %d requests of the typed titles' % len(queries)
+        print '%-35s %13s %13s' % ('', 'median', '99%')
+
+        enabled = getattr(django_settings, 'ASKBOT_USE_AUTOCOMPLETE_INDEX', False)
+        try:
+            django_settings.ASKBOT_USE_AUTOCOMPLETE_INDEX = False
+            self.run('questions, database', commands.api_get_questions, 'query_text', queries)
+            self.run('tags, database', commands.get_tags_by_wildcard, 'wildcard', tag_wildcards)
+
+            django_settings.ASKBOT_USE_AUTOCOMPLETE_INDEX = True
+            models.autocomplete.invalidate()
+            self.run('questions, index being built', commands.api_get_questions, 'query_text', queries)
+            self.run('questions, index', commands.api_get_questions, 'query_text', queries)
+            self.run('tags, index', commands.get_tags_by_wildcard, 'wildcard', tag_wildcards)
+        finally:
+            django_settings.ASKBOT_USE_AUTOCOMPLETE_INDEX = enabled
@@ -0,0 +1,81 @@
+"""benchmark_markup management command
+measures speed of conversion of the posts' markdown
+to the sanitized html and the speed of the html sanitizer
+alone, on the posts stored in the database
+
+python manage.py benchmark_markup --limit=1000
+"""
+import optparse
+import time
+from django.core.management.base import NoArgsCommand
+from django.utils.html import urlize
+from askbot import models
+from askbot.utils import markup
+from askbot.utils.html import sanitize_html, sanitize_html_with_tree
+from askbot.utils.html import StreamingSanitizer, TreeConstructionRequired
+
+class Command(NoArgsCommand):
+    help = 'Measures speed of the markdown conversion on the stored posts'
+
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option(
+            '--limit',
+            action = 'store',
+            type = 'int',
+            dest = 'limit',
+            default = 500,
+            help = 'Number of posts to convert'
+        ),
+    )
+
+    def run(self, title, converter, texts):
+        """converts all texts, prints and returns posts per second"""
+        start_time = time.time()
+        for text in texts:
+            converter(text)
+        duration = time.time() - start_time
+        rate = len(texts) / max(duration, 0.000001)
+        print '%-40s %8.3fs %10.1f posts/s' % (title, duration, rate)
+        return rate
+
+    def handle_noargs(self, **options):
+        texts = list(
+            models.Post.objects.filter(
+                post_type__in=('question', 'answer')
+            ).values_list('text', flat=True)[:options['limit']]
+        )
+        if len(texts) == 0:
+            print 'No posts to convert'
+            return
+
+        print 'Converting %d posts' % len(texts)
+
+        def convert_with_new_parser(text):
+            parser = markup.build_parser()
+            return sanitize_html(parser.convert(urlize(text)))
+
+        def convert_with_pooled_parser(text):
+            return sanitize_html(markup.get_parser().convert(urlize(text)))
+
+        baseline = self.run('new parser per post', convert_with_new_parser, texts)
+        self.run('pooled parser', convert_with_pooled_parser, texts)
+        #first pass fills the html cache
+        self.run('html cache, cold', markup.markdown_input_converter, texts)
+        cached = self.run('html cache, warm', markup.markdown_input_converter, texts)
+        print 'Speedup with the warm html cache: %.1fx' % (cached / baseline)
+
+        #sanitizer alone, on the unsanitized output of markdown
+        parser = markup.get_parser()
+        html_texts = [parser.convert(urlize(text)) for text in texts]
+        streamed_count = 0
+        for html in html_texts:
+            try:
+                list(StreamingSanitizer(html).get_serializer_tokens())
+                streamed_count += 1
+            except TreeConstructionRequired:
+                pass
+        print 'Sanitizing %d posts, %d without building the tree' % \
+                                    (len(html_texts), streamed_count)
+        tree_rate = self.run('sanitizer with dom tree', sanitize_html_with_tree, html_texts)
+        stream_rate = self.run('streaming sanitizer', sanitize_html, html_texts)
+        print 'Speedup of the streaming sanitizer: %.1fx' % (stream_rate / tree_rate)
@@ -0,0 +1,131 @@
+"""benchmark_media_urls management command
+measures speed of resolution of the media urls used
+by the template main_page.html and the templates it extends
+and includes, comparing the lookup in the media manifest with
+the lookup of the files in the skin directories, and counts
+the filesystem calls made while the urls are resolved
+
+python manage.py benchmark_media_urls --iterations=100
+"""
+import optparse
+import os
+import re
+import time
+import urllib
+from django.core.management.base import NoArgsCommand
+from askbot.conf import settings as askbot_settings
+from askbot.skins import utils as skin_utils
+
+MEDIA_URL_RE = re.compile(r'["\']([^"\'{}]+)["\']\s*\|\s*media\b')
+TEMPLATE_NAME_RE = re.compile(r'{%\s*(?:extends|include|import|from)\s+["\']([^"\']+)["\']')
+
+def find_media_in_skins(url, skin):
+    """finds skin of the media file in the skin directories"""
+    url = urllib.unquote(unicode(url)).lstrip('/')
+    skins = skin_utils.get_available_skins(selected=skin).items()
+    for skin_name, skin_dir in skins:
+        if os.path.isfile(os.path.join(skin_dir, 'media', url)):
+            return skin_name
+    return None
+
+
+class FilesystemCallCounter(object):
+    """counts calls of the filesystem functions
+    used to look up the media files"""
+    function_names = ('isfile', 'isdir', 'exists')
+
+    def __init__(self):
+        self.count = 0
+        self.originals = dict()
+
+    def wrap(self, function):
+        def counted(*args, **kwargs):
+            self.count += 1
+            return function(*args, **kwargs)
+        return counted
+
+    def __enter__(self):
+        for name in self.function_names:
+            self.originals[name] = getattr(os.path, name)
+            setattr(os.path, name, self.wrap(self.originals[name]))
+        self.originals['listdir'] = os.listdir
+        os.listdir = self.wrap(os.listdir)
+        return self
+
+    def __exit__(self, *args):
+        os.listdir = self.originals.pop('listdir')
+        for name, function in self.originals.items():
+            setattr(os.path, name, function)
+
+
+class Command(NoArgsCommand):
+    help = 'Measures speed of the media url resolution for the main page'
+
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option(
+            '--iterations',
+            action = 'store',
+            type = 'int',
+            dest = 'iterations',
+            default = 100,
+            help = 'Number of the resolutions of all urls of the page'
+        ),
+    )
+
+    def get_template_source(self, name, skin):
+        for skin_dir in skin_utils.get_available_skins(selected=skin).values():
+            file_path = os.path.join(skin_dir, 'templates', name)
+            if os.path.isfile(file_path):
+                return open(file_path).read()
+        return ''
+
+    def get_media_urls(self, template_name, skin):
+        """media urls in the template and in all
+        templates it extends, includes and imports"""
+        urls = list()
+        seen_names = set()
+        names = [template_name]
+        while names:
+            name = names.pop()
+            if name in seen_names:
+                continue
+            seen_names.add(name)
+            source = self.get_template_source(name, skin)
+            urls.extend(MEDIA_URL_RE.findall(source))
+            names.extend(TEMPLATE_NAME_RE.findall(source))
+        return urls, len(seen_names)
+
+    def run(self, title, function, urls, iterations):
+        with FilesystemCallCounter() as counter:
+            start_time = time.time()
+            for iteration in range(iterations):
+                for url in urls:
+                    function(url)
+            duration = (time.time() - start_time) / iterations
+        print '%-30s %10.3f ms %10d' % (
+                            title, duration * 1000, counter.count / iterations
+                        )
+        return duration
+
+    def handle_noargs(self, **options):
+        iterations = options['iterations']
+        skin = askbot_settings.ASKBOT_DEFAULT_SKIN
+        urls, template_count = self.get_media_urls('main_page.html', skin)
+        print 'Resolving %d media urls of main_page.html and %d templates it uses' \
+                                            % (len(urls), template_count - 1)
+
+        skin_utils.rebuild_media_manifest()
+        print '%-30s %13s %10s' % ('', 'per page', 'fs calls')
+        scan_time = self.run(
+                        'lookup in the skin directories',
+                        lambda url: find_media_in_skins(url, skin),
+                        urls,
+                        iterations
+                    )
+        manifest_time = self.run(
+                        'media manifest',
+                        lambda url: skin_utils.get_media_url(url, ignore_missing=True),
+                        urls,
+                        iterations
+                    )
+        print 'Speedup of the manifest: %.1fx' % (scan_time / max(manifest_time, 0.000001))
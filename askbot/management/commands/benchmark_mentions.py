@@ -0,0 +1,127 @@
+"""benchmark_mentions management command
+measures speed of matching of the @mentions in the post text
+with the names of the thread participants, comparing the trie
+of the usernames with the scan over the list of the participants,
+and speed of loading of the participants of the busiest thread
+
+python manage.py benchmark_mentions --participants=500 --mentions=50
+"""
+import optparse
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand
+from django.db.models import Count
+from askbot import const
+from askbot import models
+from askbot.utils import markup
+
+def scan_mentioned_author(text, anticipated_authors):
+    """matches beginning of the text with the usernames
+    by scanning the list of users"""
+    for author in anticipated_authors:
+        if text.lower().startswith(author.username.lower()):
+            ulen = len(author.username)
+            if len(text) == ulen:
+                return author, ''
+            elif text[ulen] in const.TWITTER_STYLE_MENTION_TERMINATION_CHARS:
+                return author, text[ulen:]
+    return None, text
+
+
+class Command(NoArgsCommand):
+    help = 'Measures speed of the resolution of the @mentions'
+
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option(
+            '--participants',
+            action = 'store',
+            type = 'int',
+            dest = 'participants',
+            default = 500,
+            help = 'Number of the participants of the thread'
+        ),
+        optparse.make_option(
+            '--mentions',
+            action = 'store',
+            type = 'int',
+            dest = 'mentions',
+            default = 50,
+            help = 'Number of the mentions in the post'
+        ),
+        optparse.make_option(
+            '--iterations',
+            action = 'store',
+            type = 'int',
+            dest = 'iterations',
+            default = 20,
+            help = 'Number of the repetitions of each measurement'
+        ),
+    )
+
+    def run(self, function, iterations):
+        """calls function, returns average duration of a call"""
+        start_time = time.time()
+        for iteration in range(iterations):
+            function()
+        return (time.time() - start_time) / iterations
+
+    def handle_noargs(self, **options):
+        iterations = options['iterations']
+        participant_count = options['participants']
+        mention_count = options['mentions']
+
+        #users are not saved - matching works on the usernames only
+        participants = [
+            User(id=number + 1, username='participant%d' % number) \
+            for number in range(participant_count)
+        ]
+        step = max(participant_count / max(mention_count, 1), 1)
+        mentioned = participants[::-step][:mention_count]
+        text = ' '.join(['thanks @%s!' % user.username for user in mentioned])
+
+        def match_with_scan():
+            mentions = list()
+            for chunk in text.split('@')[1:]:
+                mentions.append(scan_mentioned_author(chunk, participants))
+            return mentions
+
+        def match_with_trie():
+            trie = markup.MentionTrie(participants)
+            mentions = list()
+            for chunk in text.split('@')[1:]:
+                mentions.append(trie.match(chunk))
+            return mentions
+
+        print 'Matching %d mentions with %d participants' % \
+                                    (len(mentioned), participant_count)
+        scan_time = self.run(match_with_scan, iterations)
+        trie_time = self.run(match_with_trie, iterations)
+        print '%-30s %10.2f ms' % ('scan of the participants', scan_time * 1000)
+        print '%-30s %10.2f ms' % ('trie of the usernames', trie_time * 1000)
+        print 'Speedup of the trie: %.1fx' % (scan_time / max(trie_time, 0.000001))
+
+        threads = models.Thread.objects.annotate(
+                                        post_count=Count('posts')
+                                    ).order_by('-post_count')
+        if len(threads[:1]) == 0:
+            print 'There are no threads to load the participants of'
+            return
+        question = threads[0]._question_post()
+
+        def load_author_list():
+            return question.get_author_list(
+                include_comments=True,
+                recursive=True
+            )
+
+        participant_count = len(question.get_participant_list())
+        print 'Loading %d participants of the thread with %d posts' % \
+                                    (participant_count, threads[0].post_count)
+        print '%-30s %10.2f ms' % (
+                    'author list per post',
+                    self.run(load_author_list, iterations) * 1000
+                )
+        print '%-30s %10.2f ms' % (
+                    'participants in one query',
+                    self.run(question.get_participant_list, iterations) * 1000
+                )
@@ -0,0 +1,88 @@
+"""benchmark_settings management command
+measures speed of reading the livesettings from the
+in-process snapshot and directly from livesettings,
+and speed of the settings-heavy views - the question list
+and the question page - with the warm snapshot and with
+the snapshot rebuilt on every request
+
+python manage.py benchmark_settings --iterations=20
+"""
+import optparse
+import time
+from django.core.management.base import NoArgsCommand
+from django.core.urlresolvers import reverse
+from django.test.client import Client
+from askbot import models
+from askbot.conf import settings as askbot_settings
+from askbot.conf.settings_wrapper import ConfigSettings
+
+class Command(NoArgsCommand):
+    help = 'Measures speed of reading the livesettings'
+
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option(
+            '--iterations',
+            action = 'store',
+            type = 'int',
+            dest = 'iterations',
+            default = 20,
+            help = 'Number of reads of all settings and of requests per view'
+        ),
+    )
+
+    def run(self, title, function, iterations, unit):
+        """calls function, prints and returns calls per second"""
+        start_time = time.time()
+        for iteration in range(iterations):
+            function()
+        duration = time.time() - start_time
+        rate = iterations / max(duration, 0.000001)
+        print '%-40s %8.3fs %10.1f %s/s' % (title, duration, rate, unit)
+        return rate
+
+    def handle_noargs(self, **options):
+        iterations = options['iterations']
+        keys = askbot_settings.as_dict().keys()
+        values = askbot_settings._ConfigSettings__instance
+
+        def read_from_livesettings():
+            for key in keys:
+                values[key].value
+
+        def read_from_snapshot():
+            for key in keys:
+                getattr(askbot_settings, key)
+
+        print 'Reading %d settings' % len(keys)
+        direct_rate = self.run(
+                        'livesettings', read_from_livesettings, iterations, 'reads'
+                    )
+        snapshot_rate = self.run(
+                        'snapshot', read_from_snapshot, iterations, 'reads'
+                    )
+        print 'Speedup of the snapshot: %.1fx' % (snapshot_rate / direct_rate)
+
+        urls = [reverse('questions')]
+        questions = models.Post.objects.get_questions().filter(deleted=False)
+        for question in questions[:1]:
+            urls.append(question.get_absolute_url())
+
+        client = Client()
+        for url in urls:
+            def get_page():
+                client.get(url, follow=True)
+
+            def get_page_with_new_snapshot():
+                ConfigSettings.invalidate_snapshot()
+                client.get(url, follow=True)
+
+            print 'Requesting %s' % url
+            get_page()#warm up the caches
+            cold_rate = self.run(
+                            'snapshot rebuilt per request',
+                            get_page_with_new_snapshot,
+                            iterations,
+                            'requests'
+                        )
+            warm_rate = self.run('warm snapshot', get_page, iterations, 'requests')
+            print 'Speedup of the warm snapshot: %.1fx' % (warm_rate / cold_rate)
@@ -0,0 +1,99 @@
+"""benchmark_tag_search management command
+measures speed of the question search filtered by
+1 to 8 of the most used tags, and compares the tag filter
+intersecting the tags in one grouped subquery, as done
+by the search, with the filter joining the thread-tag
+table once per tag
+
+python manage.py benchmark_tag_search --iterations=20
+"""
+import optparse
+import time
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import NoArgsCommand
+from askbot import models
+from askbot.search.state_manager import SearchState
+
+MAX_TAG_COUNT = 8
+PAGE_SIZE = 30
+
+class Command(NoArgsCommand):
+    help = 'Measures speed of the question list filtered by the tags'
+
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option(
+            '--iterations',
+            action = 'store',
+            type = 'int',
+            dest = 'iterations',
+            default = 20,
+            help = 'Number of the searches per number of tags'
+        ),
+    )
+
+    def run(self, function, iterations):
+        """calls function, returns average duration of a call"""
+        start_time = time.time()
+        for iteration in range(iterations):
+            function()
+        return (time.time() - start_time) / iterations
+
+    def handle_noargs(self, **options):
+        iterations = options['iterations']
+        tags = models.Tag.objects.filter(used_count__gt=0)
+        tags = list(tags.order_by('-used_count')[:MAX_TAG_COUNT])
+        tag_names = [tag.name for tag in tags]
+        if len(tag_names) == 0:
+            print 'There are no tags to search for'
+            return
+
+        user = AnonymousUser()
+
+        def get_threads():
+            threads = models.Thread.objects.filter(
+                                posts__post_type='question',
+                                posts__deleted=False
+                            )
+            return threads.order_by('-last_activity_at')
+
+        def fetch_page(threads):
+            threads = threads.distinct()
+            list(threads[:PAGE_SIZE])
+            return threads.count()
+
+        print '%4s %8s %11s %12s %10s' % (
+                    'tags', 'threads', 'search, ms', 'grouped, ms', 'joins, ms'
+                )
+        for tag_count in range(1, len(tag_names) + 1):
+            names = tag_names[:tag_count]
+            tag_ids = [tag.id for tag in tags[:tag_count]]
+
+            search_state = SearchState.get_empty()
+            for name in names:
+                search_state = search_state.add_tag(name)
+
+            def search():
+                threads, meta_data = models.Thread.objects.run_advanced_search(
+                                                request_user=user,
+                                                search_state=search_state
+                                            )
+                return fetch_page(threads)
+
+            def filter_grouped():
+                thread_ids = models.Thread.objects.get_ids_tagged_with_all(tag_ids)
+                return fetch_page(get_threads().filter(id__in=thread_ids))
+
+            def filter_with_joins():
+                threads = get_threads()
+                for name in names:
+                    threads = threads.filter(tags__name=name)
+                return fetch_page(threads)
+
+            thread_count = search()
+            print '%4d %8d %11.2f %12.2f %10.2f' % (
+                        tag_count,
+                        thread_count,
+                        self.run(search, iterations) * 1000,
+                        self.run(filter_grouped, iterations) * 1000,
+                        self.run(filter_with_joins, iterations) * 1000
+                    )
@@ -0,0 +1,104 @@
+"""benchmark_template_loading management command
+measures time to load the template main_page.html and all
+templates it extends, includes and imports into a new skin
+environment - as on the first request after the restart
+of a worker process - when the templates are compiled from
+the source and when they are loaded from the bytecode cache
+
+python manage.py benchmark_template_loading --iterations=5
+"""
+import optparse
+import shutil
+import tempfile
+import time
+from django.conf import settings as django_settings
+from django.core.management.base import NoArgsCommand
+from jinja2 import meta
+from jinja2 import TemplateNotFound
+from jinja2.bccache import FileSystemBytecodeCache
+from askbot.conf import settings as askbot_settings
+from askbot.skins import loaders
+
+class Command(NoArgsCommand):
+    help = 'Measures time to load the templates of the main page after restart'
+
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option(
+            '--iterations',
+            action = 'store',
+            type = 'int',
+            dest = 'iterations',
+            default = 5,
+            help = 'Number of the simulated restarts'
+        ),
+    )
+
+    def get_template_names(self, skin, template_name):
+        """names of the template and of all templates it uses"""
+        names = list()
+        seen_names = set()
+        pending = [template_name]
+        while pending:
+            name = pending.pop()
+            if name in seen_names or name is None:
+                continue
+            seen_names.add(name)
+            try:
+                source = skin.loader.get_source(skin, name)[0]
+            except TemplateNotFound:
+                #templates included only when they are customized
+                continue
+            names.append(name)
+            pending.extend(meta.find_referenced_templates(skin.parse(source)))
+        return names
+
+    def run(self, title, bytecode_cache, template_names, iterations):
+        """loads the templates into new environments,
+        prints and returns the average time"""
+        skin_name = askbot_settings.ASKBOT_DEFAULT_SKIN
+        language_code = django_settings.LANGUAGE_CODE
+        duration = 0
+        for iteration in range(iterations):
+            skin = loaders.build_skin_environment(
+                                    skin_name,
+                                    language_code,
+                                    bytecode_cache
+                                )
+            start_time = time.time()
+            for name in template_names:
+                skin.get_template(name)
+            duration += time.time() - start_time
+        duration /= iterations
+        print '%-35s %10.1f ms' % (title, duration * 1000)
+        return duration
+
+    def handle_noargs(self, **options):
+        iterations = options['iterations']
+        skin = loaders.build_skin_environment(
+                                askbot_settings.ASKBOT_DEFAULT_SKIN,
+                                django_settings.LANGUAGE_CODE
+                            )
+        template_names = self.get_template_names(skin, 'main_page.html')
+        print 'Loading main_page.html and %d templates it uses' \
+                                        % (len(template_names) - 1)
+
+        compile_time = self.run(
+                            'compiled from the source',
+                            None,
+                            template_names,
+                            iterations
+                        )
+        cache_dir = tempfile.mkdtemp()
+        try:
+            bytecode_cache = FileSystemBytecodeCache(cache_dir, '%s.askbot.cache')
+            self.run('compiled, bytecode cache filled', bytecode_cache, template_names, 1)
+            cached_time = self.run(
+                                'loaded from the bytecode cache',
+                                bytecode_cache,
+                                template_names,
+                                iterations
+                            )
+        finally:
+            shutil.rmtree(cache_dir)
+        print 'Speedup of the bytecode cache: %.1fx' % \
+                                (compile_time / max(cached_time, 0.000001))
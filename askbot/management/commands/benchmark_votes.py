@@ -0,0 +1,172 @@
+"""benchmark_votes management command
+measures the number of votes per second processed
+by several threads voting for the same question,
+and checks that the stored score of the question and
+of its thread and the reputation of the author
+match the recorded votes and reputation changes
+
+Each vote is canceled after it is counted, but the records
+of the reputation changes and the activity are kept - run the
+command on a copy of the database.
+
+python manage.py benchmark_votes --threads=4 --voters=20 --rounds=5
+"""
+import datetime
+import optparse
+import threading
+import time
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from django.db.models import Count, Sum
+from askbot import models
+
+class Command(NoArgsCommand):
+    help = 'Measures speed of the voting and checks the stored counters'
+
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option(
+            '--threads',
+            action = 'store',
+            type = 'int',
+            dest = 'threads',
+            default = 4,
+            help = 'Number of the concurrently voting threads'
+        ),
+        optparse.make_option(
+            '--voters',
+            action = 'store',
+            type = 'int',
+            dest = 'voters',
+            default = 20,
+            help = 'Number of the users voting for the question'
+        ),
+        optparse.make_option(
+            '--rounds',
+            action = 'store',
+            type = 'int',
+            dest = 'rounds',
+            default = 5,
+            help = 'Number of the votes and cancelations per user'
+        ),
+    )
+
+    def vote(self, question_id, voter_ids, rounds, errors):
+        """casts and cancels the upvote for each voter,
+        runs in a thread with own database connection"""
+        try:
+            question = models.Post.objects.get(id=question_id)
+            voters = models.User.objects.filter(id__in=voter_ids)
+            for round_number in range(rounds):
+                for voter in voters:
+                    voter.upvote(question)
+                    voter.upvote(question, cancel=True)
+        except Exception, error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    def check_counters(self, question, author, start_reputation, started_at):
+        """prints the stored counters and whether
+        they match the votes and the reputation records"""
+        question = models.Post.objects.get(id=question.id)
+        votes = models.Vote.objects.filter(voted_post=question)
+        vote_counts = dict(votes.values_list('vote').annotate(Count('id')))
+        up_votes = vote_counts.get(models.Vote.VOTE_UP, 0)
+        down_votes = vote_counts.get(models.Vote.VOTE_DOWN, 0)
+        thread = models.Thread.objects.get(id=question.thread_id)
+
+        changes = models.Repute.objects.filter(
+                                    user=author,
+                                    reputed_at__gte=started_at
+                                ).aggregate(Sum('positive'), Sum('negative'))
+        reputation_change = (changes['positive__sum'] or 0) \
+                                + (changes['negative__sum'] or 0)
+        reputation = models.User.objects.get(id=author.id).reputation
+
+        checks = (
+            ('score of the question', question.points, up_votes - down_votes),
+            ('upvotes of the question', question.vote_up_count, up_votes),
+            ('downvotes of the question', question.vote_down_count, down_votes),
+            ('score of the thread', thread.points, question.points),
+            (
+                'reputation of the author',
+                reputation,
+                start_reputation + reputation_change
+            ),
+        )
+        consistent = True
+        for title, stored, expected in checks:
+            status = 'ok'
+            if stored != expected:
+                status = 'MISMATCH'
+                consistent = False
+            print '%-30s %8d %8d  %s' % (title, stored, expected, status)
+        return consistent
+
+    def handle_noargs(self, **options):
+        thread_count = max(options['threads'], 1)
+        rounds = options['rounds']
+
+        questions = models.Post.objects.get_questions().filter(
+                                                deleted=False,
+                                                wiki=False,
+                                                is_anonymous=False
+                                            )
+        questions = questions.order_by('-id')
+        if len(questions[:1]) == 0:
+            print 'There are no questions to vote for'
+            return
+        question = questions[0]
+        author = question.author
+
+        voted_user_ids = models.Vote.objects.filter(
+                                    voted_post=question
+                                ).values('user__id')
+        voter_ids = list(
+            models.User.objects.exclude(
+                                id=author.id
+                            ).exclude(
+                                id__in=voted_user_ids
+                            ).values_list(
+                                'id', flat=True
+                            )[:options['voters']]
+        )
+        if len(voter_ids) == 0:
+            print 'There are no users who can vote for the question'
+            return
+
+        #voters are split between the threads
+        voter_groups = [voter_ids[number::thread_count] for number in range(thread_count)]
+        voter_groups = [group for group in voter_groups if group]
+
+        start_reputation = models.User.objects.get(id=author.id).reputation
+        started_at = datetime.datetime.now()
+        errors = list()
+        threads = [
+            threading.Thread(
+                target=self.vote,
+                args=(question.id, group, rounds, errors)
+            ) for group in voter_groups
+        ]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.time() - start_time
+
+        vote_count = 2 * rounds * len(voter_ids)
+        print '%d threads, %d votes and cancelations in %.2fs, %.1f votes/s' % (
+                                        len(threads),
+                                        vote_count,
+                                        duration,
+                                        vote_count / max(duration, 0.000001)
+                                    )
+        for error in errors:
+            print 'Error: %s' % error
+
+        print '%-30s %8s %8s' % ('counter', 'stored', 'expected')
+        if self.check_counters(question, author, start_reputation, started_at):
+            print 'Counters are consistent'
+        else:
+            print 'Counters are not consistent'
@@ -6,7 +6,8 @@ class Command(NoArgsCommand):
 
     def handle_noargs(self, **options):
         from askbot.conf import settings
-        #Just loads all the settings that way they will be in the cache
+        #Just loads all the settings that way they will be in the cache,
+        #values are read from livesettings, bypassing the snapshot
         for key, value in settings._ConfigSettings__instance.items():
-            empty1 = getattr(settings, key)
+            empty1 = value.value
         print 'cache pre-loaded'
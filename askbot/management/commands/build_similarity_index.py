@@ -0,0 +1,23 @@
+"""build_similarity_index management command
+builds the index of the similar threads, used when
+``ASKBOT_USE_SIMILARITY_INDEX = True``
+
+python manage.py build_similarity_index
+"""
+from django.core import cache
+from django.core.management.base import NoArgsCommand
+from askbot import models
+from askbot.models import similarity_index
+from askbot.utils.console import ProgressBar
+
+class Command(NoArgsCommand):
+    help = 'Builds the index of the similar threads'
+
+    def handle_noargs(self, **options):
+        models.SimilarityIndexEntry.objects.all().delete()
+
+        threads = models.Thread.objects.filter(deleted=False)
+        message = 'Indexing threads'
+        for thread in ProgressBar(threads.iterator(), threads.count(), message):
+            similarity_index.index_thread(thread)
+            cache.cache.delete(similarity_index.get_cache_key(thread.id))
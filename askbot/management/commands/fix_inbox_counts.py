@@ -1,22 +1,55 @@
+"""fix_inbox_counts management command
+repairs drift of the denormalized counts of the new
+and seen responses in the user inboxes, which are
+incremented and decremented as the responses arrive
+and are read
+
+counts of all users are calculated with two queries,
+only the users whose counts differ are updated
+"""
+from django.db.models import Count
 from askbot.management import NoArgsJob
 from askbot import models
 
-def fix_inbox_counts(user):
+def get_response_counts(status):
+    """returns dictionary of the number of inbox items
+    with the given status, keyed by the user id"""
+    records = models.ActivityAuditStatus.objects.filter(
+                    status=status,
+                    activity__activity_type__in=models.get_inbox_activity_types()
+                ).values('user').annotate(response_count=Count('id'))
+    return dict([(item['user'], item['response_count']) for item in records])
+
+
+class InboxCountFixer(object):
     """a unit of job - returns True if change was made
     and False otherwise
     """
-    old_new_count = user.new_response_count
-    old_seen_count = user.seen_response_count
+    def __init__(self):
+        self.new_counts = None
+        self.seen_counts = None
+
+    def __call__(self, user):
+        if self.new_counts is None:
+            self.new_counts = get_response_counts(
+                                models.ActivityAuditStatus.STATUS_NEW
+                            )
+            self.seen_counts = get_response_counts(
+                                models.ActivityAuditStatus.STATUS_SEEN
+                            )
 
-    user.update_response_counts()
+        new_count = self.new_counts.get(user.id, 0)
+        seen_count = self.seen_counts.get(user.id, 0)
+        if user.new_response_count == new_count \
+            and user.seen_response_count == seen_count:
+            return False
 
-    (changed1, changed2) = (False, False)
-    if user.new_response_count != old_new_count:
-        changed1 = True
-    if user.seen_response_count != old_seen_count:
-        changed2 = True
+        models.User.objects.filter(id=user.id).update(
+                                new_response_count=new_count,
+                                seen_response_count=seen_count
+                            )
+        return True
 
-    return (changed1 or changed2)
 
 class Command(NoArgsJob):
     """definition of the job that fixes response counts
@@ -26,7 +59,7 @@ class Command(NoArgsJob):
         self.batches = ({
             'title': 'Checking inbox item counts for all users: ',
             'query_set': models.User.objects.all(),
-            'function': fix_inbox_counts,
+            'function': InboxCountFixer(),
             'changed_count_message': 'Corrected records for %d users',
             'nothing_changed_message': 'No problems found'
         },)
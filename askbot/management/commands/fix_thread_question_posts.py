@@ -0,0 +1,36 @@
+"""fix_thread_question_posts management command
+stores reference to the question post on the threads
+where it is missing or points to a wrong post
+
+python manage.py fix_thread_question_posts
+"""
+from askbot.management import NoArgsJob
+from askbot import models
+
+def fix_question_post_reference(question):
+    """returns True if the reference on the thread was changed"""
+    threads = models.Thread.objects.filter(
+                                id=question.thread_id
+                            ).exclude(
+                                question_post=question
+                            )
+    return threads.update(question_post=question) > 0
+
+
+class Command(NoArgsJob):
+    """definition of the job that stores
+    question post references on the threads
+    """
+    def __init__(self, *args, **kwargs):
+        questions = models.Post.objects.filter(
+                                    post_type='question',
+                                    thread__isnull=False
+                                ).only('id', 'thread')
+        self.batches = ({
+            'title': 'Checking question references of all threads: ',
+            'query_set': questions,
+            'function': fix_question_post_reference,
+            'changed_count_message': 'Corrected references on %d threads',
+            'nothing_changed_message': 'No problems found'
+        },)
+        super(Command, self).__init__(*args, **kwargs)
@@ -0,0 +1,40 @@
+"""generate_sitemaps management command
+writes the sitemap index and the sitemap shards to
+a directory, by default to ``ASKBOT_SITEMAP_DIR``,
+from which they are then served by the sitemap views
+
+python manage.py generate_sitemaps --output-dir=/path/to/dir
+"""
+import optparse
+import os
+from django.conf import settings as django_settings
+from django.core.management.base import NoArgsCommand, CommandError
+from askbot import sitemap
+
+class Command(NoArgsCommand):
+    help = 'Writes the sitemap index and the sitemap shards to a directory'
+
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option(
+            '--output-dir',
+            action = 'store',
+            type = 'str',
+            dest = 'output_dir',
+            default = getattr(django_settings, 'ASKBOT_SITEMAP_DIR', None),
+            help = 'Directory for the sitemap files, ' + \
+                    'by default - setting ASKBOT_SITEMAP_DIR'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        output_dir = options['output_dir']
+        if not output_dir:
+            raise CommandError(
+                'Please give --output-dir or set ASKBOT_SITEMAP_DIR'
+            )
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        shard_count = sitemap.write_sitemaps(output_dir, sitemap.SITEMAPS)
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Written sitemap index and %d shards to %s' % (shard_count, output_dir)
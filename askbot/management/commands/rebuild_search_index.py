@@ -0,0 +1,35 @@
+"""rebuild_search_index management command
+builds the inverted index used by the local search backend
+(``ASKBOT_SEARCH_BACKEND = 'askbot.search.local.LocalSearchBackend'``)
+from all threads, posts and users
+
+python manage.py rebuild_search_index
+"""
+from django.core.management.base import NoArgsCommand
+from askbot import models
+from askbot.models import search_index
+from askbot.utils.console import ProgressBar
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the index of the local search backend'
+
+    def handle_noargs(self, **options):
+        models.SearchIndexEntry.objects.all().delete()
+
+        threads = models.Thread.objects.all()
+        message = 'Indexing threads'
+        for thread in ProgressBar(threads.iterator(), threads.count(), message):
+            search_index.index_thread(thread)
+
+        posts = models.Post.objects.filter(
+                            post_type__in=('question', 'answer', 'comment'),
+                            deleted=False
+                        )
+        message = 'Indexing posts'
+        for post in ProgressBar(posts.iterator(), posts.count(), message):
+            search_index.index_post(post)
+
+        users = models.User.objects.all()
+        message = 'Indexing users'
+        for user in ProgressBar(users.iterator(), users.count(), message):
+            search_index.index_user(user)
@@ -1,10 +1,18 @@
 import datetime
+import logging
+import multiprocessing
+import optparse
+import time
+from collections import defaultdict
+from django.core import mail as django_mail
 from django.core.management.base import NoArgsCommand
 from django.core.urlresolvers import reverse
 from django.db import connection
 from django.db.models import Q, F
 from askbot.models import User, Post, PostRevision, Thread
-from askbot.models import Activity, EmailFeedSetting
+from askbot.models import Activity, EmailFeedSetting, QuestionView
+from askbot.models.post import PostToGroup
+from askbot.models.user import AuthUserGroups
 from django.utils.translation import ugettext as _
 from django.utils.translation import ungettext
 from django.conf import settings as django_settings
@@ -17,13 +25,39 @@ from askbot.utils.slug import slugify
 from askbot.utils.html import site_url
 
 DEBUG_THIS_COMMAND = False
-
-def get_all_origin_posts(mentions):
-    origin_posts = set()
-    for mention in mentions:
-        post = mention.content_object
-        origin_posts.add(post.get_origin_post())
-    return list(origin_posts)
+#number of users whose digests are built together
+USER_BATCH_SIZE = 500
+#max number of ids in one "in" lookup
+QUERY_CHUNK_SIZE = 500
+
+def get_origin_thread_ids(mentions):
+    """returns dictionary of the ids of the threads, in which
+    the users were mentioned, by user id, ``mentions`` - list of
+    tuples (user id, content type id, object id)
+    of the mention activities"""
+    post_ctype_id = ContentType.objects.get_for_model(Post).id
+    post_ids = set()
+    for user_id, ctype_id, object_id in mentions:
+        if ctype_id == post_ctype_id:
+            post_ids.add(object_id)
+
+    post_thread_ids = dict()
+    for ids in get_chunks(post_ids):
+        posts = Post.objects.filter(id__in=ids).values_list('id', 'thread_id')
+        post_thread_ids.update(dict(posts))
+
+    thread_ids = defaultdict(set)
+    for user_id, ctype_id, object_id in mentions:
+        if ctype_id == post_ctype_id:
+            thread_id = post_thread_ids.get(object_id)
+        else:
+            content_type = ContentType.objects.get_for_id(ctype_id)
+            content_object = content_type.get_object_for_this_type(id=object_id)
+            origin_post = content_object.get_origin_post()
+            thread_id = getattr(origin_post, 'thread_id', None)
+        if thread_id:
+            thread_ids[user_id].add(thread_id)
+    return thread_ids
 
 #todo: refactor this as class
 def extend_question_list(
@@ -49,7 +83,7 @@ def extend_question_list(
             raise ValueError('cutoff_time is a mandatory parameter')
 
     for q in src:
-        if languages and src.language_code not in languages:
+        if languages and q.thread.language_code not in languages:
             continue
         if q in dst:
             meta_data = dst[q]
@@ -77,435 +111,859 @@ def format_action_count(string, number, output):
     if number > 0:
         output.append(_(string) % {'num':number})
 
+def get_chunks(items, size=QUERY_CHUNK_SIZE):
+    """yields lists of at most ``size`` items"""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class QuestionUpdates(object):
+    """news in the questions - revisions of the questions,
+    new answers and revisions of the answers.
+    News of all questions collected for a batch of users
+    are loaded at once, with a few queries, starting from
+    the time of the earliest email about these questions,
+    then news are counted for each user in memory
+    """
+    def __init__(self, questions, since):
+        question_ids = set()
+        thread_ids = set()
+        for question in questions:
+            question_ids.add(question.id)
+            thread_ids.add(question.thread_id)
+
+        #question revisions, latest first
+        self.question_revisions = defaultdict(list)
+        for ids in get_chunks(question_ids):
+            revisions = PostRevision.objects.filter(
+                                            post__id__in=ids,
+                                            revised_at__gt=since
+                                        ).values_list(
+                                            'post_id', 'revision',
+                                            'author_id', 'revised_at'
+                                        )
+            for post_id, revision, author_id, revised_at in revisions:
+                self.question_revisions[post_id].append(
+                                            (revision, author_id, revised_at)
+                                        )
+        for revisions in self.question_revisions.values():
+            revisions.sort(reverse=True)
+
+        #answers by thread
+        self.answers = defaultdict(list)
+        answer_ids = list()
+        for ids in get_chunks(thread_ids):
+            answers = Post.objects.filter(
+                                    post_type='answer',
+                                    thread__id__in=ids,
+                                    added_at__gt=since,
+                                    deleted=False
+                                ).values_list(
+                                    'id', 'thread_id', 'author_id', 'added_at'
+                                )
+            for answer_id, thread_id, author_id, added_at in answers:
+                self.answers[thread_id].append((answer_id, author_id, added_at))
+                answer_ids.append(answer_id)
+
+        self.answer_revision_authors = defaultdict(list)
+        for ids in get_chunks(answer_ids):
+            revisions = PostRevision.objects.filter(
+                                    post__id__in=ids
+                                ).values_list('post_id', 'author_id')
+            for post_id, author_id in revisions:
+                self.answer_revision_authors[post_id].append(author_id)
+
+        #groups of the answers, when answers may be group-private
+        self.answer_groups = None
+        if askbot_settings.GROUPS_ENABLED:
+            self.answer_groups = defaultdict(set)
+            for ids in get_chunks(answer_ids):
+                post_groups = PostToGroup.objects.filter(
+                                    post__id__in=ids
+                                ).values_list('post_id', 'group_id')
+                for post_id, group_id in post_groups:
+                    self.answer_groups[post_id].add(group_id)
+
+    def count_question_revisions(self, question, user, since):
+        """returns number of revisions of the question
+        made by others after the ``since`` time
+        and whether the question itself is new"""
+        revised_at_list = [
+            revised_at for revision, author_id, revised_at \
+                in self.question_revisions[question.id] \
+                if revised_at > since and author_id != user.id
+        ]
+        if len(revised_at_list) > 0 and question.added_at == revised_at_list[0]:
+            return 0, True
+        return len(revised_at_list), False
+
+    def count_answers(self, question, user, since, group_ids=None):
+        """returns number of the answers added by others
+        after the ``since`` time and number of revisions
+        of the new answers, made by others.
+        If ``group_ids`` is given, only answers
+        shared with these groups are counted"""
+        new_answer_count = 0
+        answer_revision_count = 0
+        for answer_id, author_id, added_at in self.answers[question.thread_id]:
+            if added_at <= since:
+                continue
+            if group_ids is not None:
+                if not (self.answer_groups[answer_id] & group_ids):
+                    continue
+            if author_id != user.id:
+                new_answer_count += 1
+            for revision_author_id in self.answer_revision_authors[answer_id]:
+                if revision_author_id != user.id:
+                    answer_revision_count += 1
+        return new_answer_count, answer_revision_count
+
+
+class SubscribedQuestions(object):
+    """questions which the users of a batch follow, asked or
+    answered, and the questions in which the posts of the users
+    were commented on or the users were mentioned.
+    Candidates of all users are loaded at once, with a few queries,
+    together with the views of these questions by the users,
+    then the questions are selected for each user in memory.
+    Questions filtered by the tags of the users (``q_all``)
+    are not selected here, see ``get_updated_questions_for_user``
+    """
+    def __init__(self, base_questions, users, cutoff_times):
+        """``cutoff_times`` - dictionary of the cutoff times
+        of the ripe feeds by the feed type, by user id"""
+        def get_user_ids(feed_type):
+            return [
+                user.id for user in users if feed_type in cutoff_times[user.id]
+            ]
+
+        #sets of the thread ids by the feed type, by user id
+        candidates = defaultdict(lambda: defaultdict(set))
+
+        Follow = Thread.followed_by.through
+        for user_ids in get_chunks(get_user_ids('q_sel')):
+            follows = Follow.objects.filter(
+                                user__id__in=user_ids
+                            ).values_list('user_id', 'thread_id')
+            for user_id, thread_id in follows:
+                candidates['q_sel'][user_id].add(thread_id)
+
+        for user_ids in get_chunks(get_user_ids('q_ask')):
+            questions = Post.objects.get_questions().filter(
+                                author__id__in=user_ids
+                            ).values_list('author_id', 'thread_id')
+            for user_id, thread_id in questions:
+                candidates['q_ask'][user_id].add(thread_id)
+
+        for user_ids in get_chunks(get_user_ids('q_ans')):
+            answers = Post.objects.filter(
+                                post_type='answer',
+                                author__id__in=user_ids
+                            ).values_list('author_id', 'thread_id').distinct()
+            for user_id, thread_id in answers:
+                candidates['q_ans'][user_id].add(thread_id)
+
+        #threads of the comments by user id, one per comment
+        comment_thread_ids = defaultdict(list)
+        mentions = list()
+        for user_ids in get_chunks(get_user_ids('m_and_c')):
+            max_cutoff_time = max(
+                [cutoff_times[user_id]['m_and_c'] for user_id in user_ids]
+            )
+            comments = Post.objects.get_comments().filter(
+                                added_at__lt=max_cutoff_time,
+                                parent__author__id__in=user_ids
+                            ).values_list(
+                                'parent__author_id', 'author_id',
+                                'added_at', 'parent__thread_id'
+                            )
+            for user_id, author_id, added_at, thread_id in comments:
+                cutoff_time = cutoff_times[user_id]['m_and_c']
+                if added_at < cutoff_time and author_id != user_id and thread_id:
+                    comment_thread_ids[user_id].append(thread_id)
+
+            activities = Activity.objects.get_mentions(
+                                mentioned_at__lt=max_cutoff_time,
+                                mentioned_whom=user_ids
+                            ).values_list(
+                                'id', 'recipients__id', 'active_at',
+                                'content_type_id', 'object_id'
+                            ).distinct()
+            for activity_id, user_id, active_at, ctype_id, object_id in activities:
+                cutoff_time = cutoff_times.get(user_id, {}).get('m_and_c')
+                if cutoff_time and active_at < cutoff_time:
+                    mentions.append((user_id, ctype_id, object_id))
+
+        candidates['mentions'] = get_origin_thread_ids(mentions)
+
+        #question id, last activity time and author of the threads
+        #of the base questions
+        self.threads = dict()
+        thread_ids = set()
+        for user_thread_ids in candidates.values():
+            for ids in user_thread_ids.values():
+                thread_ids.update(ids)
+        for ids in get_chunks(thread_ids):
+            questions = base_questions.filter(
+                                    thread__id__in=ids
+                                ).values_list(
+                                    'thread_id', 'id',
+                                    'thread__last_activity_at',
+                                    'thread__last_activity_by_id'
+                                )
+            for thread_id, question_id, last_activity_at, last_activity_by_id in questions:
+                self.threads[thread_id] = (
+                                question_id, last_activity_at, last_activity_by_id
+                            )
+
+        #times when the questions were viewed by the users
+        self.views = defaultdict(list)
+        user_ids = [user.id for user in users]
+        question_ids = [thread[0] for thread in self.threads.values()]
+        for ids in get_chunks(question_ids):
+            views = QuestionView.objects.filter(
+                                    who__id__in=user_ids,
+                                    question__id__in=ids
+                                ).values_list('who_id', 'question_id', 'when')
+            for user_id, question_id, when in views:
+                self.views[(user_id, question_id)].append(when)
+
+        #lists of the question ids by (user id, group, seen), where
+        #the group is the feed type, "comments" or "mentions"
+        self.selected = dict()
+        for group, user_thread_ids in candidates.items():
+            if group == 'q_ans':
+                limit = askbot_settings.MAX_ALERTS_PER_EMAIL
+            else:
+                limit = None
+            for user in users:
+                for seen in (False, True):
+                    self.selected[(user.id, group, seen)] = self.select(
+                                            user, user_thread_ids[user.id], seen
+                                        )[:limit]
+
+        #comments are counted in all questions, without the filters
+        question_thread_ids = set()
+        for thread_ids in comment_thread_ids.values():
+            question_thread_ids.update(thread_ids)
+        question_ids = set()
+        for ids in self.selected.values():
+            question_ids.update(ids)
+
+        self.questions = dict()
+        self.thread_questions = dict()
+        for ids in get_chunks(question_ids):
+            questions = Post.objects.filter(id__in=ids).select_related('thread')
+            for question in questions:
+                self.questions[question.id] = question
+        for ids in get_chunks(question_thread_ids):
+            questions = Post.objects.get_questions().filter(
+                                        thread__id__in=ids
+                                    ).select_related('thread')
+            for question in questions:
+                self.thread_questions[question.thread_id] = question
+
+        self.comment_questions = dict()
+        for user_id, thread_ids in comment_thread_ids.items():
+            self.comment_questions[user_id] = [
+                self.thread_questions[thread_id] for thread_id in thread_ids \
+                                        if thread_id in self.thread_questions
+            ]
+
+    def select(self, user, thread_ids, seen):
+        """returns ids of the base questions of the threads,
+        which were not seen by the user or, if ``seen`` is ``True``,
+        seen before the last activity, latest activity first,
+        excluding the threads last changed by the user and
+        those older than the user"""
+        selected = list()
+        for thread_id in thread_ids:
+            if thread_id not in self.threads:
+                continue
+            question_id, last_activity_at, last_activity_by_id = self.threads[thread_id]
+            if last_activity_by_id == user.id or last_activity_at < user.date_joined:
+                continue
+            views = self.views.get((user.id, question_id))
+            if seen:
+                if not views:
+                    continue
+                if min(views) >= last_activity_at:
+                    continue
+            elif views:
+                continue
+            selected.append((last_activity_at, question_id))
+        selected.sort(reverse=True)
+        return [question_id for last_activity_at, question_id in selected]
+
+    def get_questions(self, user, group, seen=False):
+        """returns the selected questions of the user,
+        questions with comments - one per comment"""
+        if group == 'comments':
+            return self.comment_questions.get(user.id, list())
+        question_ids = self.selected.get((user.id, group, seen), list())
+        return [
+            self.questions[question_id] for question_id in question_ids \
+                                        if question_id in self.questions
+        ]
+
+
+def render_digest(digest):
+    """returns subject line and body of the email
+    from the digest - dictionary with plain values,
+    built by the ``Command.get_digest``"""
+    question_count = digest['question_count']
+    subject_line = ungettext(
+        '%(question_count)d updated question about %(topics)s',
+        '%(question_count)d updated questions about %(topics)s',
+        question_count
+    ) % {
+        'question_count': question_count,
+        'topics': digest['tag_summary']
+    }
+
+    #todo: send this to special log
+    #print 'have %d updated questions for %s' % (num_q, user.username)
+    text = ungettext(
+        '<p>Dear %(name)s,</p><p>The following question has been updated '
+        '%(sitename)s</p>',
+        '<p>Dear %(name)s,</p><p>The following %(num)d questions have been '
+        'updated on %(sitename)s:</p>',
+        question_count
+    ) % {
+        'num': question_count,
+        'name': digest['username'],
+        'sitename': askbot_settings.APP_SHORT_NAME
+    }
+
+    text += '<ul>'
+    for meta_data in digest['questions']:
+        act_list = []
+        if meta_data['new_q']:
+            act_list.append(_('new question'))
+        format_action_count('%(num)d rev', meta_data['q_rev'],act_list)
+        format_action_count('%(num)d ans', meta_data['new_ans'],act_list)
+        format_action_count('%(num)d ans rev',meta_data['ans_rev'],act_list)
+        act_token = ', '.join(act_list)
+        text += '<li><a href="%s?sort=latest">%s</a> <font color="#777777">(%s)</font></li>' \
+                    % (meta_data['url'], meta_data['title'], act_token)
+    text += '</ul>'
+    text += '<p></p>'
+    #if len(q_list.keys()) >= askbot_settings.MAX_ALERTS_PER_EMAIL:
+    #    text += _('There may be more questions updated since '
+    #                'you have logged in last time as this list is '
+    #                'abridged for your convinience. Please visit '
+    #                'the askbot and see what\'s new!<br>'
+    #              )
+
+    text += _(
+        '<p>Please remember that you can always <a '
+        'href="%(email_settings_link)s">adjust</a> frequency of the email updates or '
+        'turn them off entirely.<br/>If you believe that this message was sent in an '
+        'error, please email about it the forum administrator at %(admin_email)s.</'
+        'p><p>Sincerely,</p><p>Your friendly %(sitename)s server.</p>'
+    ) % {
+        'email_settings_link': digest['email_settings_url'],
+        'admin_email': django_settings.ADMINS[0][1],
+        'sitename': askbot_settings.APP_SHORT_NAME
+    }
+    return subject_line, text
+
+def send_digests(digests):
+    """renders and sends the digest emails over one connection
+    to the mail server, runs in the worker processes
+    when the emails are sent in parallel"""
+    connection = django_mail.get_connection()
+    try:
+        connection.open()
+    except Exception, error:
+        #each message will try to open the connection again
+        logging.debug('could not connect to the mail server: %s' % error)
+    try:
+        for digest in digests:
+            subject_line, text = render_digest(digest)
+            mail.send_mail(
+                subject_line = subject_line,
+                body_text = text,
+                recipient_list = [digest['recipient_email']],
+                connection = connection
+            )
+    finally:
+        connection.close()
+    return len(digests)
+
 class Command(NoArgsCommand):
+    help = 'Sends the digests of the updated questions by email'
+
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option(
+            '--batch-size',
+            action = 'store',
+            type = 'int',
+            dest = 'batch_size',
+            default = USER_BATCH_SIZE,
+            help = 'Number of users whose digests are built together'
+        ),
+        optparse.make_option(
+            '--processes',
+            action = 'store',
+            type = 'int',
+            dest = 'processes',
+            default = 1,
+            help = 'Number of processes rendering and sending the emails'
+        ),
+    )
+
     def handle_noargs(self, **options):
         if askbot_settings.ENABLE_EMAIL_ALERTS:
+            self.verbosity = int(options.get('verbosity', 1))
             try:
                 try:
-                    self.send_email_alerts()
+                    self.send_email_alerts(
+                                    batch_size=options.get('batch_size', USER_BATCH_SIZE),
+                                    processes=options.get('processes', 1)
+                                )
                 except Exception, e:
                     print e
             finally:
                 connection.close()
 
-    def get_updated_questions_for_user(self, user):
-        """
-        retreive relevant question updates for the user
-        according to their subscriptions and recorded question
-        views
-        """
-
-        user_feeds = EmailFeedSetting.objects.filter(
-                                                subscriber=user
-                                            ).exclude(
-                                                frequency__in=('n', 'i')
-                                            )
+    def get_feeds_for_users(self, users):
+        """returns dictionary of lists of email feed settings
+        by user id, missing feed settings are added"""
+        from askbot import forms#need to avoid circular dependency
+        form = forms.EditUserEmailFeedsForm()
+        need_feed_types = set(form.get_db_model_subscription_type_names())
+
+        user_ids = [user.id for user in users]
+        feeds = defaultdict(list)
+        for feed in EmailFeedSetting.objects.filter(subscriber__id__in=user_ids):
+            feeds[feed.subscriber_id].append(feed)
+
+        for user in users:
+            have_feed_types = set([feed.feed_type for feed in feeds[user.id]])
+            if need_feed_types - have_feed_types:
+                user.add_missing_askbot_subscriptions()
+                feeds[user.id] = list(
+                            EmailFeedSetting.objects.filter(subscriber=user)
+                        )
+        return feeds
+
+    def get_base_questions(self):
+        """returns query set of the questions which
+        may be included into the digests of any user -
+        not deleted, not closed and approved"""
+        questions = Post.objects.get_questions().exclude(
+                                deleted=True
+                            ).exclude(
+                                thread__closed=True
+                            ).select_related(
+                                'thread'
+                            ).order_by('-thread__last_activity_at')
 
-        should_proceed = False
+        if askbot_settings.ENABLE_CONTENT_MODERATION:
+            questions = questions.filter(approved = True)
+        return questions
+
+    def get_cutoff_times(self, user_feeds):
+        """returns dictionary of the cutoff times of the ripe
+        feeds of the user by the feed type, the feeds are
+        recorded to be marked as reported"""
+        user_feeds = [
+            feed for feed in user_feeds if feed.frequency not in ('n', 'i')
+        ]
+
+        cutoff_times = dict()
         for feed in user_feeds:
-            if feed.should_send_now() == True:
-                should_proceed = True
-                break
+            #each group of updates has it's own cutoff time
+            #that cutoff time is computed for each user individually
+
+            #we won't send email for a given question if an email has been
+            #sent after that cutoff_time
+            if feed.should_send_now():
+                #alerts on mentions and comments are not marked as reported
+                if DEBUG_THIS_COMMAND == False and feed.feed_type != 'm_and_c':
+                    self.reported_feed_ids.append(feed.id)
+                cutoff_times[feed.feed_type] = feed.get_previous_report_cutoff_time()
+        return cutoff_times
 
+    def get_updated_questions_for_user(self, user, cutoff_times, subscribed):
+        """
+        retreive questions with possibly relevant updates for the user
+        according to their subscriptions and recorded question
+        views, news in the questions are counted later
+        by the ``count_news``
+        ``cutoff_times`` - cutoff times of the ripe feeds by the feed type
+        ``subscribed`` - :class:`SubscribedQuestions` of the batch of users
+        """
         #shortcircuit - if there is no ripe feed to work on for this user
-        if should_proceed == False:
+        if len(cutoff_times) == 0:
             return {}
 
-        #these are placeholders for separate query sets per question group
-        #there are four groups - one for each EmailFeedSetting.feed_type
-        #and each group has subtypes A and B
-        #that's because of the strange thing commented below
-        #see note on Q and F objects marked with todo tag
-        q_sel_A = None
-        q_sel_B = None
-
-        q_ask_A = None
-        q_ask_B = None
-
-        q_ans_A = None
-        q_ans_B = None
-
+        #questions filtered by the tags of the user are selected
+        #with the query sets of this user, there are subtypes A and B
         q_all_A = None
         q_all_B = None
+        if 'q_all' in cutoff_times:
+            #base question query set for this user
+            #not too old, not last edited by the same user
+            base_qs = self.base_questions.exclude(
+                                    thread__last_activity_by=user
+                                ).exclude(
+                                    thread__last_activity_at__lt=user.date_joined#exclude old stuff
+                                )
 
-        #base question query set for this user
-        #basic things - not deleted, not closed, not too old
-        #not last edited by the same user
-        base_qs = Post.objects.get_questions().exclude(
-                                thread__last_activity_by=user
-                            ).exclude(
-                                thread__last_activity_at__lt=user.date_joined#exclude old stuff
-                            ).exclude(
-                                deleted=True
-                            ).exclude(
-                                thread__closed=True
-                            ).order_by('-thread__last_activity_at')
+            #todo: for some reason filter on did not work as expected ~Q(viewed__who=user) | 
+            #      Q(viewed__who=user,viewed__when__lt=F('thread__last_activity_at'))
+            #returns way more questions than you might think it should
+            #so because of that there are two separate query sets
+            #plus two separate queries run faster!
 
-        if askbot_settings.ENABLE_CONTENT_MODERATION:
-            base_qs = base_qs.filter(approved = True)
-        #todo: for some reason filter on did not work as expected ~Q(viewed__who=user) | 
-        #      Q(viewed__who=user,viewed__when__lt=F('thread__last_activity_at'))
-        #returns way more questions than you might think it should
-        #so because of that I've created separate query sets Q_set2 and Q_set3
-        #plus two separate queries run faster!
-
-        #build two two queries based
-
-        #questions that are not seen by the user at all
-        not_seen_qs = base_qs.filter(~Q(viewed__who=user))
-        #questions that were seen, but before last modification
-        seen_before_last_mod_qs = base_qs.filter(
+            #questions that are not seen by the user at all
+            q_all_A = user.get_tag_filtered_questions(
+                                    base_qs.filter(~Q(viewed__who=user))
+                                )
+            #questions that were seen, but before last modification
+            #the filter is applied last, because query sets
+            #with F() expressions are very slow to clone
+            q_all_B = user.get_tag_filtered_questions(base_qs).filter(
                                     Q(
                                         viewed__who=user,
                                         viewed__when__lt=F('thread__last_activity_at')
                                     )
                                 )
 
-        #shorten variables for convenience
-        Q_set_A = not_seen_qs
-        Q_set_B = seen_before_last_mod_qs
+            q_all_A = q_all_A[:askbot_settings.MAX_ALERTS_PER_EMAIL]
+            q_all_B = q_all_B[:askbot_settings.MAX_ALERTS_PER_EMAIL]
+            q_all_A.cutoff_time = cutoff_times['q_all']
+            q_all_B.cutoff_time = cutoff_times['q_all']
 
         if django_settings.ASKBOT_MULTILINGUAL:
             languages = user.languages.split()
         else:
             languages = None
 
-        for feed in user_feeds:
-            if feed.feed_type == 'm_and_c':
-                #alerts on mentions and comments are processed separately
-                #because comments to questions do not trigger change of last_updated
-                #this may be changed in the future though, see
-                #http://askbot.org/en/question/96/
-                continue
-
-            #each group of updates represented by the corresponding
-            #query set has it's own cutoff time
-            #that cutoff time is computed for each user individually
-            #and stored as a parameter "cutoff_time"
-
-            #we won't send email for a given question if an email has been
-            #sent after that cutoff_time
-            if feed.should_send_now():
-                if DEBUG_THIS_COMMAND == False:
-                    feed.mark_reported_now()
-                cutoff_time = feed.get_previous_report_cutoff_time() 
-
-                if feed.feed_type == 'q_sel':
-                    q_sel_A = Q_set_A.filter(thread__followed_by=user)
-                    q_sel_A.cutoff_time = cutoff_time #store cutoff time per query set
-                    q_sel_B = Q_set_B.filter(thread__followed_by=user)
-                    q_sel_B.cutoff_time = cutoff_time #store cutoff time per query set
-
-                elif feed.feed_type == 'q_ask':
-                    q_ask_A = Q_set_A.filter(author=user)
-                    q_ask_A.cutoff_time = cutoff_time
-                    q_ask_B = Q_set_B.filter(author=user)
-                    q_ask_B.cutoff_time = cutoff_time
-
-                elif feed.feed_type == 'q_ans':
-                    q_ans_A = Q_set_A.filter(thread__posts__author=user, thread__posts__post_type='answer')
-                    q_ans_A = q_ans_A[:askbot_settings.MAX_ALERTS_PER_EMAIL]
-                    q_ans_A.cutoff_time = cutoff_time
-
-                    q_ans_B = Q_set_B.filter(thread__posts__author=user, thread__posts__post_type='answer')
-                    q_ans_B = q_ans_B[:askbot_settings.MAX_ALERTS_PER_EMAIL]
-                    q_ans_B.cutoff_time = cutoff_time
-
-                elif feed.feed_type == 'q_all':
-                    q_all_A = user.get_tag_filtered_questions(Q_set_A)
-                    q_all_B = user.get_tag_filtered_questions(Q_set_B)
-
-                    q_all_A = q_all_A[:askbot_settings.MAX_ALERTS_PER_EMAIL]
-                    q_all_B = q_all_B[:askbot_settings.MAX_ALERTS_PER_EMAIL]
-                    q_all_A.cutoff_time = cutoff_time
-                    q_all_B.cutoff_time = cutoff_time
-
         #build ordered list questions for the email report
         q_list = SortedDict()
 
-        #todo: refactor q_list into a separate class?
-        extend_question_list(q_sel_A, q_list, languages=languages)
-        extend_question_list(q_sel_B, q_list, languages=languages)
-
-        #build list of comment and mention responses here
-        #it is separate because posts are not marked as changed
-        #when people add comments
-        #mention responses could be collected in the loop above, but
-        #it is inconvenient, because feed_type m_and_c bundles the two
-        #also we collect metadata for these here
-        try:
-            feed = user_feeds.get(feed_type='m_and_c')
-            if feed.should_send_now():
-                cutoff_time = feed.get_previous_report_cutoff_time()
-                comments = Post.objects.get_comments().filter(
-                                            added_at__lt = cutoff_time,
-                                        ).exclude(
-                                            author = user
-                                        )
-                q_commented = list() 
-                for c in comments:
-                    post = c.parent
-                    if post.author != user:
-                        continue
-
-                    #skip is post was seen by the user after
-                    #the comment posting time
-                    q_commented.append(post.get_origin_post())
-
+        def extend(feed_type, group, seen=False, **kwargs):
+            """adds questions selected for the user,
+            if the feed of the type is ripe"""
+            if feed_type in cutoff_times:
                 extend_question_list(
-                                q_commented,
-                                q_list,
-                                cutoff_time=cutoff_time,
-                                add_comment=True,
-                                languages=languages
-                            )
-
-                mentions = Activity.objects.get_mentions(
-                                                    mentioned_at__lt = cutoff_time,
-                                                    mentioned_whom = user
-                                                )
-
-                #print 'have %d mentions' % len(mentions)
-                #MM = Activity.objects.filter(activity_type = const.TYPE_ACTIVITY_MENTION)
-                #print 'have %d total mentions' % len(MM)
-                #for m in MM:
-                #    print m
-
-                mention_posts = get_all_origin_posts(mentions)
-                q_mentions_id = [q.id for q in mention_posts]
-
-                q_mentions_A = Q_set_A.filter(id__in = q_mentions_id)
-                q_mentions_A.cutoff_time = cutoff_time
-                extend_question_list(
-                    q_mentions_A,
+                    subscribed.get_questions(user, group, seen),
                     q_list,
-                    add_mention=True,
-                    languages=languages
+                    cutoff_time=cutoff_times[feed_type],
+                    languages=languages,
+                    **kwargs
                 )
 
-                q_mentions_B = Q_set_B.filter(id__in = q_mentions_id)
-                q_mentions_B.cutoff_time = cutoff_time
-                extend_question_list(
-                    q_mentions_B,
-                    q_list,
-                    add_mention=True,
-                    languages=languages
-                )
-        except EmailFeedSetting.DoesNotExist:
-            pass
+        #todo: refactor q_list into a separate class?
+        extend('q_sel', 'q_sel')
+        extend('q_sel', 'q_sel', seen=True)
+
+        #list of comment and mention responses is separate
+        #because posts are not marked as changed when people add comments
+        #so comments to questions do not trigger change of last_updated
+        #this may be changed in the future though, see
+        #http://askbot.org/en/question/96/
+        extend('m_and_c', 'comments', add_comment=True)
+        extend('m_and_c', 'mentions', add_mention=True)
+        extend('m_and_c', 'mentions', seen=True, add_mention=True)
 
         if user.email_tag_filter_strategy == const.INCLUDE_INTERESTING:
             extend_question_list(q_all_A, q_list, languages=languages)
             extend_question_list(q_all_B, q_list, languages=languages)
 
-        extend_question_list(q_ask_A, q_list, limit=True, languages=languages)
-        extend_question_list(q_ask_B, q_list, limit=True, languages=languages)
+        extend('q_ask', 'q_ask', limit=True)
+        extend('q_ask', 'q_ask', seen=True, limit=True)
 
-        extend_question_list(q_ans_A, q_list, limit=True, languages=languages)
-        extend_question_list(q_ans_B, q_list, limit=True, languages=languages)
+        extend('q_ans', 'q_ans', limit=True)
+        extend('q_ans', 'q_ans', seen=True, limit=True)
 
         if user.email_tag_filter_strategy == const.EXCLUDE_IGNORED:
             extend_question_list(q_all_A, q_list, limit=True, languages=languages)
             extend_question_list(q_all_B, q_list, limit=True, languages=languages)
 
+        return q_list
+
+    def count_news(self, question_lists):
+        """counts news in the questions collected for the users
+        ``question_lists`` - dictionary of question lists by user,
+        questions which have no news for the user or about which
+        email has been sent recently enough are marked to be skipped
+        """
         ctype = ContentType.objects.get_for_model(Post)
         EMAIL_UPDATE_ACTIVITY = const.TYPE_ACTIVITY_EMAIL_UPDATE_SENT
 
+        questions = set()
+        for q_list in question_lists.values():
+            questions.update(q_list.keys())
+        if len(questions) == 0:
+            return
+
         #up to this point we still don't know if emails about
         #collected questions were sent recently
-        #the next loop examines activity record and decides
-        #for each question, whether it needs to be included or not
-        #into the report
-
-        for q, meta_data in q_list.items():
-            #this loop edits meta_data for each question
-            #so that user will receive counts on new edits new answers, etc
-            #and marks questions that need to be skipped
-            #because an email about them was sent recently enough
-
-            #also it keeps a record of latest email activity per question per user
-            try:
-                #todo: is it possible to use content_object here, instead of
-                #content type and object_id pair?
-                update_info = Activity.objects.get(
-                                            user=user,
-                                            content_type=ctype,
-                                            object_id=q.id,
-                                            activity_type=EMAIL_UPDATE_ACTIVITY
-                                        )
-                emailed_at = update_info.active_at
-            except Activity.DoesNotExist:
-                update_info = Activity(
-                                        user=user, 
-                                        content_object=q, 
+        #so load the latest email activities per question per user
+        user_ids = [user.id for user in question_lists.keys()]
+        email_activities = dict()
+        for question_ids in get_chunks([q.id for q in questions]):
+            activities = Activity.objects.filter(
+                                        user__id__in=user_ids,
+                                        content_type=ctype,
+                                        object_id__in=question_ids,
                                         activity_type=EMAIL_UPDATE_ACTIVITY
+                                    ).values_list(
+                                        'id', 'user_id', 'object_id', 'active_at'
                                     )
-                emailed_at = datetime.datetime(1970, 1, 1)#long time ago
-            except Activity.MultipleObjectsReturned:
-                raise Exception(
+            for activity_id, user_id, object_id, active_at in activities:
+                key = (user_id, object_id)
+                if key in email_activities:
+                    raise Exception(
                                 'server error - multiple question email activities '
                                 'found per user-question pair'
                                 )
+                email_activities[key] = (activity_id, active_at)
+
+        #news are loaded since the earliest email about the questions
+        long_time_ago = datetime.datetime(1970, 1, 1)
+        since = None
+        for user, q_list in question_lists.items():
+            for q in q_list.keys():
+                activity_id, emailed_at = email_activities.get(
+                                                (user.id, q.id),
+                                                (None, long_time_ago)
+                                            )
+                if since is None or emailed_at < since:
+                    since = emailed_at
+
+        updates = QuestionUpdates(questions, since)
+
+        user_group_ids = None
+        if askbot_settings.GROUPS_ENABLED:
+            #answers may be visible only to some groups
+            user_group_ids = defaultdict(set)
+            memberships = AuthUserGroups.objects.filter(
+                                        user__id__in=user_ids
+                                    ).values_list('user_id', 'group_id')
+            for user_id, group_id in memberships:
+                user_group_ids[user_id].add(group_id)
+
+        #this loop edits meta_data for each question
+        #so that user will receive counts on new edits new answers, etc
+        #and marks questions that need to be skipped
+        #because an email about them was sent recently enough
+
+        #also it keeps a record of latest email activity per question per user
+        now = datetime.datetime.now()
+        updated_activity_ids = list()
+        new_activities = list()
+        for user, q_list in question_lists.items():
+            if user_group_ids is None:
+                group_ids = None
+            else:
+                group_ids = user_group_ids[user.id]
 
-            cutoff_time = meta_data['cutoff_time']#cutoff time for the question
+            for q, meta_data in q_list.items():
+                activity_id, emailed_at = email_activities.get(
+                                                (user.id, q.id),
+                                                (None, long_time_ago)
+                                            )
 
-            #skip question if we need to wait longer because
-            #the delay before the next email has not yet elapsed
-            #or if last email was sent after the most recent modification
-            if emailed_at > cutoff_time or emailed_at > q.thread.last_activity_at:
-                meta_data['skip'] = True
-                continue
+                cutoff_time = meta_data['cutoff_time']#cutoff time for the question
 
-            #collect info on all sorts of news that happened after
-            #the most recent emailing to the user about this question
-            q_rev = q.revisions.filter(revised_at__gt=emailed_at)
-            q_rev = q_rev.exclude(author=user)
+                #skip question if we need to wait longer because
+                #the delay before the next email has not yet elapsed
+                #or if last email was sent after the most recent modification
+                if emailed_at > cutoff_time or emailed_at > q.thread.last_activity_at:
+                    meta_data['skip'] = True
+                    continue
 
-            #now update all sorts of metadata per question
-            meta_data['q_rev'] = len(q_rev)
-            if len(q_rev) > 0 and q.added_at == q_rev[0].revised_at:
-                meta_data['q_rev'] = 0
-                meta_data['new_q'] = True
-            else:
-                meta_data['new_q'] = False
-                
-            new_ans = Post.objects.get_answers(user).filter(
-                                            thread=q.thread,
-                                            added_at__gt=emailed_at,
-                                            deleted=False,
-                                        )
-            new_ans = new_ans.exclude(author=user)
-            meta_data['new_ans'] = len(new_ans)
+                #collect info on all sorts of news that happened after
+                #the most recent emailing to the user about this question
+                q_rev, new_q = updates.count_question_revisions(q, user, emailed_at)
+                meta_data['q_rev'] = q_rev
+                meta_data['new_q'] = new_q
 
-            ans_ids = Post.objects.get_answers(user).filter(
-                                            thread=q.thread,
-                                            added_at__gt=emailed_at,
-                                            deleted=False,
-                                        ).values_list(
-                                            'id', flat = True
-                                        )
-            ans_rev = PostRevision.objects.filter(post__id__in = ans_ids)
-            ans_rev = ans_rev.exclude(author=user).distinct()
-            meta_data['ans_rev'] = len(ans_rev)
-
-            comments = meta_data.get('comments', 0)
-            mentions = meta_data.get('mentions', 0)
-
-            #print meta_data
-            #finally skip question if there are no news indeed
-            if len(q_rev) + len(new_ans) + len(ans_rev) + comments + mentions == 0:
-                meta_data['skip'] = True
-                #print 'skipping'
-            else:
-                meta_data['skip'] = False
-                #print 'not skipping'
-                update_info.active_at = datetime.datetime.now() 
-                if DEBUG_THIS_COMMAND == False:
-                    update_info.save() #save question email update activity 
-        #q_list is actually an ordered dictionary
-        #print 'user %s gets %d' % (user.username, len(q_list.keys()))
-        #todo: sort question list by update time
-        return q_list 
-
-    def send_email_alerts(self):
-        #does not change the database, only sends the email
-        #todo: move this to template
-        for user in User.objects.all():
-            user.add_missing_askbot_subscriptions()
-            #todo: q_list is a dictionary, not a list
-            q_list = self.get_updated_questions_for_user(user)
-            if len(q_list.keys()) == 0:
-                continue
-            num_q = 0
-            for question, meta_data in q_list.items():
-                if meta_data['skip']:
-                    del q_list[question]
+                new_ans, ans_rev = updates.count_answers(
+                                                q, user, emailed_at, group_ids
+                                            )
+                meta_data['new_ans'] = new_ans
+                meta_data['ans_rev'] = ans_rev
+
+                comments = meta_data.get('comments', 0)
+                mentions = meta_data.get('mentions', 0)
+
+                #finally skip question if there are no news indeed
+                if q_rev + new_q + new_ans + ans_rev + comments + mentions == 0:
+                    meta_data['skip'] = True
                 else:
-                    num_q += 1
-            if num_q > 0:
-                threads = Thread.objects.filter(id__in=[qq.thread_id for qq in q_list.keys()])
-                tag_summary = Thread.objects.get_tag_summary_from_threads(threads)
-
-                question_count = len(q_list.keys())
-
-                subject_line = ungettext(
-                    '%(question_count)d updated question about %(topics)s',
-                    '%(question_count)d updated questions about %(topics)s',
-                    question_count
-                ) % {
-                    'question_count': question_count,
-                    'topics': tag_summary
-                }
-
-                #todo: send this to special log
-                #print 'have %d updated questions for %s' % (num_q, user.username)
-                text = ungettext(
-                    '<p>Dear %(name)s,</p><p>The following question has been updated '
-                    '%(sitename)s</p>',
-                    '<p>Dear %(name)s,</p><p>The following %(num)d questions have been '
-                    'updated on %(sitename)s:</p>',
-                    num_q
-                ) % {
-                    'num':num_q,
-                    'name':user.username,
-                    'sitename': askbot_settings.APP_SHORT_NAME
-                }
-
-                text += '<ul>'
-                items_added = 0
-                items_unreported = 0
-                for q, meta_data in q_list.items():
-                    act_list = []
-                    if meta_data['skip']:
-                        continue
-                    if items_added >= askbot_settings.MAX_ALERTS_PER_EMAIL:
-                        items_unreported = num_q - items_added #may be inaccurate actually, but it's ok
-                        
+                    meta_data['skip'] = False
+                    if activity_id is None:
+                        new_activities.append(
+                            Activity(
+                                user=user,
+                                content_object=q,
+                                activity_type=EMAIL_UPDATE_ACTIVITY,
+                                active_at=now
+                            )
+                        )
                     else:
-                        items_added += 1
-                        if meta_data['new_q']:
-                            act_list.append(_('new question'))
-                        format_action_count('%(num)d rev', meta_data['q_rev'],act_list)
-                        format_action_count('%(num)d ans', meta_data['new_ans'],act_list)
-                        format_action_count('%(num)d ans rev',meta_data['ans_rev'],act_list)
-                        act_token = ', '.join(act_list)
-                        text += '<li><a href="%s?sort=latest">%s</a> <font color="#777777">(%s)</font></li>' \
-                                    % (site_url(q.get_absolute_url()), q.thread.title, act_token)
-                text += '</ul>'
-                text += '<p></p>'
-                #if len(q_list.keys()) >= askbot_settings.MAX_ALERTS_PER_EMAIL:
-                #    text += _('There may be more questions updated since '
-                #                'you have logged in last time as this list is '
-                #                'abridged for your convinience. Please visit '
-                #                'the askbot and see what\'s new!<br>'
-                #              )
-
-                link = reverse(
-                    'user_subscriptions', 
-                    kwargs = {
-                        'id': user.id,
-                        'slug': slugify(user.username)
-                    }
-                )
+                        updated_activity_ids.append(activity_id)
 
-                text += _(
-                    '<p>Please remember that you can always <a '
-                    'href="%(email_settings_link)s">adjust</a> frequency of the email updates or '
-                    'turn them off entirely.<br/>If you believe that this message was sent in an '
-                    'error, please email about it the forum administrator at %(admin_email)s.</'
-                    'p><p>Sincerely,</p><p>Your friendly %(sitename)s server.</p>'
-                ) % {
-                    'email_settings_link': site_url(link),
-                    'admin_email': django_settings.ADMINS[0][1],
-                    'sitename': askbot_settings.APP_SHORT_NAME
-                }
-                if DEBUG_THIS_COMMAND == True:
-                    recipient_email = django_settings.ADMINS[0][1]
-                else:
-                    recipient_email = user.email
+        if DEBUG_THIS_COMMAND == True:
+            return
 
-                mail.send_mail(
-                    subject_line = subject_line,
-                    body_text = text,
-                    recipient_list = [recipient_email]
+        #save question email update activities
+        for activity_ids in get_chunks(updated_activity_ids):
+            Activity.objects.filter(id__in=activity_ids).update(active_at=now)
+        if hasattr(Activity.objects, 'bulk_create'):
+            Activity.objects.bulk_create(new_activities, batch_size=QUERY_CHUNK_SIZE)
+        else:
+            #django 1.3
+            for activity in new_activities:
+                activity.save()
+
+    def get_digest(self, user, q_list):
+        """returns digest of the question updates for the user -
+        dictionary with plain values, from which
+        the email is rendered, or ``None`` if there is no news"""
+        questions = [q for q, meta_data in q_list.items() if not meta_data['skip']]
+        if len(questions) == 0:
+            return None
+
+        threads = [q.thread for q in questions]
+        tag_summary = Thread.objects.get_tag_summary_from_threads(threads)
+
+        question_data = list()
+        for q in questions[:askbot_settings.MAX_ALERTS_PER_EMAIL]:
+            meta_data = q_list[q]
+            question_data.append({
+                'url': site_url(q.get_absolute_url()),
+                'title': q.thread.title,
+                'new_q': meta_data['new_q'],
+                'q_rev': meta_data['q_rev'],
+                'new_ans': meta_data['new_ans'],
+                'ans_rev': meta_data['ans_rev'],
+            })
+
+        link = reverse(
+            'user_subscriptions',
+            kwargs = {
+                'id': user.id,
+                'slug': slugify(user.username)
+            }
+        )
+
+        if DEBUG_THIS_COMMAND == True:
+            recipient_email = django_settings.ADMINS[0][1]
+        else:
+            recipient_email = user.email
+
+        return {
+            'username': user.username,
+            'recipient_email': recipient_email,
+            'email_settings_url': site_url(link),
+            'tag_summary': tag_summary,
+            'question_count': len(questions),
+            'questions': question_data
+        }
+
+    def get_digests(self, users):
+        """returns list of the digests for the batch of users"""
+        feeds = self.get_feeds_for_users(users)
+        self.reported_feed_ids = list()
+
+        cutoff_times = dict()
+        for user in users:
+            cutoff_times[user.id] = self.get_cutoff_times(feeds[user.id])
+        subscribed = SubscribedQuestions(self.base_questions, users, cutoff_times)
+
+        question_lists = dict()
+        for user in users:
+            #todo: q_list is a dictionary, not a list
+            q_list = self.get_updated_questions_for_user(
+                                        user, cutoff_times[user.id], subscribed
+                                    )
+            if len(q_list.keys()) > 0:
+                question_lists[user] = q_list
+
+        for feed_ids in get_chunks(self.reported_feed_ids):
+            EmailFeedSetting.objects.filter(
+                                id__in=feed_ids
+                            ).update(
+                                reported_at=datetime.datetime.now()
+                            )
+
+        self.count_news(question_lists)
+
+        digests = list()
+        for user in users:
+            if user in question_lists:
+                digest = self.get_digest(user, question_lists[user])
+                if digest:
+                    digests.append(digest)
+        return digests
+
+    def send_email_alerts(self, batch_size=USER_BATCH_SIZE, processes=1):
+        """builds digests for batches of users, and sends them,
+        in parallel, if there is more than one process"""
+        pool = None
+        if processes > 1:
+            #worker processes must not share the database connection
+            connection.close()
+            pool = multiprocessing.Pool(processes)
+
+        self.base_questions = self.get_base_questions()
+        start_time = time.time()
+        build_time = 0
+        send_time = 0
+        user_count = User.objects.count()
+        users_done = 0
+        emails_sent = 0
+        last_user_id = 0
+        try:
+            while True:
+                users = User.objects.filter(id__gt=last_user_id).order_by('id')
+                users = list(users[:batch_size])
+                if len(users) == 0:
+                    break
+                last_user_id = users[-1].id
+
+                batch_start_time = time.time()
+                digests = self.get_digests(users)
+                build_time += time.time() - batch_start_time
+
+                batch_start_time = time.time()
+                if len(digests) == 0:
+                    pass
+                elif pool:
+                    #one chunk of the digests per process
+                    chunk_size = (len(digests) + processes - 1) / processes
+                    pool.map(send_digests, list(get_chunks(digests, chunk_size)))
+                else:
+                    send_digests(digests)
+                send_time += time.time() - batch_start_time
+
+                users_done += len(users)
+                emails_sent += len(digests)
+                if self.verbosity > 1:
+                    print 'users: %d of %d, emails: %d, time: %.1fs' % (
+                                users_done,
+                                user_count,
+                                emails_sent,
+                                time.time() - start_time
+                            )
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        if self.verbosity > 1:
+            print 'sent %d emails to %d users in %.1fs ' \
+                '(building digests %.1fs, sending %.1fs)' % (
+                    emails_sent,
+                    users_done,
+                    time.time() - start_time,
+                    build_time,
+                    send_time
                 )
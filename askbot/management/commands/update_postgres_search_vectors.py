@@ -0,0 +1,79 @@
+"""update_postgres_search_vectors management command
+adds the text search vector columns and their indexes,
+if necessary, and recalculates the weighted text search
+vectors of the threads and the users in batches,
+each batch is committed separately
+
+python manage.py update_postgres_search_vectors --batch-size=500
+"""
+import optparse
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import transaction
+import askbot
+from askbot import models
+from askbot.search import postgresql
+from askbot.utils.console import ProgressBar
+
+def get_batches(query_set, batch_size, *fields):
+    """yields lists of the values of the fields of the objects,
+    ordered by the id, ``id`` must be the first field"""
+    last_id = 0
+    while True:
+        batch = list(
+                query_set.filter(
+                            id__gt=last_id
+                        ).order_by(
+                            'id'
+                        ).values_list(
+                            *fields
+                        )[:batch_size]
+            )
+        if len(batch) == 0:
+            return
+        yield batch
+        last_id = batch[-1][0]
+
+
+class Command(NoArgsCommand):
+    help = 'Updates text search vectors of the threads and the users'
+
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option(
+            '--batch-size',
+            action = 'store',
+            type = 'int',
+            dest = 'batch_size',
+            default = 500,
+            help = 'Number of the threads or users updated in one transaction'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        if 'postgresql_psycopg2' not in askbot.get_database_engine_name():
+            raise CommandError('This command works only with PostgreSQL')
+
+        batch_size = max(options['batch_size'], 1)
+
+        with transaction.commit_on_success():
+            postgresql.create_search_vector_columns()
+
+        threads = models.Thread.objects.all()
+        batch_count = (threads.count() + batch_size - 1) / batch_size
+        batches = get_batches(threads, batch_size, 'id', 'language_code')
+        message = 'Updating threads'
+        for batch in ProgressBar(batches, batch_count, message):
+            thread_ids_by_language = dict()
+            for thread_id, language_code in batch:
+                thread_ids_by_language.setdefault(language_code, []).append(thread_id)
+            with transaction.commit_on_success():
+                for language_code, thread_ids in thread_ids_by_language.items():
+                    postgresql.update_thread_search_vectors(thread_ids, language_code)
+
+        users = models.User.objects.all()
+        batch_count = (users.count() + batch_size - 1) / batch_size
+        batches = get_batches(users, batch_size, 'id')
+        message = 'Updating users'
+        for batch in ProgressBar(batches, batch_count, message):
+            user_ids = [row[0] for row in batch]
+            with transaction.commit_on_success():
+                postgresql.update_user_search_vectors(user_ids)
@@ -15,6 +15,8 @@ PROTECTED_VIEW_MODULES = (
 )
 ALLOWED_VIEWS = (
     'askbot.views.meta.media',
+    'askbot.views.meta.sitemap_index',
+    'askbot.views.meta.sitemap_shard',
 )
 
 def is_view_protected(view_func):
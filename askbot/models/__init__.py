@@ -36,7 +36,8 @@ from askbot import exceptions as askbot_exceptions
 from askbot import const
 from askbot.const.message_keys import get_i18n_message
 from askbot.conf import settings as askbot_settings
-from askbot.models.question import Thread
+from askbot.models.question import Thread, ThreadToGroup
+from askbot.models.question import invalidate_thread_cache_version
 from askbot.skins import utils as skin_utils
 from askbot.mail import messages
 from askbot.models.question import QuestionView, AnonymousQuestion
@@ -45,6 +46,13 @@ from askbot.models.question import FavoriteQuestion
 from askbot.models.tag import Tag, MarkedTag, TagSynonym
 from askbot.models.tag import format_personal_group_name
 from askbot.models.user import EmailFeedSetting, ActivityAuditStatus, Activity
+from askbot.models.user import get_inbox_activity_types
+from askbot.models.user import increment_response_counts
+from askbot.models.user import MODERATION_ACTIVITY_TYPES
+from askbot.models.user import get_moderation_items_version
+from askbot.models.user import invalidate_moderation_items_version
+from askbot.models.user import get_group_list_version
+from askbot.models.user import invalidate_group_list_version
 from askbot.models.user import GroupMembership
 from askbot.models.user import Group
 from askbot.models.user import BulkTagSubscription
@@ -54,6 +62,16 @@ from askbot.models.post import PostToGroup
 from askbot.models.post import DraftAnswer
 from askbot.models.reply_by_email import ReplyAddress
 from askbot.models import signals
+from askbot.models import visit_buffer
+from askbot.models import subscription_index
+from askbot.models import search_index
+from askbot.models.search_index import SearchIndexEntry
+from askbot.models import similarity_index
+from askbot.models.similarity_index import SimilarityIndexEntry
+from askbot.models import user_directory
+from askbot.models import user_stats
+from askbot.models import autocomplete
+from askbot.search import backends as search_backends
 from askbot.models.badges import award_badges_signal, get_badge, BadgeData
 from askbot.models.repute import Award, Repute, Vote
 from askbot.models.widgets import AskWidget, QuestionWidget
@@ -104,28 +122,10 @@ def get_users_by_text_query(search_query, users_query_set = None):
     """Runs text search in user names and profile.
     For postgres, search also runs against user group names.
     """
-    if getattr(django_settings, 'ENABLE_HAYSTACK_SEARCH', False):
-        from askbot.search.haystack import AskbotSearchQuerySet
-        qs = AskbotSearchQuerySet().filter(content=search_query).models(User).get_django_queryset(User)
-        return qs
-    else:
-        import askbot
-        if users_query_set is None:
-            users_query_set = User.objects.all()
-        if 'postgresql_psycopg2' in askbot.get_database_engine_name():
-            from askbot.search import postgresql
-            return postgresql.run_user_search(users_query_set, search_query)
-        else:
-            return users_query_set.filter(
-                models.Q(username__icontains=search_query) |
-                models.Q(about__icontains=search_query)
-            )
-        #if askbot.get_database_engine_name().endswith('mysql') \
-        #    and mysql.supports_full_text_search():
-        #    return User.objects.filter(
-        #        models.Q(username__search = search_query) |
-        #        models.Q(about__search = search_query)
-        #    )
+    if users_query_set is None:
+        users_query_set = User.objects.all()
+    backend = search_backends.get_backend()
+    return backend.search_users(users_query_set, search_query)
 
 class RelatedObjectSimulator(object):
     '''Objects that simulates the "messages_set" related field
@@ -1469,6 +1469,8 @@ def user_mark_tags(
                 marked_ts.update(reason=reason)
             cleaned_tagnames = tagnames
 
+    #bulk updates and wildcard changes do not send the model signals
+    subscription_index.record_change(self.id)
     return cleaned_tagnames, cleaned_wildcards
 
 @auto_now_timestamp
@@ -2051,9 +2053,6 @@ def user_visit_question(self, question = None, timestamp = None):
     #filter memo objects on response activities directed to the qurrent user
     #that refer to the children of the currently
     #viewed question and clear them for the current user
-    ACTIVITY_TYPES = const.RESPONSE_ACTIVITY_TYPES_FOR_DISPLAY
-    ACTIVITY_TYPES += (const.TYPE_ACTIVITY_MENTION,)
-
     audit_records = ActivityAuditStatus.objects.filter(
                         user = self,
                         status = ActivityAuditStatus.STATUS_NEW,
@@ -2061,21 +2060,27 @@ def user_visit_question(self, question = None, timestamp = None):
                     )
 
     cleared_record_count = audit_records.filter(
-                                activity__activity_type__in = ACTIVITY_TYPES
+                                activity__activity_type__in = get_inbox_activity_types()
                             ).update(
                                 status=ActivityAuditStatus.STATUS_SEEN
                             )
     if cleared_record_count > 0:
-        self.update_response_counts()
+        increment_response_counts(
+                        [self],
+                        new_count=-cleared_record_count,
+                        seen_count=cleared_record_count
+                    )
 
     #finally, mark admin memo objects if applicable
     #the admin response counts are not denormalized b/c they are easy to obtain
     if self.is_moderator() or self.is_administrator():
-        audit_records.filter(
+        seen_flag_count = audit_records.filter(
                 activity__activity_type = const.TYPE_ACTIVITY_MARK_OFFENSIVE
         ).update(
             status=ActivityAuditStatus.STATUS_SEEN
         )
+        if seen_flag_count > 0:
+            invalidate_moderation_items_version()
 
 
 def user_is_username_taken(cls,username):
@@ -2625,13 +2630,9 @@ def _process_vote(user, post, timestamp=None, cancel=False, vote_type=None):
         else:
             auth.onDownVoted(vote, post, user, timestamp)
 
-    post.thread.invalidate_cached_data()
-
-    if post.post_type == 'question':
-        #denormalize the question post score on the thread
-        post.thread.points = post.points
-        post.thread.save()
-        post.thread.update_summary_html()
+    #the score of the thread is updated by the auth functions
+    auth.queue_summary_html_update(post)
+    post.thread.invalidate_cached_post_data()
 
     if cancel:
         return None
@@ -2782,9 +2783,9 @@ def user_get_flags_for_post(self, post):
 
 def user_update_response_counts(user):
     """Recount number of responses to the user.
+    Only the counts are saved.
     """
-    ACTIVITY_TYPES = const.RESPONSE_ACTIVITY_TYPES_FOR_DISPLAY
-    ACTIVITY_TYPES += (const.TYPE_ACTIVITY_MENTION,)
+    ACTIVITY_TYPES = get_inbox_activity_types()
 
     user.new_response_count = ActivityAuditStatus.objects.filter(
                                     user = user,
@@ -2796,7 +2797,10 @@ def user_update_response_counts(user):
                                     status = ActivityAuditStatus.STATUS_SEEN,
                                     activity__activity_type__in = ACTIVITY_TYPES
                                 ).count()
-    user.save()
+    User.objects.filter(id=user.id).update(
+                            new_response_count=user.new_response_count,
+                            seen_response_count=user.seen_response_count
+                        )
 
 
 def user_receive_reputation(self, num_points):
@@ -2863,6 +2867,10 @@ def user_edit_group_membership(self, user=None, group=None, action=None):
 
     returns instance of GroupMembership (if action is "add") or None
     """
+    #group ids memoized by askbot.models.question.get_visitor_group_ids
+    if hasattr(user, '_group_ids_cache'):
+        del user._group_ids_cache
+
     if action == 'add':
         #calculate new level
         openness = group.get_openness_level_for_user(user)
@@ -3067,20 +3075,16 @@ User.add_to_class(
 )
 
 #todo: move this to askbot/mail ?
-def format_instant_notification_email(
-                                        to_user = None,
-                                        from_user = None,
-                                        post = None,
-                                        reply_address = None,
-                                        alt_reply_address = None,
-                                        update_type = None,
-                                        template = None,
-                                    ):
-    """
-    returns text of the instant notification body
-    and subject line
+def get_instant_notification_data(
+                                from_user = None,
+                                post = None,
+                                update_type = None,
+                            ):
+    """returns parts of the instant notification email
+    about the update of the post, which are the same
+    for all recipients: the subject line, the content preview
+    and the description of the update action
 
-    that is built when post is updated
     only update_types in const.RESPONSE_ACTIVITY_TYPE_MAP_FOR_TEMPLATES
     are supported
     """
@@ -3126,8 +3130,6 @@ def format_instant_notification_email(
 
     content_preview += '<p>======= Full thread summary =======</p>'
 
-    content_preview += post.thread.format_for_email(user=to_user)
-
     if update_type == 'post_shared':
         user_action = _('%(user)s shared a %(post_link)s.')
     elif post.is_comment():
@@ -3156,6 +3158,50 @@ def format_instant_notification_email(
         #'post_link': '%s <a href="%s">>>></a>' % (_(post.post_type), post_url)
     }
 
+    return {
+        'subject_line': _('"%(title)s"') % {'title': origin_post.thread.title},
+        'content_preview': content_preview,
+        'user_action': user_action,
+        'post_url': post_url,
+        'origin_post_title': origin_post.thread.title,
+    }
+
+def format_instant_notification_email(
+                                        to_user = None,
+                                        from_user = None,
+                                        post = None,
+                                        reply_address = None,
+                                        alt_reply_address = None,
+                                        update_type = None,
+                                        template = None,
+                                        notification_data = None,
+                                        thread_summary = None
+                                    ):
+    """
+    returns text of the instant notification body
+    and subject line
+
+    that is built when post is updated
+    only update_types in const.RESPONSE_ACTIVITY_TYPE_MAP_FOR_TEMPLATES
+    are supported
+
+    ``notification_data`` - output of the
+    :func:`get_instant_notification_data` and ``thread_summary`` -
+    thread formatted for the email for the user, may be passed
+    when they are reused for many recipients
+    """
+    if notification_data is None:
+        notification_data = get_instant_notification_data(
+                                            from_user = from_user,
+                                            post = post,
+                                            update_type = update_type
+                                        )
+    if thread_summary is None:
+        thread_summary = post.thread.format_for_email(user=to_user)
+
+    content_preview = notification_data['content_preview'] + thread_summary
+    user_action = notification_data['user_action']
+
     can_reply = to_user.can_post_by_email()
 
     if can_reply:
@@ -3193,13 +3239,13 @@ def format_instant_notification_email(
         'can_reply': can_reply,
         'content_preview': content_preview,#post.get_snippet()
         'update_type': update_type,
-        'post_url': post_url,
-        'origin_post_title': origin_post.thread.title,
+        'post_url': notification_data['post_url'],
+        'origin_post_title': notification_data['origin_post_title'],
         'user_subscriptions_url': site_url(user_subscriptions_url),
         'reply_separator': reply_separator,
         'reply_address': reply_address
     }
-    subject_line = _('"%(title)s"') % {'title': origin_post.thread.title}
+    subject_line = notification_data['subject_line']
 
     content = template.render(Context(update_data))
 
@@ -3327,8 +3373,13 @@ def record_award_event(instance, created, **kwargs):
         activity.save()
         activity.add_recipients([instance.user])
 
-        instance.badge.awarded_count += 1
-        instance.badge.save()
+        #badge data records are shared by the awards
+        #so the counter is updated in the database only
+        BadgeData.objects.filter(
+            id = instance.badge_id
+        ).update(
+            awarded_count = models.F('awarded_count') + 1
+        )
 
         badge = get_badge(instance.badge.slug)
 
@@ -3390,6 +3441,13 @@ def record_user_visit(user, timestamp, **kwargs):
     consecutive_days_visit_count
     """
     prev_last_seen = user.last_seen or datetime.datetime.now()
+    buffering = visit_buffer.is_enabled()
+    if buffering:
+        #the value in the database may be behind the buffered one
+        buffered_last_seen = visit_buffer.visit_buffer.get_last_seen(user.id)
+        if buffered_last_seen and buffered_last_seen > prev_last_seen:
+            prev_last_seen = buffered_last_seen
+
     user.last_seen = timestamp
     if (user.last_seen - prev_last_seen).days == 1:
         user.consecutive_days_visit_count += 1
@@ -3399,8 +3457,17 @@ def record_user_visit(user, timestamp, **kwargs):
             context_object = user,
             timestamp = timestamp
         )
-    #somehow it saves on the query as compared to user.save()
-    User.objects.filter(id = user.id).update(last_seen = timestamp)
+        #day change is written through, so that other
+        #processes do not count the same day again
+        write_through = True
+    else:
+        write_through = not buffering
+
+    if buffering:
+        visit_buffer.visit_buffer.add_user_visit(user.id, timestamp)
+    if write_through:
+        #somehow it saves on the query as compared to user.save()
+        User.objects.filter(id = user.id).update(last_seen = timestamp)
 
 
 def record_vote(instance, created, **kwargs):
@@ -3715,6 +3782,47 @@ def moderate_group_joining(sender, instance=None, created=False, **kwargs):
                 content_object = group
             )
 
+def record_tag_selection_change(sender, instance, **kwargs):
+    """updates tag subscription index when tag selections change"""
+    subscription_index.record_change(instance.user_id)
+
+def record_feed_setting_change(sender, instance, **kwargs):
+    """updates tag subscription index when
+    subscriptions to all questions change"""
+    if instance.feed_type == 'q_all':
+        subscription_index.record_change(instance.subscriber_id)
+
+def invalidate_moderation_items(sender, instance, **kwargs):
+    """cached counts of the moderation items are
+    recalculated when the inbox records change"""
+    invalidate_moderation_items_version()
+
+
+def invalidate_group_list(sender, instance, **kwargs):
+    """cached list of the groups shown on all pages
+    is rebuilt when any group is saved or deleted"""
+    invalidate_group_list_version()
+
+
+def invalidate_cached_thread_data(sender, instance, **kwargs):
+    """invalidates posts and html fragments of the thread
+    cached for the visitors, when the thread, its posts,
+    votes or the sharing with groups change"""
+    try:
+        if sender is Thread:
+            thread_id = instance.id
+        elif sender is Vote:
+            thread_id = instance.voted_post.thread_id
+        elif sender is PostToGroup:
+            thread_id = instance.post.thread_id
+        else:
+            thread_id = instance.thread_id
+    except Post.DoesNotExist:
+        #the post is being deleted and will invalidate the thread
+        return
+    if thread_id:
+        invalidate_thread_cache_version(thread_id, 'posts')
+
 def tweet_new_post(sender, user=None, question=None, answer=None, form_data=None, **kwargs):
     """seends out tweets about the new post"""
     from askbot.tasks import tweet_new_post_task
@@ -3741,12 +3849,56 @@ if 'avatar' in django_settings.INSTALLED_APPS:
     django_signals.post_delete.connect(update_user_avatar_type_flag, sender=Avatar)
 
 django_signals.post_delete.connect(record_cancel_vote, sender=Vote)
+django_signals.post_save.connect(record_tag_selection_change, sender=MarkedTag)
+django_signals.post_delete.connect(record_tag_selection_change, sender=MarkedTag)
+django_signals.post_save.connect(record_feed_setting_change, sender=EmailFeedSetting)
+django_signals.post_delete.connect(record_feed_setting_change, sender=EmailFeedSetting)
+django_signals.post_save.connect(invalidate_moderation_items, sender=ActivityAuditStatus)
+django_signals.post_delete.connect(invalidate_moderation_items, sender=ActivityAuditStatus)
+django_signals.post_save.connect(invalidate_group_list, sender=Group)
+django_signals.post_delete.connect(invalidate_group_list, sender=Group)
+django_signals.post_save.connect(invalidate_cached_thread_data, sender=Thread)
+django_signals.post_save.connect(invalidate_cached_thread_data, sender=Post)
+django_signals.post_delete.connect(invalidate_cached_thread_data, sender=Post)
+django_signals.post_save.connect(invalidate_cached_thread_data, sender=Vote)
+django_signals.post_delete.connect(invalidate_cached_thread_data, sender=Vote)
+django_signals.post_save.connect(invalidate_cached_thread_data, sender=PostToGroup)
+django_signals.post_delete.connect(invalidate_cached_thread_data, sender=PostToGroup)
+django_signals.post_save.connect(invalidate_cached_thread_data, sender=ThreadToGroup)
+django_signals.post_delete.connect(invalidate_cached_thread_data, sender=ThreadToGroup)
+django_signals.post_save.connect(search_index.record_thread_save, sender=Thread)
+django_signals.post_delete.connect(search_index.record_thread_delete, sender=Thread)
+django_signals.post_save.connect(search_index.record_post_save, sender=Post)
+django_signals.post_delete.connect(search_index.record_post_delete, sender=Post)
+django_signals.post_save.connect(search_index.record_user_save, sender=User)
+django_signals.post_delete.connect(search_index.record_user_delete, sender=User)
+django_signals.post_save.connect(similarity_index.record_thread_save, sender=Thread)
+django_signals.post_delete.connect(similarity_index.record_thread_delete, sender=Thread)
+django_signals.post_init.connect(user_directory.record_user_init, sender=User)
+django_signals.post_save.connect(user_directory.record_user_save, sender=User)
+django_signals.post_delete.connect(user_directory.record_user_delete, sender=User)
+django_signals.post_save.connect(user_directory.record_membership_save, sender=GroupMembership)
+django_signals.post_delete.connect(user_directory.record_membership_delete, sender=GroupMembership)
+django_signals.post_save.connect(user_stats.record_vote_change, sender=Vote)
+django_signals.post_delete.connect(user_stats.record_vote_change, sender=Vote)
+django_signals.post_save.connect(user_stats.record_award_change, sender=Award)
+django_signals.post_delete.connect(user_stats.record_award_change, sender=Award)
+django_signals.post_save.connect(user_stats.record_post_save, sender=Post)
+django_signals.post_delete.connect(user_stats.record_post_delete, sender=Post)
+django_signals.post_init.connect(autocomplete.record_thread_init, sender=Thread)
+django_signals.post_save.connect(autocomplete.record_thread_save, sender=Thread)
+django_signals.post_delete.connect(autocomplete.record_thread_delete, sender=Thread)
+django_signals.post_init.connect(autocomplete.record_tag_init, sender=Tag)
+django_signals.post_save.connect(autocomplete.record_tag_save, sender=Tag)
+django_signals.post_delete.connect(autocomplete.record_tag_delete, sender=Tag)
 
 #change this to real m2m_changed with Django1.2
 signals.delete_question_or_answer.connect(record_delete_question, sender=Post)
 signals.flag_offensive.connect(record_flag_offensive, sender=Post)
 signals.remove_flag_offensive.connect(remove_flag_offensive, sender=Post)
 signals.tags_updated.connect(record_update_tags)
+signals.tags_updated.connect(user_stats.record_thread_retag)
+signals.tags_updated.connect(autocomplete.record_thread_retag)
 signals.user_registered.connect(greet_new_user)
 signals.user_updated.connect(record_user_full_updated, sender=User)
 signals.user_logged_in.connect(complete_pending_tag_subscriptions)#todo: add this to fake onlogin middleware
@@ -3797,5 +3949,8 @@ __all__ = [
 
         'ReplyAddress',
 
+        'SearchIndexEntry',
+        'SimilarityIndexEntry',
+
         'get_model',
 ]
@@ -0,0 +1,357 @@
+"""Index for the autocompletion of the question titles,
+tag names and usernames, used by the "similar questions" box
+of the ask form (``api_get_questions``), by the tag autocompleters
+and by the user name autocompleter
+
+Words of the titles of the threads are kept in the cache in
+sorted lists of tuples (word, thread id), one list for each
+two letter prefix of the words. Threads, whose titles contain
+words starting with each word of the query, are found by the
+binary search in the lists. The response is then joined from
+the json fragments of the threads, which are cached separately
+and built in bulk for the threads missing in the cache.
+
+Tag names are kept in the sorted list of tuples (name, used count)
+of all tags and matched as by the
+:meth:`~askbot.models.tag.TagQuerySet.get_by_wildcards`.
+Usernames are looked up in the index of the user directory
+(:mod:`askbot.models.user_directory`).
+
+All lists are kept in chunks of a limited size
+(:class:`~askbot.utils.chunked_list.ChunkedList`), so that
+they can always be stored in the cache. The lists are built
+from the database on the first lookup and then updated
+in place when the threads and tags are saved, the json
+fragments of the threads are dropped when the threads
+are saved or retagged.
+
+The index is enabled with the setting
+``ASKBOT_USE_AUTOCOMPLETE_INDEX = True``, :func:`invalidate`
+drops the whole index, for example after the data
+is imported into the database.
+"""
+import re
+from django.conf import settings as django_settings
+from django.core import cache
+from django.utils import simplejson
+from django.utils.html import escape
+from askbot.models.post import Post
+from askbot.models.question import Thread
+from askbot.models.tag import Tag
+from askbot.models import user_directory
+from askbot.utils.cache import get_cache_version, invalidate_cache_version
+from askbot.utils.chunked_list import ChunkedList
+
+TITLES_VERSION_KEY = 'autocomplete-titles-version'
+TAGS_VERSION_KEY = 'autocomplete-tags-version'
+#the lists are rebuilt at least once a day, in case they drift
+SHARD_TIMEOUT = 24 * 60 * 60
+#words of the titles are looked up by the prefixes of this length
+MIN_WORD_LENGTH = 2
+#titles have up to 300 characters, so the chunks
+#of the title lists stay well below 1MB
+TITLE_CHUNK_SIZE = 1000
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_enabled():
+    return getattr(django_settings, 'ASKBOT_USE_AUTOCOMPLETE_INDEX', False)
+
+
+def invalidate():
+    """drops all lists and the json fragments of the threads"""
+    for version_key in (TITLES_VERSION_KEY, TAGS_VERSION_KEY):
+        invalidate_cache_version(version_key)
+    user_directory.invalidate_username_index()
+
+
+def get_title_shard_key(prefix, version=None):
+    """key of the list of the words starting with the prefix"""
+    if version is None:
+        version = get_cache_version(TITLES_VERSION_KEY)
+    return 'autocomplete-titles-%s-%s' % (
+                                version,
+                                prefix.encode('utf-8').encode('hex')
+                            )
+
+
+def get_thread_key(thread_id, version=None):
+    if version is None:
+        version = get_cache_version(TITLES_VERSION_KEY)
+    return 'autocomplete-thread-%s-%d' % (version, thread_id)
+
+
+def get_tag_list_key():
+    return 'autocomplete-tags-%s-list' % get_cache_version(TAGS_VERSION_KEY)
+
+
+def get_tag_names_key():
+    return 'autocomplete-tags-%s-names' % get_cache_version(TAGS_VERSION_KEY)
+
+
+def get_title_words(title):
+    """set of the lowercased words of the title,
+    which can be found by the prefix"""
+    words = WORD_RE.findall(title.lower())
+    return set([word for word in words if len(word) >= MIN_WORD_LENGTH])
+
+
+def get_prefix_range(prefix):
+    """returns the bounds of the range of the tuples,
+    whose first items start with the prefix"""
+    return (prefix,), (prefix + u'\uffff',)
+
+
+def build_title_shard(prefix):
+    threads = Thread.objects.filter(deleted=False, title__icontains=prefix)
+    shard = list()
+    for thread_id, title in threads.values_list('id', 'title'):
+        for word in get_title_words(title):
+            if word.startswith(prefix):
+                shard.append((word, thread_id))
+    return shard
+
+
+def get_title_shard(prefix, version=None):
+    """returns the list of tuples (word, thread id)
+    of the words starting with the prefix"""
+    return ChunkedList(
+                get_title_shard_key(prefix, version),
+                lambda: build_title_shard(prefix),
+                SHARD_TIMEOUT,
+                chunk_size=TITLE_CHUNK_SIZE
+            )
+
+
+def update_title_shards(thread_id, added_words, removed_words):
+    """adds and removes the entries of the thread in the
+    cached lists, the lists which are not cached are not
+    updated - they will be built when needed"""
+    version = get_cache_version(TITLES_VERSION_KEY)
+    changes = dict()
+    for word in added_words:
+        changes.setdefault(word[:MIN_WORD_LENGTH], ([], []))[0].append(word)
+    for word in removed_words:
+        changes.setdefault(word[:MIN_WORD_LENGTH], ([], []))[1].append(word)
+
+    for prefix, (added, removed) in changes.items():
+        shard = get_title_shard(prefix, version)
+        def update_shard():
+            for word in removed:
+                shard.remove_entry((word, thread_id))
+            for word in added:
+                shard.insert_entry((word, thread_id))
+        shard.update(update_shard)
+
+
+def get_matching_thread_ids(query):
+    """returns ids of the threads, whose titles have words
+    starting with each word of the query, newest first"""
+    words = get_title_words(query)
+    if len(words) == 0:
+        return list()
+    version = get_cache_version(TITLES_VERSION_KEY)
+    shards = dict()
+    thread_ids = None
+    for word in words:
+        prefix = word[:MIN_WORD_LENGTH]
+        if prefix not in shards:
+            shards[prefix] = get_title_shard(prefix, version)
+        low, high = get_prefix_range(word)
+        matches = shards[prefix].get_range(low, high)
+        word_thread_ids = set([thread_id for match_word, thread_id in matches])
+        if thread_ids is None:
+            thread_ids = word_thread_ids
+        else:
+            thread_ids &= word_thread_ids
+        if len(thread_ids) == 0:
+            return list()
+    return sorted(thread_ids, reverse=True)
+
+
+def get_thread_record(thread):
+    """returns tuple (language code, tag names, json fragment)
+    of the thread, deleted threads have no record"""
+    if thread.deleted:
+        return None
+    fragment = simplejson.dumps({
+                        'title': escape(thread.title),
+                        'url': thread.get_absolute_url(),
+                        'answer_count': thread.answer_count
+                    })
+    return (thread.language_code, thread.get_tag_names(), fragment)
+
+
+def get_thread_records(thread_ids):
+    """returns dictionary of the records of the threads by
+    the thread ids, records missing in the cache are built
+    from the threads loaded with one query"""
+    version = get_cache_version(TITLES_VERSION_KEY)
+    keys = dict([(get_thread_key(thread_id, version), thread_id) \
+                                    for thread_id in thread_ids])
+    cached = cache.cache.get_many(keys.keys())
+    records = dict([(keys[key], record) for key, record in cached.items()])
+
+    missing_ids = [thread_id for thread_id in thread_ids if thread_id not in records]
+    if missing_ids:
+        threads = Thread.objects.filter(
+                                id__in=missing_ids
+                            ).select_related('question_post')
+        new_records = dict()
+        for thread in threads:
+            try:
+                record = get_thread_record(thread)
+            except Post.DoesNotExist:
+                #the question of the new thread is not saved yet
+                continue
+            records[thread.id] = record
+            new_records[get_thread_key(thread.id, version)] = record
+        cache.cache.set_many(new_records, SHARD_TIMEOUT)
+    return records
+
+
+def get_questions_json(query, tag_name=None, language_code=None, limit=30):
+    """returns json list of the title, url and answer count
+    of the threads matching the query, joined from the
+    cached json fragments of the threads"""
+    thread_ids = get_matching_thread_ids(query)
+    fragments = list()
+    start = 0
+    while start < len(thread_ids) and len(fragments) < limit:
+        chunk = thread_ids[start:start + limit]
+        start += limit
+        records = get_thread_records(chunk)
+        for thread_id in chunk:
+            record = records.get(thread_id)
+            if record is None:
+                continue
+            thread_language_code, tag_names, fragment = record
+            if language_code and thread_language_code != language_code:
+                continue
+            if tag_name and tag_name not in tag_names:
+                continue
+            fragments.append(fragment)
+            if len(fragments) == limit:
+                break
+    return '[' + ', '.join(fragments) + ']'
+
+
+def get_tag_entries():
+    return list(Tag.objects.values_list('name', 'used_count'))
+
+
+def get_tag_names():
+    """returns the list of tuples (name, used count)
+    of all tags, sorted by the name"""
+    return ChunkedList(get_tag_names_key(), get_tag_entries, SHARD_TIMEOUT)
+
+
+def get_tag_names_by_prefix(prefix):
+    """returns names of the tags starting with the prefix,
+    matched and ordered as by the ``Tag.objects.get_by_wildcards``:
+    case sensitive, tags of any status, the most used first"""
+    if prefix == '':
+        return list()
+    low, high = get_prefix_range(prefix)
+    matches = get_tag_names().get_range(low, high)
+    matches.sort(key=lambda match: (-match[1], match[0]))
+    return [name for name, used_count in matches]
+
+
+def get_tag_list_text():
+    """returns names of all accepted tags, one per line,
+    escaped for html, ordered as the tags"""
+    key = get_tag_list_key()
+    text = cache.cache.get(key)
+    if text is None:
+        tags = Tag.objects.filter(
+                        deleted=False,
+                        status=Tag.STATUS_ACCEPTED
+                    )
+        text = '\n'.join(map(escape, tags.values_list('name', flat=True)))
+        cache.cache.set(key, text, SHARD_TIMEOUT)
+    return text
+
+
+def get_thread_state(thread):
+    return (thread.title or '', thread.deleted)
+
+
+def record_thread_init(sender, instance, **kwargs):
+    """remembers the title, to find the changed
+    words when the thread is saved"""
+    instance._autocomplete_state = get_thread_state(instance)
+
+
+def record_thread_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw or not is_enabled():
+        return
+    cache.cache.delete(get_thread_key(instance.id))
+    state = get_thread_state(instance)
+    old_state = getattr(instance, '_autocomplete_state', None)
+    instance._autocomplete_state = state
+
+    old_words = set()
+    if not created and old_state and old_state[1] == False:
+        old_words = get_title_words(old_state[0])
+    new_words = set()
+    if state[1] == False:
+        new_words = get_title_words(state[0])
+    if old_words != new_words:
+        update_title_shards(
+                    instance.id,
+                    new_words - old_words,
+                    old_words - new_words
+                )
+
+
+def record_thread_delete(sender, instance, **kwargs):
+    if not is_enabled():
+        return
+    cache.cache.delete(get_thread_key(instance.id))
+    update_title_shards(instance.id, [], get_title_words(instance.title or ''))
+
+
+def record_thread_retag(sender, thread=None, **kwargs):
+    if is_enabled():
+        cache.cache.delete(get_thread_key(thread.id))
+
+
+def get_tag_state(tag):
+    """values of the tag, on which the lists of the tags
+    depend, the list of the accepted tags is ordered
+    by the used count"""
+    return (tag.name, tag.used_count, tag.status, tag.deleted)
+
+
+def record_tag_init(sender, instance, **kwargs):
+    instance._autocomplete_state = get_tag_state(instance)
+
+
+def record_tag_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw or not is_enabled():
+        return
+    state = get_tag_state(instance)
+    old_state = getattr(instance, '_autocomplete_state', None)
+    instance._autocomplete_state = state
+    if created:
+        get_tag_names().insert(state[:2])
+        cache.cache.delete(get_tag_list_key())
+    elif old_state is None:
+        invalidate_cache_version(TAGS_VERSION_KEY)
+    elif state != old_state:
+        if state[:2] != old_state[:2]:
+            get_tag_names().replace(
+                    old_state[:2],
+                    state[:2],
+                    match=lambda entry: entry[0] == old_state[0]
+                )
+        cache.cache.delete(get_tag_list_key())
+
+
+def record_tag_delete(sender, instance, **kwargs):
+    if not is_enabled():
+        return
+    get_tag_names().remove_matching(lambda entry: entry[0] == instance.name)
+    cache.cache.delete(get_tag_list_key())
@@ -16,10 +16,18 @@ adde it to BADGES dictionary, register with event in EVENTS_TO_BADGES
 and make sure that a signal `award_badges_signal` is sent with the
 corresponding event name, actor (user object), context_object and optionally
 - timestamp
+
+Badge instances are reused for all events until the badge settings change,
+therefore method `consider_award` must not store any state on the badge.
+Awards and counters of the users, read during one event, are shared
+by the badges via the `AwardPrefetch` object.
 """
 import datetime
+from django.conf import settings as django_settings
 from django.template.defaultfilters import slugify
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models.signals import post_delete, post_syncdb
 from django.utils.translation import ugettext as _
 from django.dispatch import Signal
 from askbot.models.repute import BadgeData, Award
@@ -28,8 +36,78 @@ from askbot.models.question import FavoriteQuestion as Fave#name collision
 from askbot.models.post import Post
 from askbot import const
 from askbot.conf import settings as askbot_settings
+from askbot.conf.badges import BADGES as BADGE_SETTINGS
 from askbot.utils.decorators import auto_now_timestamp
 
+#slug -> BadgeData, all records are read once per process
+BADGE_DATA_CACHE = dict()
+
+#event -> (badge settings key, list of badge instances)
+EVENT_BADGES_CACHE = dict()
+
+def get_badge_data(slug):
+    """returns BadgeData record for the badge key,
+    creates the record if it does not exist"""
+    if len(BADGE_DATA_CACHE) == 0:
+        for badge_data in BadgeData.objects.all():
+            BADGE_DATA_CACHE[badge_data.slug] = badge_data
+    badge_data = BADGE_DATA_CACHE.get(slug)
+    if badge_data is None:
+        badge_data, created = BadgeData.objects.get_or_create(slug = slug)
+        BADGE_DATA_CACHE[slug] = badge_data
+    return badge_data
+
+def clear_badge_data_cache(**kwargs):
+    BADGE_DATA_CACHE.clear()
+
+
+class AwardPrefetch(object):
+    """awards and activity counters of the users,
+    shared by all badges evaluated on one event,
+    so that each is read from the database once
+    """
+    def __init__(self):
+        #user id -> badge data id -> set of (content type id, object id)
+        self.awards = dict()
+        #(counter name, user id) -> value
+        self.counters = dict()
+
+    def get_awards(self, user):
+        awards = self.awards.get(user.id)
+        if awards is None:
+            awards = dict()
+            award_data = Award.objects.filter(
+                                user = user
+                            ).values_list(
+                                'badge', 'content_type', 'object_id'
+                            )
+            for badge_id, content_type_id, object_id in award_data:
+                objects = awards.setdefault(badge_id, set())
+                objects.add((content_type_id, object_id))
+            self.awards[user.id] = awards
+        return awards
+
+    def has_badge(self, user, badge_data):
+        return badge_data.id in self.get_awards(user)
+
+    def has_award(self, user, badge_data, content_type_id, object_id):
+        """True if user has the badge for the object"""
+        objects = self.get_awards(user).get(badge_data.id, ())
+        return (content_type_id, object_id) in objects
+
+    def add_award(self, user, badge_data, content_type_id, object_id):
+        objects = self.get_awards(user).setdefault(badge_data.id, set())
+        objects.add((content_type_id, object_id))
+
+    def get_count(self, name, user, calculate):
+        """returns value of the counter, ``calculate``
+        is called without arguments on the first access"""
+        key = (name, user.id)
+        if key not in self.counters:
+            self.counters[key] = calculate()
+        return self.counters[key]
+
+
 class Badge(object):
     """base class for the badges
 
@@ -57,12 +135,13 @@ class Badge(object):
         self.css_class = const.BADGE_CSS_CLASSES[self.level]
 
     def get_stored_data(self):
-        data, created = BadgeData.objects.get_or_create(slug = self.key)
-        return data
+        return get_badge_data(self.key)
 
     @property
     def awarded_count(self):
-        return self.get_stored_data().awarded_count
+        #the counter changes, so it is not read from the cache
+        badge_data, created = BadgeData.objects.get_or_create(slug = self.key)
+        return badge_data.awarded_count
 
     @property
     def awarded_to(self):
@@ -84,25 +163,39 @@ class Badge(object):
         """display name for the level of the badge"""
         return dict(const.BADGE_TYPE_CHOICES).get(self.level)
 
-    def award(self, recipient = None, context_object = None, timestamp = None):
-        """do award, the recipient was proven to deserve"""
+    def is_awarded(self, recipient, prefetch):
+        """True if the badge is not multiple and
+        the recipient already has it, badges may call this
+        before the expensive checks in the ``consider_award``
+        """
+        if self.multiple:
+            return False
+        if prefetch is None:
+            prefetch = AwardPrefetch()
+        return prefetch.has_badge(recipient, self.get_stored_data())
+
+    def award(self, recipient = None, context_object = None,
+                timestamp = None, prefetch = None):
+        """do award, the recipient was proven to deserve
+
+        prefetch - :class:`AwardPrefetch` shared by the
+        badges evaluated on the same event
+        """
+        if prefetch is None:
+            prefetch = AwardPrefetch()
 
+        badge = self.get_stored_data()
+        content_type = ContentType.objects.get_for_model(context_object)
         if self.multiple == False:
-            if recipient.badges.filter(slug = self.key).count() != 0:
+            if prefetch.has_badge(recipient, badge):
                 return False
         else:
-            content_type = ContentType.objects.get_for_model(context_object)
-            filters = {
-                'user': recipient,
-                'object_id': context_object.id,
-                'content_type': content_type,
-                'badge__slug': self.key,
-            }
             #multiple badge is not re-awarded for the same post
-            if Award.objects.filter(**filters).count() != 0:
+            if prefetch.has_award(
+                        recipient, badge, content_type.id, context_object.id
+                    ):
                 return False
 
-        badge = self.get_stored_data()
         award = Award(
                     user = recipient,
                     badge = badge,
@@ -110,10 +203,11 @@ class Badge(object):
                     content_object = context_object
                 )
         award.save()#note: there are signals that listen to saving the Award
+        prefetch.add_award(recipient, badge, content_type.id, context_object.id)
         return True
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
         """Normally this method should be reimplemented
         in subclass, but some badges are awarded without
         checks. Those do no need to override this method
@@ -121,7 +215,7 @@ class Badge(object):
         actor - user who committed some action, context_object -
         the object related to the award situation, e.g. answer
         """
-        return self.award(actor, context_object, timestamp)
+        return self.award(actor, context_object, timestamp, prefetch)
 
 class Disciplined(Badge):
     def __init__(self):
@@ -137,13 +231,13 @@ class Disciplined(Badge):
         )
 
     def consider_award(self, actor = None,
-                    context_object = None, timestamp = None):
+                    context_object = None, timestamp = None, prefetch = None):
 
         if context_object.author != actor:
             return False
         if context_object.points>= \
             askbot_settings.DISCIPLINED_BADGE_MIN_UPVOTES:
-            return self.award(actor, context_object, timestamp)
+            return self.award(actor, context_object, timestamp, prefetch)
 
 class PeerPressure(Badge):
     def __init__(self):
@@ -159,13 +253,13 @@ class PeerPressure(Badge):
         )
 
     def consider_award(self, actor = None,
-                    context_object = None, timestamp = None):
+                    context_object = None, timestamp = None, prefetch = None):
 
         if context_object.author != actor:
             return False
         if context_object.points<= \
             -1 * askbot_settings.PEER_PRESSURE_BADGE_MIN_DOWNVOTES:
-            return self.award(actor, context_object, timestamp)
+            return self.award(actor, context_object, timestamp, prefetch)
         return False
 
 class Teacher(Badge):
@@ -182,12 +276,12 @@ class Teacher(Badge):
         )
 
     def consider_award(self, actor = None,
-                context_object = None, timestamp = None):
+                context_object = None, timestamp = None, prefetch = None):
         if context_object.post_type != 'answer':
             return False
 
         if context_object.points>= askbot_settings.TEACHER_BADGE_MIN_UPVOTES:
-            return self.award(context_object.author, context_object, timestamp)
+            return self.award(context_object.author, context_object, timestamp, prefetch)
         return False
 
 class FirstVote(Badge):
@@ -205,10 +299,10 @@ class FirstVote(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
         if context_object.post_type not in ('question', 'answer'):
             return False
-        return self.award(actor, context_object, timestamp)
+        return self.award(actor, context_object, timestamp, prefetch)
 
 class Supporter(FirstVote):
     """first upvote"""
@@ -241,11 +335,13 @@ class CivicDuty(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
         if context_object.post_type not in ('question', 'answer'):
             return False
+        if self.is_awarded(actor, prefetch):
+            return False
         if actor.votes.count() == askbot_settings.CIVIC_DUTY_BADGE_MIN_VOTES:
-            return self.award(actor, context_object, timestamp)
+            return self.award(actor, context_object, timestamp, prefetch)
 
 class SelfLearner(Badge):
     def __init__(self):
@@ -260,7 +356,7 @@ class SelfLearner(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
         if context_object.post_type != 'answer':
             return False
 
@@ -268,8 +364,8 @@ class SelfLearner(Badge):
         question = context_object.thread._question_post()
         answer = context_object
 
-        if question.author == answer.author and answer.points >= min_upvotes:
-            self.award(context_object.author, context_object, timestamp)
+        if question.author_id == answer.author_id and answer.points >= min_upvotes:
+            self.award(context_object.author, context_object, timestamp, prefetch)
 
 class QualityPost(Badge):
     """Generic Badge for Nice/Good/Great Question or Answer
@@ -291,11 +387,11 @@ class QualityPost(Badge):
         )
 
     def consider_award(self, actor = None,
-                context_object = None, timestamp = None):
+                context_object = None, timestamp = None, prefetch = None):
         if context_object.post_type not in ('answer', 'question'):
             return False
         if context_object.points >= self.min_votes:
-            return self.award(context_object.author, context_object, timestamp)
+            return self.award(context_object.author, context_object, timestamp, prefetch)
         return False
 
 class NiceAnswer(QualityPost):
@@ -401,11 +497,11 @@ class FrequentedQuestion(Badge):
         )
 
     def consider_award(self, actor = None,
-                context_object = None, timestamp = None):
+                context_object = None, timestamp = None, prefetch = None):
         if context_object.post_type != 'question':
             return False
         if context_object.thread.view_count >= self.min_views:
-            return self.award(context_object.author, context_object, timestamp)
+            return self.award(context_object.author, context_object, timestamp, prefetch)
         return False
 
 class PopularQuestion(FrequentedQuestion):
@@ -457,13 +553,13 @@ class Scholar(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
         if context_object.post_type != 'answer':
             return False
         answer = context_object
         if answer.thread._question_post().author != actor:
             return False
-        return self.award(actor, context_object, timestamp)
+        return self.award(actor, context_object, timestamp, prefetch)
 
 class VotedAcceptedAnswer(Badge):
     """superclass for Enlightened and Guru badges
@@ -481,12 +577,12 @@ class VotedAcceptedAnswer(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
         if context_object.post_type != 'answer':
             return None
         answer = context_object
         if answer.points >= self.min_votes and answer.accepted():
-            return self.award(answer.author, answer, timestamp)
+            return self.award(answer.author, answer, timestamp, prefetch)
 
 class Enlightened(VotedAcceptedAnswer):
     def __new__(cls):
@@ -529,7 +625,7 @@ class Necromancer(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
         if context_object.post_type != 'answer':
             return False
         answer = context_object
@@ -538,7 +634,7 @@ class Necromancer(Badge):
         min_score = askbot_settings.NECROMANCER_BADGE_MIN_UPVOTES
         if answer.added_at - question.added_at >= delta \
             and answer.points >= min_score:
-            return self.award(answer.author, answer, timestamp)
+            return self.award(answer.author, answer, timestamp, prefetch)
         return False
 
 class CitizenPatrol(Badge):
@@ -595,15 +691,24 @@ class EditorTypeBadge(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
+
+        if self.is_awarded(actor, prefetch):
+            return False
 
         atypes = (
             const.TYPE_ACTIVITY_UPDATE_QUESTION,
             const.TYPE_ACTIVITY_UPDATE_ANSWER
         )
         filters = {'user': actor, 'activity_type__in': atypes}
-        if Activity.objects.filter(**filters).count() == self.min_edits:
-            return self.award(actor, context_object, timestamp)
+        count_edits = Activity.objects.filter(**filters).count
+        if prefetch is None:
+            edit_count = count_edits()
+        else:
+            #editor badges share the count
+            edit_count = prefetch.get_count('edits', actor, count_edits)
+        if edit_count == self.min_edits:
+            return self.award(actor, context_object, timestamp, prefetch)
 
 class Editor(EditorTypeBadge):
     def __new__(cls):
@@ -648,11 +753,11 @@ class Autobiographer(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
         user = context_object
         if user.email and user.real_name and user.website \
             and user.location and user.about:
-            return self.award(user, user, timestamp)
+            return self.award(user, user, timestamp, prefetch)
         return False
 
 class FavoriteTypeBadge(Badge):
@@ -670,7 +775,7 @@ class FavoriteTypeBadge(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
         question = context_object
         #model FavoriteQuestion imported under alias of Fave
         count = Fave.objects.filter(
@@ -679,7 +784,7 @@ class FavoriteTypeBadge(Badge):
                                         user = question.author
                                     ).count()
         if count == self.min_stars:
-            return self.award(question.author, question, timestamp)
+            return self.award(question.author, question, timestamp, prefetch)
         return False
 
 class StellarQuestion(FavoriteTypeBadge):
@@ -716,10 +821,10 @@ class Enthusiast(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
         min_days = askbot_settings.ENTHUSIAST_BADGE_MIN_DAYS
         if actor.consecutive_days_visit_count == min_days:
-            return self.award(actor, context_object, timestamp)
+            return self.award(actor, context_object, timestamp, prefetch)
         return False
 
 class Commentator(Badge):
@@ -738,10 +843,12 @@ class Commentator(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
+        if self.is_awarded(actor, prefetch):
+            return False
         num_comments = Post.objects.get_comments().filter(author=actor).count()
         if num_comments >= askbot_settings.COMMENTATOR_BADGE_MIN_COMMENTS:
-            return self.award(actor, context_object, timestamp)
+            return self.award(actor, context_object, timestamp, prefetch)
         return False
 
 class Taxonomist(Badge):
@@ -758,12 +865,12 @@ class Taxonomist(Badge):
         )
 
     def consider_award(self, actor = None,
-            context_object = None, timestamp = None):
+            context_object = None, timestamp = None, prefetch = None):
 
         tag = context_object
         taxonomist_threshold = askbot_settings.TAXONOMIST_BADGE_MIN_USE_COUNT
         if tag.used_count == taxonomist_threshold:
-            return self.award(tag.created_by, tag, timestamp)
+            return self.award(tag.created_by, tag, timestamp, prefetch)
         return False
 
 class Expert(Badge):
@@ -893,18 +1000,81 @@ award_badges_signal = Signal(
 #event - string name of the event, e.g 'downvote'
 #context_object - database object related to the event, e.g. question
 
+def get_badge_settings_key():
+    """returns a string identifying current values
+    of the badge settings"""
+    values = [
+        getattr(askbot_settings, value.key) for value in BADGE_SETTINGS.values()
+    ]
+    return repr(values)
+
+def get_event_badges(event):
+    """returns list of instances of the badges
+    considered on the event, the instances
+    are reused until the badge settings change
+    """
+    try:
+        badge_classes = EVENTS_TO_BADGES[event]
+    except KeyError:
+        raise NotImplementedError('event "%s" is not implemented' % event)
+
+    settings_key = get_badge_settings_key()
+    cached = EVENT_BADGES_CACHE.get(event)
+    if cached is None or cached[0] != settings_key:
+        badges = [badge_class() for badge_class in badge_classes]
+        cached = (settings_key, badges)
+        EVENT_BADGES_CACHE[event] = cached
+    return cached[1]
+
+def evaluate_badges(event = None, actor = None,
+                    context_object = None, timestamp = None):
+    """considers all badges associated with the event,
+    the badges share one :class:`AwardPrefetch`
+    """
+    prefetch = AwardPrefetch()
+    for badge in get_event_badges(event):
+        badge.consider_award(actor, context_object, timestamp, prefetch)
+
+def is_async_evaluation_enabled():
+    return getattr(django_settings, 'ASKBOT_ASYNC_BADGE_AWARDS', False)
+
 @auto_now_timestamp
 def award_badges(event = None, actor = None,
                 context_object = None, timestamp = None, **kwargs):
     """function that is called when signal `award_badges_signal` is sent
+
+    with the setting ``ASKBOT_ASYNC_BADGE_AWARDS = True``
+    badges are evaluated by a celery task
     """
-    try:
-        consider_badges = EVENTS_TO_BADGES[event]
-    except KeyError:
+    if event not in EVENTS_TO_BADGES:
         raise NotImplementedError('event "%s" is not implemented' % event)
 
-    for badge in consider_badges:
-        badge_instance = badge()
-        badge_instance.consider_award(actor, context_object, timestamp)
+    if len(EVENTS_TO_BADGES[event]) == 0:
+        return
+
+    if is_async_evaluation_enabled():
+        from askbot.tasks import award_badges_celery_task
+        content_type = ContentType.objects.get_for_model(context_object)
+        award_badges_celery_task.delay(
+                                event,
+                                actor.id,
+                                content_type.id,
+                                context_object.id,
+                                timestamp
+                            )
+    else:
+        evaluate_badges(event, actor, context_object, timestamp)
 
 award_badges_signal.connect(award_badges)
+
+def reset_badge_data(sender, **kwargs):
+    """creates BadgeData records after the tables are
+    created or flushed and discards the cached records"""
+    clear_badge_data_cache()
+    if sender.__name__ != 'askbot.models':
+        return
+    if BadgeData._meta.db_table in connection.introspection.table_names():
+        init_badges()
+
+post_syncdb.connect(reset_badge_data)
+post_delete.connect(clear_badge_data_cache, sender = BadgeData)
@@ -30,6 +30,8 @@ from askbot.models.user import Group
 from askbot.models.user import GroupMembership
 from askbot.models.tag import Tag, MarkedTag
 from askbot.models.tag import tags_match_some_wildcard
+from askbot.models import subscription_index
+from askbot.models import user_directory
 from askbot.conf import settings as askbot_settings
 from askbot import exceptions
 from askbot.utils import markup
@@ -334,6 +336,26 @@ class PostManager(BaseQuerySetManager):
 
 
 
+def get_users_by_name_seeds(name_seeds):
+    """returns list of users whose names start with
+    any of the name seeds - strings following the @ symbols,
+    looked up in the cached index of the usernames when
+    the user directory or the autocomplete index
+    is enabled, or in one query"""
+    name_seeds = [seed for seed in name_seeds if seed != '']
+    if len(name_seeds) == 0:
+        return list()
+    if user_directory.is_username_index_enabled():
+        user_ids = set()
+        for seed in name_seeds:
+            user_ids.update(user_directory.get_user_ids_by_username_prefix(seed))
+        if len(user_ids) == 0:
+            return list()
+        return list(User.objects.filter(id__in=user_ids))
+    conditions = [models.Q(username__istartswith=seed) for seed in name_seeds]
+    return list(User.objects.filter(reduce(operator.or_, conditions)))
+
+
 class Post(models.Model):
     post_type = models.CharField(max_length=255, db_index=True)
 
@@ -445,22 +467,16 @@ class Post(models.Model):
         removed_mentions = list()
         if '@' in text:
             op = self.get_origin_post()
-            anticipated_authors = op.get_author_list(
-                include_comments = True,
-                recursive = True
-            )
+            if op is None:
+                anticipated_authors = list()
+            else:
+                anticipated_authors = op.get_participant_list()
 
             extra_name_seeds = markup.extract_mentioned_name_seeds(text)
 
-            extra_authors = set()
-            for name_seed in extra_name_seeds:
-                extra_authors.update(
-                    User.objects.filter(username__istartswith = name_seed)
-                )
-
             #it is important to preserve order here so that authors of post
             #get mentioned first
-            anticipated_authors += list(extra_authors)
+            anticipated_authors += get_users_by_name_seeds(extra_name_seeds)
 
             mentioned_authors, post_html = markup.mentionize_text(
                 text,
@@ -474,7 +490,7 @@ class Post(models.Model):
                 #only look for previous mentions if post was already saved before
                 prev_mention_qs = Activity.objects.get_mentions(
                     mentioned_in = self
-                )
+                ).prefetch_related('recipients')
                 new_set = set(mentioned_authors)
                 for prev_mention in prev_mention_qs:
 
@@ -693,6 +709,8 @@ class Post(models.Model):
                     )
         update_activity.save()
 
+        #response counts of the recipients are incremented
+        #by the add_recipients, with a fixed number of queries
         update_activity.add_recipients(notify_sets['for_inbox'])
 
         #create new mentions (barring the double-adds)
@@ -704,9 +722,6 @@ class Post(models.Model):
                                     mentioned_at = timestamp
                                 )
 
-        for user in (notify_sets['for_inbox'] | notify_sets['for_mentions']):
-            user.update_response_counts()
-
         #shortcircuit if the email alerts are disabled
         if suppress_email == True or askbot_settings.ENABLE_EMAIL_ALERTS == False:
             return
@@ -1099,10 +1114,27 @@ class Post(models.Model):
         specific tags
 
         this method in turn calls several more specialized
-        subscriber retrieval functions
-        todo: retrieval of wildcard tag followers ignorers
-              won't scale at all
+        subscriber retrieval functions, or uses the
+        :mod:`~askbot.models.subscription_index`, if enabled
         """
+        if askbot_settings.SUBSCRIBED_TAG_SELECTOR_ENABLED:
+            good_mark_reason = 'subscribed'
+        else:
+            good_mark_reason = 'good'
+
+        if subscription_index.is_enabled():
+            index = subscription_index.subscription_index
+            tag_names = self.get_tag_names()
+            use_wildcards = askbot_settings.USE_WILDCARD_TAGS
+            subscriber_ids = index.get_unfiltered_subscriber_ids()
+            for reason in (good_mark_reason, 'bad'):
+                subscriber_ids.update(
+                    index.get_subscriber_ids(tag_names, reason, use_wildcards)
+                )
+            if len(subscriber_ids) == 0:
+                return set()
+            return set(User.objects.filter(id__in=subscriber_ids))
+
         subscriber_set = set()
 
         global_subscriptions = EmailFeedSetting.objects.filter(
@@ -1121,10 +1153,6 @@ class Post(models.Model):
         subscriber_set.update(global_subscribers)
 
         #segment of users who want emails on selected questions only
-        if askbot_settings.SUBSCRIBED_TAG_SELECTOR_ENABLED:
-            good_mark_reason = 'subscribed'
-        else:
-            good_mark_reason = 'good'
         subscriber_set.update(
             self.get_global_tag_based_subscribers(
                 subscription_records = global_subscriptions,
@@ -1410,6 +1438,31 @@ class Post(models.Model):
             authors -= set(exclude_list)
         return list(authors)
 
+    def get_participant_list(self):
+        """same as ``get_author_list(include_comments=True, recursive=True)``,
+        all authors are selected in one query"""
+        posts = Post.objects.filter(id=self.id)
+        if self.is_question():
+            posts = Post.objects.filter(
+                            models.Q(id=self.id)
+                            | models.Q(
+                                thread__id=self.thread_id,
+                                post_type='answer',
+                                deleted=False
+                            )
+                        )
+        posts = posts.values('id')
+        revision_authors = PostRevision.objects.filter(
+                                            post__in=posts
+                                        ).values('author')
+        comment_authors = Post.objects.filter(parent__in=posts).values('author')
+        return list(
+            User.objects.filter(
+                models.Q(id__in=revision_authors)
+                | models.Q(id__in=comment_authors)
+            )
+        )
+
     def passes_tag_filter_for_user(self, user):
 
         question = self.get_origin_post()
@@ -1467,83 +1520,37 @@ class Post(models.Model):
         else:
             return self.thread._question_post()
 
-    def _repost_as_question(self, new_title = None):
-        """posts answer as question, together with all the comments
-        while preserving time stamps and authors
-        does not delete the answer itself though
-        """
-        if not self.is_answer():
-            raise NotImplementedError
-        revisions = self.revisions.all().order_by('revised_at')
-        rev0 = revisions[0]
-        new_question = rev0.author.post_question(
-            title = new_title,
-            body_text = rev0.text,
-            tags = self.question.thread.tagnames,
-            wiki = self.question.wiki,
-            is_anonymous = self.question.is_anonymous,
-            timestamp = rev0.revised_at
-        )
-        if len(revisions) > 1:
-            for rev in revisions[1:]:
-                rev.author.edit_question(
-                    question = new_question,
-                    body_text = rev.text,
-                    revision_comment = rev.summary,
-                    timestamp = rev.revised_at
-                )
-        for comment in self.comments.all():
-            comment.content_object = new_question
-            comment.save()
-        return new_question
-
-    def _repost_as_answer(self, question = None):
-        """posts question as answer to another question,
-        but does not delete the question,
-        but moves all the comments to the new answer"""
-        if not self.is_question():
-            raise NotImplementedError
-        revisions = self.revisions.all().order_by('revised_at')
-        rev0 = revisions[0]
-        new_answer = rev0.author.post_answer(
-            question = question,
-            body_text = rev0.text,
-            wiki = self.wiki,
-            timestamp = rev0.revised_at
-        )
-        if len(revisions) > 1:
-            for rev in revisions:
-                rev.author.edit_answer(
-                    answer = new_answer,
-                    body_text = rev.text,
-                    revision_comment = rev.summary,
-                    timestamp = rev.revised_at
-                )
-        for comment in self.comments.all():
-            comment.content_object = new_answer
-            comment.save()
-        return new_answer
-
-
     def swap_with_question(self, new_title = None):
-        """swaps answer with the question it belongs to and
-        sets the title of question to ``new_title``
+        """swaps answer with the question of its thread:
+        the answer becomes the question with title ``new_title``
+        and the question becomes an answer, authors, revisions
+        and comments of both posts are preserved
         """
         if not self.is_answer():
             raise NotImplementedError
-            #1) make new question by using new title, tags of old question
-        #   and the answer body, as well as the authors of all revisions
-        #   and repost all the comments
-        new_question = self._repost_as_question(new_title = new_title)
 
-        #2) post question (all revisions and comments) as answer
-        new_answer = self.question._repost_as_answer(question = new_question)
+        thread = self.thread
+        old_question = thread._question_post(refresh=True)
+        Post.objects.filter(id=old_question.id).update(post_type='answer')
+        Post.objects.filter(id=self.id).update(post_type='question')
+        old_question.post_type = 'answer'
+        self.post_type = 'question'
+
+        if new_title:
+            thread.title = new_title
+        if thread.accepted_answer_id == self.id:
+            thread.accepted_answer = None
+            thread.answer_accepted_at = None
+        thread.question_post = self
+        thread._question_cache = self
+        #score of the thread is the score of its question
+        thread.points = self.points
+        thread.save()
 
-        #3) assign all remaining answers to the new question
-        self.question.answers.update(question = new_question)
-        self.question.delete()
-        self.delete()
-        return new_question
+        #title and tags are stored in the question revisions
+        self.revisions.update(title=thread.title, tagnames=thread.tagnames)
+        thread.invalidate_cached_data()
+        return self
 
 
     def get_user_vote(self, user):
@@ -2256,8 +2263,7 @@ class PostRevision(models.Model):
 
     @property
     def html(self, **kwargs):
-        markdowner = markup.get_parser()
-        sanitized_html = sanitize_html(markdowner.convert(self.text))
+        sanitized_html = markup.markdown_to_sanitized_html(self.text)
 
         if self.post.is_question():
             return self.QUESTION_REVISION_TEMPLATE_NO_TAGS % {
@@ -19,18 +19,21 @@ import askbot
 from askbot.conf import settings as askbot_settings
 from askbot import mail
 from askbot.mail import messages
-from askbot.models.tag import Tag, TagSynonym
+from askbot.models.tag import Tag, TagSynonym, MarkedTag
 from askbot.models.tag import get_tags_by_names
 from askbot.models.tag import filter_accepted_tags, filter_suggested_tags
 from askbot.models.tag import separate_unused_tags
 from askbot.models.base import DraftContent, BaseQuerySetManager
 from askbot.models.post import Post, PostRevision
 from askbot.models.post import PostToGroup
+from askbot.models import similarity_index
 from askbot.models.user import Group, PERSONAL_GROUP_NAME_PREFIX
 from askbot.models import signals
+from askbot.models import visit_buffer
 from askbot import const
+from askbot.utils.cache import get_cache_version, invalidate_cache_version
 from askbot.utils.lists import LazyList
-from askbot.search import mysql
+from askbot.search import backends as search_backends
 from askbot.utils.slug import slugify
 from askbot.search.state_manager import DummySearchState
 
@@ -46,26 +49,18 @@ class ThreadQuerySet(models.query.QuerySet):
     def get_for_title_query(self, search_query):
         """returns threads matching title query
         todo: possibly add tags
-        todo: implement full text search on relevant fields
         """
-        db_engine_name = askbot.get_database_engine_name()
-        filter_parameters = {'deleted': False}
-        if 'postgresql_psycopg2' in db_engine_name:
-            from askbot.search import postgresql
-            return postgresql.run_title_search(
-                                    self, search_query
-                                ).filter(
-                                    **filter_parameters
-                                ).order_by('-relevance')
-        elif 'mysql' in db_engine_name and mysql.supports_full_text_search():
-            filter_parameters['title__search'] = search_query
-        else:
-            filter_parameters['title__icontains'] = search_query
+        backend = search_backends.get_backend()
+        threads = backend.search_thread_titles(
+                                    self.filter(deleted=False), search_query
+                                )
 
         if getattr(django_settings, 'ASKBOT_MULTILINGUAL', False):
-            filter_parameters['language_code'] = get_language()
+            threads = threads.filter(language_code=get_language())
 
-        return self.filter(**filter_parameters)
+        if backend.supports_relevance:
+            threads = threads.order_by('-relevance')
+        return threads
 
 
 class ThreadManager(BaseQuerySetManager):
@@ -165,6 +160,10 @@ class ThreadManager(BaseQuerySetManager):
         #this call is rather heavy, we should split into several functions
         parse_results = question.parse_and_save(author=author, is_private=is_private)
 
+        thread.question_post = question
+        thread._question_cache = question
+        self.filter(id=thread.id).update(question_post=question)
+
         revision = question.add_revision(
             author=author,
             is_anonymous=is_anonymous,
@@ -201,38 +200,46 @@ class ThreadManager(BaseQuerySetManager):
 
         return thread
 
+    def get_ids_tagged_with_all(self, tag_ids, required_tag_count=None):
+        """returns query set of ids of the threads tagged
+        with all of the given tags - one grouped subquery
+        of the thread-tag table, instead of a join per tag
+
+        ``required_tag_count`` - number of the tags a thread
+        must have, by default - number of the given tag ids
+        """
+        if required_tag_count is None:
+            required_tag_count = len(set(tag_ids))
+        thread_tags = self.model.tags.through.objects.filter(tag__id__in=tag_ids)
+        if required_tag_count > 1:
+            thread_tags = thread_tags.values('thread').annotate(
+                                        tag_count=models.Count('id')
+                                    ).filter(tag_count=required_tag_count)
+        return thread_tags.values('thread')
+
+    def get_ids_tagged_with_any(self, tags):
+        """returns query set of ids of the threads tagged
+        with any of the given tags, ``tags`` - ids or a query set
+        """
+        thread_tags = self.model.tags.through.objects.filter(tag__in=tags)
+        return thread_tags.values('thread')
+
+    def get_last_activity_at(self):
+        """returns time of the latest activity in the
+        non-deleted threads, or ``None`` if there are none
+        """
+        threads = self.filter(deleted=False)
+        aggregate = threads.aggregate(models.Max('last_activity_at'))
+        return aggregate['last_activity_at__max']
+
     def get_for_query(self, search_query, qs=None):
         """returns a query set of questions,
         matching the full text query
         todo: move to query set
         """
-        if getattr(django_settings, 'ENABLE_HAYSTACK_SEARCH', False):
-            from askbot.search.haystack import AskbotSearchQuerySet
-            hs_qs = AskbotSearchQuerySet().filter(content=search_query)
-            return hs_qs.get_django_queryset()
-        else:
-            if not qs:
-                qs = self.all()
-    #        if getattr(settings, 'USE_SPHINX_SEARCH', False):
-    #            matching_questions = Question.sphinx_search.query(search_query)
-    #            question_ids = [q.id for q in matching_questions]
-    #            return qs.filter(posts__post_type='question', posts__deleted=False, posts__self_question_id__in=question_ids)
-            if askbot.get_database_engine_name().endswith('mysql') \
-                and mysql.supports_full_text_search():
-                return qs.filter(
-                    models.Q(title__search = search_query) |
-                    models.Q(tagnames__search = search_query) |
-                    models.Q(posts__deleted=False, posts__text__search = search_query)
-                )
-            elif 'postgresql_psycopg2' in askbot.get_database_engine_name():
-                from askbot.search import postgresql
-                return postgresql.run_thread_search(qs, search_query)
-            else:
-                return qs.filter(
-                    models.Q(title__icontains=search_query) |
-                    models.Q(tagnames__icontains=search_query) |
-                    models.Q(posts__deleted=False, posts__text__icontains = search_query)
-                )
+        if qs is None:
+            qs = self.all()
+        return search_backends.get_backend().search_threads(qs, search_query)
 
 
     def run_advanced_search(self, request_user, search_state):  # TODO: !! review, fix, and write tests for this
@@ -293,33 +300,48 @@ class ThreadManager(BaseQuerySetManager):
         #syntax.
         #run tag search in addition to these unified tags
         meta_data = {}
-        tags = search_state.unified_tags()
+        tags = set(search_state.unified_tags())
         if len(tags) > 0:
 
             if askbot_settings.TAG_SEARCH_INPUT_ENABLED:
                 #todo: this may be gone or disabled per option
                 #"tag_search_box_enabled"
-                existing_tags = set()
+                #all tags are found with one query, matching
+                #each name case-insensitively, so that the
+                #case-insensitive search indexes in postgresql can be used
+                name_filter = reduce(
+                                operator.or_,
+                                [models.Q(name__iexact=tag) for tag in tags]
+                            )
+                tag_ids = dict()
+                for tag_id, tag_name in Tag.objects.filter(
+                                    name_filter
+                                ).values_list('id', 'name'):
+                    tag_ids.setdefault(tag_name.lower(), tag_id)
+
                 non_existing_tags = set()
-                #we're using a one-by-one tag retreival, b/c
-                #we want to take advantage of case-insensitive search indexes
-                #in postgresql, plus it is most likely that there will be
-                #only one or two search tags anyway
                 for tag in tags:
-                    try:
-                        tag_record = Tag.objects.get(name__iexact=tag)
-                        existing_tags.add(tag_record.name)
-                    except Tag.DoesNotExist:
+                    if tag.lower() not in tag_ids:
                         non_existing_tags.add(tag)
 
                 meta_data['non_existing_tags'] = list(non_existing_tags)
-                tags = existing_tags
+                tag_ids = tag_ids.values()
+                required_tag_count = len(tag_ids)
             else:
                 meta_data['non_existing_tags'] = list()
-
-            #construct filter for the tag search
-            for tag in tags:
-                qs = qs.filter(tags__name=tag) # Tags or AND-ed here, not OR-ed (i.e. we fetch only threads with all tags)
+                tag_ids = Tag.objects.filter(
+                                    name__in=tags
+                                ).values_list('id', flat=True)
+                #when some tags do not exist no threads can match
+                required_tag_count = len(tags)
+
+            #tags are AND-ed, not OR-ed (i.e. we fetch only threads with all tags)
+            if required_tag_count > 0:
+                qs = qs.filter(
+                    id__in=self.get_ids_tagged_with_all(
+                                            list(tag_ids), required_tag_count
+                                        )
+                )
         else:
             meta_data['non_existing_tags'] = list()
 
@@ -370,46 +392,53 @@ class ThreadManager(BaseQuerySetManager):
         if request_user and request_user.is_authenticated():
             #mark questions tagged with interesting tags
             #a kind of fancy annotation, would be nice to avoid it
-            interesting_tags = Tag.objects.filter(
-                user_selections__user = request_user,
-                user_selections__reason = 'good'
-            )
-            ignored_tags = Tag.objects.filter(
-                user_selections__user = request_user,
-                user_selections__reason = 'bad'
-            )
-            subscribed_tags = Tag.objects.none()
+            #all marked tags of the user are read with one query
+            marked_tags = {'good': list(), 'bad': list(), 'subscribed': list()}
+            for reason, tag_id, tag_name in MarkedTag.objects.filter(
+                                user=request_user
+                            ).values_list('reason', 'tag__id', 'tag__name'):
+                marked_tags.setdefault(reason, list()).append((tag_id, tag_name))
+
+            interesting_tags = marked_tags['good']
+            ignored_tags = marked_tags['bad']
+            subscribed_tags = list()
             if askbot_settings.SUBSCRIBED_TAG_SELECTOR_ENABLED:
-                subscribed_tags = Tag.objects.filter(
-                    user_selections__user = request_user,
-                    user_selections__reason = 'subscribed'
-                )
-                meta_data['subscribed_tag_names'] = [tag.name for tag in subscribed_tags]
+                subscribed_tags = marked_tags['subscribed']
+                meta_data['subscribed_tag_names'] = [tag_name for (tag_id, tag_name) in subscribed_tags]
 
-            meta_data['interesting_tag_names'] = [tag.name for tag in interesting_tags]
-            meta_data['ignored_tag_names'] = [tag.name for tag in ignored_tags]
+            meta_data['interesting_tag_names'] = [tag_name for (tag_id, tag_name) in interesting_tags]
+            meta_data['ignored_tag_names'] = [tag_name for (tag_id, tag_name) in ignored_tags]
 
             if request_user.display_tag_filter_strategy == const.INCLUDE_INTERESTING and (interesting_tags or request_user.has_interesting_wildcard_tags()):
                 #filter by interesting tags only
-                interesting_tag_filter = models.Q(tags__in=interesting_tags)
+                interesting_tag_ids = [tag_id for (tag_id, tag_name) in interesting_tags]
+                interesting_tag_filter = models.Q(
+                    id__in=self.get_ids_tagged_with_any(interesting_tag_ids)
+                )
                 if request_user.has_interesting_wildcard_tags():
                     interesting_wildcards = request_user.interesting_tags.split()
                     extra_interesting_tags = Tag.objects.get_by_wildcards(interesting_wildcards)
-                    interesting_tag_filter |= models.Q(tags__in=extra_interesting_tags)
+                    interesting_tag_filter |= models.Q(
+                        id__in=self.get_ids_tagged_with_any(extra_interesting_tags)
+                    )
                 qs = qs.filter(interesting_tag_filter)
 
             # get the list of interesting and ignored tags (interesting_tag_names, ignored_tag_names) = (None, None)
             if request_user.display_tag_filter_strategy == const.EXCLUDE_IGNORED and (ignored_tags or request_user.has_ignored_wildcard_tags()):
                 #exclude ignored tags if the user wants to
-                qs = qs.exclude(tags__in=ignored_tags)
+                ignored_tag_ids = [tag_id for (tag_id, tag_name) in ignored_tags]
+                qs = qs.exclude(id__in=self.get_ids_tagged_with_any(ignored_tag_ids))
                 if request_user.has_ignored_wildcard_tags():
                     ignored_wildcards = request_user.ignored_tags.split()
                     extra_ignored_tags = Tag.objects.get_by_wildcards(ignored_wildcards)
-                    qs = qs.exclude(tags__in = extra_ignored_tags)
+                    qs = qs.exclude(
+                        id__in=self.get_ids_tagged_with_any(extra_ignored_tags)
+                    )
 
             if request_user.display_tag_filter_strategy == const.INCLUDE_SUBSCRIBED \
                 and subscribed_tags:
-                qs = qs.filter(tags__in = subscribed_tags)
+                subscribed_tag_ids = [tag_id for (tag_id, tag_name) in subscribed_tags]
+                qs = qs.filter(id__in=self.get_ids_tagged_with_any(subscribed_tag_ids))
 
             if askbot_settings.USE_WILDCARD_TAGS:
                 meta_data['interesting_tag_names'].extend(request_user.interesting_tags.split())
@@ -425,7 +454,7 @@ class ThreadManager(BaseQuerySetManager):
             'votes-desc': '-points',
             'votes-asc': 'points',
 
-            'relevance-desc': '-relevance', # special Postgresql-specific ordering, 'relevance' quaso-column is added by get_for_query()
+            'relevance-desc': '-relevance', # 'relevance' quasi-column is added by the search backend in get_for_query()
         }
 
         orderby = QUESTION_ORDER_BY_MAP[search_state.sort]
@@ -435,7 +464,16 @@ class ThreadManager(BaseQuerySetManager):
             and orderby=='-relevance'
         ):
             #FIXME: this does not produces the very same results as postgres.
-            qs = qs.extra(order_by=[orderby])
+            if orderby == '-relevance':
+                qs = qs.extra(order_by=[orderby])
+            else:
+                #thread id is a tie-breaker, which makes the order stable,
+                #so that the listing can be continued from any thread,
+                #see askbot.search.keyset
+                if orderby.startswith('-'):
+                    qs = qs.extra(order_by=[orderby, '-id'])
+                else:
+                    qs = qs.extra(order_by=[orderby, 'id'])
 
 
         # HACK: We add 'ordering_key' column as an alias and order by it, because when distict() is used,
@@ -445,7 +483,7 @@ class ThreadManager(BaseQuerySetManager):
         # qs = qs.extra(select={'ordering_key': orderby.lstrip('-')}, order_by=['-ordering_key' if orderby.startswith('-') else 'ordering_key'])
         # qs = qs.distinct()
 
-        qs = qs.only('id', 'title', 'view_count', 'answer_count', 'last_activity_at', 'last_activity_by', 'closed', 'tagnames', 'accepted_answer')
+        qs = qs.only('id', 'title', 'view_count', 'answer_count', 'last_activity_at', 'last_activity_by', 'closed', 'tagnames', 'accepted_answer', 'question_post', 'added_at', 'points')
 
         #print qs.query
 
@@ -459,9 +497,14 @@ class ThreadManager(BaseQuerySetManager):
         # Precache data only for non-cached threads - only those will be rendered
         #threads = [thread for thread in threads if not thread.summary_html_cached()]
 
-        thread_ids = [obj.id for obj in threads]
+        question_ids = [obj.question_post_id for obj in threads]
+        if None in question_ids:
+            #some threads lack the reference to the question post
+            question_filter = models.Q(post_type='question', thread__in=threads)
+        else:
+            question_filter = models.Q(id__in=question_ids)
         page_questions = Post.objects.filter(
-            post_type='question', thread__id__in = thread_ids
+            question_filter
         ).only(# pick only the used fields
             'id', 'thread', 'points', 'is_anonymous',
             'summary', 'post_type', 'deleted'
@@ -536,9 +579,39 @@ class ThreadToGroup(models.Model):
         app_label = 'askbot'
 
 
+def get_thread_cache_version(thread_id, name):
+    """returns version of the cached data of the thread,
+    the version is a part of the cache keys, so that
+    all cached variants of the data - for the various
+    visitors - are invalidated at once
+    ``name`` - 'posts' or 'summary'
+    """
+    return get_cache_version(Thread.CACHE_VERSION_KEY_TPL % (name, thread_id))
+
+
+def invalidate_thread_cache_version(thread_id, name):
+    invalidate_cache_version(Thread.CACHE_VERSION_KEY_TPL % (name, thread_id))
+
+
+def get_visitor_group_ids(user):
+    """returns ids of the groups of the user, the ids
+    are stored on the user object to be reused within the request"""
+    if user is None:
+        return [Group.objects.get_global_group().id]
+    if not hasattr(user, '_group_ids_cache'):
+        if user.is_anonymous():
+            group_ids = [Group.objects.get_global_group().id]
+        else:
+            group_ids = list(user.get_groups().values_list('id', flat=True))
+        user._group_ids_cache = group_ids
+    return user._group_ids_cache
+
+
 class Thread(models.Model):
     SUMMARY_CACHE_KEY_TPL = 'thread-question-summary-%d'
     ANSWER_LIST_KEY_TPL = 'thread-answer-list-%d'
+    CACHE_VERSION_KEY_TPL = 'thread-%s-version-%d'
+    SHARING_CACHE_KEY_TPL = 'thread-sharing-%d-%s'
 
     title = models.CharField(max_length=300)
 
@@ -573,6 +646,14 @@ class Thread(models.Model):
     approved = models.BooleanField(default=True, db_index=True)
 
     accepted_answer = models.ForeignKey(Post, null=True, blank=True, related_name='+')
+    #denormalized reference to the question post of the thread
+    question_post = models.ForeignKey(
+                                    Post,
+                                    null=True,
+                                    blank=True,
+                                    related_name='+',
+                                    on_delete=models.SET_NULL
+                                )
     answer_accepted_at = models.DateTimeField(null=True, blank=True)
     added_at = models.DateTimeField(default = datetime.datetime.now)
 
@@ -594,13 +675,24 @@ class Thread(models.Model):
             self.points = int(number)
 
     def _question_post(self, refresh=False):
-        if refresh and hasattr(self, '_question_cache'):
-            delattr(self, '_question_cache')
+        if refresh:
+            for cache_name in ('_question_cache', '_question_post_cache'):
+                if hasattr(self, cache_name):
+                    delattr(self, cache_name)
         post = getattr(self, '_question_cache', None)
         if post:
             return post
-        self._question_cache = Post.objects.get(post_type='question', thread=self)
-        return self._question_cache
+        if self.question_post_id:
+            #loaded by id or taken from select_related('question_post')
+            post = self.question_post
+        else:
+            #the reference is missing in the threads created
+            #before it was added, it is stored on the first use
+            post = Post.objects.get(post_type='question', thread=self)
+            Thread.objects.filter(id=self.id).update(question_post=post)
+            self.question_post = post
+        self._question_cache = post
+        return post
 
     def apply_hinted_tags(self, hints=None, user=None, timestamp=None, silent=False):
         """match words in title and body with hints
@@ -762,6 +854,20 @@ class Thread(models.Model):
         self.save()
 
     def increase_view_count(self, increment=1):
+        if visit_buffer.is_enabled():
+            #the count is written to the database later,
+            #see askbot.models.visit_buffer, and the summary
+            #cache is invalidated when the buffer is flushed
+            pending = visit_buffer.visit_buffer.add_thread_view(
+                                                    self.id, increment
+                                                )
+            #in-memory value includes views pending in the buffer,
+            #as the view count badges rely on it
+            stored_count = getattr(self, '_stored_view_count', self.view_count)
+            self._stored_view_count = stored_count
+            self.view_count = stored_count + pending
+            return
+
         qset = Thread.objects.filter(id=self.id)
         qset.update(view_count=models.F('view_count') + increment)
         self.view_count = qset.values('view_count')[0]['view_count'] # get the new view_count back because other pieces of code relies on such behaviour
@@ -901,16 +1007,79 @@ class Thread(models.Model):
     def invalidate_cached_thread_content_fragment(self):
         cache.cache.delete(self.SUMMARY_CACHE_KEY_TPL % self.id)
 
-    def get_post_data_cache_key(self, sort_method = None):
-        return 'thread-data-%s-%s' % (self.id, sort_method)
+    def get_cache_version(self, name='posts'):
+        return get_thread_cache_version(self.id, name)
+
+    def get_cached_sharing_info(self):
+        """returns tuple: ids of the groups to which
+        the posts of the thread are shared and ``True``
+        if the thread is moderated, both are
+        the same for all visitors"""
+        key = self.SHARING_CACHE_KEY_TPL % (self.id, self.get_cache_version())
+        sharing_info = cache.cache.get(key)
+        if sharing_info is None:
+            group_ids = PostToGroup.objects.filter(
+                                    post__thread=self
+                                ).values_list(
+                                    'group_id', flat=True
+                                ).distinct()
+            sharing_info = (set(group_ids), self.is_moderated())
+            cache.cache.set(key, sharing_info, const.LONG_TIME)
+        return sharing_info
+
+    def get_visible_group_ids(self, user=None):
+        """returns sorted list of ids of the groups through which
+        the user sees posts of the thread, visitors with
+        the same groups see the same posts"""
+        if askbot_settings.GROUPS_ENABLED is False:
+            return list()
+        thread_group_ids = self.get_cached_sharing_info()[0]
+        user_group_ids = get_visitor_group_ids(user)
+        return sorted(thread_group_ids.intersection(user_group_ids))
+
+    def get_visibility_key(self, user=None):
+        """returns string naming the class of the visitors
+        who see the same content of the thread:
+        same visible groups and whether the visitor
+        is the author of the question in the moderated thread,
+        for the latter the published answers are not listed first
+        """
+        if askbot_settings.GROUPS_ENABLED is False:
+            return 'all'
+        group_ids = self.get_visible_group_ids(user)
+        key = 'g' + '.'.join([str(group_id) for group_id in group_ids])
+        is_moderated = self.get_cached_sharing_info()[1]
+        if is_moderated and user is not None and user.is_authenticated():
+            if user.id == self._question_post().author_id:
+                key += '-enquirer'
+        return key
+
+    def get_post_data_cache_key(self, sort_method=None, user=None):
+        return 'thread-data-%s-%s-%s-%s' % (
+                                self.id,
+                                self.get_cache_version(),
+                                sort_method,
+                                self.get_visibility_key(user)
+                            )
+
+    def get_content_cache_key(self, sort_method=None, user=None):
+        """returns key of the cached html fragment of
+        the question page with the question and the answers"""
+        if user is None or user.is_anonymous():
+            visitor_type = 'anon'
+        else:
+            visitor_type = 'user'
+        return '%s-%s-%s' % (
+                        self.get_post_data_cache_key(sort_method, user),
+                        visitor_type,
+                        get_language()
+                    )
 
     def invalidate_cached_post_data(self):
         """needs to be called when anything notable
         changes in the post data - on votes, adding,
         deleting, editing content"""
-        #we can call delete_many() here if using Django > 1.2
-        for sort_method in const.ANSWER_SORT_METHODS:
-            cache.cache.delete(self.get_post_data_cache_key(sort_method))
+        invalidate_thread_cache_version(self.id, 'posts')
 
     def invalidate_cached_data(self):
         self.invalidate_cached_post_data()
@@ -919,14 +1088,12 @@ class Thread(models.Model):
 
     def get_cached_post_data(self, user = None, sort_method = 'votes'):
         """returns cached post data, as calculated by
-        the method get_post_data()"""
-        if askbot_settings.GROUPS_ENABLED:
-            #temporary plug: bypass cache where groups are enabled
-            return self.get_post_data(sort_method=sort_method, user=user)
-        key = self.get_post_data_cache_key(sort_method)
+        the method get_post_data(), the data is cached
+        per class of the visitors - see :meth:`get_visibility_key`"""
+        key = self.get_post_data_cache_key(sort_method, user)
         post_data = cache.cache.get(key)
         if not post_data:
-            post_data = self.get_post_data(sort_method)
+            post_data = self.get_post_data(sort_method=sort_method, user=user)
             cache.cache.set(key, post_data, const.LONG_TIME)
         return post_data
 
@@ -1025,10 +1192,11 @@ class Thread(models.Model):
                                         }[sort_method]
                                     ).values_list('id', flat=True)
 
-            published_answer_ids = reversed(published_answer_ids)
+            #a list, because the post data is cached
+            published_answer_ids = list(published_answer_ids)
             #now put those answers first
             answer_map = dict([(answer.id, answer) for answer in answers])
-            for answer_id in published_answer_ids:
+            for answer_id in reversed(published_answer_ids):
                 #note that answer map may not contain answers publised
                 #to the question enquirer, because current user may
                 #not have access to that answer, so we use the .get() method
@@ -1055,16 +1223,21 @@ class Thread(models.Model):
         Get 10 similar threads for given one.
         Threads with the individual tags will be added to list if above questions are not full.
 
-        This function has a limitation that it will
+        If the similarity index is enabled
+        (``ASKBOT_USE_SIMILARITY_INDEX = True``), the threads are
+        found with the index, ranked by the overlap of tags and
+        title words, see :mod:`askbot.models.similarity_index`.
+
+        Otherwise this function has a limitation that it will
         retrieve only 100 records then select 10 most similar
         from that list as querying entire database may
-        be very expensive - this function will benefit from
-        some sort of optimization
+        be very expensive
         """
 
-        def get_data():
-            # todo: code in this function would be simpler if
-            # we had question post id denormalized on the thread
+        def get_threads():
+            if similarity_index.is_enabled():
+                return similarity_index.get_similar_threads(self, 10)
+
             tags_list = self.get_tag_names()
             similar_threads = Thread.objects.filter(
                                         tags__name__in=tags_list
@@ -1080,29 +1253,26 @@ class Thread(models.Model):
                 thread.similarity = self.get_similarity(other_thread=thread)
 
             similar_threads.sort(key=operator.attrgetter('similarity'), reverse=True)
-            similar_threads = similar_threads[:10]
+            return similar_threads[:10]
 
-            # Denormalize questions to speed up template rendering
-            # todo: just denormalize question_post_id on the thread!
-            thread_map = dict([(thread.id, thread) for thread in similar_threads])
-            questions = Post.objects.get_questions()
-            questions = questions.select_related('thread').filter(thread__in=similar_threads)
-            for q in questions:
-                thread_map[q.thread_id].question_denorm = q
+        def get_data():
+            similar_threads = get_threads()
+
+            # questions are loaded by the ids stored on the threads
+            question_ids = [thread.question_post_id for thread in similar_threads]
+            questions = Post.objects.in_bulk(filter(None, question_ids))
 
-            # Postprocess data for the final output
             result = list()
             for thread in similar_threads:
-                question_post = getattr(thread, 'question_denorm', None)
-                # unfortunately the if statement below is necessary due to
-                # a possible bug
-                # all this proves that it's wrong to reference threads by
-                # the question post id in the question page urls!!!
-                # this is a "legacy" problem inherited from the old models
-                if question_post:
-                    url = question_post.get_absolute_url()
-                    title = thread.get_title(question_post)
-                    result.append({'url': url, 'title': title})
+                question_post = questions.get(thread.question_post_id)
+                if question_post is None:
+                    try:
+                        question_post = thread._question_post()
+                    except Post.DoesNotExist:
+                        continue
+                url = question_post.get_absolute_url(thread=thread)
+                title = thread.get_title(question_post)
+                result.append({'url': url, 'title': title})
 
             return result
 
@@ -1110,7 +1280,7 @@ class Thread(models.Model):
             """similar thread data will expire
             with the default expiration delay
             """
-            key = 'similar-threads-%s' % self.id
+            key = similarity_index.get_cache_key(self.id)
             data = cache.cache.get(key)
             if data is None:
                 data = get_data()
@@ -1463,21 +1633,31 @@ class Thread(models.Model):
 
         return html
 
-    def get_cached_summary_html(self, visitor = None):
-        #todo: remove this plug by adding cached foreign user group
-        #parameter to the key. Now with groups on caching is turned off
-        #parameter visitor is there to get summary out by the user groups
+    def get_summary_cache_key(self, visitor=None):
+        """summary is cached per set of the groups
+        through which the visitor sees the answers,
+        because the answer count depends on them"""
+        key = self.SUMMARY_CACHE_KEY_TPL % self.id
         if askbot_settings.GROUPS_ENABLED:
-            return None
-        return cache.cache.get(self.SUMMARY_CACHE_KEY_TPL % self.id)
+            group_ids = self.get_visible_group_ids(visitor)
+            key += '-%s-%s-g%s' % (
+                        self.get_cache_version('summary'),
+                        self.get_cache_version('posts'),
+                        '.'.join([str(group_id) for group_id in group_ids])
+                    )
+        return key
+
+    def get_cached_summary_html(self, visitor = None):
+        return cache.cache.get(self.get_summary_cache_key(visitor))
 
     def update_summary_html(self, visitor = None):
-        #todo: it is quite wrong that visitor is an argument here
-        #because we do not include any visitor-related info in the cache key
-        #ideally cache should be shareable between users, so straight up
-        #using the user id for cache is wrong, we could use group
-        #memberships, but in that case we'd need to be more careful with
-        #cache invalidation
+        """renders the summary for the visitor and caches it,
+        ``visitor`` is ``None`` when the summary is regenerated
+        after a change of the thread, then summaries cached
+        for the other visitors are invalidated too
+        """
+        if visitor is None and askbot_settings.GROUPS_ENABLED:
+            invalidate_thread_cache_version(self.id, 'summary')
         context = {
             'thread': self,
             #fetch new question post to make sure we're up-to-date
@@ -1494,14 +1674,14 @@ class Thread(models.Model):
         # * Additionally, Memcached treats timeouts > 30day as dates (https://code.djangoproject.com/browser/django/tags/releases/1.3/django/core/cache/backends/memcached.py#L36),
         #   which probably doesn't break anything but if we can stick to 30 days then let's stick to it
         cache.cache.set(
-            self.SUMMARY_CACHE_KEY_TPL % self.id,
+            self.get_summary_cache_key(visitor),
             html,
             timeout=const.LONG_TIME
         )
         return html
 
-    def summary_html_cached(self):
-        return cache.cache.has_key(self.SUMMARY_CACHE_KEY_TPL % self.id)
+    def summary_html_cached(self, visitor=None):
+        return cache.cache.has_key(self.get_summary_cache_key(visitor))
 
 class QuestionView(models.Model):
     question = models.ForeignKey(Post, related_name='viewed')
@@ -82,6 +82,7 @@ class Vote(models.Model):
         else:
             # cancel downvote
             auth.onDownVotedCanceled(self, self.voted_post, self.user)
+        auth.queue_summary_html_update(self.voted_post)
         score_after = self.voted_post.points
 
         return score_after - score_before
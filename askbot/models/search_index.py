@@ -0,0 +1,188 @@
+"""Inverted index of the thread titles, tags, posts
+and user profiles for the local search backend
+:class:`askbot.search.local.LocalSearchBackend`
+
+For each indexed object the index stores the terms
+(lowercased words) with the weights - number of occurences
+of the term multiplied by the weight of the field, e.g.
+words in the thread titles weigh more than in the posts.
+
+The index is updated when the threads, posts and users are saved
+or deleted, only the changed terms are written. The index of the
+existing content is built with the command ``rebuild_search_index``.
+"""
+import re
+from django.db import connection
+from django.db import models
+from django.db import transaction
+
+#weights of the terms by the field
+TITLE_WEIGHT = 10
+TAG_WEIGHT = 5
+TEXT_WEIGHT = 1
+USERNAME_WEIGHT = 10
+ABOUT_WEIGHT = 1
+
+MAX_TERM_LENGTH = 64
+#number of terms written or deleted by one query
+BATCH_SIZE = 100
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+OBJECT_TYPE_CHOICES = (
+    ('thread', 'thread'),
+    ('post', 'post'),
+    ('user', 'user'),
+)
+
+class SearchIndexEntry(models.Model):
+    """weight of the term in the object, for the threads
+    and the posts the id of the thread is denormalized,
+    so that threads are searched without joins"""
+    term = models.CharField(max_length=MAX_TERM_LENGTH, db_index=True)
+    object_type = models.CharField(max_length=8, choices=OBJECT_TYPE_CHOICES)
+    object_id = models.PositiveIntegerField(db_index=True)
+    thread_id = models.PositiveIntegerField(null=True, db_index=True)
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        app_label = 'askbot'
+
+
+def is_enabled():
+    from askbot.search import backends
+    return getattr(backends.get_backend(), 'uses_search_index', False)
+
+
+def get_terms(text):
+    """returns list of the lowercased words of the text"""
+    terms = TERM_RE.findall(text.lower())
+    return [term for term in terms if len(term) <= MAX_TERM_LENGTH]
+
+
+def add_term_weights(weights, text, field_weight):
+    for term in get_terms(text):
+        weights[term] = weights.get(term, 0) + field_weight
+
+
+def get_thread_weights(thread):
+    weights = dict()
+    add_term_weights(weights, thread.title, TITLE_WEIGHT)
+    for tag_name in thread.get_tag_names():
+        #whole tag names like "c++" are searchable too
+        tag_name = tag_name.lower()
+        if len(tag_name) <= MAX_TERM_LENGTH:
+            weights[tag_name] = weights.get(tag_name, 0) + TAG_WEIGHT
+        add_term_weights(weights, tag_name, TAG_WEIGHT)
+    return weights
+
+
+def get_post_weights(post):
+    weights = dict()
+    add_term_weights(weights, post.text or '', TEXT_WEIGHT)
+    return weights
+
+
+def get_user_weights(user):
+    weights = dict()
+    add_term_weights(weights, user.username, USERNAME_WEIGHT)
+    add_term_weights(weights, user.about or '', ABOUT_WEIGHT)
+    return weights
+
+
+def update_entries(object_type, object_id, thread_id, weights):
+    """replaces entries of the object in the index,
+    entries which did not change are not rewritten"""
+    entries = SearchIndexEntry.objects.filter(
+                                object_type=object_type,
+                                object_id=object_id
+                            )
+    current = dict()
+    for term, weight, entry_thread_id in entries.values_list(
+                                        'term', 'weight', 'thread_id'
+                                    ):
+        current[term] = (weight, entry_thread_id)
+
+    new = dict()
+    for term, weight in weights.items():
+        new[term] = (weight, thread_id)
+
+    if current == new:
+        return
+
+    stale_terms = [term for term in current if current[term] != new.get(term)]
+    added_terms = [term for term in new if current.get(term) != new[term]]
+
+    table = connection.ops.quote_name(SearchIndexEntry._meta.db_table)
+    cursor = connection.cursor()
+    for start in range(0, len(stale_terms), BATCH_SIZE):
+        batch = stale_terms[start:start + BATCH_SIZE]
+        cursor.execute(
+            'DELETE FROM %s WHERE object_type=%%s AND object_id=%%s '
+            'AND term IN (%s)' % (table, ', '.join(['%s'] * len(batch))),
+            [object_type, object_id] + batch
+        )
+
+    rows = [
+        (term, object_type, object_id, thread_id, new[term][0])
+        for term in added_terms
+    ]
+    if rows:
+        cursor.executemany(
+            'INSERT INTO %s (term, object_type, object_id, thread_id, weight) '
+            'VALUES (%%s, %%s, %%s, %%s, %%s)' % table,
+            rows
+        )
+    transaction.commit_unless_managed()
+
+
+def remove_entries(object_type, object_id):
+    SearchIndexEntry.objects.filter(
+                        object_type=object_type,
+                        object_id=object_id
+                    ).delete()
+
+
+def index_thread(thread):
+    update_entries('thread', thread.id, thread.id, get_thread_weights(thread))
+
+
+def index_post(post):
+    if post.deleted or post.post_type not in ('question', 'answer', 'comment'):
+        remove_entries('post', post.id)
+    else:
+        update_entries('post', post.id, post.thread_id, get_post_weights(post))
+
+
+def index_user(user):
+    update_entries('user', user.id, None, get_user_weights(user))
+
+
+def record_thread_save(sender, instance, **kwargs):
+    if is_enabled():
+        index_thread(instance)
+
+
+def record_thread_delete(sender, instance, **kwargs):
+    if is_enabled():
+        SearchIndexEntry.objects.filter(thread_id=instance.id).delete()
+
+
+def record_post_save(sender, instance, **kwargs):
+    if is_enabled():
+        index_post(instance)
+
+
+def record_post_delete(sender, instance, **kwargs):
+    if is_enabled():
+        remove_entries('post', instance.id)
+
+
+def record_user_save(sender, instance, **kwargs):
+    if is_enabled():
+        index_user(instance)
+
+
+def record_user_delete(sender, instance, **kwargs):
+    if is_enabled():
+        remove_entries('user', instance.id)
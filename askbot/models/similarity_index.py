@@ -0,0 +1,216 @@
+"""Index of the similar threads, used by
+:meth:`~askbot.models.question.Thread.get_similar_threads`
+
+Each thread is described by the set of its tags and the words
+of its title. Similarity of two threads is the Jaccard index
+of their sets, which is estimated with the MinHash signatures.
+Signatures are split into bands and the hashes of the bands
+(buckets) are stored in the index. Threads sharing at least one
+bucket are the candidates, those sharing more buckets are likely
+to be more similar, the candidates are then ranked by the exact
+Jaccard index of their tags and title words.
+
+Threads sharing a single tag with many others do not
+fall into the same buckets, so the lookup reads only
+a small number of the index entries.
+
+The index is enabled with the setting
+``ASKBOT_USE_SIMILARITY_INDEX = True``, it is updated
+when the threads are saved - on retagging and editing the titles,
+then the cached lists of the similar threads sharing the buckets
+with the thread are deleted. The index of the existing threads
+is built with the command ``build_similarity_index``.
+"""
+import random
+import re
+from django.conf import settings as django_settings
+from django.core import cache
+from django.db import models
+from django.db import transaction
+from django.utils.hashcompat import md5_constructor
+
+NUM_BANDS = 20
+ROWS_PER_BAND = 2
+NUM_HASHES = NUM_BANDS * ROWS_PER_BAND
+#threads sharing most buckets with the thread, ranked by the similarity
+MAX_CANDIDATES = 100
+MIN_WORD_LENGTH = 3
+#very common words of the titles, which do not make the threads similar
+STOP_WORDS = frozenset((
+    'and', 'are', 'can', 'does', 'for', 'from', 'get', 'have', 'how',
+    'not', 'the', 'that', 'this', 'use', 'using', 'what', 'when',
+    'where', 'which', 'why', 'with', 'you', 'your'
+))
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+#coefficients of the hash functions (a*x + b) mod p,
+#fixed, so that the signatures are the same in all processes
+HASH_PRIME = (1 << 61) - 1
+_random = random.Random(7919)
+HASH_COEFFICIENTS = [
+    (_random.randint(1, HASH_PRIME - 1), _random.randint(0, HASH_PRIME - 1))
+    for i in range(NUM_HASHES)
+]
+
+class SimilarityIndexEntry(models.Model):
+    """bucket of the thread - hash of one band
+    of the MinHash signature"""
+    bucket = models.CharField(max_length=24, db_index=True)
+    thread_id = models.PositiveIntegerField(db_index=True)
+
+    class Meta:
+        app_label = 'askbot'
+
+
+def is_enabled():
+    return getattr(django_settings, 'ASKBOT_USE_SIMILARITY_INDEX', False)
+
+
+def get_cache_key(thread_id):
+    """key of the list of the similar threads, cached
+    by the :meth:`~askbot.models.question.Thread.get_similar_threads`"""
+    return 'similar-threads-%s' % thread_id
+
+
+def get_features(title, tagnames):
+    """returns set of the tag names and the words
+    of the title describing the thread"""
+    features = set(['tag:' + name.lower() for name in tagnames.split()])
+    for word in WORD_RE.findall(title.lower()):
+        if len(word) >= MIN_WORD_LENGTH and word not in STOP_WORDS:
+            features.add('word:' + word)
+    return features
+
+
+def get_similarity(features1, features2):
+    """Jaccard index of the two sets"""
+    if not features1 or not features2:
+        return 0.0
+    common = len(features1 & features2)
+    return float(common) / (len(features1) + len(features2) - common)
+
+
+def get_signature(features):
+    """returns MinHash signature of the set of features"""
+    values = [
+        int(md5_constructor(feature.encode('utf-8')).hexdigest()[:15], 16)
+        for feature in features
+    ]
+    signature = list()
+    for a, b in HASH_COEFFICIENTS:
+        signature.append(min([(a * value + b) % HASH_PRIME for value in values]))
+    return signature
+
+
+def get_buckets(features):
+    """returns list of the buckets of the thread
+    with the given features"""
+    if not features:
+        return list()
+    signature = get_signature(features)
+    buckets = list()
+    for band in range(NUM_BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        band_hash = md5_constructor(','.join(map(str, rows))).hexdigest()
+        buckets.append('%d-%s' % (band, band_hash[:16]))
+    return buckets
+
+
+def get_thread_buckets(thread):
+    if thread.deleted:
+        return list()
+    return get_buckets(get_features(thread.title, thread.tagnames))
+
+
+def index_thread(thread):
+    """updates buckets of the thread in the index, if they changed,
+    returns ids of the threads whose lists of the similar
+    threads may change - the thread itself and the threads
+    sharing the old or the new buckets with it"""
+    buckets = set(get_thread_buckets(thread))
+    entries = SimilarityIndexEntry.objects.filter(thread_id=thread.id)
+    old_buckets = set(entries.values_list('bucket', flat=True))
+    if old_buckets == buckets:
+        return set()
+    entries.delete()
+    new_entries = [
+        SimilarityIndexEntry(bucket=bucket, thread_id=thread.id) \
+        for bucket in buckets
+    ]
+    if hasattr(SimilarityIndexEntry.objects, 'bulk_create'):
+        SimilarityIndexEntry.objects.bulk_create(new_entries)
+    else:
+        #django 1.3
+        for entry in new_entries:
+            entry.save()
+    transaction.commit_unless_managed()
+
+    neighbors = SimilarityIndexEntry.objects.filter(
+                                    bucket__in=list(old_buckets | buckets)
+                                ).values_list('thread_id', flat=True)
+    return set(neighbors) | set([thread.id])
+
+
+def clear_cached_lists(thread_ids):
+    """deletes cached lists of the similar threads"""
+    if thread_ids:
+        cache.cache.delete_many([get_cache_key(tid) for tid in thread_ids])
+
+
+def get_similar_threads(thread, max_count):
+    """returns list of at most ``max_count`` threads
+    most similar to the given one, most similar first"""
+    from askbot.models.question import Thread
+    buckets = get_thread_buckets(thread)
+    if not buckets:
+        return list()
+    matches = SimilarityIndexEntry.objects.filter(
+                                    bucket__in=buckets
+                                ).exclude(
+                                    thread_id=thread.id
+                                ).values(
+                                    'thread_id'
+                                ).annotate(
+                                    shared_buckets=models.Count('id')
+                                ).order_by(
+                                    '-shared_buckets'
+                                )[:MAX_CANDIDATES]
+    shared_buckets = dict()
+    for match in matches:
+        shared_buckets[match['thread_id']] = match['shared_buckets']
+
+    candidates = Thread.objects.filter(
+                                id__in=shared_buckets.keys(),
+                                deleted=False
+                            )
+    features = get_features(thread.title, thread.tagnames)
+    ranked_threads = list()
+    for candidate in candidates:
+        candidate.similarity = get_similarity(
+                        features,
+                        get_features(candidate.title, candidate.tagnames)
+                    )
+        ranked_threads.append(candidate)
+
+    ranked_threads.sort(
+        key=lambda t: (t.similarity, shared_buckets[t.id], t.last_activity_at),
+        reverse=True
+    )
+    return ranked_threads[:max_count]
+
+
+def record_thread_save(sender, instance, **kwargs):
+    if is_enabled():
+        clear_cached_lists(index_thread(instance))
+
+
+def record_thread_delete(sender, instance, **kwargs):
+    if is_enabled():
+        entries = SimilarityIndexEntry.objects.filter(thread_id=instance.id)
+        buckets = list(entries.values_list('bucket', flat=True))
+        entries.delete()
+        neighbors = SimilarityIndexEntry.objects.filter(
+                                    bucket__in=buckets
+                                ).values_list('thread_id', flat=True)
+        clear_cached_lists(set(neighbors))
@@ -0,0 +1,309 @@
+"""In-memory index of the tag based email subscriptions.
+
+When a question or an answer is posted, the users
+who get instant notifications about all questions
+are selected by their tag filters: those who follow
+(or do not ignore) the tags of the question, directly
+or via the wildcard selections like ``django*``.
+
+Without the index each post runs joins over the tag selections
+and - with the wildcard tags enabled - loops in python over
+all users who have any wildcard selections.
+
+The index keeps, for the users subscribed to the instant
+notifications about all questions:
+
+* tag name -> ids of the users who selected the tag,
+  for each tag selection reason
+* prefix tree of the wildcard selections, for each reason
+* email tag filter strategy -> ids of the users
+
+so that the subscribers for a set of tags are found in time
+proportional to the number of the matches.
+
+The index is enabled with the setting
+``ASKBOT_USE_TAG_SUBSCRIPTION_INDEX = True``. It is built
+once per process and then updated incrementally:
+changes of the tag selections and of the subscriptions
+are recorded in the cache as a sequence of the changed user ids,
+from which each process re-reads data of those users only.
+The cache must be shared by all processes (i.e. not ``locmem://``).
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings as django_settings
+from django.core import cache
+
+from askbot import const
+from askbot.utils.cache import get_cache_version, invalidate_cache_version
+
+VERSION_CACHE_KEY = 'tag-subscription-index-version'
+CHANGE_CACHE_KEY_TPL = 'tag-subscription-index-change-%d'
+#the index is rebuilt from scratch at least this often (seconds)
+REBUILD_INTERVAL = 60*60
+#when there are more changes, it is cheaper to rebuild the index
+MAX_REFRESHED_USERS = 500
+
+MARK_REASONS = ('good', 'bad', 'subscribed')
+
+#tag selection reason -> email tag filter strategy
+REASON_STRATEGIES = {
+    'good': const.INCLUDE_INTERESTING,
+    'bad': const.EXCLUDE_IGNORED,
+    'subscribed': const.INCLUDE_SUBSCRIBED,
+}
+
+#tag selection reason -> User attribute with the wildcard tags
+WILDCARD_ATTRIBUTES = {
+    'good': 'interesting_tags',
+    'bad': 'ignored_tags',
+    'subscribed': 'subscribed_tags',
+}
+
+def is_enabled():
+    return getattr(django_settings, 'ASKBOT_USE_TAG_SUBSCRIPTION_INDEX', False)
+
+
+def get_version():
+    """returns number of the latest recorded change
+    or ``None`` if the cache does not store the values"""
+    return get_cache_version(VERSION_CACHE_KEY)
+
+
+def record_change(user_id):
+    """records that tag selections, tag filter strategy
+    or the subscriptions of the user have changed"""
+    if not is_enabled():
+        return
+    if get_version() is None:
+        return
+    version = invalidate_cache_version(VERSION_CACHE_KEY)
+    if version is None:
+        #the key has just expired
+        return
+    cache.cache.set(CHANGE_CACHE_KEY_TPL % version, user_id, REBUILD_INTERVAL)
+
+
+def get_wildcard_prefixes(wildcard_tags):
+    """returns prefixes of the wildcard tags, stored
+    in the space separated string, same way as
+    :func:`~askbot.models.tag.tags_match_some_wildcard`
+    interprets them"""
+    if wildcard_tags == '':
+        return ()
+    return [wildcard[:-1] for wildcard in wildcard_tags.split(' ')]
+
+
+class WildcardTrie(object):
+    """prefix tree of the wildcard tag selections,
+    each node is a list ``[children by character, user ids]``,
+    user ids are of the users whose wildcard prefix
+    ends at the node
+    """
+    def __init__(self):
+        self.root = [dict(), set()]
+
+    def add(self, prefix, user_id):
+        node = self.root
+        for char in prefix:
+            node = node[0].setdefault(char, [dict(), set()])
+        node[1].add(user_id)
+
+    def remove(self, prefix, user_id):
+        path = list()
+        node = self.root
+        for char in prefix:
+            child = node[0].get(char)
+            if child is None:
+                return
+            path.append((node, char))
+            node = child
+        node[1].discard(user_id)
+        #prune the branches left empty
+        for parent, char in reversed(path):
+            child = parent[0][char]
+            if child[0] or child[1]:
+                break
+            del parent[0][char]
+
+    def get_matching_user_ids(self, tag_names):
+        """returns ids of the users with wildcards
+        matching any of the tag names"""
+        user_ids = set()
+        for tag_name in tag_names:
+            node = self.root
+            user_ids.update(node[1])
+            for char in tag_name:
+                node = node[0].get(char)
+                if node is None:
+                    break
+                user_ids.update(node[1])
+        return user_ids
+
+
+class TagSubscriptionIndex(object):
+    """tag based subscriptions of the users receiving
+    instant notifications about all questions"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.built_at = None
+        self.clear()
+
+    def clear(self):
+        #reason -> tag name -> set of user ids
+        self.tag_selections = dict([(reason, dict()) for reason in MARK_REASONS])
+        #reason -> wildcard trie
+        self.wildcards = dict([(reason, WildcardTrie()) for reason in MARK_REASONS])
+        #email tag filter strategy -> set of user ids
+        self.subscribers = dict()
+        #user id -> (strategy, list of (reason, tag name), list of (reason, prefix))
+        self.users = dict()
+
+    def load_users(self, user_ids=None):
+        """reads subscriptions of the users from the database
+        into the index, if ``user_ids`` is ``None`` - of all users
+        """
+        from askbot.models import User, MarkedTag
+        subscribers = User.objects.filter(
+                            notification_subscriptions__feed_type='q_all',
+                            notification_subscriptions__frequency='i'
+                        )
+        selections = MarkedTag.objects.filter(
+                            user__notification_subscriptions__feed_type='q_all',
+                            user__notification_subscriptions__frequency='i'
+                        )
+        if user_ids is not None:
+            subscribers = subscribers.filter(id__in=user_ids)
+            selections = selections.filter(user__id__in=user_ids)
+
+        users = dict()
+        wildcard_fields = [WILDCARD_ATTRIBUTES[reason] for reason in MARK_REASONS]
+        subscriber_data = subscribers.values_list(
+                                'id', 'email_tag_filter_strategy', *wildcard_fields
+                            )
+        for row in subscriber_data:
+            user_id, strategy = row[:2]
+            wildcards = list()
+            for reason, wildcard_tags in zip(MARK_REASONS, row[2:]):
+                for prefix in get_wildcard_prefixes(wildcard_tags):
+                    wildcards.append((reason, prefix))
+            users[user_id] = (strategy, list(), wildcards)
+
+        selection_data = selections.values_list('user_id', 'reason', 'tag__name')
+        for user_id, reason, tag_name in selection_data:
+            if user_id in users:
+                users[user_id][1].append((reason, tag_name))
+
+        for user_id, user_data in users.items():
+            self.add_user(user_id, *user_data)
+
+    def add_user(self, user_id, strategy, tag_selections, wildcards):
+        self.users[user_id] = (strategy, tag_selections, wildcards)
+        self.subscribers.setdefault(strategy, set()).add(user_id)
+        for reason, tag_name in tag_selections:
+            selections = self.tag_selections.get(reason)
+            if selections is not None:
+                selections.setdefault(tag_name, set()).add(user_id)
+        for reason, prefix in wildcards:
+            self.wildcards[reason].add(prefix, user_id)
+
+    def remove_user(self, user_id):
+        user_data = self.users.pop(user_id, None)
+        if user_data is None:
+            return
+        strategy, tag_selections, wildcards = user_data
+        self.subscribers[strategy].discard(user_id)
+        for reason, tag_name in tag_selections:
+            selections = self.tag_selections.get(reason, {})
+            user_ids = selections.get(tag_name)
+            if user_ids is not None:
+                user_ids.discard(user_id)
+                if not user_ids:
+                    del selections[tag_name]
+        for reason, prefix in wildcards:
+            self.wildcards[reason].remove(prefix, user_id)
+
+    def build(self, version):
+        start_time = time.time()
+        self.clear()
+        self.load_users()
+        self.version = version
+        self.built_at = time.time()
+        logging.debug(
+            'built tag subscription index of %d users in %.3fs' % \
+            (len(self.users), self.built_at - start_time)
+        )
+
+    def refresh_users(self, user_ids):
+        for user_id in user_ids:
+            self.remove_user(user_id)
+        self.load_users(user_ids)
+
+    def sync(self):
+        """applies changes recorded since the last sync,
+        or rebuilds the index"""
+        version = get_version()
+        if version is None \
+            or self.version is None \
+            or version < self.version \
+            or version - self.version > MAX_REFRESHED_USERS \
+            or time.time() - self.built_at > REBUILD_INTERVAL:
+            self.build(version)
+            return
+
+        if version == self.version:
+            return
+
+        change_keys = [
+            CHANGE_CACHE_KEY_TPL % change_number \
+            for change_number in range(self.version + 1, version + 1)
+        ]
+        changes = cache.cache.get_many(change_keys)
+        changed_user_ids = set(changes.values())
+        if len(changes) < len(change_keys) \
+            or len(changed_user_ids) > MAX_REFRESHED_USERS:
+            #some changes are lost or there are too many
+            self.build(version)
+        else:
+            self.refresh_users(changed_user_ids)
+            self.version = version
+
+    def get_subscriber_ids(self, tag_names, reason, use_wildcards):
+        """returns set of ids of users who follow or
+        "do not ignore" the tags, depending on the ``reason``,
+        same as :meth:`~askbot.models.post.Post.get_global_tag_based_subscribers`
+        """
+        strategy = REASON_STRATEGIES[reason]
+        self.lock.acquire()
+        try:
+            self.sync()
+            matches = set()
+            selections = self.tag_selections[reason]
+            for tag_name in tag_names:
+                matches.update(selections.get(tag_name, ()))
+            if use_wildcards:
+                wildcards = self.wildcards[reason]
+                matches.update(wildcards.get_matching_user_ids(tag_names))
+            candidates = self.subscribers.get(strategy, set())
+            if reason == 'bad':
+                return candidates - matches
+            else:
+                return candidates & matches
+        finally:
+            self.lock.release()
+
+    def get_unfiltered_subscriber_ids(self):
+        """returns set of ids of users who have
+        the email tag filter turned off"""
+        self.lock.acquire()
+        try:
+            self.sync()
+            return set(self.subscribers.get(const.INCLUDE_ALL, ()))
+        finally:
+            self.lock.release()
+
+
+subscription_index = TagSubscriptionIndex()
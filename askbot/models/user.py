@@ -20,19 +20,77 @@ from askbot.models.tag import Tag
 from askbot.models.tag import clean_group_name#todo - delete this
 from askbot.models.tag import get_tags_by_names
 from askbot.forms import DomainNameField
+from askbot.utils.cache import get_cache_version, invalidate_cache_version
 from askbot.utils.forms import email_is_allowed
 
 PERSONAL_GROUP_NAME_PREFIX = '_personal_'
+#number of the inbox audit records inserted by one query
+RECIPIENT_BATCH_SIZE = 100
+
+MODERATION_ACTIVITY_TYPES = (
+    const.TYPE_ACTIVITY_MARK_OFFENSIVE,
+    const.TYPE_ACTIVITY_MODERATED_NEW_POST,
+    const.TYPE_ACTIVITY_MODERATED_POST_EDIT,
+)
+#versions of the cached counts of the moderation items
+#and of the cached list of groups, versions are parts of the cache keys
+MODERATION_ITEMS_VERSION_KEY = 'moderation-items-version'
+GROUP_LIST_VERSION_KEY = 'group-list-version'
+
+def get_moderation_items_version():
+    return get_cache_version(MODERATION_ITEMS_VERSION_KEY)
+
+
+def invalidate_moderation_items_version():
+    """call when the moderation items in the inboxes
+    are added, removed or change status"""
+    invalidate_cache_version(MODERATION_ITEMS_VERSION_KEY)
+
+
+def get_group_list_version():
+    return get_cache_version(GROUP_LIST_VERSION_KEY)
+
+
+def invalidate_group_list_version():
+    invalidate_cache_version(GROUP_LIST_VERSION_KEY)
+
+
+def get_inbox_activity_types():
+    """activity types counted in the user inboxes"""
+    return const.RESPONSE_ACTIVITY_TYPES_FOR_DISPLAY + \
+                                    (const.TYPE_ACTIVITY_MENTION,)
+
+
+def increment_response_counts(users, new_count=0, seen_count=0):
+    """atomically adds ``new_count`` and ``seen_count`` to the
+    denormalized counts of the responses in the inboxes of the users,
+    with one query for all users, counts may be negative
+
+    the counts are also updated on the given user objects,
+    if the counts drift, they are repaired with the
+    ``fix_inbox_counts`` management command
+    """
+    users = list(users)
+    if len(users) == 0 or (new_count == 0 and seen_count == 0):
+        return
+    User.objects.filter(
+                    id__in=[user.id for user in users]
+                ).update(
+                    new_response_count=models.F('new_response_count') + new_count,
+                    seen_response_count=models.F('seen_response_count') + seen_count
+                )
+    for user in users:
+        user.new_response_count += new_count
+        user.seen_response_count += seen_count
+
 
 class ResponseAndMentionActivityManager(models.Manager):
     def get_query_set(self):
-        response_types = const.RESPONSE_ACTIVITY_TYPES_FOR_DISPLAY
-        response_types += (const.TYPE_ACTIVITY_MENTION, )
         return super(
                     ResponseAndMentionActivityManager,
                     self
                 ).get_query_set().filter(
-                    activity_type__in = response_types
+                    activity_type__in = get_inbox_activity_types()
                 )
 
 class ActivityManager(models.Manager):
@@ -91,7 +149,6 @@ class ActivityManager(models.Manager):
         if mentioned_whom:
             assert(isinstance(mentioned_whom, User))
             mention_activity.add_recipients([mentioned_whom])
-            mentioned_whom.update_response_counts()
 
         return mention_activity
 
@@ -198,11 +255,32 @@ class Activity(models.Model):
     def add_recipients(self, recipients):
         """have to use a special method, because django does not allow
         auto-adding to M2M with "through" model
+
+        audit records are inserted in batches, if the activity is
+        a response or a mention, the counts of the new responses
+        of the recipients are incremented
         """
-        for recipient in recipients:
-            #todo: may optimize for bulk addition
-            aas = ActivityAuditStatus(user = recipient, activity = self)
-            aas.save()
+        records = [
+            ActivityAuditStatus(user=recipient, activity=self)
+            for recipient in recipients
+        ]
+        if len(records) == 0:
+            return
+
+        if hasattr(ActivityAuditStatus.objects, 'bulk_create'):
+            ActivityAuditStatus.objects.bulk_create(
+                                    records,
+                                    batch_size=RECIPIENT_BATCH_SIZE
+                                )
+        else:
+            #django 1.3
+            for record in records:
+                record.save()
+
+        if self.activity_type in get_inbox_activity_types():
+            increment_response_counts(recipients, new_count=1)
+        elif self.activity_type in MODERATION_ACTIVITY_TYPES:
+            invalidate_moderation_items_version()
 
     def get_mentioned_user(self):
         assert(self.activity_type == const.TYPE_ACTIVITY_MENTION)
@@ -0,0 +1,385 @@
+"""Directory of the users, used by the users page
+
+For each listing of the users - by reputation, the newest,
+the oldest and by the username, of all users or of the members
+of a group - ids of the users in the order of the listing are
+kept in the cache, in chunks of a limited size
+(:class:`~askbot.utils.chunked_list.ChunkedList`). A page of the
+listing is then read from the chunks with the users on that page,
+without counting and skipping all users listed before it.
+
+The lists are updated in place when the reputation of a user
+changes, when users are created and when they join or leave
+the groups, only the chunks with the moved user are rewritten.
+Other changes - blocking, renaming and deleting the users -
+drop all the lists, which are then rebuilt on the next request.
+
+Users are searched by the prefix of the username in the
+sorted index of the lowercased usernames, kept in chunks too.
+The index is shared with the user name autocompleter
+(setting ``ASKBOT_USE_AUTOCOMPLETE_INDEX``) and is
+dropped when a user is renamed or deleted.
+
+The directory is enabled with the setting
+``ASKBOT_USE_USER_DIRECTORY = True``.
+"""
+from django.conf import settings as django_settings
+from django.contrib.auth.models import User
+from django.core import cache
+from django.db.models import Q
+from django.utils.encoding import force_unicode
+from askbot.conf import settings as askbot_settings
+from askbot.models.user import GroupMembership
+from askbot.utils.cache import get_cache_version, invalidate_cache_version
+from askbot.utils.chunked_list import ChunkedList
+
+VERSION_KEY = 'user-directory-version'
+NAMES_VERSION_KEY = 'user-directory-names-version'
+#the lists are rebuilt at least once a day, in case they drift
+LIST_TIMEOUT = 24 * 60 * 60
+
+#sort method of the users page -> ordering of the users
+ORDER_BY = {
+    'reputation': ('-reputation', 'id'),
+    'newest': ('-date_joined', '-id'),
+    'last': ('date_joined', 'id'),
+    'user': ('username',),
+}
+
+
+def is_enabled():
+    return getattr(django_settings, 'ASKBOT_USE_USER_DIRECTORY', False)
+
+
+def is_username_index_enabled():
+    """the index of the usernames is used by the directory
+    and by the user name autocompleter"""
+    return is_enabled() or \
+        getattr(django_settings, 'ASKBOT_USE_AUTOCOMPLETE_INDEX', False)
+
+
+def invalidate():
+    """drops all lists and the index of the usernames"""
+    invalidate_cache_version(VERSION_KEY)
+    invalidate_username_index()
+
+
+def invalidate_username_index():
+    invalidate_cache_version(NAMES_VERSION_KEY)
+
+
+def get_list_key(sort_method, group_id):
+    return 'user-directory-%s-%s-%s' % (
+                                get_cache_version(VERSION_KEY),
+                                sort_method,
+                                group_id or 'all'
+                            )
+
+
+def get_username_index_key():
+    return 'user-directory-names-%s' % get_cache_version(NAMES_VERSION_KEY)
+
+
+def get_group_ids_key(user_id):
+    return 'user-directory-%s-groups-%d' % (
+                                get_cache_version(VERSION_KEY),
+                                user_id
+                            )
+
+
+def get_listed_users(group_id=None):
+    """returns query set of the users listed in the directory -
+    not blocked users, optionally only the full members of the group"""
+    users = User.objects.exclude(status='b')
+    if group_id:
+        memberships = GroupMembership.objects.filter(
+                                        group__id=group_id,
+                                        level=GroupMembership.FULL
+                                    )
+        users = users.filter(id__in=memberships.values('user__id'))
+    return users
+
+
+def get_entry(sort_method, user_id, reputation=None):
+    """entries of the list by reputation are tuples
+    (negated reputation, user id), sorted as the listing,
+    entries of the other lists are the user ids"""
+    if sort_method == 'reputation':
+        return (-reputation, user_id)
+    return user_id
+
+
+def build_entries(sort_method, group_id=None):
+    users = get_listed_users(group_id).order_by(*ORDER_BY[sort_method])
+    if sort_method == 'reputation':
+        return [
+            get_entry(sort_method, user_id, reputation) \
+            for user_id, reputation in users.values_list('id', 'reputation')
+        ]
+    return list(users.values_list('id', flat=True))
+
+
+def build_list(sort_method, group_id=None):
+    """returns ids of the users in the order
+    of the listing, read from the database"""
+    return UserList(sort_method, build_entries(sort_method, group_id))
+
+
+def get_chunked_list(sort_method, group_id=None):
+    return ChunkedList(
+                get_list_key(sort_method, group_id),
+                lambda: build_entries(sort_method, group_id),
+                LIST_TIMEOUT,
+                ordered=(sort_method == 'reputation')
+            )
+
+
+class UserList(object):
+    """ids of the users in the order of a listing,
+    read from the list of the entries of the listing.
+
+    Supports ``len()`` and slicing, so it can be paginated.
+    """
+    def __init__(self, sort_method, entries):
+        self.sort_method = sort_method
+        self.entries = entries
+
+    def get_ids(self, entries):
+        if self.sort_method == 'reputation':
+            return [user_id for reputation, user_id in entries]
+        return list(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.get_ids(self.entries))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if isinstance(self.entries, ChunkedList):
+                entries = self.entries.get_slice(start, stop)
+            else:
+                entries = self.entries[start:stop]
+            return self.get_ids(entries)[::step]
+        if index < 0:
+            index += len(self)
+        return self[index:index + 1][0]
+
+
+def get_user_list(sort_method, group_id=None):
+    """returns :class:`UserList` of the listing, the cached
+    list is built from the database if it is not cached"""
+    return UserList(sort_method, get_chunked_list(sort_method, group_id))
+
+
+def get_position(sort_method, group_id, user):
+    """returns position of the user in the listing,
+    except the listing by reputation, counted in the database"""
+    if sort_method == 'newest':
+        condition = Q(date_joined__gt=user.date_joined) \
+                    | Q(date_joined=user.date_joined, id__gt=user.id)
+    elif sort_method == 'last':
+        condition = Q(date_joined__lt=user.date_joined) \
+                    | Q(date_joined=user.date_joined, id__lt=user.id)
+    elif sort_method == 'user':
+        condition = Q(username__lt=user.username)
+    else:
+        raise ValueError('unknown sort method %s' % sort_method)
+    users = get_listed_users(group_id).exclude(id=user.id)
+    return users.filter(condition).count()
+
+
+def get_entry_matcher(sort_method, user_id):
+    """returns function, which is ``True`` for the entry
+    of the user in the listing"""
+    if sort_method == 'reputation':
+        return lambda entry: entry[1] == user_id
+    return lambda entry: entry == user_id
+
+
+def add_user_to_lists(user, group_id=None, is_new=False):
+    """inserts user into the listings of all users,
+    or of the group members, if ``group_id`` is given"""
+    for sort_method in ORDER_BY:
+        user_list = get_chunked_list(sort_method, group_id)
+        entry = get_entry(sort_method, user.id, user.reputation)
+        if sort_method == 'reputation':
+            position = None
+        elif is_new and sort_method == 'newest':
+            position = 0
+        elif is_new and sort_method == 'last':
+            #at the end
+            position = None
+        else:
+            position = get_position(sort_method, group_id, user)
+
+        if is_new:
+            user_list.insert(entry, position)
+        else:
+            #the user may be listed already
+            user_list.replace(
+                    entry,
+                    entry,
+                    match=get_entry_matcher(sort_method, user.id),
+                    position=position
+                )
+
+
+def remove_user_from_lists(user_id, group_id):
+    for sort_method in ORDER_BY:
+        user_list = get_chunked_list(sort_method, group_id)
+        if sort_method == 'reputation':
+            user_list.remove_matching(get_entry_matcher(sort_method, user_id))
+        else:
+            user_list.remove(user_id)
+
+
+def get_group_ids(user):
+    """ids of the groups, in which the user is a full member,
+    kept in the cache until the memberships of the user change"""
+    if askbot_settings.GROUPS_ENABLED == False:
+        return list()
+    key = get_group_ids_key(user.id)
+    group_ids = cache.cache.get(key)
+    if group_ids is None:
+        memberships = GroupMembership.objects.filter(
+                                        user=user,
+                                        level=GroupMembership.FULL
+                                    )
+        group_ids = list(memberships.values_list('group__id', flat=True))
+        cache.cache.set(key, group_ids, LIST_TIMEOUT)
+    return group_ids
+
+
+def update_reputation(user, old_reputation=None):
+    """moves the user in the listings by reputation,
+    only the chunks with the old and the new position
+    are rewritten, if the old reputation is known"""
+    old_entry = None
+    if old_reputation is not None:
+        old_entry = get_entry('reputation', user.id, old_reputation)
+    new_entry = get_entry('reputation', user.id, user.reputation)
+    for group_id in [None] + get_group_ids(user):
+        get_chunked_list('reputation', group_id).replace(
+                    old_entry,
+                    new_entry,
+                    match=get_entry_matcher('reputation', user.id)
+                )
+
+
+def get_username_entries():
+    users = User.objects.values_list('username', 'id')
+    return [
+        (username.lower(), username, user_id) \
+        for username, user_id in users if username
+    ]
+
+
+def get_username_index():
+    """sorted list of tuples (lowercased username, username, user id)"""
+    return ChunkedList(
+                get_username_index_key(),
+                get_username_entries,
+                LIST_TIMEOUT
+            )
+
+
+def add_username_to_index(user):
+    if user.username:
+        entry = (user.username.lower(), user.username, user.id)
+        get_username_index().insert(entry)
+
+
+def get_usernames_by_prefix(prefix, limit=None):
+    """returns list of tuples (username, user id) of the users,
+    whose usernames start with the prefix, in any case,
+    ordered by the lowercased username"""
+    prefix = force_unicode(prefix).strip().lower()
+    if prefix == '':
+        return list()
+    entries = get_username_index().get_range((prefix,), (prefix + u'\uffff',))
+    return [(username, user_id) for lower, username, user_id in entries[:limit]]
+
+
+def get_user_ids_by_username_prefix(prefix):
+    """returns set of ids of the users whose
+    usernames start with the prefix, in any case"""
+    return set([user_id for username, user_id in get_usernames_by_prefix(prefix)])
+
+
+def search(query, group_id=None):
+    """returns list of ids of the listed users whose usernames
+    start with the query, ordered by the reputation"""
+    matching_ids = get_user_ids_by_username_prefix(query)
+    if len(matching_ids) == 0:
+        return list()
+    users = get_listed_users(group_id).filter(id__in=matching_ids)
+    users = users.order_by(*ORDER_BY['reputation'])
+    return list(users.values_list('id', flat=True))
+
+
+def get_users(user_ids):
+    """returns users with the ids, in the same order"""
+    user_ids = list(user_ids)
+    users = User.objects.in_bulk(user_ids)
+    return [users[user_id] for user_id in user_ids if user_id in users]
+
+
+def get_user_state(user):
+    """values of the user, on which the listings depend"""
+    return (user.status == 'b', user.username, user.reputation)
+
+
+def record_user_init(sender, instance, **kwargs):
+    """remembers the values of the listed fields,
+    to find what has changed when the user is saved"""
+    instance._directory_state = get_user_state(instance)
+
+
+def record_user_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    state = get_user_state(instance)
+    old_state = getattr(instance, '_directory_state', None)
+    instance._directory_state = state
+
+    if is_username_index_enabled():
+        if created:
+            add_username_to_index(instance)
+        elif old_state is None or state[1] != old_state[1]:
+            invalidate_username_index()
+
+    if not is_enabled():
+        return
+    if created:
+        if state[0] == False:
+            add_user_to_lists(instance, is_new=True)
+    elif old_state is None or state[:2] != old_state[:2]:
+        invalidate_cache_version(VERSION_KEY)
+    elif state[2] != old_state[2] and state[0] == False:
+        update_reputation(instance, old_state[2])
+
+
+def record_user_delete(sender, instance, **kwargs):
+    if is_enabled():
+        invalidate()
+    elif is_username_index_enabled():
+        invalidate_username_index()
+
+
+def record_membership_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw or not is_enabled():
+        return
+    cache.cache.delete(get_group_ids_key(instance.user_id))
+    if instance.level == GroupMembership.FULL and instance.user.status != 'b':
+        add_user_to_lists(instance.user, group_id=instance.group_id)
+    else:
+        remove_user_from_lists(instance.user_id, instance.group_id)
+
+
+def record_membership_delete(sender, instance, **kwargs):
+    if is_enabled():
+        cache.cache.delete(get_group_ids_key(instance.user_id))
+        remove_user_from_lists(instance.user_id, instance.group_id)
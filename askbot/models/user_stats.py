@@ -0,0 +1,187 @@
+"""Summary of the activity of the user, shown on the
+"stats" tab of the user profile
+
+The summary - counts of the votes given by the user and
+the awards with the awarded posts - is cached until the user votes,
+receives or loses an award, or the posts of the user change.
+
+Counts of the tags of the threads, in which the user has posted,
+are cached separately and are incremented in place when the user
+posts, so that the table of the top tags is not rebuilt
+after the votes and the awards. Counts of the user tags are dropped
+when the posts of the user are deleted or their threads retagged.
+"""
+import datetime
+from django.contrib.contenttypes.models import ContentType
+from django.core import cache
+from django.db.models import Count
+from askbot import const
+from askbot.models.post import Post
+from askbot.models.repute import Award, Vote
+from askbot.models.tag import Tag
+
+
+def get_summary_key(user_id):
+    return 'user-stats-%d' % user_id
+
+
+def get_tag_counts_key(user_id):
+    return 'user-tag-counts-%d' % user_id
+
+
+def count_votes_today(user_id):
+    today = datetime.date.today()
+    votes = Vote.objects.filter(
+                    user__id=user_id,
+                    voted_at__range=(today, today + datetime.timedelta(1))
+                )
+    return votes.count()
+
+
+class UserStatsSummary(object):
+    """counts of the votes and the awards of the user,
+    awards have the awarded posts in the ``content_object``"""
+
+    def __init__(self, user):
+        self.user_id = user.id
+
+        vote_counts = Vote.objects.filter(
+                                user=user
+                            ).values_list(
+                                'vote'
+                            ).annotate(
+                                count=Count('id')
+                            )
+        vote_counts = dict(vote_counts)
+        self.up_votes = vote_counts.get(Vote.VOTE_UP, 0)
+        self.down_votes = vote_counts.get(Vote.VOTE_DOWN, 0)
+        self.counted_on = datetime.date.today()
+        self.votes_today = count_votes_today(user.id)
+
+        self.awards = list(
+                    Award.objects.filter(user=user).select_related('badge')
+                )
+        post_type = ContentType.objects.get_for_model(Post)
+        awarded_post_ids = [
+            award.object_id for award in self.awards \
+                if award.content_type_id == post_type.id
+        ]
+        # select related to avoid additional queries in Post.get_absolute_url()
+        awarded_posts = Post.objects.filter(
+                                    id__in=awarded_post_ids
+                                ).select_related('thread')
+        awarded_posts = dict([(post.id, post) for post in awarded_posts])
+
+        for award in self.awards:
+            awarded_post = None
+            if award.content_type_id == post_type.id:
+                #here we go around a possibility of awards
+                #losing the content objects when the content
+                #objects are deleted for some reason
+                awarded_post = awarded_posts.get(award.object_id, None)
+            if awarded_post is not None:
+                award.content_object = awarded_post
+                award.content_object_is_post = True
+            else:
+                award.content_object_is_post = False
+
+    def get_votes_today(self):
+        """the count of the votes today is recounted
+        when the cached summary is read on the next day"""
+        today = datetime.date.today()
+        if self.counted_on != today:
+            self.counted_on = today
+            self.votes_today = count_votes_today(self.user_id)
+        return self.votes_today
+
+
+def get_summary(user):
+    """returns :class:`UserStatsSummary` of the user, cached"""
+    key = get_summary_key(user.id)
+    summary = cache.cache.get(key)
+    if summary is None:
+        summary = UserStatsSummary(user)
+        cache.cache.set(key, summary, const.LONG_TIME)
+    elif summary.counted_on != datetime.date.today():
+        summary.get_votes_today()
+        cache.cache.set(key, summary, const.LONG_TIME)
+    return summary
+
+
+def get_tag_counts(user):
+    """returns dictionary of the numbers of the posts of the user
+    by the names of the tags of their threads, cached"""
+    key = get_tag_counts_key(user.id)
+    tag_counts = cache.cache.get(key)
+    if tag_counts is None:
+        rows = Post.objects.filter(
+                            author=user
+                        ).values_list(
+                            'thread__tags__name'
+                        ).annotate(
+                            count=Count('id')
+                        )
+        tag_counts = dict([row for row in rows if row[0] is not None])
+        cache.cache.set(key, tag_counts, const.LONG_TIME)
+    return tag_counts
+
+
+def get_top_tags(user, limit=const.USER_VIEW_DATA_SIZE):
+    """returns list of the tags used most in the posts
+    of the user, with the counts in ``user_tag_usage_count``"""
+    tag_counts = get_tag_counts(user)
+    tag_names = tag_counts.keys()
+    tag_names.sort(key=lambda name: (-tag_counts[name], name))
+    tag_names = tag_names[:limit]
+
+    tags = dict([(tag.name, tag) for tag in Tag.objects.filter(name__in=tag_names)])
+    top_tags = list()
+    for name in tag_names:
+        if name in tags:
+            tag = tags[name]
+            tag.user_tag_usage_count = tag_counts[name]
+            top_tags.append(tag)
+    return top_tags
+
+
+def invalidate_summary(user_id):
+    cache.cache.delete(get_summary_key(user_id))
+
+
+def record_vote_change(sender, instance, **kwargs):
+    invalidate_summary(instance.user_id)
+
+
+def record_award_change(sender, instance, **kwargs):
+    invalidate_summary(instance.user_id)
+
+
+def record_post_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    invalidate_summary(instance.author_id)
+    if created and instance.thread_id:
+        #count the new post in the cached counts of the tags
+        key = get_tag_counts_key(instance.author_id)
+        tag_counts = cache.cache.get(key)
+        if tag_counts is not None:
+            for tag_name in instance.thread.get_tag_names():
+                tag_counts[tag_name] = tag_counts.get(tag_name, 0) + 1
+            cache.cache.set(key, tag_counts, const.LONG_TIME)
+
+
+def record_post_delete(sender, instance, **kwargs):
+    invalidate_summary(instance.author_id)
+    cache.cache.delete(get_tag_counts_key(instance.author_id))
+
+
+def record_thread_retag(sender, thread=None, **kwargs):
+    """drops the counts of the tags of the users
+    who have posted in the retagged thread"""
+    author_ids = Post.objects.filter(
+                            thread=thread
+                        ).values_list(
+                            'author__id', flat=True
+                        ).distinct()
+    keys = [get_tag_counts_key(author_id) for author_id in author_ids]
+    cache.cache.delete_many(keys)
@@ -0,0 +1,261 @@
+"""Write-behind buffer for the question view counts
+and the "last seen" timestamps of the users.
+
+Without the buffer each question view runs an ``UPDATE``
+of the thread row and each page load by an authenticated user -
+an ``UPDATE`` of the user row. On busy sites these single row
+writes contend on the "hot" threads and users.
+
+With the setting ``ASKBOT_BUFFER_VISIT_COUNTS = True``
+the increments and timestamps are accumulated in memory
+of the process and are written to the database
+every ``ASKBOT_VISIT_BUFFER_FLUSH_INTERVAL`` seconds
+(default - 60), with one ``UPDATE ... CASE`` query per table
+per batch of rows.
+
+The buffer is flushed by a background thread of the process,
+with its own database connection and transaction, so that
+the writes do not depend on the outcome of the requests.
+"""
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings as django_settings
+from django.core import cache
+from django.db import connection
+from django.db import transaction
+
+BATCH_SIZE = 500
+
+def is_enabled():
+    return getattr(django_settings, 'ASKBOT_BUFFER_VISIT_COUNTS', False)
+
+
+def get_flush_interval():
+    return getattr(django_settings, 'ASKBOT_VISIT_BUFFER_FLUSH_INTERVAL', 60)
+
+
+def get_update_case_sql(table, column, values, increment=False):
+    """returns sql and parameters of a query
+    updating ``column`` in many rows of a ``table``
+    with one statement
+
+    ``values`` is a dictionary: row id -> new value
+    if ``increment`` is True, values are added to the
+    current values of the column
+    """
+    quote = connection.ops.quote_name
+    row_ids = values.keys()
+    cases = ' '.join(['WHEN %s THEN %s'] * len(row_ids))
+    params = list()
+    for row_id in row_ids:
+        params.extend((row_id, values[row_id]))
+    params.extend(row_ids)
+
+    if increment:
+        new_value = '%s + CASE %s %s END' % (quote(column), quote('id'), cases)
+    else:
+        new_value = 'CASE %s %s END' % (quote('id'), cases)
+
+    sql = 'UPDATE %s SET %s = %s WHERE %s IN (%s)' % (
+                    quote(table),
+                    quote(column),
+                    new_value,
+                    quote('id'),
+                    ', '.join(['%s'] * len(row_ids))
+                )
+    return sql, params
+
+
+class VisitBuffer(object):
+    """accumulates view counts of threads and
+    last seen times of the users in memory
+    and writes them to the database in bulk
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.view_counts = dict()
+        self.last_seen = dict()
+        #the flushing thread and the process it was started in
+        self.flush_thread = None
+        self.flush_thread_pid = None
+        #flush metrics
+        self.stats = {
+            'flush_count': 0,
+            'flushed_view_counts': 0,
+            'flushed_threads': 0,
+            'flushed_users': 0,
+            'last_flush_at': None,
+            'last_flush_duration': None,
+            'total_flush_duration': 0.0,
+        }
+
+    def add_thread_view(self, thread_id, increment=1):
+        """records question view, returns the number
+        of views of the thread pending in the buffer"""
+        self.lock.acquire()
+        try:
+            pending = self.view_counts.get(thread_id, 0) + increment
+            self.view_counts[thread_id] = pending
+        finally:
+            self.lock.release()
+        self.maybe_flush()
+        return pending
+
+    def get_pending_views(self, thread_id):
+        return self.view_counts.get(thread_id, 0)
+
+    def add_user_visit(self, user_id, timestamp):
+        self.lock.acquire()
+        try:
+            prev_timestamp = self.last_seen.get(user_id)
+            if prev_timestamp is None or prev_timestamp < timestamp:
+                self.last_seen[user_id] = timestamp
+        finally:
+            self.lock.release()
+        self.maybe_flush()
+
+    def get_last_seen(self, user_id):
+        """returns last seen timestamp pending in the buffer"""
+        return self.last_seen.get(user_id)
+
+    def maybe_flush(self):
+        """starts the thread flushing the buffer, if it is
+        not running in this process yet"""
+        if self.flush_thread_pid == os.getpid():
+            return
+        self.lock.acquire()
+        try:
+            if self.flush_thread_pid != os.getpid():
+                self.flush_thread = threading.Thread(
+                                        target=self.run_flushes,
+                                        name='visit-buffer-flush'
+                                    )
+                self.flush_thread.daemon = True
+                self.flush_thread.start()
+                self.flush_thread_pid = os.getpid()
+        finally:
+            self.lock.release()
+
+    def run_flushes(self):
+        """flushes the buffer periodically, the connection
+        of this thread is closed between the flushes"""
+        while True:
+            time.sleep(get_flush_interval())
+            try:
+                self.flush()
+            finally:
+                connection.close()
+
+    def get_stats(self):
+        """returns a copy of the flush metrics
+        and the number of the pending updates"""
+        self.lock.acquire()
+        try:
+            stats = dict(self.stats)
+            stats['pending_threads'] = len(self.view_counts)
+            stats['pending_users'] = len(self.last_seen)
+        finally:
+            self.lock.release()
+        return stats
+
+    def restore(self, view_counts, last_seen):
+        """puts back the data, which could not be written,
+        merging it with the data buffered in the meantime"""
+        self.lock.acquire()
+        try:
+            for thread_id, count in view_counts.items():
+                self.view_counts[thread_id] = \
+                            self.view_counts.get(thread_id, 0) + count
+            for user_id, timestamp in last_seen.items():
+                prev_timestamp = self.last_seen.get(user_id)
+                if prev_timestamp is None or prev_timestamp < timestamp:
+                    self.last_seen[user_id] = timestamp
+        finally:
+            self.lock.release()
+
+    def flush(self):
+        """writes the buffered data to the database in a
+        separate transaction, returns ``False`` if the write fails,
+        then the data is kept in the buffer"""
+        self.lock.acquire()
+        try:
+            view_counts = self.view_counts
+            last_seen = self.last_seen
+            self.view_counts = dict()
+            self.last_seen = dict()
+        finally:
+            self.lock.release()
+
+        if not (view_counts or last_seen):
+            return True
+
+        start_time = time.time()
+        try:
+            with transaction.commit_on_success():
+                self.write(view_counts, last_seen)
+        except Exception, error:
+            logging.critical('could not flush visit buffer: %s' % error)
+            self.restore(view_counts, last_seen)
+            return False
+
+        #summaries display the view counts
+        from askbot.models import Thread
+        cache.cache.delete_many([
+            Thread.SUMMARY_CACHE_KEY_TPL % thread_id for thread_id in view_counts
+        ])
+
+        duration = time.time() - start_time
+        self.lock.acquire()
+        try:
+            self.stats['flush_count'] += 1
+            self.stats['flushed_view_counts'] += sum(view_counts.values())
+            self.stats['flushed_threads'] += len(view_counts)
+            self.stats['flushed_users'] += len(last_seen)
+            self.stats['last_flush_at'] = datetime.datetime.now()
+            self.stats['last_flush_duration'] = duration
+            self.stats['total_flush_duration'] += duration
+        finally:
+            self.lock.release()
+        logging.debug(
+            'flushed visit buffer: %d threads, %d users in %.3fs' % \
+            (len(view_counts), len(last_seen), duration)
+        )
+        return True
+
+    def write(self, view_counts, last_seen):
+        """updates the view counts of the threads and
+        the last seen times of the users in batches"""
+        from askbot.models import Thread, User
+        cursor = connection.cursor()
+
+        thread_ids = view_counts.keys()
+        for start in range(0, len(thread_ids), BATCH_SIZE):
+            batch = dict(
+                (thread_id, view_counts[thread_id])
+                for thread_id in thread_ids[start:start + BATCH_SIZE]
+            )
+            sql, params = get_update_case_sql(
+                Thread._meta.db_table, 'view_count', batch, increment=True
+            )
+            cursor.execute(sql, params)
+
+        user_ids = last_seen.keys()
+        for start in range(0, len(user_ids), BATCH_SIZE):
+            batch = dict(
+                (user_id, last_seen[user_id])
+                for user_id in user_ids[start:start + BATCH_SIZE]
+            )
+            sql, params = get_update_case_sql(
+                User._meta.db_table, 'last_seen', batch
+            )
+            cursor.execute(sql, params)
+
+
+visit_buffer = VisitBuffer()
+
+atexit.register(visit_buffer.flush)
@@ -0,0 +1,148 @@
+"""Full text search backends
+
+A backend runs text search for the threads, for the thread titles
+and for the users, each method takes a query set and a search query
+and returns the query set narrowed to the matches. Backends which
+support relevance ranking add a ``relevance`` column to the
+returned query set, the ``relevance-desc`` sorting of the questions
+uses it.
+
+The backend is selected with the setting ``ASKBOT_SEARCH_BACKEND`` -
+dotted python path to the backend class, for example::
+
+    ASKBOT_SEARCH_BACKEND = 'askbot.search.local.LocalSearchBackend'
+
+If the setting is not given, the backend is chosen
+by the database engine and the haystack settings.
+"""
+from django.conf import settings as django_settings
+from django.db import models
+from django.utils.importlib import import_module
+import askbot
+from askbot.search import mysql
+
+BACKENDS = dict()
+
+class SearchBackend(object):
+    """base class of the search backends"""
+    supports_relevance = False
+
+    def search_threads(self, query_set, query):
+        """returns threads matching the query
+        in the titles, tags or the posts"""
+        raise NotImplementedError()
+
+    def search_thread_titles(self, query_set, query):
+        """returns threads matching the query in the titles"""
+        raise NotImplementedError()
+
+    def search_users(self, query_set, query):
+        """returns users matching the query
+        in the user names and profiles"""
+        raise NotImplementedError()
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """substring search, works with any database,
+    but scans the tables"""
+
+    def search_threads(self, query_set, query):
+        return query_set.filter(
+            models.Q(title__icontains=query) |
+            models.Q(tagnames__icontains=query) |
+            models.Q(posts__deleted=False, posts__text__icontains=query)
+        )
+
+    def search_thread_titles(self, query_set, query):
+        return query_set.filter(title__icontains=query)
+
+    def search_users(self, query_set, query):
+        return query_set.filter(
+            models.Q(username__icontains=query) |
+            models.Q(about__icontains=query)
+        )
+
+
+class MysqlSearchBackend(DatabaseSearchBackend):
+    """uses full text indexes of the MyISAM tables"""
+
+    def search_threads(self, query_set, query):
+        return query_set.filter(
+            models.Q(title__search=query) |
+            models.Q(tagnames__search=query) |
+            models.Q(posts__deleted=False, posts__text__search=query)
+        )
+
+    def search_thread_titles(self, query_set, query):
+        return query_set.filter(title__search=query)
+
+
+class PostgresqlSearchBackend(SearchBackend):
+    """uses text search vectors installed by the
+    ``init_postgresql_full_text_search`` command and
+    refreshed by the ``update_postgres_search_vectors`` command"""
+    supports_relevance = True
+
+    def search_threads(self, query_set, query):
+        from askbot.search import postgresql
+        return postgresql.run_thread_search(query_set, query)
+
+    def search_thread_titles(self, query_set, query):
+        from askbot.search import postgresql
+        return postgresql.run_title_search(query_set, query)
+
+    def search_users(self, query_set, query):
+        from askbot.search import postgresql
+        return postgresql.run_user_search(query_set, query)
+
+
+class HaystackSearchBackend(SearchBackend):
+    """searches threads and users in the haystack index,
+    the query set passed to the search is not used,
+    titles are searched in the database"""
+
+    def search_threads(self, query_set, query):
+        from askbot.search.haystack import AskbotSearchQuerySet
+        hs_qs = AskbotSearchQuerySet().filter(content=query)
+        return hs_qs.get_django_queryset()
+
+    def search_thread_titles(self, query_set, query):
+        return get_database_backend().search_thread_titles(query_set, query)
+
+    def search_users(self, query_set, query):
+        from askbot.models import User
+        from askbot.search.haystack import AskbotSearchQuerySet
+        hs_qs = AskbotSearchQuerySet().filter(content=query).models(User)
+        return hs_qs.get_django_queryset(User)
+
+
+def get_backend_by_path(path):
+    backend = BACKENDS.get(path)
+    if backend is None:
+        module_path, class_name = path.rsplit('.', 1)
+        backend = getattr(import_module(module_path), class_name)()
+        BACKENDS[path] = backend
+    return backend
+
+
+def get_database_backend():
+    """returns the backend using the full text search
+    of the database, if available"""
+    db_engine_name = askbot.get_database_engine_name()
+    if 'postgresql_psycopg2' in db_engine_name:
+        path = 'askbot.search.backends.PostgresqlSearchBackend'
+    elif db_engine_name.endswith('mysql') and mysql.supports_full_text_search():
+        path = 'askbot.search.backends.MysqlSearchBackend'
+    else:
+        path = 'askbot.search.backends.DatabaseSearchBackend'
+    return get_backend_by_path(path)
+
+
+def get_backend():
+    """returns the configured search backend"""
+    path = getattr(django_settings, 'ASKBOT_SEARCH_BACKEND', None)
+    if path:
+        return get_backend_by_path(path)
+    if getattr(django_settings, 'ENABLE_HAYSTACK_SEARCH', False):
+        return get_backend_by_path('askbot.search.backends.HaystackSearchBackend')
+    return get_database_backend()
@@ -0,0 +1,191 @@
+"""Keyset (a.k.a. "seek") pagination for the thread listings
+
+Instead of counting all matching threads and skipping to
+the requested page with ``OFFSET``, the listing is continued
+from the last (or the first) thread seen on the previous page.
+Position in the listing is encoded as a "cursor" - a string like
+``next_<sort key value>_<thread id>`` (or ``prev_...``), which
+is stored in the search state url.
+
+The cost of fetching a page then does not depend on the page number.
+"""
+import datetime
+
+from django.core import cache
+from django.db import models
+from django.utils.hashcompat import md5_constructor
+from django.utils.translation import get_language
+
+from askbot import const
+
+#sort method -> (Thread field name, descending)
+#relevance ordering is calculated on the fly and cannot be seeked
+SEEK_FIELDS = {
+    'age-desc': ('added_at', True),
+    'age-asc': ('added_at', False),
+    'activity-desc': ('last_activity_at', True),
+    'activity-asc': ('last_activity_at', False),
+    'answers-desc': ('answer_count', True),
+    'answers-asc': ('answer_count', False),
+    'votes-desc': ('points', True),
+    'votes-asc': ('points', False),
+}
+
+DATETIME_KEY_FORMAT = '%Y%m%d%H%M%S'
+
+def supports_sort_method(sort_method):
+    """True if listings ordered by ``sort_method``
+    can be paginated with the cursor"""
+    return sort_method in SEEK_FIELDS
+
+
+def encode_key(value):
+    """returns url-safe string representation of the sort key value"""
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATETIME_KEY_FORMAT) + '%06d' % value.microsecond
+    return str(int(value))
+
+
+def decode_key(value, field_name):
+    """reverse of the :func:`encode_key`"""
+    if field_name in ('added_at', 'last_activity_at'):
+        timestamp = datetime.datetime.strptime(value[:14], DATETIME_KEY_FORMAT)
+        return timestamp.replace(microsecond=int(value[14:] or 0))
+    return int(value)
+
+
+def get_cursor(direction, sort_method, thread):
+    """returns cursor string pointing past the ``thread``,
+    ``direction`` is either 'next' or 'prev'
+    """
+    field_name = SEEK_FIELDS[sort_method][0]
+    key = encode_key(getattr(thread, field_name))
+    return '%s_%s_%d' % (direction, key, thread.id)
+
+
+def parse_cursor(cursor, sort_method):
+    """returns tuple (direction, sort key value, thread id)
+    or ``None`` if the cursor is not valid for the sort method
+    """
+    if not cursor or not supports_sort_method(sort_method):
+        return None
+    try:
+        direction, key, thread_id = cursor.split('_')
+        field_name = SEEK_FIELDS[sort_method][0]
+        return direction, decode_key(key, field_name), int(thread_id)
+    except ValueError:
+        return None
+
+
+def seek(query_set, sort_method, cursor):
+    """returns query set filtered to start right after
+    the position marked by cursor and ordered by the
+    sort key, with thread id as a tie-breaker.
+
+    For the 'prev' direction the ordering is reversed,
+    so that the nearest preceding threads come first.
+    """
+    direction, key, thread_id = cursor
+    field_name, descending = SEEK_FIELDS[sort_method]
+    if direction == 'prev':
+        descending = not descending
+
+    if descending:
+        lookup = 'lt'
+        order_by = ['-' + field_name, '-id']
+    else:
+        lookup = 'gt'
+        order_by = [field_name, 'id']
+
+    seek_filter = models.Q(**{field_name + '__' + lookup: key})
+    seek_filter |= models.Q(**{field_name: key, 'id__' + lookup: thread_id})
+    return query_set.filter(seek_filter).extra(order_by=order_by)
+
+
+def get_cached_count(query_set, search_state, user):
+    """returns number of threads in the listing,
+    the value is cached for a short time, because
+    on large sites ``COUNT(DISTINCT ...)`` over the
+    listing query is expensive, while the exact number
+    is not important
+    """
+    if user.is_authenticated():
+        user_key = str(user.id)
+    else:
+        user_key = 'anon'
+    #first page url without the cursor identifies the listing
+    listing_key = search_state.change_page(1).query_string()
+    key_seed = '%s-%s-%s' % (user_key, get_language(), listing_key)
+    key = 'thread-listing-count-' + md5_constructor(
+                                        key_seed.encode('utf-8')
+                                    ).hexdigest()
+    count = cache.cache.get(key)
+    if count is None:
+        count = query_set.count()
+        cache.cache.set(key, count, const.THREAD_LISTING_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class KeysetPage(object):
+    """a page of threads, retrieved by the cursor,
+    duck-types :class:`django.core.paginator.Page`
+    so that it can be used in the paginator templates
+    """
+    def __init__(self, query_set, search_state, page_size):
+        sort_method = search_state.sort
+        cursor = parse_cursor(search_state.cursor, sort_method)
+        self.number = search_state.page
+
+        if cursor:
+            threads = list(seek(query_set, sort_method, cursor)[:page_size + 1])
+            has_more = len(threads) > page_size
+            threads = threads[:page_size]
+            if cursor[0] == 'prev':
+                threads.reverse()
+                self._has_next = True
+                #page number in the url may be stale
+                self._has_previous = has_more and self.number > 1
+            else:
+                self._has_next = has_more
+                self._has_previous = self.number > 1
+        else:
+            #no cursor - use offset, this is cheap for the first pages
+            #and allows jumping to arbitrary page from the page links
+            start = (self.number - 1) * page_size
+            threads = list(query_set[start:start + page_size + 1])
+            self._has_next = len(threads) > page_size
+            threads = threads[:page_size]
+            self._has_previous = self.number > 1
+
+        self.object_list = threads
+
+        if threads:
+            self.previous_cursor = get_cursor('prev', sort_method, threads[0])
+            self.next_cursor = get_cursor('next', sort_method, threads[-1])
+        else:
+            self.previous_cursor = None
+            self.next_cursor = None
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __repr__(self):
+        return '<Keyset page %s>' % self.number
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
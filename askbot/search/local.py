@@ -0,0 +1,149 @@
+"""Search backend running on the inverted index stored in the
+database (:mod:`askbot.models.search_index`), does not require
+any external service or database extensions.
+
+The words of the query are matched against the indexed terms,
+words of three and more characters - by the prefix. Threads
+and users matching any of the words are returned, with the
+``relevance`` - sum of the weights of the matched terms,
+multiplied by the inverse document frequency of the query words.
+
+To enable add to the ``settings.py``::
+
+    ASKBOT_SEARCH_BACKEND = 'askbot.search.local.LocalSearchBackend'
+
+and build the index with ``python manage.py rebuild_search_index``
+"""
+import math
+from django.core import cache
+from django.db import connection
+from askbot.models.search_index import SearchIndexEntry
+from askbot.models.search_index import get_terms, MAX_TERM_LENGTH
+from askbot.search.backends import SearchBackend
+
+MAX_QUERY_TERMS = 10
+MIN_PREFIX_LENGTH = 3
+#number of the documents changes slowly relative to the idf,
+#so it is counted once in this many seconds
+DOCUMENT_COUNT_TIMEOUT = 600
+
+def get_query_terms(query):
+    """returns list of unique terms of the query,
+    whole words like "c++" are included too, because
+    tag names are indexed as they are"""
+    terms = list()
+    for word in query.lower().split():
+        if len(word) <= MAX_TERM_LENGTH:
+            terms.append(word)
+        terms.extend(get_terms(word))
+    unique_terms = list()
+    for term in terms:
+        if term not in unique_terms:
+            unique_terms.append(term)
+    return unique_terms[:MAX_QUERY_TERMS]
+
+
+def get_term_condition(term):
+    """returns sql condition matching the term
+    and the parameters"""
+    if len(term) < MIN_PREFIX_LENGTH:
+        return 'term = %s', [term]
+    return '(term >= %s AND term < %s)', [term, term + u'\uffff']
+
+
+def get_document_count(model):
+    """returns the number of the objects of the model,
+    cached for the ``DOCUMENT_COUNT_TIMEOUT``"""
+    cache_key = 'local-search-documents-%s' % model._meta.db_table
+    count = cache.cache.get(cache_key)
+    if count is None:
+        count = model._default_manager.count()
+        cache.cache.set(cache_key, count, DOCUMENT_COUNT_TIMEOUT)
+    return count
+
+
+class LocalSearchBackend(SearchBackend):
+    supports_relevance = True
+    uses_search_index = True
+
+    def search_threads(self, query_set, query):
+        return self.run_search(query_set, query, ('thread', 'post'), 'thread_id')
+
+    def search_thread_titles(self, query_set, query):
+        return self.run_search(query_set, query, ('thread',), 'thread_id')
+
+    def search_users(self, query_set, query):
+        return self.run_search(query_set, query, ('user',), 'object_id')
+
+    def run_search(self, query_set, query, object_types, key_column):
+        """filters the query set by the ids of the objects
+        matching the query, ``key_column`` is the column of the
+        index with the id of the objects of the query set
+        """
+        terms = get_query_terms(query)
+        if len(terms) == 0:
+            return query_set.none()
+
+        quote = connection.ops.quote_name
+        index_table = quote(SearchIndexEntry._meta.db_table)
+        key_column = quote(key_column)
+        object_table = quote(query_set.model._meta.db_table)
+
+        type_condition = 'object_type IN (%s)' % ', '.join(['%s'] * len(object_types))
+        type_params = list(object_types)
+
+        term_conditions = list()
+        term_params = list()
+        for term in terms:
+            condition, params = get_term_condition(term)
+            term_conditions.append(condition)
+            term_params.append(params)
+
+        match_condition = ' OR '.join(term_conditions)
+        match_params = sum(term_params, [])
+
+        #inverse document frequencies of all terms, with one query
+        count_columns = list()
+        for condition in term_conditions:
+            count_columns.append(
+                'COUNT(DISTINCT CASE WHEN %s THEN %s END)' % (condition, key_column)
+            )
+        cursor = connection.cursor()
+        cursor.execute(
+            'SELECT %s FROM %s WHERE %s AND (%s)' % \
+            (', '.join(count_columns), index_table, type_condition, match_condition),
+            match_params + type_params + match_params
+        )
+        document_counts = cursor.fetchone()
+        total_count = get_document_count(query_set.model)
+        weight_cases = list()
+        weight_params = list()
+        for condition, params, document_count in \
+            zip(term_conditions, term_params, document_counts):
+            idf = math.log((total_count + 1.0) / (document_count + 0.5))
+            weight_cases.append('WHEN %s THEN %%s' % condition)
+            weight_params.extend(params + [max(idf, 0.01)])
+
+        relevance_sql = 'SELECT SUM(weight * CASE %s ELSE 0 END) ' \
+                        'FROM %s WHERE %s.%s = %s.id AND %s AND (%s)' % (
+                            ' '.join(weight_cases),
+                            index_table,
+                            index_table,
+                            key_column,
+                            object_table,
+                            type_condition,
+                            match_condition
+                        )
+        where_sql = '%s.id IN (SELECT %s FROM %s WHERE %s AND (%s))' % (
+                            object_table,
+                            key_column,
+                            index_table,
+                            type_condition,
+                            match_condition
+                        )
+        return query_set.extra(
+            select={'relevance': relevance_sql},
+            select_params=weight_params + type_params + match_params,
+            where=[where_sql],
+            params=type_params + match_params
+        )
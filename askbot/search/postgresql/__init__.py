@@ -1,4 +1,5 @@
 """Procedures to initialize the full text search in PostgresQL"""
+import re
 from django.db import connection
 from django.conf import settings as django_settings
 from django.utils.translation import get_language
@@ -15,7 +16,7 @@ LANGUAGE_NAMES = {
     'it': 'italian',
     'ja': 'japanese',
     'nb': 'norwegian',
-    'pt': 'portugese',
+    'pt': 'portuguese',
     'ro': 'romanian',
     'ru': 'russian',
     'es': 'spanish',
@@ -23,6 +24,9 @@ LANGUAGE_NAMES = {
     'tr': 'turkish'
 }
 
+#words, "quoted phrases" and their -negations
+WEBSEARCH_TOKEN_RE = re.compile(r'(-?)(?:"([^"]+)"?|([^\s"]+))')
+
 def setup_full_text_search(script_path):
     """using postgresql database connection,
     installs the plsql language, if necessary
@@ -42,27 +46,73 @@ def setup_full_text_search(script_path):
     finally:
         cursor.close()
 
-def run_full_text_search(query_set, query_text, text_search_vector_name):
+def quote_lexeme(text):
+    """quotes text for the ``to_tsquery``, so that
+    the characters of the query operators are not interpreted"""
+    return "'" + text.replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+def get_tsquery_text(query_text, prefix=False):
+    """converts search query written in the syntax of the web search
+    engines into the text of the ``to_tsquery()`` argument,
+    returns ``None`` if the query has no words.
+
+    All words must be matched, ``"quoted words"`` are matched as a phrase,
+    ``-word`` excludes the matches with the word and ``or`` between
+    the words matches either of them. If ``prefix`` is ``True``,
+    the last word is matched by the prefix - for the search as you type.
+    """
+    #list of the alternatives joined with "or", all are required
+    groups = list()
+    join_with_previous = False
+    is_prefix_candidate = False
+    for negation, phrase, word in WEBSEARCH_TOKEN_RE.findall(query_text):
+        if word.lower() == 'or' and negation == '':
+            join_with_previous = len(groups) > 0
+            continue
+        term = quote_lexeme(phrase or word)
+        is_prefix_candidate = bool(word) and negation == ''
+        if negation:
+            term = '!' + term
+        if join_with_previous:
+            groups[-1].append(term)
+        else:
+            groups.append([term])
+        join_with_previous = False
+
+    if len(groups) == 0:
+        return None
+
+    if prefix and is_prefix_candidate:
+        groups[-1][-1] += ':*'
+
+    terms = list()
+    for group in groups:
+        if len(group) == 1:
+            terms.append(group[0])
+        else:
+            terms.append('(' + ' | '.join(group) + ')')
+    return ' & '.join(terms)
+
+
+def run_full_text_search(
+    query_set, query_text, text_search_vector_name, prefix=False
+):
     """runs full text search against the query set and
-    the search text. All words in the query text are
-    added to the search with the & operator - i.e.
-    the more terms in search, the narrower it is.
+    the search text, see :func:`get_tsquery_text` for the
+    syntax of the query. Matches are ranked by the weights
+    of the parts of the text (title and tags weigh more
+    than the posts) in the ``relevance`` column.
+
+    With the setting ``ASKBOT_SEARCH_RANK_LIMIT = N`` only the
+    first N matches found by the index are ranked, which bounds
+    cost of the search for the frequent words on large sites.
 
     It is also assumed that we ar searching in the same
     table as the query set was built against, also
     it is assumed that the table has text search vector
     stored in the column called with value of`text_search_vector_name`.
     """
-    table_name = query_set.model._meta.db_table
- 
-    rank_clause = 'ts_rank(' + table_name + \
-                    '.' + text_search_vector_name + \
-                    ', plainto_tsquery(%s, %s))'
- 
-    where_clause = table_name + '.' + \
-                    text_search_vector_name + \
-                    ' @@ plainto_tsquery(%s, %s)'
-
     language_code = get_language()
 
     #a hack with japanese search for the short queries
@@ -70,23 +120,40 @@ def run_full_text_search(query_set, query_text, text_search_vector_name):
         mul = 4/len(query_text) #4 for 1 and 2 for 2
         query_text = (query_text + ' ')*mul
 
+    tsquery_text = get_tsquery_text(query_text, prefix=prefix)
+    if tsquery_text is None:
+        return query_set.none()
+
+    quote = connection.ops.quote_name
+    table_name = quote(query_set.model._meta.db_table)
+    vector = table_name + '.' + quote(text_search_vector_name)
+
+    language_name = LANGUAGE_NAMES.get(language_code, 'english')
+    query_params = [language_name, tsquery_text]
+    match_clause = vector + ' @@ to_tsquery(%s, %s)'
+    match_params = list(query_params)
+
     #the table name is a hack, because user does not have the language code
     is_multilingual = getattr(django_settings, 'ASKBOT_MULTILINGUAL', True)
-    if is_multilingual and table_name == 'askbot_thread':
-        where_clause += " AND " + table_name + \
-                        '.' + "language_code='" + language_code + "'"
+    if is_multilingual and table_name == quote('askbot_thread'):
+        match_clause += ' AND ' + table_name + '.language_code = %s'
+        match_params.append(language_code)
 
-    search_query = '|'.join(query_text.split())#apply "OR" operator
-    language_name = LANGUAGE_NAMES.get(language_code, 'english')
-    extra_params = (language_name, search_query,)
-    extra_kwargs = {
-        'select': {'relevance': rank_clause},
-        'where': [where_clause,],
-        'params': extra_params,
-        'select_params': extra_params,
-    }
+    rank_limit = getattr(django_settings, 'ASKBOT_SEARCH_RANK_LIMIT', None)
+    if rank_limit:
+        #the index finds the matches, only those are ranked
+        where_clause = table_name + '.id IN (SELECT id FROM ' + \
+                        table_name + ' WHERE ' + match_clause + ' LIMIT %s)'
+        match_params.append(rank_limit)
+    else:
+        where_clause = match_clause
 
-    return query_set.extra(**extra_kwargs)
+    return query_set.extra(
+        select={'relevance': 'ts_rank(' + vector + ', to_tsquery(%s, %s))'},
+        select_params=query_params,
+        where=[where_clause],
+        params=match_params
+    )
 
 def run_thread_search(query_set, query):
     """runs search for full thread content"""
@@ -95,5 +162,130 @@ def run_thread_search(query_set, query):
 run_user_search = run_thread_search #an alias
 
 def run_title_search(query_set, query):
-    """runs search for title and tags"""
-    return run_full_text_search(query_set, query, 'title_search_vector')
+    """runs search for title and tags,
+    the last word of the query is matched by the prefix"""
+    return run_full_text_search(
+                        query_set, query, 'title_search_vector', prefix=True
+                    )
+
+
+#weights of the posts in the text search vector of the thread,
+#title and tags of the thread have the weight 'A'
+POST_WEIGHTS = (('question', 'B'), ('answer', 'C'), ('comment', 'D'))
+
+#text search vector columns with the gin indexes
+SEARCH_VECTOR_COLUMNS = (
+    ('askbot_thread', 'text_search_vector', 'askbot_search_idx'),
+    ('askbot_thread', 'title_search_vector', 'askbot_title_search_idx'),
+    ('auth_user', 'text_search_vector', 'auth_user_search_idx'),
+)
+
+def create_search_vector_columns():
+    """adds the text search vector columns and
+    their gin indexes, if they do not exist"""
+    cursor = connection.cursor()
+    for table_name, column_name, index_name in SEARCH_VECTOR_COLUMNS:
+        cursor.execute(
+            'SELECT COUNT(*) FROM information_schema.columns '
+            'WHERE table_name = %s AND column_name = %s',
+            [table_name, column_name]
+        )
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(
+                'ALTER TABLE %s ADD COLUMN %s tsvector' % (table_name, column_name)
+            )
+        cursor.execute(
+            "SELECT COUNT(*) FROM pg_class WHERE relname = %s AND relkind = 'i'",
+            [index_name]
+        )
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(
+                'CREATE INDEX %s ON %s USING gin(%s)' % \
+                (index_name, table_name, column_name)
+            )
+
+
+def trigger_exists(trigger_name):
+    cursor = connection.cursor()
+    cursor.execute('SELECT COUNT(*) FROM pg_trigger WHERE tgname = %s', [trigger_name])
+    return cursor.fetchone()[0] > 0
+
+
+def get_weighted_vector_sql(column_sql, weight):
+    """sql of the weighted text search vector of the column,
+    takes name of the text search configuration as a parameter"""
+    return "setweight(to_tsvector(%%s::regconfig, coalesce(%s, '')), '%s')" % \
+                                                        (column_sql, weight)
+
+
+def update_thread_search_vectors(thread_ids, language_code):
+    """calculates text search vectors of the threads from
+    the titles, tags and the texts of the posts, all threads
+    must have the same language code.
+
+    The vectors built by the ``.plsql`` triggers grow with
+    each edit of the posts, updating them in batches restores
+    the vectors of the current contents of the threads.
+    """
+    if len(thread_ids) == 0:
+        return
+    language_name = LANGUAGE_NAMES.get(language_code, 'english')
+
+    title_parts = [
+        get_weighted_vector_sql('askbot_thread.title', 'A'),
+        get_weighted_vector_sql('askbot_thread.tagnames', 'A')
+    ]
+    title_sql = ' || '.join(title_parts)
+
+    text_parts = list()
+    #the update trigger of the thread appends the title vector itself
+    if not trigger_exists('thread_search_vector_update_trigger'):
+        text_parts.extend(title_parts)
+    for post_type, weight in POST_WEIGHTS:
+        posts_text_sql = "(SELECT string_agg(post.text, ' ') " + \
+                    'FROM askbot_post AS post ' + \
+                    'WHERE post.thread_id = askbot_thread.id ' + \
+                    "AND post.post_type = '%s' AND post.deleted = false)" % post_type
+        text_parts.append(get_weighted_vector_sql(posts_text_sql, weight))
+    text_sql = ' || '.join(text_parts)
+
+    cursor = connection.cursor()
+    cursor.execute(
+        'UPDATE askbot_thread SET title_search_vector = %s, '
+        'text_search_vector = %s WHERE id IN (%s)' % (
+                            title_sql,
+                            text_sql,
+                            ', '.join(['%s'] * len(thread_ids))
+                        ),
+        [language_name] * (len(title_parts) + len(text_parts)) + list(thread_ids)
+    )
+
+
+def update_user_search_vectors(user_ids):
+    """calculates text search vectors of the users from
+    the user names, group names and the profiles"""
+    if len(user_ids) == 0:
+        return
+    language_code = django_settings.LANGUAGE_CODE[:2]
+    language_name = LANGUAGE_NAMES.get(language_code, 'english')
+
+    group_names_sql = "(SELECT string_agg(user_group.name, ' ') " + \
+                    'FROM auth_group AS user_group ' + \
+                    'INNER JOIN auth_user_groups AS gm ' + \
+                    'ON gm.group_id = user_group.id ' + \
+                    'WHERE gm.user_id = auth_user.id)'
+    parts = [
+        get_weighted_vector_sql('auth_user.username', 'A'),
+        get_weighted_vector_sql('auth_user.real_name', 'A'),
+        get_weighted_vector_sql(group_names_sql, 'B'),
+        get_weighted_vector_sql('auth_user.email', 'C'),
+        get_weighted_vector_sql('auth_user.about', 'D'),
+    ]
+    cursor = connection.cursor()
+    cursor.execute(
+        'UPDATE auth_user SET text_search_vector = %s WHERE id IN (%s)' % (
+                            ' || '.join(parts),
+                            ', '.join(['%s'] * len(user_ids))
+                        ),
+        [language_name] * len(parts) + list(user_ids)
+    )
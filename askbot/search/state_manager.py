@@ -13,6 +13,8 @@ from askbot.conf import settings as askbot_settings
 from askbot import const
 from askbot.utils.functions import strip_plus
 
+CURSOR_RE = re.compile(r'^(next|prev)_-?\d+_\d+$')
+
 
 def extract_matching_token(text, regexes):
     """if text matches any of the regexes,
@@ -88,7 +90,10 @@ class SearchState(object):
     def get_empty(cls):
         return cls(scope=None, sort=None, query=None, tags=None, author=None, page=None, user_logged_in=None)
 
-    def __init__(self, scope, sort, query, tags, author, page, user_logged_in):
+    def __init__(
+        self, scope, sort, query, tags, author, page, user_logged_in,
+        cursor=None
+    ):
         # INFO: zip(*[('a', 1), ('b', 2)])[0] == ('a', 'b')
 
         if (scope not in zip(*const.POST_SCOPE_LIST)[0]) or (scope == 'followed' and not user_logged_in):
@@ -137,6 +142,13 @@ class SearchState(object):
         if self.page == 0:  # in case someone likes jokes :)
             self.page = 1
 
+        #position in the list for the keyset pagination
+        #see askbot.search.keyset
+        if cursor and CURSOR_RE.match(cursor):
+            self.cursor = cursor
+        else:
+            self.cursor = None
+
         self._questions_url = urlresolvers.reverse('questions')
 
     def __str__(self):
@@ -191,6 +203,7 @@ class SearchState(object):
             r'(%s)?' % r'/tags:(?P<tags>[\w+.#,-]+)' + # Should match: const.TAG_CHARS + ','; TODO: Is `#` char decoded by the time URLs are processed ??
             r'(%s)?' % r'/author:(?P<author>\d+)' +
             r'(%s)?' % r'/page:(?P<page>\d+)' +
+            r'(%s)?' % r'/cursor:(?P<cursor>(?:next|prev)_-?\d+_\d+)' +
             r'(%s)?' % r'/query:(?P<query>.+)' +  # INFO: query is last, b/c it can contain slash!!!
         """
 
@@ -201,6 +214,8 @@ class SearchState(object):
             lst.append('author:' + str(self.author))
         if self.page:
             lst.append('page:' + str(self.page))
+        if self.cursor:
+            lst.append('cursor:' + self.cursor)
         if self.query:
             lst.append('query:' + urllib.quote(smart_str(self.query), safe=self.SAFE_CHARS))
         return '/'.join(lst) + '/'
@@ -233,12 +248,14 @@ class SearchState(object):
         if tag not in ss.tags:
             ss.tags.append(tag)
             ss.page = 1 # state change causes page reset
+            ss.cursor = None
         return ss
 
     def remove_author(self):
         ss = self.deepcopy()
         ss.author = None
         ss.page = 1
+        ss.cursor = None
         return ss
 
     def remove_tags(self, tags = None):
@@ -250,23 +267,27 @@ class SearchState(object):
         else:
             ss.tags = []
         ss.page = 1
+        ss.cursor = None
         return ss
 
     def change_scope(self, new_scope):
         ss = self.deepcopy()
         ss.scope = new_scope
         ss.page = 1
+        ss.cursor = None
         return ss
 
     def change_sort(self, new_sort):
         ss = self.deepcopy()
         ss.sort = new_sort
         ss.page = 1
+        ss.cursor = None
         return ss
 
-    def change_page(self, new_page):
+    def change_page(self, new_page, cursor=None):
         ss = self.deepcopy()
         ss.page = new_page
+        ss.cursor = cursor
         return ss
 
 
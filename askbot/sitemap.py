@@ -1,14 +1,148 @@
+"""Sitemap of the questions
+
+The sitemap is split into the shards of at most
+``ASKBOT_SITEMAP_SHARD_SIZE`` urls, listed in the sitemap index.
+Shards are rendered from the tuples of the needed columns,
+selected with the thread in one query, and streamed to the response.
+"""
+import datetime
+import os
+from xml.sax.saxutils import escape
+from django.conf import settings as django_settings
 from django.contrib.sitemaps import Sitemap
+from django.core.urlresolvers import reverse
+from django.utils.http import urlquote
+from django.utils.translation import get_language, activate as activate_language
 from askbot.models import Post
+from askbot.utils.html import site_url
+from askbot.utils.slug import slugify
+
+SHARD_SIZE = getattr(django_settings, 'ASKBOT_SITEMAP_SHARD_SIZE', 10000)
+INDEX_FILE_NAME = 'sitemap.xml'
 
 class QuestionsSitemap(Sitemap):
     changefreq = 'daily'
     priority = 0.5
+    limit = SHARD_SIZE
+
     def items(self):
-        return Post.objects.get_questions().exclude(deleted=True)
+        """returns tuples (id, title, last activity, language)
+        of the questions, ordered by id so that the shards are stable"""
+        questions = Post.objects.get_questions().filter(deleted=False)
+        return questions.order_by('id').values_list(
+                                'id',
+                                'thread__title',
+                                'thread__last_activity_at',
+                                'thread__language_code'
+                            )
+
+    def lastmod(self, item):
+        return item[2]
+
+    def location(self, item):
+        question_id, title, last_activity_at, language_code = item
+        is_multilingual = getattr(django_settings, 'ASKBOT_MULTILINGUAL', False)
+        if is_multilingual:
+            request_language = get_language()
+            activate_language(language_code)
+
+        url = reverse('question', args=[question_id])
+        url += urlquote(slugify(title)) + '/'
+
+        if is_multilingual:
+            activate_language(request_language)
+        return url
+
+
+#sitemap classes by the name of the section
+SITEMAPS = {
+    'questions': QuestionsSitemap
+}
+
+
+def get_shard_file_name(section, page):
+    return 'sitemap-%s-%d.xml' % (section, page)
+
+
+def get_pregenerated_file_path(file_name):
+    """returns path to the sitemap file written by
+    the generate_sitemaps command, or ``None``"""
+    sitemap_dir = getattr(django_settings, 'ASKBOT_SITEMAP_DIR', None)
+    if sitemap_dir:
+        file_path = os.path.join(sitemap_dir, file_name)
+        if os.path.isfile(file_path):
+            return file_path
+    return None
+
+
+def get_file_modified_time(file_path):
+    return datetime.datetime.fromtimestamp(os.path.getmtime(file_path))
+
+
+def get_shard_count(sitemap):
+    return max(sitemap.paginator.num_pages, 1)
+
+
+def format_lastmod(timestamp):
+    return timestamp.strftime('%Y-%m-%d')
+
+
+def iter_sitemap_index(sitemaps):
+    """yields xml of the sitemap index listing
+    all shards of the given sitemaps"""
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for section, sitemap_class in sitemaps.items():
+        sitemap = sitemap_class()
+        for page in range(1, get_shard_count(sitemap) + 1):
+            url = reverse(
+                        'sitemap_shard',
+                        kwargs={'section': section, 'page': page}
+                    )
+            yield '<sitemap><loc>%s</loc></sitemap>\n' % escape(site_url(url))
+    yield '</sitemapindex>\n'
+
+
+def iter_sitemap_shard(sitemap, page):
+    """yields xml of the urls of one shard of the sitemap,
+    rows are fetched from the database as they are rendered"""
+    start = (page - 1) * sitemap.limit
+    items = sitemap.items()[start:start + sitemap.limit]
+
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for item in items.iterator():
+        location = escape(site_url(sitemap.location(item)))
+        xml = u'<url><loc>%s</loc>' % location
+        lastmod = sitemap.lastmod(item)
+        if lastmod:
+            xml += u'<lastmod>%s</lastmod>' % format_lastmod(lastmod)
+        xml += u'<changefreq>%s</changefreq>' % sitemap.changefreq
+        xml += u'<priority>%s</priority></url>\n' % sitemap.priority
+        yield xml.encode('utf-8')
+    yield '</urlset>\n'
+
 
-    def lastmod(self, obj):
-        return obj.thread.last_activity_at
+def write_sitemaps(directory, sitemaps):
+    """writes the sitemap index and all shards to the directory,
+    returns number of the written shards"""
+    def write_file(file_name, chunks):
+        file_path = os.path.join(directory, file_name)
+        #file is renamed when complete so that readers
+        #never see a partially written sitemap
+        temp_path = file_path + '.tmp'
+        output = open(temp_path, 'w')
+        for chunk in chunks:
+            output.write(chunk)
+        output.close()
+        os.rename(temp_path, file_path)
 
-    def location(self, obj):
-        return obj.get_absolute_url()
+    shard_count = 0
+    for section, sitemap_class in sitemaps.items():
+        sitemap = sitemap_class()
+        for page in range(1, get_shard_count(sitemap) + 1):
+            file_name = get_shard_file_name(section, page)
+            write_file(file_name, iter_sitemap_shard(sitemap, page))
+            shard_count += 1
+    write_file(INDEX_FILE_NAME, iter_sitemap_index(sitemaps))
+    return shard_count
@@ -1,4 +1,5 @@
 import os.path
+import threading
 from django.template.loader import BaseLoader
 from django.template import RequestContext
 from django.template import TemplateDoesNotExist
@@ -8,10 +9,12 @@ from django.conf import settings as django_settings
 from django.core.exceptions import ImproperlyConfigured
 from coffin.common import CoffinEnvironment
 from jinja2 import loaders as jinja_loaders
+from jinja2.bccache import FileSystemBytecodeCache
 from jinja2.exceptions import TemplateNotFound
 from jinja2.utils import open_if_exists
 from askbot.conf import settings as askbot_settings
 from askbot.skins import utils
+from askbot.utils.path import mkdir_p
 
 from coffin import template
 template.add_to_builtins('askbot.templatetags.extra_filters_jinja')
@@ -76,29 +79,60 @@ class SkinEnvironment(CoffinEnvironment):
 
         return ''
 
-def load_skins():
-    skins = dict()
-    for skin_name in utils.get_available_skins():
-        skins[skin_name] = SkinEnvironment(
-                                skin = skin_name,
-                                extensions=['jinja2.ext.i18n',]
-                            )
-        skins[skin_name].set_language(django_settings.LANGUAGE_CODE)
-        #from askbot.templatetags import extra_filters_jinja as filters
-        #skins[skin_name].filters['media'] = filters.media
-    return skins
-
-SKINS = load_skins()
+def get_bytecode_cache():
+    """returns cache of the compiled templates, shared by
+    all skin environments, if the directory for the cache
+    is given in the setting ``ASKBOT_TEMPLATE_BYTECODE_CACHE_DIR``"""
+    cache_dir = getattr(django_settings, 'ASKBOT_TEMPLATE_BYTECODE_CACHE_DIR', None)
+    if cache_dir is None:
+        return None
+    mkdir_p(cache_dir)
+    return FileSystemBytecodeCache(cache_dir, '%s.askbot.cache')
+
+BYTECODE_CACHE = get_bytecode_cache()
+
+def build_skin_environment(skin_name, language_code, bytecode_cache=None):
+    """returns new environment of the skin with
+    the translations of the language installed"""
+    skin = SkinEnvironment(
+                    skin = skin_name,
+                    extensions=['jinja2.ext.i18n',],
+                    bytecode_cache = bytecode_cache
+                )
+    skin.set_language(language_code)
+    return skin
+
+#media urls are resolved from the manifest built at startup
+utils.rebuild_media_manifest()
+
+#environments by (skin name, language code), built when first used,
+#the environments are not changed after they are built
+SKINS = dict()
+SKINS_LOCK = threading.Lock()
 
 def get_skin(request = None):
-    """retreives the skin environment
-    for a given request (request var is not used at this time)"""
+    """retreives the skin environment for the language
+    of the request, or for the active language"""
     skin_name = askbot_settings.ASKBOT_DEFAULT_SKIN
-    try:
-        return SKINS[skin_name]
-    except KeyError:
-        msg_fmt = 'skin "%s" not found, check value of "ASKBOT_EXTRA_SKINS_DIR"'
-        raise ImproperlyConfigured(msg_fmt % skin_name)
+    language_code = getattr(request, 'LANGUAGE_CODE', None) \
+                        or translation.get_language() \
+                        or django_settings.LANGUAGE_CODE
+    key = (skin_name, language_code)
+    skin = SKINS.get(key)
+    if skin is None:
+        if skin_name not in utils.get_available_skins():
+            msg_fmt = 'skin "%s" not found, check value of "ASKBOT_EXTRA_SKINS_DIR"'
+            raise ImproperlyConfigured(msg_fmt % skin_name)
+        with SKINS_LOCK:
+            skin = SKINS.get(key)
+            if skin is None:
+                skin = build_skin_environment(
+                                    skin_name,
+                                    language_code,
+                                    BYTECODE_CACHE
+                                )
+                SKINS[key] = skin
+    return skin
 
 def get_askbot_template(template, request = None):
     """
@@ -108,10 +142,7 @@ def get_askbot_template(template, request = None):
 
     request variable is used to localize the skin if possible
     """
-    skin = get_skin(request)
-    if hasattr(request,'LANGUAGE_CODE'):
-        skin.set_language(request.LANGUAGE_CODE)
-    return skin.get_template(template)
+    return get_skin(request).get_template(template)
 
 def render_into_skin_as_string(template, data, request):
     context = RequestContext(request, data)
@@ -5,6 +5,7 @@ the lookup resolution process for templates and media works as follows:
 * if not found look in 'default'
 * raise an exception
 """
+import hashlib
 import os
 import logging
 import urllib
@@ -13,6 +14,9 @@ from askbot.utils import hasher
 from django.conf import settings as django_settings
 from django.utils.datastructures import SortedDict
 
+#length of the content hashes added to the media urls
+MEDIA_HASH_LENGTH = 12
+
 class MediaNotFound(Exception):
     """raised when media file is not found"""
     pass
@@ -81,13 +85,101 @@ def get_skin_choices():
     skin_names = list(reversed(available_skins))
     return zip(skin_names, skin_names)
 
+def get_media_file_hash(file_path):
+    """returns short hash of the contents of the media file"""
+    sha_hash = hashlib.sha1()
+    media_file = open(file_path, 'rb')
+    try:
+        while True:
+            chunk = media_file.read(65536)
+            if not chunk:
+                break
+            sha_hash.update(chunk)
+    finally:
+        media_file.close()
+    return sha_hash.hexdigest()[:MEDIA_HASH_LENGTH]
+
+def uses_media_content_hashes():
+    return getattr(django_settings, 'ASKBOT_MEDIA_CONTENT_HASHES', False)
+
+class MediaManifest(object):
+    """paths of all files in the "media" directories
+    of the available skins, relative to the "media" directory,
+    optionally with the hashes of the contents of the files,
+    so that the media urls are resolved without
+    accessing the filesystem.
+
+    The manifest is built on the first use and rebuilt
+    by :func:`update_media_revision` or when the
+    ``ASKBOT_EXTRA_SKINS_DIR`` setting is changed.
+    """
+    def __init__(self):
+        self.skins_dir = getattr(django_settings, 'ASKBOT_EXTRA_SKINS_DIR', None)
+        self.use_hashes = uses_media_content_hashes()
+        #skin name -> {relative path -> hash of the contents or None}
+        self.files = dict()
+        for skin_name, skin_dir in get_available_skins().items():
+            self.files[skin_name] = self.list_files(
+                                        os.path.join(skin_dir, 'media')
+                                    )
+        #resolved urls by (url, skin, revision)
+        self.urls = dict()
+
+    def list_files(self, media_dir):
+        files = dict()
+        for root, dirs, file_names in os.walk(media_dir):
+            for file_name in file_names:
+                file_path = os.path.join(root, file_name)
+                relative_path = os.path.relpath(file_path, media_dir)
+                relative_path = relative_path.replace('\\', '/')
+                file_hash = None
+                if self.use_hashes:
+                    file_hash = get_media_file_hash(file_path)
+                files[relative_path] = file_hash
+        return files
+
+    def is_current(self):
+        skins_dir = getattr(django_settings, 'ASKBOT_EXTRA_SKINS_DIR', None)
+        return skins_dir == self.skins_dir \
+            and uses_media_content_hashes() == self.use_hashes
+
+    def resolve_skin(self, media, preferred_skin=None):
+        """returns name of the first skin containing the media file,
+        the preferred skin or 'default'"""
+        media = os.path.normpath(media).replace('\\', '/')
+        for skin_name in (preferred_skin, 'default'):
+            if skin_name and media in self.files.get(skin_name, ()):
+                return skin_name
+        raise MediaNotFound(media)
+
+    def get_file_hash(self, skin_name, media):
+        media = os.path.normpath(media).replace('\\', '/')
+        return self.files[skin_name].get(media)
+
+
+MEDIA_MANIFEST = None
+
+def get_media_manifest():
+    global MEDIA_MANIFEST
+    if MEDIA_MANIFEST is None or not MEDIA_MANIFEST.is_current():
+        MEDIA_MANIFEST = MediaManifest()
+    return MEDIA_MANIFEST
+
+def rebuild_media_manifest():
+    global MEDIA_MANIFEST
+    MEDIA_MANIFEST = MediaManifest()
+    return MEDIA_MANIFEST
+
 def resolve_skin_for_media(media=None, preferred_skin = None):
     #see if file exists, if not, try skin 'default'
-    available_skins = get_available_skins(selected=preferred_skin).items()
-    for skin_name, skin_dir in available_skins:
-        if os.path.isfile(os.path.join(skin_dir, 'media', media)):
-            return skin_name
-    raise MediaNotFound(media)
+    manifest = get_media_manifest()
+    if preferred_skin and preferred_skin not in manifest.files:
+        #raises ValueError for the unknown skin
+        get_available_skins(selected=preferred_skin)
+    return manifest.resolve_skin(media, preferred_skin)
+
+#uploaded files found in MEDIA_ROOT
+UPLOADED_FILES = set()
 
 def get_media_url(url, ignore_missing = False):
     """returns url prefixed with the skin name
@@ -97,10 +189,11 @@ def get_media_url(url, ignore_missing = False):
     if file is not found - returns None
     and logs an error message
 
+    skin media files are looked up in the :class:`MediaManifest`,
+    resolved urls are memoized
+
     todo: move this to the skin environment class
     """
-    #import datetime
-    #before = datetime.datetime.now()
     url = urllib.unquote(unicode(url))
     while url[0] == '/': url = url[1:]
 
@@ -122,7 +215,8 @@ def get_media_url(url, ignore_missing = False):
                             django_settings.MEDIA_ROOT,
                             file_path
                         )
-        if os.path.isfile(file_path):
+        if file_path in UPLOADED_FILES or os.path.isfile(file_path):
+            UPLOADED_FILES.add(file_path)
             url_copy = os.path.normpath(
                                     '///' + url_copy
                                 ).replace(
@@ -149,9 +243,14 @@ def get_media_url(url, ignore_missing = False):
         use_skin = 'default'
         resource_revision = None
 
+    manifest = get_media_manifest()
+    key = (url, use_skin, resource_revision)
+    if key in manifest.urls:
+        return manifest.urls[key]
+
     #determine from which skin take the media file
     try:
-        use_skin = resolve_skin_for_media(media=url, preferred_skin = use_skin)
+        media_skin = resolve_skin_for_media(media=url, preferred_skin = use_skin)
     except MediaNotFound:
         if ignore_missing == False:
             log_message = 'missing media resource %s in skin %s' \
@@ -159,19 +258,21 @@ def get_media_url(url, ignore_missing = False):
             logging.critical(log_message)
         return None
 
-    url = django_settings.STATIC_URL + use_skin + '/media/' + url
-    url = os.path.normpath(url).replace('\\', '/')
+    media_url = django_settings.STATIC_URL + media_skin + '/media/' + url
+    media_url = os.path.normpath(media_url).replace('\\', '/')
 
-    if resource_revision:
-        url +=  '?v=%d' % resource_revision
+    file_hash = manifest.get_file_hash(media_skin, url)
+    if file_hash:
+        media_url += '?v=%s' % file_hash
+    elif resource_revision:
+        media_url +=  '?v=%d' % resource_revision
 
-    #after = datetime.datetime.now()
-    #print after - before
-    return url
+    manifest.urls[key] = media_url
+    return media_url
 
 def update_media_revision(skin=None):
     """update skin media revision number based on the contents
-    of the skin media directory"""
+    of the skin media directory and rebuild the media manifest"""
     from askbot.conf import settings as askbot_settings
     resource_revision = askbot_settings.MEDIA_RESOURCE_REVISION
 
@@ -199,3 +300,5 @@ def update_media_revision(skin=None):
         askbot_settings.update('MEDIA_RESOURCE_REVISION', resource_revision + 1)
         askbot_settings.update('MEDIA_RESOURCE_REVISION_HASH', current_hash)
         logging.debug('MEDIA_RESOURCE_REVISION changed')
+
+    rebuild_media_manifest()
@@ -22,7 +22,10 @@ import traceback
 import logging
 import uuid
 
+from django.conf import settings as django_settings
 from django.contrib.contenttypes.models import ContentType
+from django.core import mail as django_mail
+from django.core.exceptions import ObjectDoesNotExist
 from django.template import Context
 from django.template.loader import get_template
 from django.utils.translation import ugettext as _
@@ -31,12 +34,19 @@ from celery.decorators import task
 from askbot.conf import settings as askbot_settings
 from askbot import const
 from askbot import mail
-from askbot.models import Post, Thread, User, ReplyAddress
+from askbot.models import Activity, Post, Thread, User, ReplyAddress
+from askbot.models import badges
 from askbot.models.badges import award_badges_signal
 from askbot.models import get_reply_to_addresses, format_instant_notification_email
+from askbot.models import get_instant_notification_data
 from askbot import exceptions as askbot_exceptions
 from askbot.utils.twitter import Twitter
 
+#delivery of the failed instant notifications is retried
+#this many times, with the delay in seconds
+INSTANT_NOTIFICATION_MAX_RETRIES = 3
+INSTANT_NOTIFICATION_RETRY_DELAY = 5*60
+
 # TODO: Make exceptions raised inside record_post_update_celery_task() ...
 #       ... propagate upwards to test runner, if only CELERY_ALWAYS_EAGER = True
 #       (i.e. if Celery tasks are not deferred but executed straight away)
@@ -200,12 +210,51 @@ def record_question_visit(
                     context_object = question_post,
                 )
 
+@task(ignore_result = True)
+def update_thread_summary_html_celery_task(thread_id):
+    """re-renders the cached summary html of the thread,
+    after the score of the question has changed"""
+    try:
+        thread = Thread.objects.get(id=thread_id)
+    except Thread.DoesNotExist:
+        return
+    thread.update_summary_html()
+
+def get_instant_notification_batch_size():
+    return getattr(
+        django_settings, 'ASKBOT_INSTANT_NOTIFICATION_BATCH_SIZE', 100
+    )
+
+
+@task(ignore_result = True)
+def award_badges_celery_task(
+                        event, actor_id, content_type_id,
+                        object_id, timestamp
+                    ):
+    """evaluates badges associated with the event,
+    when the badges are awarded asynchronously"""
+    try:
+        actor = User.objects.get(id=actor_id)
+        content_type = ContentType.objects.get_for_id(content_type_id)
+        context_object = content_type.get_object_for_this_type(id=object_id)
+    except ObjectDoesNotExist:
+        return
+    badges.evaluate_badges(
+                    event = event,
+                    actor = actor,
+                    context_object = context_object,
+                    timestamp = timestamp
+                )
+
 @task()
 def send_instant_notifications_about_activity_in_post(
                                                 update_activity = None,
                                                 post = None,
                                                 recipients = None,
                                             ):
+    """splits the recipients into batches and sends
+    each batch of notifications with a separate task
+    """
     #reload object from the database
     post = Post.objects.get(id=post.id)
     if post.is_approved() is False:
@@ -219,16 +268,6 @@ def send_instant_notifications_about_activity_in_post(
     if update_activity.activity_type not in acceptable_types:
         return
 
-    #calculate some variables used in the loop below
-    update_type_map = const.RESPONSE_ACTIVITY_TYPE_MAP_FOR_TEMPLATES
-    update_type = update_type_map[update_activity.activity_type]
-    origin_post = post.get_origin_post()
-    headers = mail.thread_headers(
-                            post,
-                            origin_post,
-                            update_activity.activity_type
-                        )
-
     logger = logging.getLogger()
     if logger.getEffectiveLevel() <= logging.DEBUG:
         log_id = uuid.uuid1()
@@ -237,37 +276,160 @@ def send_instant_notifications_about_activity_in_post(
     else:
         log_id = None
 
+    recipient_ids = [user.id for user in recipients if not user.is_blocked()]
+
+    batch_size = get_instant_notification_batch_size()
+    for start in range(0, len(recipient_ids), batch_size):
+        send_instant_notifications_batch_celery_task.delay(
+                                update_activity.id,
+                                post.id,
+                                recipient_ids[start:start + batch_size],
+                                log_id
+                            )
 
-    for user in recipients:
-        if user.is_blocked():
-            continue
 
-        reply_address, alt_reply_address = get_reply_to_addresses(user, post)
+def send_instant_notifications_batch(
+                                update_activity = None,
+                                post = None,
+                                recipients = None,
+                                log_id = None
+                            ):
+    """sends notifications about the update of the post
+    to the recipients over one connection to the mail server,
+    parts of the message common for all recipients
+    are calculated once
 
-        subject_line, body_text = format_instant_notification_email(
+    returns list of the recipients to whom
+    the notification was not sent
+    """
+    logger = logging.getLogger()
+
+    update_type_map = const.RESPONSE_ACTIVITY_TYPE_MAP_FOR_TEMPLATES
+    update_type = update_type_map[update_activity.activity_type]
+    origin_post = post.get_origin_post()
+    headers = mail.thread_headers(
+                            post,
+                            origin_post,
+                            update_activity.activity_type
+                        )
+    template = get_template('email/instant_notification.html')
+    notification_data = get_instant_notification_data(
+                                from_user = update_activity.user,
+                                post = post,
+                                update_type = update_type
+                            )
+    #thread summary depends on the user only via the groups
+    thread_summaries = dict()
+
+    connection = django_mail.get_connection()
+    try:
+        connection.open()
+    except Exception, error:
+        #each message will try to open the connection again
+        logger.debug('could not connect to the mail server: %s' % error)
+
+    failed_recipients = list()
+    try:
+        for user in recipients:
+            reply_address, alt_reply_address = get_reply_to_addresses(user, post)
+
+            if askbot_settings.GROUPS_ENABLED:
+                group_ids = [group.id for group in user.get_groups()]
+                summary_key = (
+                    tuple(sorted(group_ids)),
+                    user.id == origin_post.author_id
+                )
+            else:
+                summary_key = None
+            if summary_key not in thread_summaries:
+                thread_summaries[summary_key] = \
+                                    post.thread.format_for_email(user=user)
+
+            subject_line, body_text = format_instant_notification_email(
                             to_user = user,
                             from_user = update_activity.user,
                             post = post,
                             reply_address = reply_address,
                             alt_reply_address = alt_reply_address,
                             update_type = update_type,
-                            template = get_template('email/instant_notification.html')
+                            template = template,
+                            notification_data = notification_data,
+                            thread_summary = thread_summaries[summary_key]
                         )
 
-        headers['Reply-To'] = reply_address
-        try:
-            mail.send_mail(
-                subject_line=subject_line,
-                body_text=body_text,
-                recipient_list=[user.email],
-                related_object=origin_post,
-                activity_type=const.TYPE_ACTIVITY_EMAIL_UPDATE_SENT,
-                headers=headers,
-                raise_on_failure=True
-            )
-        except askbot_exceptions.EmailNotSent, error:
-            logger.debug(
-                '%s, error=%s, logId=%s' % (user.email, error, log_id)
+            headers['Reply-To'] = reply_address
+            try:
+                mail.send_mail(
+                    subject_line=subject_line,
+                    body_text=body_text,
+                    recipient_list=[user.email],
+                    related_object=origin_post,
+                    activity_type=const.TYPE_ACTIVITY_EMAIL_UPDATE_SENT,
+                    headers=headers,
+                    raise_on_failure=True,
+                    connection=connection
+                )
+            except askbot_exceptions.EmailNotSent, error:
+                failed_recipients.append(user)
+                logger.debug(
+                    '%s, error=%s, logId=%s' % (user.email, error, log_id)
+                )
+            else:
+                logger.debug('success %s, logId=%s' % (user.email, log_id))
+    finally:
+        connection.close()
+
+    logger.debug(
+        'email-alert batch sent=%d, failed=%d, logId=%s' % (
+            len(recipients) - len(failed_recipients),
+            len(failed_recipients),
+            log_id
+        )
+    )
+    return failed_recipients
+
+
+@task(
+    ignore_result = True,
+    max_retries = INSTANT_NOTIFICATION_MAX_RETRIES,
+    default_retry_delay = INSTANT_NOTIFICATION_RETRY_DELAY
+)
+def send_instant_notifications_batch_celery_task(
+                                update_activity_id,
+                                post_id,
+                                recipient_ids,
+                                log_id = None
+                            ):
+    """sends a batch of the instant notifications,
+    the notifications which could not be sent
+    are retried, up to the ``max_retries`` times
+    """
+    try:
+        update_activity = Activity.objects.get(id=update_activity_id)
+        post = Post.objects.get(id=post_id)
+    except (Activity.DoesNotExist, Post.DoesNotExist):
+        return
+    recipients = list(User.objects.filter(id__in=recipient_ids))
+
+    failed_recipients = send_instant_notifications_batch(
+                                    update_activity = update_activity,
+                                    post = post,
+                                    recipients = recipients,
+                                    log_id = log_id
+                                )
+    if not failed_recipients:
+        return
+
+    retry_task = send_instant_notifications_batch_celery_task
+    failed_ids = [user.id for user in failed_recipients]
+    try:
+        retry_task.retry(
+            args = (update_activity_id, post_id, failed_ids, log_id)
+        )
+    except retry_task.MaxRetriesExceededError:
+        logging.critical(
+            'instant notifications about post %d were not sent to: %s' % (
+                post_id,
+                ', '.join([user.email for user in failed_recipients])
             )
-        else:
-            logger.debug('success %s, logId=%s' % (user.email, log_id))
+        )
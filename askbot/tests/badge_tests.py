@@ -1,10 +1,12 @@
 import datetime
 from django.conf import settings as django_settings
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test.client import Client
 from askbot.tests.utils import AskbotTestCase
 from askbot.conf import settings
 from askbot import models
+from askbot.models import badges
 from askbot.models.badges import award_badges_signal
 
 class BadgeTests(AskbotTestCase):
@@ -506,3 +508,72 @@ class BadgeTests(AskbotTestCase):
         self.client.get(reverse('questions'))
         self.assert_have_badge('enthusiast', self.u1, 1)
 
+
+
+class BadgeEvaluationTests(AskbotTestCase):
+
+    def setUp(self):
+        self.u1 = self.create_user(username = 'user1')
+        self.u2 = self.create_user(username = 'user2')
+        self.u3 = self.create_user(username = 'user3')
+        question = self.post_question(user = self.u1)
+        self.answer = self.post_answer(user = self.u2, question = question)
+        #enough for all answer quality badges
+        self.answer.points = 100
+        self.answer.save()
+
+    def count_event_queries(self, event, actor, context_object):
+        """returns number of queries run during evaluation
+        of the badges on the event"""
+        old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        start = len(connection.queries)
+        try:
+            award_badges_signal.send(None,
+                event = event,
+                actor = actor,
+                context_object = context_object
+            )
+            return len(connection.queries) - start
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+
+    def test_upvote_answer_query_count_is_bounded(self):
+        #first evaluation awards the badges
+        self.count_event_queries('upvote_answer', self.u1, self.answer)
+        awards = models.Award.objects.filter(user = self.u2)
+        self.assertEqual(
+            set(awards.values_list('badge__slug', flat = True)),
+            set(['teacher', 'nice-answer', 'good-answer', 'great-answer'])
+        )
+        #ten badges are considered, but awards of the actor and
+        #of the answer author are read once
+        count = self.count_event_queries('upvote_answer', self.u1, self.answer)
+        #awards of the two users and the count of the votes
+        self.assertTrue(count <= 3)
+
+    def test_badge_instances_are_reused_until_settings_change(self):
+        badge_list = badges.get_event_badges('upvote_answer')
+        self.assertTrue(badge_list is badges.get_event_badges('upvote_answer'))
+        min_votes = settings.NICE_ANSWER_BADGE_MIN_UPVOTES
+        settings.update('NICE_ANSWER_BADGE_MIN_UPVOTES', min_votes + 1)
+        new_badge_list = badges.get_event_badges('upvote_answer')
+        settings.update('NICE_ANSWER_BADGE_MIN_UPVOTES', min_votes)
+        self.assertFalse(badge_list is new_badge_list)
+        nice_answer = [b for b in new_badge_list if b.key == 'nice-answer'][0]
+        self.assertEqual(nice_answer.min_votes, min_votes + 1)
+
+    def test_async_evaluation(self):
+        django_settings.ASKBOT_ASYNC_BADGE_AWARDS = True
+        try:
+            self.u1.upvote(self.answer)
+        finally:
+            del django_settings.ASKBOT_ASYNC_BADGE_AWARDS
+        awards = models.Award.objects.filter(badge__slug = 'supporter')
+        self.assertEqual(awards.filter(user = self.u1).count(), 1)
+
+    def test_awarded_count_of_badge_without_data(self):
+        badge = badges.get_badge('nice-answer')
+        models.BadgeData.objects.filter(slug = 'nice-answer').delete()
+        badges.clear_badge_data_cache()
+        self.assertEqual(badge.awarded_count, 0)
@@ -1,6 +1,17 @@
+import re
 from django.db import connection
+from django.core import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.signals import request_started
 from django.core.urlresolvers import reverse
 from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.test.client import Client
+from askbot import models
+from askbot.conf import settings as askbot_settings
+from askbot.conf import settings_wrapper
+from askbot.conf.settings_wrapper import ConfigSettings
+from askbot.search.state_manager import SearchState
 from askbot.tests.utils import AskbotTestCase
 
 
@@ -27,3 +38,177 @@ class CacheTests(AskbotTestCase):
         self.assertTrue(before_count > after_count,
                 ('Expected fewer queries after calling visit_question. ' +
                  'Before visit: %d. After visit: %d.') % (before_count, after_count))
+
+
+CSRF_TOKEN_RE = re.compile(r"name='csrfmiddlewaretoken' value='\w+'")
+
+
+class ThreadFragmentCacheTests(AskbotTestCase):
+    """cached post data and html of the thread must be
+    the same as rendered without the cache, for every
+    class of the visitors"""
+
+    def setUp(self):
+        askbot_settings.update('GROUPS_ENABLED', True)
+        self.group = self.create_group(group_name='private')
+        self.author = self.create_user('author')
+        self.member = self.create_user('member')
+        self.outsider = self.create_user('outsider')
+        self.moderator = self.create_user('moderator', status='m')
+        self.author.join_group(self.group)
+        self.member.join_group(self.group)
+
+        self.question = self.post_question(user=self.author)
+        self.post_answer(
+                user=self.outsider,
+                question=self.question,
+                body_text='public answer text'
+            )
+        self.private_answer = self.post_answer(
+                user=self.member,
+                question=self.question,
+                body_text='private answer text',
+                is_private=True
+            )
+        self.post_comment(user=self.member, parent_post=self.private_answer)
+
+        self.clients = {'anonymous': Client()}
+        for user in (self.author, self.member, self.outsider, self.moderator):
+            user.set_password('pswd')
+            user.save()
+            client = Client()
+            client.login(username=user.username, password='pswd')
+            self.clients[user.username] = client
+        cache.cache.clear()
+
+    def tearDown(self):
+        askbot_settings.update('GROUPS_ENABLED', False)
+
+    def get_pages(self):
+        pages = dict()
+        for name, client in self.clients.items():
+            response = client.get(self.question.get_absolute_url())
+            self.assertEqual(response.status_code, 200)
+            #csrf tokens in the cached html are replaced by the javascript
+            pages[name] = CSRF_TOKEN_RE.sub('', response.content)
+        return pages
+
+    def get_uncached_pages(self):
+        real_cache = cache.cache
+        cache.cache = DummyCache('', {})
+        try:
+            #the first visit shows the greeting and the
+            #notifications about the badges
+            self.get_pages()
+            return self.get_pages()
+        finally:
+            cache.cache = real_cache
+
+    def assert_cached_pages_are_correct(self):
+        expected = self.get_uncached_pages()
+        #first pass fills the cache, second reads from it
+        self.assertEqual(self.get_pages(), expected)
+        self.assertEqual(self.get_pages(), expected)
+        return expected
+
+    def test_visibility_classes(self):
+        thread = self.question.thread
+        anonymous = AnonymousUser()
+        keys = [
+            thread.get_visibility_key(user) for user in (
+                anonymous, self.author, self.member,
+                self.outsider, self.moderator
+            )
+        ]
+        #posts are shared with the personal groups of their
+        #authors, visitors who did not post share the same class
+        self.assertEqual(len(set(keys)), 4)
+        self.assertEqual(keys[0], keys[4])
+
+        pages = self.assert_cached_pages_are_correct()
+        self.assertTrue('private answer text' in pages['member'])
+        self.assertFalse('private answer text' in pages['outsider'])
+        self.assertFalse('private answer text' in pages['anonymous'])
+
+    def test_cached_data_is_invalidated(self):
+        self.assert_cached_pages_are_correct()
+        #edits, votes and comments are picked up via the signals
+        self.edit_answer(
+                user=self.outsider,
+                answer=self.question.thread.posts.get(
+                                        text='public answer text'
+                                    ),
+                body_text='edited public answer'
+            )
+        self.member.upvote(self.question)
+        self.post_comment(user=self.outsider, parent_post=self.question)
+        pages = self.assert_cached_pages_are_correct()
+        self.assertTrue('edited public answer' in pages['anonymous'])
+
+        #sharing changes
+        self.question.thread.add_to_groups(
+            [self.group],
+            visibility=models.ThreadToGroup.SHOW_PUBLISHED_RESPONSES
+        )
+        self.assert_cached_pages_are_correct()
+        personal_group = self.member.get_personal_group()
+        self.private_answer.remove_from_groups([personal_group])
+        pages = self.assert_cached_pages_are_correct()
+        self.assertFalse('private answer text' in pages['member'])
+
+    def test_cached_summary_html(self):
+        thread = self.question.thread
+        for user in (AnonymousUser(), self.member, self.outsider):
+            thread.get_summary_html(
+                            search_state=SearchState.get_empty(),
+                            visitor=user
+                        )
+            self.assertTrue(thread.summary_html_cached(visitor=user))
+            self.assertEqual(
+                thread.get_cached_summary_html(user),
+                thread.update_summary_html(user)
+            )
+        #private answer is counted for the member only
+        self.assertEqual(thread.get_answer_count(self.member), 2)
+        self.assertEqual(thread.get_answer_count(self.outsider), 1)
+        self.assertNotEqual(
+            thread.get_cached_summary_html(self.member),
+            thread.get_cached_summary_html(self.outsider)
+        )
+        #summary regenerated after a change invalidates all variants
+        thread.update_summary_html()
+        self.assertFalse(thread.summary_html_cached(visitor=self.member))
+
+
+class LivesettingsSnapshotTests(AskbotTestCase):
+
+    def test_settings_are_read_without_queries(self):
+        keys = askbot_settings.as_dict().keys()
+        old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        start = len(connection.queries)
+        try:
+            for key in keys:
+                getattr(askbot_settings, key)
+            self.assertEqual(len(connection.queries) - start, 0)
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+
+    def test_updated_setting_is_read(self):
+        max_tags = askbot_settings.MAX_TAGS_PER_POST
+        askbot_settings.update('MAX_TAGS_PER_POST', max_tags + 1)
+        self.assertEqual(askbot_settings.MAX_TAGS_PER_POST, max_tags + 1)
+        self.assertEqual(askbot_settings.as_dict()['MAX_TAGS_PER_POST'], max_tags + 1)
+        askbot_settings.update('MAX_TAGS_PER_POST', max_tags)
+        self.assertEqual(askbot_settings.MAX_TAGS_PER_POST, max_tags)
+
+    def test_snapshot_is_rebuilt_when_version_changes(self):
+        request_started.send(sender=None)
+        snapshot = ConfigSettings.get_snapshot()
+        self.assertTrue(ConfigSettings.get_snapshot() is snapshot)
+        #setting is updated by another process
+        cache.cache.incr(settings_wrapper.VERSION_CACHE_KEY)
+        #version is checked once per request
+        self.assertTrue(ConfigSettings.get_snapshot() is snapshot)
+        request_started.send(sender=None)
+        self.assertFalse(ConfigSettings.get_snapshot() is snapshot)
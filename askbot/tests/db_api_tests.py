@@ -8,12 +8,17 @@ from django.core import exceptions
 from django.core.urlresolvers import reverse
 from django.test.client import Client
 from django.conf import settings
+from django.core import cache
+from django.core import management
 from django.contrib.auth.models import AnonymousUser
 from django import forms
+from django.utils import simplejson
 from askbot import exceptions as askbot_exceptions
 from askbot.tests.utils import AskbotTestCase
 from askbot.tests.utils import with_settings
 from askbot import models
+from askbot.models import visit_buffer
+from askbot.models import subscription_index
 from askbot import const
 from askbot.conf import settings as askbot_settings
 import datetime
@@ -703,3 +708,709 @@ class LinkPostingTests(AskbotTestCase):
         self.assert_no_link(question.html)
         self.edit_question(user=admin, question=question, body_text=text + ' ok')
         self.assert_has_link(question.html, 'http://wikipedia.org')
+
+
+class VisitBufferTests(AskbotTestCase):
+
+    def setUp(self):
+        settings.ASKBOT_BUFFER_VISIT_COUNTS = True
+        settings.ASKBOT_VISIT_BUFFER_FLUSH_INTERVAL = 3600
+        self.user = self.create_user()
+        self.question = self.post_question()
+        self.buffer = visit_buffer.visit_buffer
+        self.buffer.flush()
+
+    def tearDown(self):
+        self.buffer.flush()
+        del settings.ASKBOT_BUFFER_VISIT_COUNTS
+        del settings.ASKBOT_VISIT_BUFFER_FLUSH_INTERVAL
+
+    def test_view_counts_are_written_in_bulk(self):
+        other_question = self.post_question(title='another question')
+        thread = self.reload_object(self.question.thread)
+        thread.increase_view_count()
+        thread.increase_view_count()
+        other_question.thread.increase_view_count()
+        #in-memory count includes the pending views
+        self.assertEqual(thread.view_count, 2)
+        #database is not updated yet
+        self.assertEqual(self.reload_object(thread).view_count, 0)
+
+        flush_count = self.buffer.get_stats()['flush_count']
+        self.buffer.flush()
+        self.assertEqual(self.reload_object(thread).view_count, 2)
+        self.assertEqual(self.reload_object(other_question.thread).view_count, 1)
+
+        stats = self.buffer.get_stats()
+        self.assertEqual(stats['flush_count'], flush_count + 1)
+        self.assertEqual(stats['pending_threads'], 0)
+
+    def test_popular_question_badge_counts_pending_views(self):
+        min_views = askbot_settings.POPULAR_QUESTION_BADGE_MIN_VIEWS
+        visitor = self.create_user('visitor')
+        for i in range(min_views):
+            question = self.reload_object(self.question)
+            question.thread.increase_view_count()
+            models.award_badges_signal.send(None,
+                event='view_question',
+                actor=visitor,
+                context_object=question
+            )
+        self.assertEqual(
+            self.user.badges.filter(slug='popular-question').count(), 1
+        )
+
+    def test_last_seen_is_buffered(self):
+        now = datetime.datetime.now()
+        last_seen = self.user.last_seen
+        models.signals.site_visited.send(None, user=self.user, timestamp=now)
+        self.assertEqual(self.reload_object(self.user).last_seen, last_seen)
+        self.buffer.flush()
+        self.assertEqual(self.reload_object(self.user).last_seen, now)
+
+    def test_failed_flush_keeps_pending_data(self):
+        thread = self.reload_object(self.question.thread)
+        thread.increase_view_count()
+        now = datetime.datetime.now()
+        models.signals.site_visited.send(None, user=self.user, timestamp=now)
+
+        def fail(view_counts, last_seen):
+            raise Exception('database is not available')
+        self.buffer.write = fail
+        try:
+            #the error is logged, not raised into the request
+            self.assertFalse(self.buffer.flush())
+        finally:
+            del self.buffer.write
+        #views recorded after the failure are added up
+        thread.increase_view_count()
+        self.assertEqual(self.buffer.get_pending_views(thread.id), 2)
+        self.assertEqual(self.buffer.get_last_seen(self.user.id), now)
+
+        self.buffer.flush()
+        self.assertEqual(self.reload_object(thread).view_count, 2)
+        self.assertEqual(self.reload_object(self.user).last_seen, now)
+
+    def test_day_change_is_written_through(self):
+        yesterday = datetime.datetime.now() - datetime.timedelta(1, 60)
+        models.User.objects.filter(id=self.user.id).update(last_seen=yesterday)
+        user = self.reload_object(self.user)
+        now = datetime.datetime.now()
+        models.signals.site_visited.send(None, user=user, timestamp=now)
+        self.assertEqual(user.consecutive_days_visit_count, 1)
+        self.assertEqual(self.reload_object(user).last_seen, now)
+        #repeated visit does not count the day again
+        user = self.reload_object(user)
+        later = now + datetime.timedelta(0, 10)
+        models.signals.site_visited.send(None, user=user, timestamp=later)
+        self.assertEqual(user.consecutive_days_visit_count, 0)
+
+
+class TagSubscriptionIndexTests(AskbotTestCase):
+
+    def setUp(self):
+        settings.ASKBOT_USE_TAG_SUBSCRIPTION_INDEX = True
+        self.index = subscription_index.subscription_index
+        #the database is rolled back after each test
+        self.index.version = None
+        schedule = {'q_all': 'i'}
+        self.u1 = self.create_user('user1', notification_schedule=schedule)
+        self.u2 = self.create_user('user2', notification_schedule=schedule)
+        self.u3 = self.create_user('user3', notification_schedule=schedule)
+        self.question = self.post_question(user=self.u1, tags='django-admin python')
+
+    def tearDown(self):
+        del settings.ASKBOT_USE_TAG_SUBSCRIPTION_INDEX
+        self.index.version = None
+
+    def set_strategy(self, user, strategy):
+        user.email_tag_filter_strategy = strategy
+        user.save()
+        #as done by the tag filter form
+        subscription_index.record_change(user.id)
+
+    def assert_index_matches_queries(self):
+        subscriptions = models.EmailFeedSetting.objects.filter(
+                                                    feed_type='q_all',
+                                                    frequency='i'
+                                                )
+        tag_names = self.question.get_tag_names()
+        for reason in ('good', 'bad', 'subscribed'):
+            expected = self.question.get_global_tag_based_subscribers(
+                tag_mark_reason=reason,
+                subscription_records=subscriptions
+            )
+            actual = self.index.get_subscriber_ids(
+                tag_names, reason, askbot_settings.USE_WILDCARD_TAGS
+            )
+            self.assertEqual(actual, set([user.id for user in expected]))
+
+    def test_wildcard_trie(self):
+        trie = subscription_index.WildcardTrie()
+        trie.add('dj', 1)
+        trie.add('django-', 2)
+        trie.add('py', 3)
+        self.assertEqual(trie.get_matching_user_ids(['django-admin']), set([1, 2]))
+        self.assertEqual(trie.get_matching_user_ids(['dj', 'python']), set([1, 3]))
+        trie.remove('django-', 2)
+        self.assertEqual(trie.get_matching_user_ids(['django-admin']), set([1]))
+        #empty branch is pruned
+        self.assertEqual(trie.root[0]['d'][0]['j'][0], {})
+
+    @with_settings(USE_WILDCARD_TAGS=True, SUBSCRIBED_TAG_SELECTOR_ENABLED=True)
+    def test_index_matches_queries(self):
+        self.set_strategy(self.u1, const.INCLUDE_INTERESTING)
+        self.set_strategy(self.u2, const.EXCLUDE_IGNORED)
+        self.set_strategy(self.u3, const.INCLUDE_SUBSCRIBED)
+        self.u1.mark_tags(tagnames=('python',), reason='good', action='add')
+        self.u2.mark_tags(wildcards=('django*',), reason='bad', action='add')
+        self.u3.mark_tags(wildcards=('dj*',), reason='subscribed', action='add')
+        self.assert_index_matches_queries()
+
+        self.u2.mark_tags(wildcards=('django*',), reason='bad', action='remove')
+        self.u1.mark_tags(tagnames=('python',), reason='bad', action='add')
+        self.assert_index_matches_queries()
+
+    @with_settings(USE_WILDCARD_TAGS=True)
+    def test_index_is_updated_incrementally(self):
+        self.set_strategy(self.u1, const.INCLUDE_INTERESTING)
+        tag_names = self.question.get_tag_names()
+        #start with a fresh version number, the locmem cache
+        #may have evicted it during the setup
+        cache.cache.clear()
+        self.assertEqual(self.index.get_subscriber_ids(tag_names, 'good', True), set())
+        built_at = self.index.built_at
+
+        self.u1.mark_tags(wildcards=('pyth*',), reason='good', action='add')
+        self.assertEqual(
+            self.index.get_subscriber_ids(tag_names, 'good', True),
+            set([self.u1.id])
+        )
+        #unsubscribing removes the user from the index
+        models.EmailFeedSetting.objects.filter(
+            subscriber=self.u1, feed_type='q_all'
+        ).update(frequency='n')
+        subscription = models.EmailFeedSetting.objects.get(
+                                        subscriber=self.u1, feed_type='q_all'
+                                    )
+        subscription.save()
+        self.assertEqual(self.index.get_subscriber_ids(tag_names, 'good', True), set())
+        self.assertEqual(self.index.built_at, built_at)
+
+    def test_instant_notification_subscribers(self):
+        self.set_strategy(self.u2, const.INCLUDE_INTERESTING)
+        self.u2.mark_tags(tagnames=('python',), reason='good', action='add')
+        self.set_strategy(self.u3, const.INCLUDE_INTERESTING)
+        subscribers = self.question.get_global_instant_notification_subscribers()
+        self.assertEqual(subscribers, set([self.u1, self.u2]))
+
+        del settings.ASKBOT_USE_TAG_SUBSCRIPTION_INDEX
+        self.assertEqual(
+            self.question.get_global_instant_notification_subscribers(),
+            subscribers
+        )
+        settings.ASKBOT_USE_TAG_SUBSCRIPTION_INDEX = True
+
+
+class LocalSearchBackendTests(AskbotTestCase):
+
+    def setUp(self):
+        settings.ASKBOT_SEARCH_BACKEND = 'askbot.search.local.LocalSearchBackend'
+        self.user = self.create_user('searcher')
+        self.q1 = self.post_question(
+                            user=self.user,
+                            title='How to configure nginx proxy',
+                            body_text='upstream servers question',
+                            tags='nginx'
+                        )
+        self.q2 = self.post_question(
+                            user=self.user,
+                            title='Compiling python extensions',
+                            body_text='the extension works behind nginx',
+                            tags='python c++'
+                        )
+
+    def tearDown(self):
+        del settings.ASKBOT_SEARCH_BACKEND
+
+    def get_thread_ids(self, query):
+        threads = models.Thread.objects.get_for_query(query)
+        return [thread.id for thread in threads.order_by('-relevance')]
+
+    def test_posts_are_indexed(self):
+        entries = models.SearchIndexEntry.objects.filter(
+                                            object_type='post',
+                                            object_id=self.q1.id
+                                        )
+        self.assertEqual(
+            set(entries.values_list('term', flat=True)),
+            set(['upstream', 'servers', 'question'])
+        )
+        self.assertEqual(
+            set(entries.values_list('thread_id', flat=True)),
+            set([self.q1.thread_id])
+        )
+
+    def test_thread_search_ranks_by_relevance(self):
+        #title match ranks above the match in the text
+        self.assertEqual(
+            self.get_thread_ids('nginx'),
+            [self.q1.thread_id, self.q2.thread_id]
+        )
+        #prefix match and tag names with punctuation
+        self.assertEqual(self.get_thread_ids('compil'), [self.q2.thread_id])
+        self.assertEqual(self.get_thread_ids('c++'), [self.q2.thread_id])
+        self.assertEqual(self.get_thread_ids('!!'), [])
+
+    def test_title_search(self):
+        threads = models.Thread.objects.get_for_title_query('extension')
+        self.assertEqual([thread.id for thread in threads], [self.q2.thread_id])
+        threads = models.Thread.objects.get_for_title_query('upstream')
+        self.assertEqual(list(threads), [])
+
+    def test_edited_and_deleted_posts_are_reindexed(self):
+        self.edit_question(
+                    user=self.user,
+                    question=self.q1,
+                    title='How to configure nginx proxy',
+                    body_text='downstream servers',
+                    tags='nginx'
+                )
+        self.assertEqual(self.get_thread_ids('upstream'), [])
+        self.assertEqual(self.get_thread_ids('downstream'), [self.q1.thread_id])
+
+        answerer = self.create_user('answerer')
+        answer = self.post_answer(
+                            user=answerer,
+                            question=self.q2,
+                            body_text='try the unusual flag'
+                        )
+        self.assertEqual(self.get_thread_ids('unusual'), [self.q2.thread_id])
+        answerer.delete_post(answer)
+        self.assertEqual(self.get_thread_ids('unusual'), [])
+
+    def test_user_search(self):
+        self.create_user('nginxfan')
+        users = models.get_users_by_text_query('nginx')
+        self.assertEqual([user.username for user in users], ['nginxfan'])
+
+    def test_rebuild_search_index(self):
+        models.SearchIndexEntry.objects.all().delete()
+        management.call_command('rebuild_search_index', verbosity=0)
+        self.assertEqual(self.get_thread_ids('upstream'), [self.q1.thread_id])
+
+
+class SimilarityIndexTests(AskbotTestCase):
+
+    def setUp(self):
+        settings.ASKBOT_USE_SIMILARITY_INDEX = True
+        self.user = self.create_user('asker', status='m')
+        self.question = self.post_question(
+                            user=self.user,
+                            title='Configure nginx reverse proxy',
+                            tags='nginx proxy ssl'
+                        )
+        self.close = self.post_question(
+                            user=self.user,
+                            title='Nginx reverse proxy timeouts',
+                            tags='nginx proxy ssl'
+                        )
+        self.far = self.post_question(
+                            user=self.user,
+                            title='Installing python on windows',
+                            tags='python windows'
+                        )
+
+    def tearDown(self):
+        del settings.ASKBOT_USE_SIMILARITY_INDEX
+
+    def get_similar_titles(self, question):
+        thread = self.reload_object(question.thread)
+        return [item['title'] for item in thread.get_similar_threads().data()]
+
+    def test_similar_threads(self):
+        thread = self.question.thread
+        entries = models.SimilarityIndexEntry.objects.filter(thread_id=thread.id)
+        self.assertEqual(entries.count(), models.similarity_index.NUM_BANDS)
+        self.assertEqual(
+            self.get_similar_titles(self.question),
+            [self.close.thread.get_title()]
+        )
+
+    def test_retagged_thread_is_reindexed(self):
+        self.assertEqual(self.get_similar_titles(self.far), [])
+        self.user.retag_question(question=self.far, tags='nginx proxy ssl')
+        self.user.edit_question(
+                        question=self.far,
+                        title='Configure nginx reverse proxy on windows',
+                        body_text='body text of the question',
+                        revision_comment='',
+                        tags='nginx proxy ssl'
+                    )
+        self.assertEqual(
+            self.get_similar_titles(self.far)[0],
+            self.question.thread.get_title()
+        )
+
+    def test_build_similarity_index(self):
+        models.SimilarityIndexEntry.objects.all().delete()
+        management.call_command('build_similarity_index', verbosity=0)
+        self.assertEqual(
+            self.get_similar_titles(self.close),
+            [self.question.thread.get_title()]
+        )
+
+
+class VoteCounterTests(AskbotTestCase):
+
+    def setUp(self):
+        self.author = self.create_user('author', reputation=100)
+        self.voter = self.create_user('voter', reputation=100)
+        self.question = self.post_question(user=self.author)
+        self.answer = self.post_answer(user=self.author, question=self.question)
+
+    def assert_counters(self, post, points, up_votes, down_votes):
+        post = self.reload_object(post)
+        self.assertEqual(post.points, points)
+        self.assertEqual(post.vote_up_count, up_votes)
+        self.assertEqual(post.vote_down_count, down_votes)
+        self.assertEqual(post.thread.points, post.thread._question_post().points)
+
+    def test_votes_update_stored_counters(self):
+        #counters of the post instances loaded before the votes
+        #are not written back to the database
+        stale_question = models.Post.objects.get(id=self.question.id)
+        self.voter.upvote(self.question)
+        self.assert_counters(self.question, 1, 1, 0)
+        self.assertEqual(self.question.points, 1)
+
+        other_voter = self.create_user('other_voter', reputation=100)
+        other_voter.downvote(stale_question)
+        self.assert_counters(self.question, 0, 1, 1)
+
+        self.voter.upvote(self.question, cancel=True)
+        self.assert_counters(self.question, -1, 0, 1)
+
+        self.voter.downvote(self.answer)
+        self.assert_counters(self.answer, -1, 0, 1)
+        self.assertEqual(self.reload_object(self.question.thread).points, -1)
+
+    def test_canceled_vote_counts_do_not_go_below_zero(self):
+        self.voter.upvote(self.answer)
+        self.voter.downvote(self.question)
+        models.Post.objects.filter(
+                    id__in=(self.question.id, self.answer.id)
+                ).update(vote_up_count=0, vote_down_count=0)
+        self.voter.upvote(self.answer, cancel=True)
+        self.voter.downvote(self.question, cancel=True)
+        self.assert_counters(self.answer, 0, 0, 0)
+        self.assert_counters(self.question, 0, 0, 0)
+
+    def test_reputation_is_changed_atomically(self):
+        stale_author = models.User.objects.get(id=self.author.id)
+        self.voter.upvote(self.question)
+        self.voter.upvote(self.answer)
+        gain = askbot_settings.REP_GAIN_FOR_RECEIVING_UPVOTE
+        self.assertEqual(self.reload_object(self.author).reputation, 100 + 2 * gain)
+
+        self.voter.upvote(self.answer, cancel=True)
+        self.assertEqual(
+            self.reload_object(self.author).reputation,
+            100 + 2 * gain + askbot_settings.REP_LOSS_FOR_RECEIVING_UPVOTE_CANCELATION
+        )
+        #the recorded reputation matches the stored value
+        repute = models.Repute.objects.filter(user=self.author).order_by('-id')[0]
+        self.assertEqual(repute.reputation, self.reload_object(self.author).reputation)
+        self.assertEqual(stale_author.reputation, 100)
+
+    def test_reputation_does_not_fall_below_minimum(self):
+        low_author = self.create_user('low_author', reputation=1)
+        answer = self.post_answer(user=low_author, question=self.question)
+        self.voter.downvote(answer)
+        self.assertEqual(
+            self.reload_object(low_author).reputation,
+            const.MIN_REPUTATION
+        )
+
+
+class UserDirectoryTests(AskbotTestCase):
+
+    def setUp(self):
+        settings.ASKBOT_USE_USER_DIRECTORY = True
+        cache.cache.clear()
+        self.alice = self.create_user('Alice', reputation=50)
+        self.alfred = self.create_user('alfred', reputation=10)
+        self.bob = self.create_user('bob', reputation=30)
+
+    def tearDown(self):
+        del settings.ASKBOT_USE_USER_DIRECTORY
+
+    def get_cached_ids(self, sort_method, group_id=None):
+        return list(models.user_directory.get_user_list(sort_method, group_id))
+
+    def get_ids_from_database(self, sort_method, group_id=None):
+        user_list = models.user_directory.build_list(sort_method, group_id)
+        return list(user_list)
+
+    def assert_lists_are_current(self, group_id=None):
+        for sort_method in models.user_directory.ORDER_BY:
+            self.assertEqual(
+                self.get_cached_ids(sort_method, group_id),
+                self.get_ids_from_database(sort_method, group_id)
+            )
+
+    def test_reputation_change_moves_user(self):
+        self.assertEqual(
+            self.get_cached_ids('reputation')[:3],
+            [self.alice.id, self.bob.id, self.alfred.id]
+        )
+        self.alfred.receive_reputation(100)
+        self.alfred.save()
+        self.assertEqual(
+            self.get_cached_ids('reputation')[:3],
+            [self.alfred.id, self.alice.id, self.bob.id]
+        )
+        self.assert_lists_are_current()
+
+    def test_new_user_is_added_to_cached_lists(self):
+        self.assert_lists_are_current()
+        self.create_user('carol', reputation=40)
+        self.assert_lists_are_current()
+
+    def test_blocked_user_is_not_listed(self):
+        self.assert_lists_are_current()
+        self.bob.set_status('b')
+        self.assertFalse(self.bob.id in self.get_cached_ids('reputation'))
+        self.assert_lists_are_current()
+
+    def test_group_members_are_listed(self):
+        group = self.create_group(group_name='private')
+        self.assert_lists_are_current(group.id)
+        self.bob.join_group(group)
+        self.assertEqual(self.get_cached_ids('reputation', group.id), [self.bob.id])
+        self.assert_lists_are_current(group.id)
+        #the cached lists of the group are not empty now
+        self.alice.join_group(group)
+        self.assertEqual(
+            self.get_cached_ids('reputation', group.id),
+            [self.alice.id, self.bob.id]
+        )
+        self.assert_lists_are_current(group.id)
+        self.bob.leave_group(group)
+        self.assertEqual(self.get_cached_ids('user', group.id), [self.alice.id])
+        self.assert_lists_are_current(group.id)
+
+    def test_search_by_username_prefix(self):
+        self.assertEqual(
+            models.user_directory.search('AL'),
+            [self.alice.id, self.alfred.id]
+        )
+        self.create_user('Alan', reputation=20)
+        alan = models.User.objects.get(username='Alan')
+        self.assertEqual(
+            models.user_directory.search('al'),
+            [self.alice.id, alan.id, self.alfred.id]
+        )
+        self.assertEqual(models.user_directory.search('alf'), [self.alfred.id])
+        self.assertEqual(models.user_directory.search('zed'), [])
+
+    def test_users_page(self):
+        client = Client()
+        response = client.get(reverse('users'), {'sort': 'reputation'}, follow=True)
+        users = response.context['users'].object_list
+        self.assertEqual(
+            [user.id for user in users][:3],
+            [self.alice.id, self.bob.id, self.alfred.id]
+        )
+        response = client.get(reverse('users'), {'query': 'alf'}, follow=True)
+        users = response.context['users'].object_list
+        self.assertEqual([user.id for user in users], [self.alfred.id])
+
+
+class UserStatsTests(AskbotTestCase):
+
+    def setUp(self):
+        cache.cache.clear()
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+        self.question = self.post_question(user=self.alice, tags='one two')
+
+    def get_tag_counts_from_database(self, user):
+        cache.cache.delete(models.user_stats.get_tag_counts_key(user.id))
+        return models.user_stats.get_tag_counts(user)
+
+    def test_new_post_is_counted_in_cached_tags(self):
+        self.assertEqual(
+            models.user_stats.get_tag_counts(self.alice),
+            {'one': 1, 'two': 1}
+        )
+        question = self.post_question(user=self.bob, tags='two three')
+        self.post_answer(user=self.alice, question=question)
+        tag_counts = models.user_stats.get_tag_counts(self.alice)
+        self.assertEqual(tag_counts, {'one': 1, 'two': 2, 'three': 1})
+        self.assertEqual(
+            tag_counts,
+            self.get_tag_counts_from_database(self.alice)
+        )
+
+        top_tags = models.user_stats.get_top_tags(self.alice)
+        self.assertEqual(
+            [(tag.name, tag.user_tag_usage_count) for tag in top_tags],
+            [('two', 2), ('one', 1), ('three', 1)]
+        )
+
+    def test_retag_updates_tag_counts(self):
+        models.user_stats.get_tag_counts(self.alice)
+        self.alice.retag_question(question=self.question, tags='one four')
+        self.assertEqual(
+            models.user_stats.get_tag_counts(self.alice),
+            {'one': 1, 'four': 1}
+        )
+
+    def test_vote_and_award_update_summary(self):
+        answer = self.post_answer(user=self.alice, question=self.question)
+        summary = models.user_stats.get_summary(self.bob)
+        self.assertEqual(summary.up_votes, 0)
+        self.assertEqual(summary.get_votes_today(), 0)
+
+        self.bob.upvote(self.question)
+        self.bob.downvote(answer)
+        summary = models.user_stats.get_summary(self.bob)
+        self.assertEqual(summary.up_votes, 1)
+        self.assertEqual(summary.down_votes, 1)
+        self.assertEqual(summary.get_votes_today(), 2)
+        award_count = len(summary.awards)
+
+        badge = models.BadgeData.objects.get_or_create(slug='nice-question')[0]
+        models.Award(
+            user=self.bob, badge=badge, content_object=self.question
+        ).save()
+        summary = models.user_stats.get_summary(self.bob)
+        self.assertEqual(len(summary.awards), award_count + 1)
+        award = [award for award in summary.awards if award.badge == badge][0]
+        self.assertTrue(award.content_object_is_post)
+        self.assertEqual(award.content_object, self.question)
+
+
+class AutocompleteTests(AskbotTestCase):
+
+    def setUp(self):
+        settings.ASKBOT_USE_AUTOCOMPLETE_INDEX = True
+        cache.cache.clear()
+        self.user = self.create_user('searcher')
+        self.q1 = self.post_question(
+                            user=self.user,
+                            title='How to configure nginx proxy',
+                            tags='nginx'
+                        )
+        self.q2 = self.post_question(
+                            user=self.user,
+                            title='Configuring the nginx logs',
+                            tags='nginx logging'
+                        )
+
+    def tearDown(self):
+        del settings.ASKBOT_USE_AUTOCOMPLETE_INDEX
+
+    def get_questions(self, query, **kwargs):
+        data = {'query_text': query}
+        data.update(kwargs)
+        response = self.client.get(reverse('api_get_questions'), data)
+        return simplejson.loads(response.content)
+
+    def test_questions_are_found_by_word_prefixes(self):
+        self.assertEqual(
+            self.get_questions('config ngi'),
+            [
+                {
+                    'title': self.q2.thread.title,
+                    'url': self.q2.get_absolute_url(),
+                    'answer_count': 0
+                },
+                {
+                    'title': self.q1.thread.title,
+                    'url': self.q1.get_absolute_url(),
+                    'answer_count': 0
+                },
+            ]
+        )
+        titles = [item['title'] for item in self.get_questions('conf', tag_name='logging')]
+        self.assertEqual(titles, [self.q2.thread.title])
+        self.assertEqual(self.get_questions('proxy logs'), [])
+
+    def test_index_is_updated_when_threads_change(self):
+        #shards are cached by the first lookup
+        self.assertEqual(len(self.get_questions('nginx')), 2)
+        self.edit_question(
+                    user=self.user,
+                    question=self.q1,
+                    title='How to configure apache proxy',
+                    tags='apache'
+                )
+        titles = [item['title'] for item in self.get_questions('nginx')]
+        self.assertEqual(titles, ['Configuring the nginx logs'])
+        titles = [item['title'] for item in self.get_questions('apa')]
+        self.assertEqual(titles, ['How to configure apache proxy'])
+
+        thread = self.q2.thread
+        thread.deleted = True
+        thread.save()
+        self.assertEqual(self.get_questions('nginx'), [])
+
+        q3 = self.post_question(user=self.user, title='Nginx rewrite rules')
+        titles = [item['title'] for item in self.get_questions('nginx')]
+        self.assertEqual(titles, ['Nginx rewrite rules'])
+
+    def get_tags_by_wildcard(self, wildcard):
+        response = self.client.get(
+                            reverse('get_tags_by_wildcard'),
+                            {'wildcard': wildcard}
+                        )
+        return simplejson.loads(response.content)
+
+    def test_tags_by_wildcard_match_database(self):
+        #cached by the first lookup
+        self.get_tags_by_wildcard('ng*')
+        suggested = self.create_tag('ngrok')
+        suggested.status = models.Tag.STATUS_SUGGESTED
+        suggested.used_count = 5
+        suggested.save()
+        deleted = self.create_tag('ngx')
+        deleted.deleted = True
+        deleted.save()
+        for wildcard in ('ng*', 'ngi*', 'x*'):
+            indexed = self.get_tags_by_wildcard(wildcard)
+            del settings.ASKBOT_USE_AUTOCOMPLETE_INDEX
+            try:
+                self.assertEqual(indexed, self.get_tags_by_wildcard(wildcard))
+            finally:
+                settings.ASKBOT_USE_AUTOCOMPLETE_INDEX = True
+        self.assertEqual(
+            self.get_tags_by_wildcard('ng*')['tag_names'],
+            ['ngrok', 'nginx', 'ngx']
+        )
+
+    def test_tags_and_usernames(self):
+        autocomplete = models.autocomplete
+        #tags are matched as by the Tag.objects.get_by_wildcards
+        self.assertEqual(autocomplete.get_tag_names_by_prefix('ng'), ['nginx'])
+        self.assertEqual(autocomplete.get_tag_names_by_prefix('NG'), [])
+        self.assertEqual(autocomplete.get_tag_list_text().split('\n'), ['nginx', 'logging'])
+        self.create_tag('ngrok')
+        self.assertEqual(
+            autocomplete.get_tag_names_by_prefix('ng'),
+            ['nginx', 'ngrok']
+        )
+        self.assertTrue('ngrok' in autocomplete.get_tag_list_text().split('\n'))
+
+        self.assertEqual(
+            models.user_directory.get_usernames_by_prefix('SEA'),
+            [('searcher', self.user.id)]
+        )
+        other = self.create_user('seal')
+        self.user.username = 'finder'
+        self.user.save()
+        self.assertEqual(
+            models.user_directory.get_usernames_by_prefix('sea'),
+            [('seal', other.id)]
+        )
@@ -7,6 +7,7 @@ from django.conf import settings as django_settings
 from django.core import management
 from django.core import serializers
 import django.core.mail
+from django.core.mail.backends import locmem
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.client import Client
@@ -16,6 +17,7 @@ from askbot import models
 from askbot import mail
 from askbot.conf import settings as askbot_settings
 from askbot import const
+from askbot import tasks
 from askbot.models.question import Thread
 
 TO_JSON = functools.partial(serializers.serialize, 'json')
@@ -740,6 +742,76 @@ class DelayedAlertSubjectLineTests(TestCase):
         subject = Thread.objects.get_tag_summary_from_threads(threads)
         self.assertEqual('"six", "five", "four", "three", "two" and more', subject)
 
+class BatchedDigestTests(utils.AskbotTestCase):
+    """digests of the users are built in batches"""
+
+    def setUp(self):
+        self.author = self.create_user('author')
+        self.subscribers = list()
+        for number in range(5):
+            self.subscribers.append(
+                self.create_user(
+                    'subscriber%d' % number,
+                    notification_schedule = {'q_all': 'd'}
+                )
+            )
+        self.question = self.post_question(user=self.author)
+        self.answer = self.post_answer(
+                                user=self.subscribers[0],
+                                question=self.question
+                            )
+        django.core.mail.outbox = list()
+
+    def send_alerts(self, **options):
+        django.core.mail.outbox = list()
+        management.call_command('send_email_alerts', **options)
+        return django.core.mail.outbox
+
+    def get_recipients(self, outbox):
+        return set([message.recipients()[0] for message in outbox])
+
+    def test_digests_do_not_depend_on_batch_size(self):
+        outbox = self.send_alerts(batch_size=2)
+        #the answerer is the last to update the thread
+        expected = set([user.email for user in self.subscribers[1:]])
+        self.assertEqual(self.get_recipients(outbox), expected)
+        for message in outbox:
+            self.assertTrue('1 ans' in message.body)
+            self.assertTrue('new question' in message.body)
+
+        #emails about these questions are recorded
+        #as sent, so there is no news for the next run
+        feeds = models.EmailFeedSetting.objects.filter(
+                                    subscriber__in=self.subscribers,
+                                    feed_type='q_all'
+                                )
+        self.assertEqual(feeds.filter(reported_at=None).count(), 0)
+        feeds.update(reported_at=None)
+        self.assertEqual(len(self.send_alerts(batch_size=3)), 0)
+
+    def test_only_news_since_the_last_email_are_counted(self):
+        self.send_alerts()
+        #pretend that the posts were made three days ago
+        #and the emails were sent two days ago
+        now = datetime.datetime.now()
+        models.Post.objects.update(added_at=now - datetime.timedelta(3))
+        models.PostRevision.objects.update(revised_at=now - datetime.timedelta(3))
+        models.EmailFeedSetting.objects.update(reported_at=None)
+        models.Activity.objects.filter(
+                activity_type=const.TYPE_ACTIVITY_EMAIL_UPDATE_SENT
+            ).update(
+                active_at=now - datetime.timedelta(2)
+            )
+        self.post_answer(user=self.author, question=self.question)
+
+        outbox = self.send_alerts(batch_size=1)
+        messages = dict([(message.recipients()[0], message) for message in outbox])
+        for user in self.subscribers[1:]:
+            body = messages[user.email].body
+            self.assertTrue('1 ans' in body)
+            self.assertFalse('new question' in body)
+
+
 class FeedbackTests(utils.AskbotTestCase):
     def setUp(self):
         self.create_user(username = 'user1', status='m')
@@ -869,6 +941,76 @@ class TagFollowedInstantWholeForumEmailAlertTests(utils.AskbotTestCase):
             self.user1.email in outbox[0].recipients()
         )
 
+class CountingEmailBackend(locmem.EmailBackend):
+    """counts connections and delivery attempts,
+    refuses messages to the ``failing_recipients``"""
+    opened_connections = 0
+    delivery_attempts = list()
+    failing_recipients = set()
+
+    def open(self):
+        CountingEmailBackend.opened_connections += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            self.delivery_attempts.extend(message.recipients())
+            if set(message.recipients()) & self.failing_recipients:
+                raise Exception('recipient refused')
+        return super(CountingEmailBackend, self).send_messages(messages)
+
+
+class BatchedInstantNotificationTests(utils.AskbotTestCase):
+
+    def setUp(self):
+        self.backend_backup = django_settings.EMAIL_BACKEND
+        django_settings.EMAIL_BACKEND = \
+            'askbot.tests.email_alert_tests.CountingEmailBackend'
+        django_settings.ASKBOT_INSTANT_NOTIFICATION_BATCH_SIZE = 2
+        CountingEmailBackend.opened_connections = 0
+        CountingEmailBackend.delivery_attempts = list()
+        CountingEmailBackend.failing_recipients = set()
+        self.sender = self.create_user('sender')
+        self.recipients = list()
+        for number in range(5):
+            self.recipients.append(
+                self.create_user(
+                    'recipient%d' % number,
+                    notification_schedule = {'q_all': 'i'}
+                )
+            )
+
+    def tearDown(self):
+        django_settings.EMAIL_BACKEND = self.backend_backup
+        del django_settings.ASKBOT_INSTANT_NOTIFICATION_BATCH_SIZE
+
+    @with_settings(MIN_REP_TO_TRIGGER_EMAIL=1)
+    def test_one_connection_per_batch(self):
+        self.post_question(user=self.sender)
+        outbox = django.core.mail.outbox
+        self.assertEqual(len(outbox), 5)
+        self.assertEqual(
+            set([message.recipients()[0] for message in outbox]),
+            set([user.email for user in self.recipients])
+        )
+        self.assertEqual(CountingEmailBackend.opened_connections, 3)
+
+    @with_settings(MIN_REP_TO_TRIGGER_EMAIL=1)
+    def test_failed_notifications_are_retried(self):
+        failing_email = self.recipients[0].email
+        CountingEmailBackend.failing_recipients = set([failing_email])
+        self.post_question(user=self.sender)
+        outbox = django.core.mail.outbox
+        self.assertEqual(len(outbox), 4)
+        attempts = CountingEmailBackend.delivery_attempts
+        self.assertEqual(
+            attempts.count(failing_email),
+            tasks.INSTANT_NOTIFICATION_MAX_RETRIES + 1
+        )
+        for user in self.recipients[1:]:
+            self.assertEqual(attempts.count(user.email), 1)
+
+
 class EmailReminderTestCase(utils.AskbotTestCase):
     #subclass must define these (example below)
     #enable_setting_name = 'ENABLE_UNANSWERED_REMINDERS'
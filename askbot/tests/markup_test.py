@@ -1,5 +1,7 @@
 from django.conf import settings as django_settings
+from askbot.conf import settings as askbot_settings
 from askbot.tests.utils import AskbotTestCase
+from askbot.tests.utils import with_settings
 from askbot.utils import markup
 
 class MarkupTest(AskbotTestCase):
@@ -22,3 +24,56 @@ class MarkupTest(AskbotTestCase):
         text = "oh hai @user1 how are you?"
         output = markup.extract_mentioned_name_seeds(text)
         self.assertEquals(output, set(['user1']))
+
+    def test_mention_trie_matches_first_added_user(self):
+        u2 = self.create_user('user1 two')
+        trie = markup.MentionTrie([u2, self.u1])
+        self.assertEqual(trie.match('User1 two, hi'), (u2, ', hi'))
+        self.assertEqual(trie.match('user1 three'), (self.u1, ' three'))
+        self.assertEqual(trie.match('user12'), (None, 'user12'))
+
+        trie = markup.MentionTrie([self.u1, u2])
+        self.assertEqual(trie.match('user1 two'), (self.u1, ' two'))
+
+    def test_participants_are_mentioned(self):
+        u2 = self.create_user('user2')
+        u3 = self.create_user('user3')
+        question = self.post_question(user=self.u1)
+        answer = self.post_answer(user=u2, question=question)
+        self.post_comment(user=u3, parent_post=answer)
+        self.assertEqual(
+            set(question.get_participant_list()),
+            set(question.get_author_list(include_comments=True, recursive=True))
+        )
+
+        answer = self.post_answer(
+                            user=self.u1,
+                            question=question,
+                            body_text='thanks @user2 and @user3!'
+                        )
+        self.assertTrue(u2.get_profile_url() in answer.html)
+        self.assertTrue(u3.get_profile_url() in answer.html)
+
+    def test_parser_is_reused(self):
+        parser = markup.get_parser()
+        self.assertTrue(parser is markup.get_parser())
+
+    @with_settings(MARKUP_CODE_FRIENDLY=False, ENABLE_MATHJAX=False)
+    def test_parser_is_rebuilt_on_settings_change(self):
+        text = 'some_thing_here'
+        parser = markup.get_parser()
+        self.assertTrue('<em>' in markup.markdown_input_converter(text))
+        askbot_settings.update('MARKUP_CODE_FRIENDLY', True)
+        self.assertFalse(parser is markup.get_parser())
+        #cached html is not reused with the new settings
+        self.assertFalse('<em>' in markup.markdown_input_converter(text))
+
+    def test_converted_html_is_cached(self):
+        calls = list()
+        def converter(text):
+            calls.append(text)
+            return text.upper()
+        cached_converter = markup.cached_conversion(converter)
+        self.assertEqual(cached_converter(u'some text'), u'SOME TEXT')
+        self.assertEqual(cached_converter(u'some text'), u'SOME TEXT')
+        self.assertEqual(len(calls), 1)
@@ -9,9 +9,12 @@
 """
 import datetime
 import time
+from django.core import management
+from django.db import connection
 from django.test import TestCase
 from askbot import models
 from askbot import const
+from askbot.tests.utils import AskbotTestCase
 from askbot.tests.utils import create_user
 
 
@@ -622,3 +625,68 @@ class OnScreenUpdateNotificationTests(TestCase):
         )
 
 
+class InboxFanOutTests(AskbotTestCase):
+    """response counts are incremented for all recipients
+    of the activity with a fixed number of queries"""
+
+    def setUp(self):
+        self.author = self.create_user('author')
+        self.question = self.post_question(user=self.author)
+
+    def create_users(self, prefix, count):
+        users = set()
+        for number in range(count):
+            users.add(self.create_user('%s%d' % (prefix, number)))
+        return users
+
+    def issue_notifications(self, recipients):
+        """returns number of queries issuing the notifications"""
+        old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        start = len(connection.queries)
+        try:
+            self.question.issue_update_notifications(
+                    updated_by=self.author,
+                    notify_sets={
+                        'for_inbox': recipients,
+                        'for_mentions': set(),
+                        'for_email': set()
+                    },
+                    activity_type=const.TYPE_ACTIVITY_UPDATE_QUESTION,
+                    suppress_email=True,
+                    timestamp=datetime.datetime.now()
+                )
+            return len(connection.queries) - start
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+
+    def test_query_count_does_not_depend_on_recipients(self):
+        few_users = self.create_users('few', 2)
+        many_users = self.create_users('many', 20)
+        self.assertEqual(
+            self.issue_notifications(few_users),
+            self.issue_notifications(many_users)
+        )
+        for user in few_users | many_users:
+            user = self.reload_object(user)
+            self.assertEqual(user.new_response_count, 1)
+            self.assertEqual(user.seen_response_count, 0)
+
+    def test_counts_after_visit_and_fix_inbox_counts(self):
+        user = self.create_user('recipient')
+        self.issue_notifications(set([user]))
+        self.issue_notifications(set([user]))
+        user = self.reload_object(user)
+        user.visit_question(self.question)
+        user = self.reload_object(user)
+        self.assertEqual(user.new_response_count, 0)
+        self.assertEqual(user.seen_response_count, 2)
+
+        models.User.objects.filter(id=user.id).update(
+                                    new_response_count=5,
+                                    seen_response_count=0
+                                )
+        management.call_command('fix_inbox_counts')
+        user = self.reload_object(user)
+        self.assertEqual(user.new_response_count, 0)
+        self.assertEqual(user.seen_response_count, 2)
@@ -1,3 +1,9 @@
+import datetime
+import os
+import shutil
+import tempfile
+from xml.dom import minidom
+
 from askbot.search.state_manager import SearchState
 from django.test import signals
 from django.conf import settings
@@ -14,6 +20,7 @@ from bs4 import BeautifulSoup
 
 from askbot import models
 from askbot.utils.slug import slugify
+from askbot.sitemap import QuestionsSitemap
 from askbot.deployment import package_utils
 from askbot.tests.utils import AskbotTestCase
 from askbot.conf import settings as askbot_settings
@@ -810,3 +817,123 @@ class UserProfilePageTests(AskbotTestCase):
         response = self.client.get(url, data={'sort':'network'})
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.templates[0].name, 'user_profile/user_network.html')
+
+
+def get_sitemap_locations(xml):
+    document = minidom.parseString(xml)
+    return [
+        element.firstChild.data
+        for element in document.getElementsByTagName('loc')
+    ]
+
+
+class SitemapAndFeedTests(AskbotTestCase):
+
+    def setUp(self):
+        self.user = self.create_user('user')
+        self.questions = [
+            self.post_question(user=self.user, title='question %d' % number)
+            for number in range(3)
+        ]
+        self.limit_backup = QuestionsSitemap.limit
+        QuestionsSitemap.limit = 2
+
+    def tearDown(self):
+        QuestionsSitemap.limit = self.limit_backup
+
+    def test_sitemap_index_lists_shards(self):
+        response = self.client.get(reverse('sitemap'))
+        self.assertEqual(response.status_code, 200)
+        locations = get_sitemap_locations(response.content)
+        self.assertEqual(len(locations), 2)
+        shard_url = reverse(
+                        'sitemap_shard',
+                        kwargs={'section': 'questions', 'page': 2}
+                    )
+        self.assertTrue(locations[1].endswith(shard_url))
+
+    def test_sitemap_shards_list_questions(self):
+        locations = list()
+        for page in (1, 2):
+            url = reverse(
+                    'sitemap_shard',
+                    kwargs={'section': 'questions', 'page': page}
+                )
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            locations.extend(get_sitemap_locations(response.content))
+        expected = [question.get_absolute_url() for question in self.questions]
+        self.assertEqual(len(locations), 3)
+        for location, url in zip(locations, expected):
+            self.assertTrue(location.endswith(url))
+
+    def test_sitemap_shard_out_of_range(self):
+        url = reverse(
+                'sitemap_shard',
+                kwargs={'section': 'questions', 'page': 3}
+            )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def assert_not_modified_until_activity(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        thread = self.questions[0].thread
+        thread.set_last_activity(
+                    last_activity_at=thread.last_activity_at + datetime.timedelta(1),
+                    last_activity_by=self.user
+                )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_sitemap_shard_not_modified(self):
+        url = reverse(
+                'sitemap_shard',
+                kwargs={'section': 'questions', 'page': 1}
+            )
+        self.assert_not_modified_until_activity(url)
+
+    @with_settings(RSS_ENABLED=True)
+    def test_latest_questions_feed_not_modified(self):
+        self.assert_not_modified_until_activity(reverse('latest_questions_feed'))
+
+    @with_settings(RSS_ENABLED=True)
+    def test_question_feed_not_modified(self):
+        url = reverse(
+                'individual_question_feed',
+                kwargs={'pk': self.questions[0].id}
+            )
+        self.assert_not_modified_until_activity(url)
+
+    def test_generate_sitemaps(self):
+        output_dir = tempfile.mkdtemp()
+        try:
+            management.call_command(
+                        'generate_sitemaps', output_dir=output_dir, verbosity=0
+                    )
+            file_names = sorted(os.listdir(output_dir))
+            self.assertEqual(
+                file_names,
+                ['sitemap-questions-1.xml', 'sitemap-questions-2.xml', 'sitemap.xml']
+            )
+            dir_backup = getattr(settings, 'ASKBOT_SITEMAP_DIR', None)
+            settings.ASKBOT_SITEMAP_DIR = output_dir
+            try:
+                url = reverse(
+                        'sitemap_shard',
+                        kwargs={'section': 'questions', 'page': 2}
+                    )
+                response = self.client.get(url)
+            finally:
+                settings.ASKBOT_SITEMAP_DIR = dir_backup
+            file_path = os.path.join(output_dir, 'sitemap-questions-2.xml')
+            self.assertEqual(response.content, open(file_path).read())
+        finally:
+            shutil.rmtree(output_dir)
@@ -4,13 +4,15 @@ from operator import attrgetter
 import time
 from askbot.search.state_manager import SearchState
 from django.contrib.auth.models import User
-from django.core import cache, urlresolvers
+from django.core import cache, management, urlresolvers
 from django.core.cache.backends.dummy import DummyCache
 from django.core.cache.backends.locmem import LocMemCache
 
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.template.loader import get_template
 from askbot.tests.utils import AskbotTestCase
+from askbot.tests.utils import with_settings
 from askbot.models import Post
 from askbot.models import PostRevision
 from askbot.models import Thread
@@ -19,6 +21,7 @@ from askbot.models import Group
 from askbot.search.state_manager import DummySearchState
 from django.utils import simplejson
 from askbot.conf import settings as askbot_settings
+from askbot import const
 
 
 class PostModelTests(AskbotTestCase):
@@ -235,6 +238,58 @@ class ThreadTagModelsTests(AskbotTestCase):
         qs, meta_data = Thread.objects.run_advanced_search(request_user=self.user, search_state=ss)
         self.assertEqual(1, qs.count())
 
+    def get_search_count(self, tags):
+        ss = SearchState.get_empty()
+        for tag in tags:
+            ss = ss.add_tag(tag)
+        qs, meta_data = Thread.objects.run_advanced_search(request_user=self.user, search_state=ss)
+        return qs.count(), meta_data
+
+    @with_settings(TAG_SEARCH_INPUT_ENABLED=True)
+    def test_run_adv_search_tag_names_resolved_case_insensitively(self):
+        count, meta_data = self.get_search_count(['TAG1', 'Tag3'])
+        self.assertEqual(count, 2)
+        self.assertEqual(meta_data['non_existing_tags'], [])
+
+        count, meta_data = self.get_search_count(['TAG1', 'nosuchtag'])
+        self.assertEqual(count, 2)
+        self.assertEqual(meta_data['non_existing_tags'], ['nosuchtag'])
+
+    @with_settings(TAG_SEARCH_INPUT_ENABLED=False)
+    def test_run_adv_search_non_existing_tag_matches_nothing(self):
+        count, meta_data = self.get_search_count(['tag1', 'nosuchtag'])
+        self.assertEqual(count, 0)
+
+    def test_run_adv_search_query_count_does_not_grow_with_tags(self):
+        connection.use_debug_cursor = True
+        try:
+            query_counts = list()
+            for tags in (['tag1'], ['tag1', 'tag2', 'tag3', 'tag4']):
+                queries_before = len(connection.queries)
+                count, meta_data = self.get_search_count(tags)
+                query_counts.append(len(connection.queries) - queries_before)
+        finally:
+            connection.use_debug_cursor = False
+        self.assertEqual(count, 1)
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_run_adv_search_interesting_and_ignored_tags(self):
+        self.user.mark_tags(tagnames=['tag4'], reason='good', action='add')
+        self.user.mark_tags(tagnames=['tag6'], reason='bad', action='add')
+
+        self.user.display_tag_filter_strategy = const.INCLUDE_INTERESTING
+        count, meta_data = self.get_search_count([])
+        self.assertEqual(count, 2)
+        self.assertEqual(meta_data['interesting_tag_names'], ['tag4'])
+        self.assertEqual(meta_data['ignored_tag_names'], ['tag6'])
+
+        self.user.display_tag_filter_strategy = const.EXCLUDE_IGNORED
+        count, meta_data = self.get_search_count([])
+        self.assertEqual(count, 2)
+
+        count, meta_data = self.get_search_count(['tag3'])
+        self.assertEqual(count, 2)
+
     def test_run_adv_search_query_author(self):
         ss = SearchState(scope=None, sort=None, query="@user", tags=None, author=None, page=None, user_logged_in=None)
         qs, meta_data = Thread.objects.run_advanced_search(request_user=self.user, search_state=ss)
@@ -301,6 +356,59 @@ class ThreadTagModelsTests(AskbotTestCase):
             self.assertTrue(thread.last_activity_by is thread._last_activity_by_cache)
 
 
+class ThreadQuestionPostTests(AskbotTestCase):
+
+    def setUp(self):
+        self.user = self.create_user('user')
+        self.question = self.post_question(user=self.user)
+        self.thread = self.question.thread
+
+    def assert_question_loaded_by_id(self, thread, question):
+        connection.use_debug_cursor = True
+        try:
+            queries_before = len(connection.queries)
+            self.assertEqual(thread._question_post(), question)
+            queries = connection.queries[queries_before:]
+        finally:
+            connection.use_debug_cursor = False
+        self.assertEqual(len(queries), 1)
+
+    def test_new_thread_references_question(self):
+        self.assertEqual(self.thread.question_post_id, self.question.id)
+        thread = self.reload_object(self.thread)
+        self.assertEqual(thread.question_post_id, self.question.id)
+        self.assert_question_loaded_by_id(thread, self.question)
+
+    def test_missing_reference_is_stored_on_first_use(self):
+        Thread.objects.filter(id=self.thread.id).update(question_post=None)
+        thread = self.reload_object(self.thread)
+        self.assertEqual(thread._question_post(), self.question)
+        thread = self.reload_object(self.thread)
+        self.assertEqual(thread.question_post_id, self.question.id)
+
+    def test_fix_thread_question_posts(self):
+        Thread.objects.filter(id=self.thread.id).update(question_post=None)
+        management.call_command('fix_thread_question_posts')
+        thread = self.reload_object(self.thread)
+        self.assertEqual(thread.question_post_id, self.question.id)
+
+    def test_swap_with_question(self):
+        answerer = self.create_user('answerer')
+        answer = self.post_answer(user=answerer, question=self.question)
+        self.user.upvote(answer)
+        answer = self.reload_object(answer)
+        new_question = answer.swap_with_question(new_title='swapped title')
+        self.assertEqual(new_question.id, answer.id)
+
+        thread = self.reload_object(self.thread)
+        self.assertEqual(thread.question_post_id, answer.id)
+        self.assertEqual(thread.title, 'swapped title')
+        self.assertEqual(thread.points, 1)
+        self.assertEqual(self.reload_object(answer).post_type, 'question')
+        self.assertEqual(self.reload_object(self.question).post_type, 'answer')
+        self.assertEqual(thread._question_post(refresh=True), answer)
+
+
 class ThreadRenderLowLevelCachingTests(AskbotTestCase):
     def setUp(self):
         self.create_user()
@@ -1,9 +1,15 @@
+import datetime
 from bs4 import BeautifulSoup
 from askbot.conf import settings as askbot_settings
 from askbot import const
+from askbot.search import keyset
+from askbot.search.state_manager import SearchState
 from askbot.tests.utils import AskbotTestCase
+from askbot.tests.utils import with_settings
 from askbot import models
+from django.conf import settings as django_settings
 from django.core.urlresolvers import reverse
+from django.db import connection
 
 
 class PrivateQuestionViewsTests(AskbotTestCase):
@@ -203,3 +209,111 @@ class PrivateAnswerViewsTests(AskbotTestCase):
         self.client.logout()
         response = self.client.get(self.question.get_absolute_url())
         self.assertFalse('edited answer text' in response.content)
+
+
+class KeysetPaginationTests(AskbotTestCase):
+
+    def setUp(self):
+        self.user = self.create_user('user')
+        timestamp = datetime.datetime(2013, 1, 1, 10, 0, 0, 1234)
+        for i in range(7):
+            #two threads share the same timestamp to test the tie-breaker
+            if i != 3:
+                timestamp += datetime.timedelta(minutes=1)
+            self.post_question(
+                user=self.user,
+                title='question %d' % i,
+                timestamp=timestamp
+            )
+
+    def get_search_state(self, sort='activity-desc', page=1, cursor=None):
+        return SearchState(
+            scope='all', sort=sort, query=None, tags=None,
+            author=None, page=page, user_logged_in=True, cursor=cursor
+        )
+
+    def get_listing(self, search_state):
+        qs, meta_data = models.Thread.objects.run_advanced_search(
+                                request_user=self.user,
+                                search_state=search_state
+                            )
+        return qs
+
+    def walk_pages(self, sort):
+        """returns list of thread ids collected by following
+        the "next" cursors, and the list of pages"""
+        search_state = self.get_search_state(sort=sort)
+        pages = list()
+        while True:
+            qs = self.get_listing(search_state)
+            page = keyset.KeysetPage(qs, search_state, 3)
+            pages.append(page)
+            if not page.has_next():
+                break
+            search_state = search_state.change_page(
+                                            page.next_page_number(),
+                                            page.next_cursor
+                                        )
+        return pages
+
+    def test_next_pages_match_offset_listing(self):
+        for sort in keyset.SEEK_FIELDS:
+            expected = [thread.id for thread in self.get_listing(
+                                        self.get_search_state(sort=sort)
+                                    )]
+            pages = self.walk_pages(sort)
+            seen = list()
+            for page in pages:
+                seen.extend([thread.id for thread in page])
+            self.assertEqual(seen, expected)
+            self.assertEqual([page.number for page in pages], [1, 2, 3])
+
+    def test_previous_page(self):
+        pages = self.walk_pages('activity-desc')
+        last_page = pages[-1]
+        search_state = self.get_search_state(
+                                page=2, cursor=last_page.previous_cursor
+                            )
+        page = keyset.KeysetPage(self.get_listing(search_state), search_state, 3)
+        self.assertEqual(
+            [thread.id for thread in page],
+            [thread.id for thread in pages[1]]
+        )
+        self.assertTrue(page.has_next())
+        self.assertTrue(page.has_previous())
+
+    def test_page_cost_does_not_depend_on_page_number(self):
+        """checks that pages retrieved by the cursor
+        do not use offset, and take the same number of queries"""
+        django_settings.DEBUG = True
+        try:
+            pages = self.walk_pages('activity-desc')
+            search_states = [
+                self.get_search_state(page=2, cursor=pages[0].next_cursor),
+                self.get_search_state(page=3, cursor=pages[1].next_cursor)
+            ]
+            query_counts = list()
+            for search_state in search_states:
+                before_count = len(connection.queries)
+                page = keyset.KeysetPage(
+                                    self.get_listing(search_state),
+                                    search_state, 3
+                                )
+                query_counts.append(len(connection.queries) - before_count)
+                self.assertFalse('OFFSET' in connection.queries[-1]['sql'])
+            self.assertEqual(query_counts[0], query_counts[1])
+        finally:
+            django_settings.DEBUG = False
+
+    @with_settings(QUESTIONS_KEYSET_PAGINATION_ENABLED=True)
+    def test_questions_view(self):
+        pages = self.walk_pages('activity-desc')
+        search_state = self.get_search_state(
+                                page=2, cursor=pages[0].next_cursor
+                            )
+        response = self.client.get(search_state.full_url())
+        self.assertEqual(response.status_code, 200)
+        for thread in pages[1]:
+            self.assertTrue(thread.title in response.content)
+        for thread in pages[0]:
+            self.assertFalse(thread.title in response.content)
@@ -1,6 +1,8 @@
 from askbot.tests.utils import AskbotTestCase
+from askbot.search import postgresql
 from askbot.search.state_manager import SearchState
 import askbot.conf
+from django.test import TestCase
 from django.core import urlresolvers
 
 
@@ -291,3 +293,75 @@ class SearchStateTests(AskbotTestCase):
         )
 
 
+
+    def test_cursor(self):
+        ss = SearchState(
+            scope=None,
+            sort='votes-desc',
+            query=None,
+            tags=None,
+            author=None,
+            page='3',
+            user_logged_in=False,
+            cursor='next_-2_15'
+        )
+        self.assertEqual(
+            'scope:all/sort:votes-desc/page:3/cursor:next_-2_15/',
+            ss.query_string()
+        )
+        #url must resolve with the cursor
+        match = urlresolvers.resolve(ss.full_url())
+        self.assertEqual(match.kwargs['cursor'], 'next_-2_15')
+        #state changes reset the cursor
+        self.assertEqual(ss.change_sort('age-desc').cursor, None)
+        self.assertEqual(ss.add_tag('tag').cursor, None)
+        self.assertEqual(ss.change_page(1).cursor, None)
+        self.assertEqual(
+            ss.change_page(4, 'next_-3_7').query_string(),
+            'scope:all/sort:votes-desc/page:4/cursor:next_-3_7/'
+        )
+
+    def test_bad_cursor_is_dropped(self):
+        ss = SearchState(
+            scope=None,
+            sort=None,
+            query=None,
+            tags=None,
+            author=None,
+            page=None,
+            user_logged_in=False,
+            cursor='next_1_; drop'
+        )
+        self.assertEqual(ss.cursor, None)
+
+
+class PostgresqlQueryTests(TestCase):
+
+    def test_words_and_phrases(self):
+        self.assertEqual(
+            postgresql.get_tsquery_text('nginx  "reverse proxy" -apache'),
+            "'nginx' & 'reverse proxy' & !'apache'"
+        )
+        self.assertEqual(
+            postgresql.get_tsquery_text('python or ruby install'),
+            "('python' | 'ruby') & 'install'"
+        )
+        self.assertEqual(postgresql.get_tsquery_text(' or '), None)
+        self.assertEqual(postgresql.get_tsquery_text('""'), None)
+
+    def test_query_operators_are_quoted(self):
+        self.assertEqual(
+            postgresql.get_tsquery_text("a|b & !c's:*"),
+            "'a|b' & '&' & '!c''s:*'"
+        )
+        self.assertEqual(postgresql.get_tsquery_text('c:\\'), "'c:\\\\'")
+
+    def test_prefix_of_the_last_word(self):
+        self.assertEqual(
+            postgresql.get_tsquery_text('configure ngi', prefix=True),
+            "'configure' & 'ngi':*"
+        )
+        self.assertEqual(
+            postgresql.get_tsquery_text('configure -ngi', prefix=True),
+            "'configure' & !'ngi'"
+        )
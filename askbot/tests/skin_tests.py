@@ -4,7 +4,9 @@ import tempfile
 from django.test import TestCase
 from django.core.files.uploadedfile import UploadedFile
 from django.conf import settings as django_settings
+from django.http import HttpRequest
 from askbot.conf import settings as askbot_settings
+from askbot.skins import loaders
 from askbot.skins import utils as skin_utils
 from askbot.utils.path import mkdir_p
 import askbot
@@ -70,3 +72,75 @@ class SkinTests(TestCase):
         self.assertTrue(logo_url.startswith(django_settings.MEDIA_URL))
         response = self.client.get(logo_url, follow=True)
         self.assertTrue(response.status_code == 200)
+
+    def test_media_is_resolved_from_manifest(self):
+        askbot_settings.update('ASKBOT_DEFAULT_SKIN', 'test_skin')
+        url = skin_utils.get_media_url('/images/logo.gif')
+        self.assertTrue('/test_skin/media/images/logo.gif' in url)
+
+        #files added later are found after the manifest is rebuilt
+        new_file_path = os.path.join(
+                            self.temp_dir, 'test_skin', 'media', 'new.css'
+                        )
+        open(new_file_path, 'w').write('body {}')
+        self.assertEqual(
+            skin_utils.get_media_url('new.css', ignore_missing=True),
+            None
+        )
+        skin_utils.update_media_revision()
+        url = skin_utils.get_media_url('new.css')
+        self.assertTrue('/test_skin/media/new.css' in url)
+
+    def test_media_content_hashes(self):
+        django_settings.ASKBOT_MEDIA_CONTENT_HASHES = True
+        try:
+            askbot_settings.update('ASKBOT_DEFAULT_SKIN', 'test_skin')
+            url = skin_utils.get_media_url('/images/logo.gif')
+            file_path = os.path.join(
+                            self.temp_dir, 'test_skin', 'media', 'images', 'logo.gif'
+                        )
+            file_hash = skin_utils.get_media_file_hash(file_path)
+            self.assertTrue(url.endswith('?v=' + file_hash))
+        finally:
+            del django_settings.ASKBOT_MEDIA_CONTENT_HASHES
+
+
+class SkinEnvironmentTests(TestCase):
+
+    def test_environment_per_language(self):
+        request = HttpRequest()
+        request.LANGUAGE_CODE = 'en'
+        skin = loaders.get_skin(request)
+        self.assertTrue(skin is loaders.get_skin(request))
+
+        request.LANGUAGE_CODE = 'de'
+        german_skin = loaders.get_skin(request)
+        self.assertFalse(german_skin is skin)
+        #environments of the other languages are not changed
+        template = skin.from_string('{% trans %}Questions{% endtrans %}')
+        self.assertEqual(template.render(), 'Questions')
+        template = german_skin.from_string('{% trans %}Questions{% endtrans %}')
+        self.assertEqual(template.render(), 'Fragen')
+
+    def test_templates_are_compiled_once_with_bytecode_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        django_settings.ASKBOT_TEMPLATE_BYTECODE_CACHE_DIR = cache_dir
+        try:
+            bytecode_cache = loaders.get_bytecode_cache()
+            skin = loaders.build_skin_environment('default', 'en', bytecode_cache)
+            skin.get_template('main_page.html')
+            self.assertTrue(len(os.listdir(cache_dir)) > 0)
+
+            #new environment, as after restart, loads the bytecode
+            compiled = list()
+            skin = loaders.build_skin_environment('default', 'en', bytecode_cache)
+            compile_templates = skin.compile
+            def compile_and_record(*args, **kwargs):
+                compiled.append(args)
+                return compile_templates(*args, **kwargs)
+            skin.compile = compile_and_record
+            skin.get_template('main_page.html')
+            self.assertEqual(compiled, [])
+        finally:
+            del django_settings.ASKBOT_TEMPLATE_BYTECODE_CACHE_DIR
+            shutil.rmtree(cache_dir)
@@ -3,7 +3,12 @@ from askbot.tests.utils import with_settings
 from askbot.utils.url_utils import urls_equal
 from askbot.utils.html import absolutize_urls
 from askbot.utils.html import replace_links_with_text
+from askbot.utils.html import sanitize_html, sanitize_html_with_tree
+from askbot.utils.html import StreamingSanitizer, TreeConstructionRequired
+from askbot.utils.html import strip_tags, strip_tags_with_tree
+from askbot.utils.chunked_list import ChunkedList
 from askbot.conf import settings as askbot_settings
+from django.core import cache
 
 class UrlUtilsTests(TestCase):
     
@@ -103,3 +108,192 @@ class HTMLUtilsTests(TestCase):
             absolutize_urls(text),
             '<a href="http://example.com/upfiles/13487909784287052.png"><img src="http://example.com/upfiles/13487909942351405.png" style="max-width:500px;" alt="" /></a><img src="http://i2.cdn.turner.com/cnn/dam/assets/120927033530-ryder-cup-captains-wall-4-tease.jpg" alt="" width="160" height="90" border="0" />and some text<br />aouaosutoaehut'
         )
+
+
+class SanitizeHTMLTests(TestCase):
+    """compares output of the streaming :func:`sanitize_html`
+    with the reference implementation building the DOM tree"""
+
+    WELL_FORMED = (
+        '',
+        'plain text & <symbols>',
+        '<p>paragraph with <b>bold</b> and <a href="http://example.com/?a=1&b=2" title=\'"q"\'>link</a></p>',
+        '<pre><code>if a < b:\n    return "&amp;"\n</code></pre>',
+        '<pre>\nleading newline is dropped</pre>',
+        '<ul><li>one<ul><li>nested</li></ul></li><li>two</li></ul>',
+        '<dl><dt>term</dt><dd>definition</dd></dl>',
+        '<table>\n<thead><tr><th nowrap>head</th></tr></thead>\n<tbody><tr><td>cell <i>x</i></td></tr></tbody></table>',
+        '<table><caption>title</caption><colgroup><col span="2"></colgroup></table>',
+        '<blockquote><p>quote</p></blockquote><hr><img src="/a.png" alt="">',
+        '<h1>title</h1><h2>subtitle</h2>',
+        '<object data="x.swf"><param name="movie" value="x.swf"></object>',
+        '<p>unclosed <b>tags',
+    )
+
+    MALFORMED = (
+        '<p>one<p>two',
+        '<b><i>misnested</b></i>',
+        '<ul><li>one<li>two</ul>',
+        '<table><tr><td>no tbody</td></tr></table>',
+        '<table>text in table<tr><td>x</td></tr></table>',
+        '<p><div>block in paragraph</div></p>',
+        '<a href="/1">one<a href="/2">two</a></a>',
+        '</p>stray end tag</br>',
+        '<td>cell outside table</td>',
+        '<h1><h2>nested headings</h2></h1>',
+        '<div>\n</span>text</div>',
+    )
+
+    UNSAFE = (
+        '<script>alert("x")</script>',
+        '<a href="javascript:alert(1)" onclick="alert(2)">link</a>',
+        '<img src="x.png" style="background:url(x)" onerror="alert(1)">',
+        '<iframe src="http://example.com"></iframe><!-- comment -->',
+        '<p style="color:red" class="x">text</p>',
+    )
+
+    def assertSameAsTree(self, html):
+        self.assertEqual(sanitize_html(html), sanitize_html_with_tree(html))
+
+    def assertStreamed(self, html):
+        sanitizer = StreamingSanitizer(html)
+        list(sanitizer.get_serializer_tokens())
+
+    def test_well_formed(self):
+        for html in self.WELL_FORMED:
+            self.assertSameAsTree(html)
+            self.assertStreamed(html)
+
+    def test_malformed(self):
+        for html in self.MALFORMED:
+            self.assertSameAsTree(html)
+            self.assertRaises(TreeConstructionRequired, self.assertStreamed, html)
+
+    def test_unsafe(self):
+        for html in self.UNSAFE:
+            self.assertSameAsTree(html)
+        self.assertEqual(
+            sanitize_html('<a href="javascript:alert(1)" onclick="alert(2)">link</a>'),
+            '<a>link</a>'
+        )
+
+    def test_strip_tags(self):
+        html = '<p>a<script>alert(1)<b>b</b></script> c <style>p{}</style>d<br></p>'
+        self.assertEqual(
+            sanitize_html(html, strip_tags=('script', 'style', 'br')),
+            '<p>a c d</p>'
+        )
+        #tags are stripped before the tree is built
+        html = '<p>a<script>x</script><div>b</div>'
+        self.assertEqual(
+            sanitize_html(html, strip_tags=('script',)),
+            sanitize_html_with_tree('<p>a<div>b</div>')
+        )
+
+
+class StripTagsTests(TestCase):
+    """compares output of the streaming :func:`strip_tags`
+    with the reference implementation building the DOM tree"""
+    TAGS = ('script', 'style', 'link')
+
+    HTML = (
+        '<p>text <b>bold</b><script>alert(1)</script></p>',
+        '<p style="color:red" class="x" onclick="f()">kept attributes</p>',
+        '<style>p {color: red}</style><link rel="stylesheet" href="/a.css">text',
+        '<script><script>nested</script>x</script>after',
+        '<p>one<p>two',
+        '<iframe src="http://example.com/v"></iframe><p>video</p>',
+        '<textarea><b>raw</b></textarea>',
+        '<p><!-- comment -->text</p>',
+        '<form><input type="text" name="q"></form>',
+        '<p title="a" title="b">repeated attribute</p>',
+    )
+
+    def test_same_as_tree(self):
+        for html in self.HTML:
+            self.assertEqual(
+                strip_tags(html, self.TAGS),
+                strip_tags_with_tree(html, self.TAGS)
+            )
+
+    def test_keeps_other_markup(self):
+        html = '<p style="color:red">a<script>alert(1)</script> <u>b</u></p>'
+        self.assertEqual(
+            strip_tags(html, self.TAGS),
+            '<p style="color:red">a <u>b</u></p>'
+        )
+        sanitizer = StreamingSanitizer(html, self.TAGS, whitelist=False)
+        list(sanitizer.get_serializer_tokens())
+
+    def test_empty_html(self):
+        self.assertEqual(strip_tags('  ', self.TAGS), '  ')
+
+
+class ChunkedListTests(TestCase):
+
+    def setUp(self):
+        cache.cache.clear()
+        self.entries = [(number, 'entry') for number in range(0, 20, 2)]
+
+    def get_list(self, ordered=True):
+        return ChunkedList(
+                    'test-chunked-list',
+                    lambda: list(self.entries),
+                    60,
+                    ordered=ordered,
+                    chunk_size=3
+                )
+
+    def test_chunks_are_stored_separately(self):
+        chunked_list = self.get_list()
+        self.assertEqual(list(chunked_list), self.entries)
+        header = cache.cache.get('test-chunked-list')
+        self.assertEqual([length for chunk_id, first, length \
+                                in header['chunks']], [3, 3, 3, 1])
+        self.assertEqual(self.get_list().get_slice(4, 7), self.entries[4:7])
+        self.assertEqual(
+            self.get_list().get_range((5,), (11,)),
+            [(6, 'entry'), (8, 'entry'), (10, 'entry')]
+        )
+
+    def test_updates_change_cached_chunks(self):
+        list(self.get_list())
+        for number in (1, 3, 5, 7, 21):
+            self.get_list().insert((number, 'new'))
+        self.get_list().remove((8, 'entry'))
+        self.get_list().replace((0, 'entry'), (30, 'moved'))
+        self.get_list().replace(None, (31, 'moved'), match=lambda e: e[0] == 2)
+        expected = sorted(
+            [entry for entry in self.entries if entry[0] not in (0, 2, 8)] + \
+            [(1, 'new'), (3, 'new'), (5, 'new'), (7, 'new'), (21, 'new'),
+             (30, 'moved'), (31, 'moved')]
+        )
+        self.assertEqual(list(self.get_list()), expected)
+        #the chunk which has grown is split
+        header = cache.cache.get('test-chunked-list')
+        self.assertTrue(max([length for chunk_id, first, length \
+                                in header['chunks']]) <= 6)
+
+    def test_missing_chunk_is_rebuilt(self):
+        chunked_list = self.get_list()
+        len(chunked_list)
+        header = cache.cache.get('test-chunked-list')
+        cache.cache.delete(chunked_list.get_chunk_key(header['chunks'][1][0]))
+        self.entries.append((100, 'entry'))
+        self.assertEqual(list(self.get_list()), self.entries)
+
+    def test_uncached_list_is_not_updated(self):
+        self.get_list().insert((1, 'new'))
+        self.assertEqual(cache.cache.get('test-chunked-list'), None)
+
+    def test_unordered_list_inserts_by_position(self):
+        self.get_list(ordered=False)
+        len(self.get_list(ordered=False))
+        self.get_list(ordered=False).insert('first', 0)
+        self.get_list(ordered=False).insert('last', None)
+        self.get_list(ordered=False).insert('middle', 5)
+        self.get_list(ordered=False).remove((4, 'entry'))
+        entries = ['first'] + self.entries + ['last']
+        entries.insert(5, 'middle')
+        entries.remove((4, 'entry'))
+        self.assertEqual(list(self.get_list(ordered=False)), entries)
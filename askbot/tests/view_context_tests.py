@@ -1,4 +1,9 @@
 from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.utils import simplejson
+from askbot import api
+from askbot import context as askbot_context
+from askbot.conf import settings as askbot_settings
 from askbot.tests.utils import AskbotTestCase
 from askbot.models import Group
 from askbot.views import context
@@ -28,3 +33,61 @@ class ViewContextTests(AskbotTestCase):
         values = set(inbox_context.values())
         self.assertEqual(values, set([0, 0, 0]))
 
+
+
+class CachedContextTests(AskbotTestCase):
+
+    def count_queries(self, function, *args):
+        old_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        start = len(connection.queries)
+        try:
+            function(*args)
+            return len(connection.queries) - start
+        finally:
+            connection.use_debug_cursor = old_debug_cursor
+
+    def test_moderation_items_are_cached(self):
+        moderator = self.create_user('moderator', status='m')
+        author = self.create_user('author')
+        flagger = self.create_user('flagger', reputation=10000)
+        question = self.post_question(user=author)
+
+        info = api.get_info_on_moderation_items(moderator)
+        self.assertEqual(info, {'seen_count': 0, 'new_count': 0})
+        self.assertEqual(
+            self.count_queries(api.get_info_on_moderation_items, moderator), 0
+        )
+
+        flagger.flag_post(question)
+        info = api.get_info_on_moderation_items(moderator)
+        self.assertEqual(info, {'seen_count': 0, 'new_count': 1})
+
+        moderator.visit_question(question)
+        info = api.get_info_on_moderation_items(moderator)
+        self.assertEqual(info, {'seen_count': 1, 'new_count': 0})
+
+        flagger.flag_post(question, cancel=True)
+        info = api.get_info_on_moderation_items(moderator)
+        self.assertEqual(info, {'seen_count': 0, 'new_count': 0})
+
+    def test_group_list_is_cached(self):
+        askbot_settings.update('GROUPS_ENABLED', True)
+        Group.objects.get_global_group()
+        Group.objects.create(name='Beta')
+        group_list = simplejson.loads(askbot_context.get_group_list_json())
+        self.assertEqual(
+            [group['name'] for group in group_list][1:],
+            ['Beta']
+        )
+        self.assertEqual(
+            self.count_queries(askbot_context.get_group_list_json), 0
+        )
+
+        Group.objects.create(name='alpha')
+        group_list = simplejson.loads(askbot_context.get_group_list_json())
+        self.assertEqual(
+            [group['name'] for group in group_list][1:],
+            ['alpha', 'Beta']
+        )
+        askbot_settings.update('GROUPS_ENABLED', False)
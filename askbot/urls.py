@@ -9,7 +9,7 @@ from django.conf.urls.defaults import handler500, handler404
 from django.contrib import admin
 from askbot import views
 from askbot.feed import RssLastestQuestionsFeed, RssIndividualQuestionFeed
-from askbot.sitemap import QuestionsSitemap
+from askbot.sitemap import SITEMAPS
 from askbot.skins.utils import update_media_revision
 from askbot.utils.url_utils import service_url
 
@@ -25,9 +25,7 @@ feeds = {
     'rss': RssLastestQuestionsFeed,
     'question':RssIndividualQuestionFeed
 }
-sitemaps = {
-    'questions': QuestionsSitemap
-}
+sitemaps = SITEMAPS
 
 #prefix is optional, recommended when a variable url prefix
 #is used to subdivide the forum into namespaces
@@ -47,6 +45,7 @@ urlpatterns = patterns('',
             r'(%s)?' % r'/tags:(?P<tags>[\w+.#,-]+)' + # Should match: const.TAG_CHARS + ','; TODO: Is `#` char decoded by the time URLs are processed ??
             r'(%s)?' % r'/author:(?P<author>\d+)' +
             r'(%s)?' % r'/page:(?P<page>\d+)' +
+            r'(%s)?' % r'/cursor:(?P<cursor>(?:next|prev)_-?\d+_\d+)' +
             r'(%s)?' % r'/query:(?P<query>.+)' +  # INFO: query is last, b/c it can contain slash!!!
         r'/$'),
         views.readers.questions,
@@ -123,10 +122,16 @@ urlpatterns = patterns('',
     ),
     url(
         r'^sitemap.xml$',
-        'django.contrib.sitemaps.views.sitemap',
+        views.meta.sitemap_index,
         {'sitemaps': sitemaps},
         name='sitemap'
     ),
+    url(
+        r'^sitemap-(?P<section>\w+)-(?P<page>\d+)\.xml$',
+        views.meta.sitemap_shard,
+        {'sitemaps': sitemaps},
+        name='sitemap_shard'
+    ),
     #feeds
     url(r'^feeds/rss/$', RssLastestQuestionsFeed(), name="latest_questions_feed"),
     url(r'^feeds/question/(?P<pk>\d+)/$', RssIndividualQuestionFeed(), name="individual_question_feed"),
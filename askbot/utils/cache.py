@@ -1,10 +1,37 @@
-"""Utilities for working with Django Models."""
+"""Utilities for working with Django Models
+and for the versioned keys of the cached data."""
 import itertools
+import random
 
 from django.contrib.contenttypes.models import ContentType
+from django.core import cache
 
+from askbot import const
 from askbot.utils.lists import flatten
 
+def get_cache_version(key):
+    """returns version of the cached data stored under the ``key``,
+    the version is a part of the cache keys of the data, so that
+    all of it is invalidated at once, returns ``None``
+    if the cache does not store the values"""
+    version = cache.cache.get(key)
+    if version is None:
+        #start from a random number, so that the keys of the
+        #data cached before the version was evicted are not reused
+        cache.cache.add(key, random.getrandbits(32), const.LONG_TIME)
+        version = cache.cache.get(key)
+    return version
+
+def invalidate_cache_version(key):
+    """increments the version, returns the new version
+    or ``None`` if the version is not in the cache"""
+    try:
+        return cache.cache.incr(key)
+    except ValueError:
+        #the version is not in the cache, the next
+        #version will be chosen at random
+        return None
+
 def fetch_model_dict(model, ids, fields=None):
     """
     Fetches a dict of model details for model instances with the given
@@ -0,0 +1,317 @@
+"""Lists kept in the cache in chunks
+
+A value stored in memcached is limited to 1MB and is read and
+written back whole. :class:`ChunkedList` keeps the entries
+in chunks of limited size, each chunk under its own key,
+and a small header with the id, the first entry and the length
+of each chunk. Lookups read only the chunks they need and a change
+rewrites one chunk and the header, under a lock kept in the cache.
+
+The list is built with the ``build_entries`` function, when
+the header or any of the needed chunks is missing in the cache.
+"""
+import bisect
+import time
+from django.core import cache
+
+#entries of the newly built chunks, a chunk is split
+#in two when it grows twice as large
+CHUNK_SIZE = 2000
+#seconds, after which an abandoned lock expires
+LOCK_TIMEOUT = 10
+LOCK_ATTEMPTS = 20
+#seconds between the attempts to take the lock
+LOCK_WAIT = 0.01
+
+
+class ChunkMissing(Exception):
+    """raised when a chunk of the list is not in the cache"""
+    pass
+
+
+class ChunkedList(object):
+    """list of the entries kept in the cache in chunks,
+    if ``ordered`` is ``True``, the entries are kept sorted
+    and :meth:`insert`, :meth:`remove` and :meth:`get_range`
+    find the chunks by the entries, otherwise
+    the entries are inserted by the position
+    """
+    def __init__(self, key, build_entries, timeout,
+                ordered=True, chunk_size=CHUNK_SIZE):
+        self.key = key
+        self.build_entries = build_entries
+        self.timeout = timeout
+        self.ordered = ordered
+        self.chunk_size = chunk_size
+        #{'chunks': [[chunk id, first entry, length], ...], 'next_id': id}
+        self.header = None
+        #chunk id -> list of the entries, chunks read so far
+        self.chunks = dict()
+
+    def get_chunk_key(self, chunk_id):
+        return '%s-chunk-%d' % (self.key, chunk_id)
+
+    def get_lock_key(self):
+        return '%s-lock' % self.key
+
+    def build(self):
+        """builds the list and stores it in the cache,
+        chunks are kept in the instance, so the list can be
+        read even if they could not be stored"""
+        entries = list(self.build_entries())
+        if self.ordered:
+            entries.sort()
+        self.header = {'chunks': list(), 'next_id': 0}
+        self.chunks = dict()
+        values = dict()
+        for start in range(0, len(entries), self.chunk_size):
+            chunk = entries[start:start + self.chunk_size]
+            chunk_id = self.add_chunk(len(self.header['chunks']), chunk)
+            values[self.get_chunk_key(chunk_id)] = chunk
+        cache.cache.set_many(values, self.timeout)
+        cache.cache.set(self.key, self.header, self.timeout)
+
+    def load(self):
+        """reads the header, builds the list if it is not cached"""
+        if self.header is None:
+            self.header = cache.cache.get(self.key)
+            if self.header is None:
+                self.build()
+        return self.header
+
+    def add_chunk(self, index, chunk):
+        """adds descriptor of the new chunk to the header"""
+        chunk_id = self.header['next_id']
+        self.header['next_id'] += 1
+        first_entry = None
+        if chunk:
+            first_entry = chunk[0]
+        self.header['chunks'].insert(index, [chunk_id, first_entry, len(chunk)])
+        self.chunks[chunk_id] = chunk
+        return chunk_id
+
+    def get_chunks(self, descriptors):
+        """returns chunks of the descriptors of the header,
+        raises :class:`ChunkMissing`"""
+        missing_keys = dict()
+        for chunk_id, first_entry, length in descriptors:
+            if chunk_id not in self.chunks:
+                missing_keys[self.get_chunk_key(chunk_id)] = chunk_id
+        if missing_keys:
+            cached = cache.cache.get_many(missing_keys.keys())
+            for key, chunk in cached.items():
+                self.chunks[missing_keys[key]] = chunk
+
+        chunks = list()
+        for chunk_id, first_entry, length in descriptors:
+            if chunk_id not in self.chunks:
+                raise ChunkMissing()
+            chunks.append(self.chunks[chunk_id])
+        return chunks
+
+    def read(self, function):
+        """returns result of the function reading the chunks,
+        the list is rebuilt once, if a chunk is missing"""
+        self.load()
+        try:
+            return function()
+        except ChunkMissing:
+            self.build()
+            return function()
+
+    def __len__(self):
+        self.load()
+        return sum([length for chunk_id, first_entry, length \
+                                    in self.header['chunks']])
+
+    def __iter__(self):
+        def read_all():
+            entries = list()
+            for chunk in self.get_chunks(self.header['chunks']):
+                entries.extend(chunk)
+            return entries
+        return iter(self.read(read_all))
+
+    def get_slice(self, start, stop):
+        """returns entries from the ``start`` position
+        up to, but not including the ``stop``"""
+        def read_slice():
+            descriptors = list()
+            first_offset = None
+            offset = 0
+            for descriptor in self.header['chunks']:
+                length = descriptor[2]
+                if offset < stop and offset + length > start:
+                    if first_offset is None:
+                        first_offset = offset
+                    descriptors.append(descriptor)
+                offset += length
+            if len(descriptors) == 0:
+                return list()
+            entries = list()
+            for chunk in self.get_chunks(descriptors):
+                entries.extend(chunk)
+            return entries[start - first_offset:stop - first_offset]
+        return self.read(read_slice)
+
+    def get_chunk_index(self, entry):
+        """index of the descriptor of the chunk, where
+        the entry of the ordered list belongs"""
+        first_entries = [first_entry for chunk_id, first_entry, length \
+                                                in self.header['chunks']]
+        return max(bisect.bisect_right(first_entries, entry) - 1, 0)
+
+    def get_range(self, low, high):
+        """returns entries of the ordered list, which are
+        not less than ``low`` and less than ``high``"""
+        def read_range():
+            descriptors = self.header['chunks']
+            if len(descriptors) == 0:
+                return list()
+            start = self.get_chunk_index(low)
+            stop = start + 1
+            while stop < len(descriptors) and descriptors[stop][1] < high:
+                stop += 1
+            entries = list()
+            for chunk in self.get_chunks(descriptors[start:stop]):
+                entries.extend(chunk[bisect.bisect_left(chunk, low):\
+                                        bisect.bisect_left(chunk, high)])
+            return entries
+        return self.read(read_range)
+
+    def acquire_lock(self):
+        for attempt in range(LOCK_ATTEMPTS):
+            if cache.cache.add(self.get_lock_key(), 1, LOCK_TIMEOUT):
+                return True
+            time.sleep(LOCK_WAIT)
+        return False
+
+    def update(self, function):
+        """calls ``function`` changing the chunks under the lock,
+        lists which are not cached are not updated - they will
+        be built when needed, the list which can not be updated
+        is dropped"""
+        if not self.acquire_lock():
+            cache.cache.delete(self.key)
+            return
+        try:
+            #the header and the chunks are read again under the lock
+            self.header = cache.cache.get(self.key)
+            self.chunks = dict()
+            if self.header is None:
+                return
+            try:
+                function()
+            except ChunkMissing:
+                cache.cache.delete(self.key)
+        finally:
+            cache.cache.delete(self.get_lock_key())
+
+    def save_chunk(self, index, chunk):
+        """stores the changed chunk and the header,
+        splits the chunk which has grown too large"""
+        descriptors = self.header['chunks']
+        chunk_id = descriptors[index][0]
+        values = dict()
+        if len(chunk) == 0 and len(descriptors) > 1:
+            del descriptors[index]
+            del self.chunks[chunk_id]
+            cache.cache.delete(self.get_chunk_key(chunk_id))
+        else:
+            if len(chunk) > 2 * self.chunk_size:
+                new_chunk = chunk[self.chunk_size:]
+                del chunk[self.chunk_size:]
+                new_chunk_id = self.add_chunk(index + 1, new_chunk)
+                values[self.get_chunk_key(new_chunk_id)] = new_chunk
+            first_entry = None
+            if chunk:
+                first_entry = chunk[0]
+            descriptors[index][1:] = [first_entry, len(chunk)]
+            values[self.get_chunk_key(chunk_id)] = chunk
+        cache.cache.set_many(values, self.timeout)
+        cache.cache.set(self.key, self.header, self.timeout)
+
+    def find_position(self, position):
+        """returns index of the chunk descriptor and the position
+        in the chunk for the position in the list,
+        position ``None`` is the end of the list"""
+        descriptors = self.header['chunks']
+        offset = 0
+        for index, descriptor in enumerate(descriptors):
+            if position is not None and position <= offset + descriptor[2]:
+                return index, position - offset
+            offset += descriptor[2]
+        return len(descriptors) - 1, descriptors[-1][2]
+
+    def insert_entry(self, entry, position=None):
+        if len(self.header['chunks']) == 0:
+            self.add_chunk(0, list())
+        if self.ordered:
+            index = self.get_chunk_index(entry)
+        else:
+            index, offset = self.find_position(position)
+        chunk = self.get_chunks([self.header['chunks'][index]])[0]
+        if self.ordered:
+            bisect.insort(chunk, entry)
+        else:
+            chunk.insert(offset, entry)
+        self.save_chunk(index, chunk)
+
+    def remove_entry(self, entry):
+        """returns ``True`` if the entry was found and removed,
+        entries of the ordered list are looked up only
+        in the chunk, where they belong"""
+        descriptors = self.header['chunks']
+        if len(descriptors) == 0:
+            return False
+        if self.ordered:
+            index = self.get_chunk_index(entry)
+            chunk = self.get_chunks([descriptors[index]])[0]
+            position = bisect.bisect_left(chunk, entry)
+            if position < len(chunk) and chunk[position] == entry:
+                del chunk[position]
+                self.save_chunk(index, chunk)
+                return True
+            return False
+        for index, chunk in enumerate(self.get_chunks(descriptors)):
+            if entry in chunk:
+                chunk.remove(entry)
+                self.save_chunk(index, chunk)
+                return True
+        return False
+
+    def remove_matching_entries(self, function):
+        """removes the entries, for which the function
+        returns ``True``, reads all chunks"""
+        descriptors = list(self.header['chunks'])
+        chunks = self.get_chunks(descriptors)
+        for descriptor, chunk in reversed(zip(descriptors, chunks)):
+            kept = [entry for entry in chunk if not function(entry)]
+            if len(kept) != len(chunk):
+                index = self.header['chunks'].index(descriptor)
+                self.save_chunk(index, kept)
+
+    def insert(self, entry, position=None):
+        """inserts entry into the ordered list, or at the
+        position, if the list is not ordered, at the end
+        if the position is ``None``"""
+        self.update(lambda: self.insert_entry(entry, position))
+
+    def remove(self, entry):
+        self.update(lambda: self.remove_entry(entry))
+
+    def remove_matching(self, function):
+        self.update(lambda: self.remove_matching_entries(function))
+
+    def replace(self, old_entry, new_entry, match=None, position=None):
+        """replaces the entry in one update, if the old entry
+        is not given or not found, the entries for which
+        the ``match`` function returns ``True`` are removed"""
+        def replace_entry():
+            removed = False
+            if old_entry is not None:
+                removed = self.remove_entry(old_entry)
+            if not removed and match:
+                self.remove_matching_entries(match)
+            self.insert_entry(new_entry, position)
+        self.update(replace_entry)
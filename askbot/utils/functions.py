@@ -172,6 +172,9 @@ def setup_paginator(context):
             "in_trailing_range" : in_trailing_range,
             "pages_outside_leading_range": pages_outside_leading_range,
             "pages_outside_trailing_range": pages_outside_trailing_range,
+            #cursors are available in the pages of keyset pagination
+            "previous_cursor": getattr(page_object, 'previous_cursor', None),
+            "next_cursor": getattr(page_object, 'next_cursor', None),
         }
 
 def get_admin():
@@ -2,6 +2,8 @@
 from bs4 import BeautifulSoup
 import html5lib
 from html5lib import sanitizer, serializer, tokenizer, treebuilders, treewalkers
+from html5lib.constants import headingElements, namespaces
+from html5lib.constants import spaceCharacters, specialElements, tokenTypes
 import re
 import htmlentitydefs
 from urlparse import urlparse
@@ -95,23 +97,22 @@ def replace_links_with_text(html):
 
     return unicode(soup.find('body').renderContents(), 'utf-8')
 
-def strip_tags(html, tags=None):
-    """strips tags from given html output"""
-    #a corner case
-    if html.strip() == '':
-        return html
+class TokenReplay(object):
+    """stands in for the tokenizer of the html5lib parser
+    and plays back the already sanitized tokens"""
+    def __init__(self, tokens, stream):
+        self.tokens = tokens
+        #parser reads the stream position for the error messages
+        self.stream = stream
 
-    assert(tags != None)
+    def __iter__(self):
+        return iter(self.tokens)
 
-    soup = BeautifulSoup(html, 'html5lib')
-    for tag in tags:
-        tag_matches = soup.find_all(tag)
-        map(lambda v: v.replaceWith(''), tag_matches)
-    return unicode(soup.find('body').renderContents(), 'utf-8')
 
-def sanitize_html(html):
-    """Sanitizes an HTML fragment."""
-    p = html5lib.HTMLParser(tokenizer=HTMLSanitizer,
+def serialize_fragment(tokenizer_class, html):
+    """parses the fragment into the html5lib DOM tree,
+    using the given tokenizer, and serializes the tree"""
+    p = html5lib.HTMLParser(tokenizer=tokenizer_class,
                             tree=treebuilders.getTreeBuilder("dom"))
     dom_tree = p.parseFragment(html)
     walker = treewalkers.getTreeWalker("dom")
@@ -121,6 +122,327 @@ def sanitize_html(html):
     output_generator = s.serialize(stream)
     return u''.join(output_generator)
 
+
+def strip_elements(tokens, strip_tags):
+    """yields the tokens, except for the elements
+    listed in ``strip_tags`` and all their contents"""
+    stripped_name = None
+    stripped_depth = 0
+    for token in tokens:
+        token_type = token['type']
+        if stripped_name:
+            if token_type == START_TAG and token['name'] == stripped_name:
+                stripped_depth += 1
+            elif token_type == END_TAG and token['name'] == stripped_name:
+                stripped_depth -= 1
+                if stripped_depth == 0:
+                    stripped_name = None
+            continue
+        if token_type in (START_TAG, EMPTY_TAG) \
+            and token['name'] in strip_tags:
+            if token_type == START_TAG and not token['selfClosing'] \
+                and token['name'] not in VOID_ELEMENTS:
+                stripped_name = token['name']
+                stripped_depth = 1
+            continue
+        elif token_type == END_TAG and token['name'] in strip_tags:
+            continue
+        yield token
+
+
+def get_stripping_tokenizer(strip_tags):
+    """returns html5lib tokenizer class which removes
+    the elements listed in ``strip_tags`` and keeps
+    all other markup"""
+    class StrippingTokenizer(tokenizer.HTMLTokenizer):
+        def __iter__(self):
+            tokens = tokenizer.HTMLTokenizer.__iter__(self)
+            return strip_elements(tokens, strip_tags)
+    return StrippingTokenizer
+
+
+def sanitize_html_with_tree(html):
+    """Sanitizes an HTML fragment by building the full
+    html5lib DOM tree and serializing it back.
+
+    This is the reference implementation for the :func:`sanitize_html`.
+    """
+    return serialize_fragment(HTMLSanitizer, html)
+
+
+def strip_tags_with_tree(html, tags):
+    """Removes the listed elements from an HTML fragment
+    by building the full html5lib DOM tree.
+
+    This is the reference implementation for the :func:`strip_tags`.
+    """
+    return serialize_fragment(get_stripping_tokenizer(frozenset(tags)), html)
+
+
+#start tags implicitly closing an open <p>
+P_CLOSING_ELEMENTS = frozenset((
+    'address', 'blockquote', 'center', 'dd', 'dir', 'div', 'dl', 'dt',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'li', 'ol', 'p', 'pre',
+    'table', 'ul'
+))
+#table parts and the elements which must directly contain them
+TABLE_PART_PARENTS = {
+    'caption': ('table',),
+    'colgroup': ('table',),
+    'tbody': ('table',),
+    'thead': ('table',),
+    'tfoot': ('table',),
+    'tr': ('tbody', 'thead', 'tfoot'),
+    'td': ('tr',),
+    'th': ('tr',),
+    'col': ('colgroup',),
+}
+#elements in which only whitespace and the table parts may appear
+TABLE_CONTEXT_ELEMENTS = frozenset(
+    ('table', 'tbody', 'thead', 'tfoot', 'tr', 'colgroup')
+)
+#elements closed by the start tag of the same kind
+LIST_ITEM_SIBLINGS = {
+    'li': ('li',),
+    'dd': ('dd', 'dt'),
+    'dt': ('dd', 'dt'),
+}
+HEADING_ELEMENTS = frozenset(headingElements)
+VOID_ELEMENTS = frozenset(('br', 'col', 'hr', 'img', 'param'))
+SPECIAL_ELEMENTS = frozenset([
+    name for namespace, name in specialElements \
+    if namespace == namespaces['html']
+])
+SPACE_CHARACTERS = frozenset(spaceCharacters)
+
+START_TAG = tokenTypes['StartTag']
+EMPTY_TAG = tokenTypes['EmptyTag']
+END_TAG = tokenTypes['EndTag']
+CHARACTERS = tokenTypes['Characters']
+SPACE_CHARACTERS_TOKEN = tokenTypes['SpaceCharacters']
+COMMENT = tokenTypes['Comment']
+#elements which the streaming pass can insert without the whitelist,
+#tree construction rules are checked only for these
+STREAMED_ELEMENTS = frozenset(HTMLSanitizerMixin.acceptable_elements)
+
+
+class TreeConstructionRequired(Exception):
+    """raised when the token stream is not well-formed
+    and the html5lib parser would rearrange the elements"""
+    pass
+
+
+class StreamingSanitizer(object):
+    """Sanitizes html in a single pass over the tokens of the
+    whitelisting :class:`HTMLSanitizer` tokenizer and serializes
+    the tokens right away, without building the DOM tree.
+
+    Tokens of the well-formed html - where the html5lib parser
+    would simply append each element to the current one -
+    are serialized in the same way as by the tree builder.
+    For this the parser rules which apply to the whitelisted
+    elements are checked for each token. As soon as any other
+    tree construction rule would apply (implicitly closed elements,
+    misnested tags, text inside the table rows, etc.),
+    the collected tokens are handed over to the parser,
+    so the output is the same as of :func:`sanitize_html_with_tree`.
+
+    Elements listed in ``strip_tags`` are removed
+    together with their contents in the same pass.
+    With ``whitelist=False`` all other markup is kept, as by
+    :func:`strip_tags_with_tree`, elements outside of the whitelist
+    and comments are then handed over to the parser.
+    """
+    def __init__(self, html, strip_tags=None, whitelist=True):
+        self.html = html
+        self.strip_tags = frozenset(strip_tags or ())
+        self.whitelist = whitelist
+        self.tokenizer = HTMLSanitizer(html)
+        self.token_stream = self.get_tokens()
+        #tokens seen so far, for the fallback to the parser
+        self.tokens = list()
+        #open elements: lists [name, has_content]
+        self.open_elements = list()
+        self.table_depth = 0
+        #html5lib drops the newline right after the <pre>
+        self.drop_newline = False
+
+    def get_tokens(self):
+        """yields sanitized tokens, with the stripped
+        elements removed"""
+        if self.whitelist and not self.strip_tags:
+            return iter(self.tokenizer)
+
+        tokens = tokenizer.HTMLTokenizer.__iter__(self.tokenizer)
+        if self.strip_tags:
+            tokens = strip_elements(tokens, self.strip_tags)
+        if self.whitelist:
+            return self.sanitize_tokens(tokens)
+        return tokens
+
+    def sanitize_tokens(self, tokens):
+        for token in tokens:
+            token = self.tokenizer.sanitize_token(token)
+            if token:
+                yield token
+
+    def open_element(self, token):
+        """checks that the element would be appended
+        to the current one and returns the serializer token"""
+        name = token['name']
+        if name not in STREAMED_ELEMENTS:
+            raise TreeConstructionRequired()
+        open_elements = self.open_elements
+        if open_elements:
+            current_name = open_elements[-1][0]
+        else:
+            current_name = None
+
+        if name in TABLE_PART_PARENTS:
+            if current_name not in TABLE_PART_PARENTS[name]:
+                raise TreeConstructionRequired()
+        elif current_name in TABLE_CONTEXT_ELEMENTS:
+            raise TreeConstructionRequired()
+
+        if name in P_CLOSING_ELEMENTS:
+            for element in open_elements:
+                if element[0] == 'p':
+                    raise TreeConstructionRequired()
+
+        if name in HEADING_ELEMENTS and current_name in HEADING_ELEMENTS:
+            raise TreeConstructionRequired()
+
+        if name in LIST_ITEM_SIBLINGS:
+            siblings = LIST_ITEM_SIBLINGS[name]
+            for element in reversed(open_elements):
+                if element[0] in siblings:
+                    raise TreeConstructionRequired()
+                if element[0] in SPECIAL_ELEMENTS \
+                    and element[0] not in ('address', 'div', 'p'):
+                    break
+
+        if name == 'a':
+            for element in open_elements:
+                if element[0] == 'a':
+                    raise TreeConstructionRequired()
+
+        if name == 'table':
+            #newline dropping depends on the insertion mode
+            if self.drop_newline:
+                raise TreeConstructionRequired()
+            self.table_depth += 1
+        elif name == 'pre':
+            if self.table_depth:
+                raise TreeConstructionRequired()
+            self.drop_newline = True
+
+        if open_elements:
+            open_elements[-1][1] = True
+
+        data = token.get('data') or ()
+        attrs = dict(data)
+        if len(attrs) != len(data):
+            #parser keeps the first of the repeated attributes
+            raise TreeConstructionRequired()
+        if name in VOID_ELEMENTS:
+            return {'type': 'EmptyTag', 'name': name, 'data': attrs}
+
+        open_elements.append([name, False])
+        return {'type': 'StartTag', 'name': name, 'data': attrs}
+
+    def close_element(self, token):
+        """checks that the end tag closes the current element
+        and returns the serializer token"""
+        name = token['name']
+        if not self.open_elements or self.open_elements[-1][0] != name:
+            raise TreeConstructionRequired()
+        self.open_elements.pop()
+        if name == 'table':
+            self.table_depth -= 1
+        return {'type': 'EndTag', 'name': name}
+
+    def add_text(self, token):
+        """returns the serializer token for the text
+        or ``None`` if there is no text to insert"""
+        data = token['data']
+        open_elements = self.open_elements
+        if token['type'] == SPACE_CHARACTERS_TOKEN:
+            if self.drop_newline and self.table_depth == 0:
+                self.drop_newline = False
+                if data.startswith('\n') and open_elements \
+                    and open_elements[-1][0] == 'pre' \
+                    and open_elements[-1][1] == False:
+                    data = data[1:]
+            token_type = 'SpaceCharacters'
+        else:
+            if open_elements \
+                and open_elements[-1][0] in TABLE_CONTEXT_ELEMENTS:
+                raise TreeConstructionRequired()
+            token_type = 'Characters'
+
+        if not data:
+            return None
+        if open_elements:
+            open_elements[-1][1] = True
+        return {'type': token_type, 'data': data}
+
+    def get_serializer_tokens(self):
+        """yields tokens in the format of the html5lib
+        tree walkers, raises :class:`TreeConstructionRequired`"""
+        for token in self.token_stream:
+            self.tokens.append(token)
+            token_type = token['type']
+            if token_type in (CHARACTERS, SPACE_CHARACTERS_TOKEN):
+                token = self.add_text(token)
+                if token:
+                    yield token
+            elif token_type in (START_TAG, EMPTY_TAG):
+                yield self.open_element(token)
+            elif token_type == END_TAG:
+                yield self.close_element(token)
+            elif token_type == COMMENT:
+                raise TreeConstructionRequired()
+            #doctypes and parse errors do not produce output
+
+        while self.open_elements:
+            name = self.open_elements.pop()[0]
+            yield {'type': 'EndTag', 'name': name}
+
+    def sanitize(self):
+        """returns the sanitized html"""
+        s = serializer.HTMLSerializer(omit_optional_tags=False,
+                                      quote_attr_values=True)
+        try:
+            return u''.join(s.serialize(self.get_serializer_tokens()))
+        except TreeConstructionRequired:
+            if not self.whitelist:
+                #the parser must switch the tokenizer into the
+                #raw text mode for <textarea>, <iframe>, etc.
+                return strip_tags_with_tree(self.html, self.strip_tags)
+            tokens = self.tokens
+            tokens.extend(self.token_stream)
+            replay = TokenReplay(tokens, self.tokenizer.stream)
+            return serialize_fragment(lambda *args, **kwargs: replay, self.html)
+
+
+def sanitize_html(html, strip_tags=None):
+    """Sanitizes an HTML fragment.
+
+    Elements listed in ``strip_tags`` are removed together
+    with the contents.
+    """
+    return StreamingSanitizer(html, strip_tags).sanitize()
+
+def strip_tags(html, tags=None):
+    """strips tags from given html output"""
+    #a corner case
+    if html.strip() == '':
+        return html
+
+    assert(tags != None)
+
+    return StreamingSanitizer(html, tags, whitelist=False).sanitize()
+
 def site_url(url):
     from askbot.conf import settings
     base_url = urlparse(settings.APP_URL)
@@ -5,16 +5,64 @@ Twitter-style @mentions"""
 
 import re
 import logging
+import threading
+from functools import wraps
 from askbot import const
 from askbot.conf import settings as askbot_settings
+from askbot.deps.livesettings import signals as livesettings_signals
 from askbot.utils.html import sanitize_html, strip_tags
+from django.core import cache
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import md5_constructor
 from django.utils.html import urlize
 from markdown2 import Markdown
 #url taken from http://regexlib.com/REDetails.aspx?regexp_id=501 by Brian Bothwell
 URL_RE = re.compile("((?<!(href|.src|data)=['\"])((http|https|ftp)\://([a-zA-Z0-9\.\-]+(\:[a-zA-Z0-9\.&amp;%\$\-]+)*@)*((25[0-5]|2[0-4][0-9]|[0-1]{1}[0-9]{2}|[1-9]{1}[0-9]{1}|[1-9])\.(25[0-5]|2[0-4][0-9]|[0-1]{1}[0-9]{2}|[1-9]{1}[0-9]{1}|[1-9]|0)\.(25[0-5]|2[0-4][0-9]|[0-1]{1}[0-9]{2}|[1-9]{1}[0-9]{1}|[1-9]|0)\.(25[0-5]|2[0-4][0-9]|[0-1]{1}[0-9]{2}|[1-9]{1}[0-9]{1}|[0-9])|localhost|([a-zA-Z0-9\-]+\.)*[a-zA-Z0-9\-]+\.(com|edu|gov|int|mil|net|org|biz|arpa|info|name|pro|aero|coop|museum|[a-zA-Z]{2}))(\:[0-9]+)*(/($|[a-zA-Z0-9\.\,\?\'\\\+&amp;%\$#\=~_\-]+))*))")
 
+#settings which affect the output of the markdown parser
+MARKUP_SETTING_NAMES = (
+    'ENABLE_MATHJAX',
+    'MARKUP_CODE_FRIENDLY',
+    'ENABLE_VIDEO_EMBEDDING',
+    'ENABLE_AUTO_LINKING',
+    'AUTO_LINK_PATTERNS',
+    'AUTO_LINK_URLS',
+)
+#increment when conversion or sanitizing of html changes
+#to discard the html cached by the previous versions
+HTML_CACHE_VERSION = 1
+
+#building the parser is expensive, because link patterns
+#are compiled, so parsers are reused. Parser holds state during
+#the conversion, therefore each thread gets its own parser
+PARSER_POOL = threading.local()
+
+def get_markup_settings_key():
+    """returns a string identifying current values
+    of the settings that affect the markup conversion"""
+    values = [getattr(askbot_settings, name) for name in MARKUP_SETTING_NAMES]
+    return repr(values)
+
 def get_parser():
-    """returns an instance of configured ``markdown2`` parser
+    """returns an instance of configured ``markdown2`` parser,
+    the instance is shared within the thread and is rebuilt
+    when the markup settings change
+    """
+    settings_key = get_markup_settings_key()
+    if getattr(PARSER_POOL, 'settings_key', None) != settings_key:
+        PARSER_POOL.parser = build_parser()
+        PARSER_POOL.settings_key = settings_key
+    return PARSER_POOL.parser
+
+def clear_parser_pool(sender, setting=None, **kwargs):
+    """drops the parser when markup settings change"""
+    if setting is None or setting.key in MARKUP_SETTING_NAMES:
+        PARSER_POOL.__dict__.clear()
+
+livesettings_signals.configuration_value_changed.connect(clear_parser_pool)
+
+def build_parser():
+    """returns a new instance of configured ``markdown2`` parser
     """
     extras = ['link-patterns', 'video']  
 
@@ -70,28 +118,66 @@ def format_mention_in_html(mentioned_user):
     username = mentioned_user.username
     return '<a href="%s">@%s</a>' % (url, username)
 
+class MentionTrie(object):
+    """trie of the lowercased usernames of the users
+    who can be mentioned, finds the users whose names
+    start the text in one pass over the beginning of the text.
+
+    When several names match, the user who was added first
+    wins - like the first matching user in a list.
+    """
+    def __init__(self, users=None):
+        self.root = dict()
+        self.size = 0
+        for user in users or ():
+            self.add(user)
+
+    def add(self, user):
+        node = self.root
+        for char in user.username.lower():
+            node = node.setdefault(char, dict())
+        #key None holds (order of addition, user) at the end of the name
+        if None not in node:
+            node[None] = (self.size, user)
+        self.size += 1
+
+    def match(self, text):
+        """returns first added user whose name matches the
+        beginning of the ``text`` and is followed by the end of the text
+        or by a termination character, and the remainder of the text"""
+        best = None
+        node = self.root
+        for position, char in enumerate(text):
+            if None in node and char in const.TWITTER_STYLE_MENTION_TERMINATION_CHARS:
+                if best is None or node[None][0] < best[0][0]:
+                    best = (node[None], position)
+            node = node.get(char.lower())
+            if node is None:
+                break
+        else:
+            if None in node:
+                if best is None or node[None][0] < best[0][0]:
+                    best = (node[None], len(text))
+
+        if best is None:
+            return None, text
+        (order, user), position = best
+        return user, text[position:]
+
+
 def extract_first_matching_mentioned_author(text, anticipated_authors):
     """matches beginning of ``text`` string with the names
-    of ``anticipated_authors`` - list of user objects.
+    of ``anticipated_authors`` - list of user objects
+    or a :class:`MentionTrie`.
     Returns upon first match the first matched user object
     and the remainder of the ``text`` that is left unmatched"""
 
     if len(text) == 0:
         return None, ''
 
-    for author in anticipated_authors:
-        if text.lower().startswith(author.username.lower()):
-            ulen = len(author.username)
-            if len(text) == ulen:
-                text = ''
-            elif text[ulen] in const.TWITTER_STYLE_MENTION_TERMINATION_CHARS:
-                text = text[ulen:]
-            else:
-                #near miss, here we could insert a warning that perhaps
-                #a termination character is needed
-                continue
-            return author, text
-    return None, text
+    if not isinstance(anticipated_authors, MentionTrie):
+        anticipated_authors = MentionTrie(anticipated_authors)
+    return anticipated_authors.match(text)
 
 def extract_mentioned_name_seeds(text):
     """Returns list of strings that
@@ -135,6 +221,7 @@ def mentionize_text(text, anticipated_authors):
     """
     output = ''
     mentioned_authors = list()
+    anticipated_authors = MentionTrie(anticipated_authors)
     while '@' in text:
         #the purpose of this loop is to convert any occurance of 
         #'@mention ' syntax
@@ -192,16 +279,46 @@ def mentionize_text(text, anticipated_authors):
     output += text
     return mentioned_authors, output
 
+def cached_conversion(converter):
+    """decorator caching the output of the text to html
+    converter, by the hash of the input text and the markup
+    settings. Same text is then converted only once, as it
+    happens with the revisions, repeated edits and re-parsing
+    """
+    @wraps(converter)
+    def wrapped(text):
+        key_seed = '%s-%d-%s-%s' % (
+                            converter.__name__,
+                            HTML_CACHE_VERSION,
+                            get_markup_settings_key(),
+                            text
+                        )
+        key = 'html-' + md5_constructor(smart_str(key_seed)).hexdigest()
+        html = cache.cache.get(key)
+        if html is None:
+            html = converter(text)
+            cache.cache.set(key, html, const.LONG_TIME)
+        return html
+    return wrapped
+
+@cached_conversion
 def plain_text_input_converter(text):
     """plain text to html converter"""
     return sanitize_html(urlize('<p>' + text + '</p>'))
 
+@cached_conversion
 def markdown_input_converter(text):
     """markdown to html converter"""
     text = urlize(text)
     text = get_parser().convert(text)
     return sanitize_html(text)
 
+@cached_conversion
+def markdown_to_sanitized_html(text):
+    """markdown to html converter, without the urlize step"""
+    return sanitize_html(get_parser().convert(text))
+
+@cached_conversion
 def tinymce_input_converter(text):
     """tinymce input to production html converter"""
     text = urlize(text)
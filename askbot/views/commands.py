@@ -25,6 +25,7 @@ from django.template.loader import get_template
 from django.views.decorators import csrf
 from django.utils import simplejson
 from django.utils.html import escape
+from django.utils.translation import get_language
 from django.utils.translation import ugettext as _
 from django.utils.translation import string_concat
 from askbot.utils.slug import slugify
@@ -78,8 +79,10 @@ def manage_inbox(request):
                         memo_set.delete()
                     elif action_type == 'mark_new':
                         memo_set.update(status = models.ActivityAuditStatus.STATUS_NEW)
+                        models.invalidate_moderation_items_version()
                     elif action_type == 'mark_seen':
                         memo_set.update(status = models.ActivityAuditStatus.STATUS_SEEN)
+                        models.invalidate_moderation_items_version()
                     elif action_type == 'remove_flag':
                         for memo in memo_set:
                             activity_type = memo.activity.activity_type
@@ -311,11 +314,6 @@ def vote(request):
                                         post = post
                                     )
 
-            ####################################################################
-            if vote_type in ('1', '2'): # up/down-vote question
-                post.thread.update_summary_html() # regenerate question/thread summary html
-            ####################################################################
-
         elif vote_type in ['7', '8']:
             #flag question or answer
             if vote_type == '7':
@@ -485,10 +483,14 @@ def get_tags_by_wildcard(request):
     if wildcard is None:
         return HttpResponseForbidden()
 
-    matching_tags = models.Tag.objects.get_by_wildcards( [wildcard,] )
-    count = matching_tags.count()
-    names = matching_tags.values_list('name', flat = True)[:20]
-    re_data = simplejson.dumps({'tag_count': count, 'tag_names': list(names)})
+    if models.autocomplete.is_enabled() and len(wildcard) > 1:
+        names = models.autocomplete.get_tag_names_by_prefix(wildcard[:-1])
+        count = len(names)
+    else:
+        matching_tags = models.Tag.objects.get_by_wildcards( [wildcard,] )
+        count = matching_tags.count()
+        names = matching_tags.values_list('name', flat = True)
+    re_data = simplejson.dumps({'tag_count': count, 'tag_names': list(names[:20])})
     return HttpResponse(re_data, mimetype = 'application/json')
 
 @decorators.get_only
@@ -544,6 +546,10 @@ def get_tag_list(request):
     """returns tags to use in the autocomplete
     function
     """
+    if models.autocomplete.is_enabled():
+        output = models.autocomplete.get_tag_list_text()
+        return HttpResponse(output, mimetype = 'text/plain')
+
     tags = models.Tag.objects.filter(
                         deleted = False,
                         status = models.Tag.STATUS_ACCEPTED
@@ -820,6 +826,20 @@ def api_get_questions(request):
     query = request.GET.get('query_text', '').strip()
     tag_name = request.GET.get('tag_name', None)
 
+    #without the groups answer counts and visibility
+    #of the threads are the same for all users
+    if query and models.autocomplete.is_enabled() \
+        and askbot_settings.GROUPS_ENABLED == False:
+        language_code = None
+        if getattr(django_settings, 'ASKBOT_MULTILINGUAL', False):
+            language_code = get_language()
+        json_data = models.autocomplete.get_questions_json(
+                                                query,
+                                                tag_name=tag_name,
+                                                language_code=language_code
+                                            )
+        return HttpResponse(json_data, mimetype = "application/json")
+
     if askbot_settings.GROUPS_ENABLED:
         threads = models.Thread.objects.get_visible(user=request.user)
     else:
@@ -868,6 +888,8 @@ def set_tag_filter_strategy(request):
         assert(filter_value in allowed_values_dict)
         request.user.email_tag_filter_strategy = filter_value
     request.user.save()
+    if filter_type == 'email':
+        models.subscription_index.record_change(request.user.id)
     return HttpResponse('', mimetype = "application/json")
 
 
@@ -1347,6 +1369,23 @@ def get_users_info(request):
     query = request.GET['q']
     limit = IntegerField().clean(request.GET['limit'])
 
+    if query and models.autocomplete.is_enabled():
+        usernames = models.user_directory.get_usernames_by_prefix(query, limit)
+        if request.user.is_administrator_or_moderator():
+            user_ids = [user_id for username, user_id in usernames]
+            emails = dict(
+                models.User.objects.filter(
+                                    id__in=user_ids
+                                ).values_list('id', 'email')
+            )
+            result_list = [
+                '%s|%s' % (username, emails.get(user_id, '')) \
+                for username, user_id in usernames
+            ]
+        else:
+            result_list = [username for username, user_id in usernames]
+        return HttpResponse('\n'.join(result_list), mimetype = 'text/plain')
+
     users = models.User.objects
     user_info_list = users.filter(username__istartswith=query)
 
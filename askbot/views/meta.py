@@ -15,14 +15,17 @@ from django.utils.translation import ugettext as _
 from django.utils.translation import ugettext_lazy
 from django.views import static
 from django.views.decorators import csrf
+from django.views.decorators.http import condition
+from django.utils.hashcompat import md5_constructor
 from django.db.models import Max, Count
 from askbot import skins
+from askbot import sitemap as sitemap_utils
 from askbot.conf import settings as askbot_settings
 from askbot.forms import FeedbackForm
 from askbot.utils.url_utils import get_login_url
 from askbot.utils.forms import get_next_url
 from askbot.mail import mail_moderators
-from askbot.models import BadgeData, Award, User, Tag
+from askbot.models import BadgeData, Award, User, Tag, Thread
 from askbot.models import badges as badge_data
 from askbot.skins.loaders import render_text_into_skin
 from askbot.utils.decorators import admins_only
@@ -181,6 +184,63 @@ def badge(request, id):
     }
     return render(request, 'badge.html', data)
 
+def get_sitemap_file_name(request, sitemaps, section=None, page=None):
+    if section is None:
+        return sitemap_utils.INDEX_FILE_NAME
+    return sitemap_utils.get_shard_file_name(section, int(page))
+
+def get_sitemap_last_modified(request, sitemaps, section=None, page=None):
+    """returns modification time of the pregenerated sitemap file,
+    if there is one, or time of the latest activity on the site,
+    the value is calculated once per request"""
+    if not hasattr(request, '_sitemap_last_modified'):
+        file_name = get_sitemap_file_name(request, sitemaps, section, page)
+        file_path = sitemap_utils.get_pregenerated_file_path(file_name)
+        if file_path:
+            last_modified = sitemap_utils.get_file_modified_time(file_path)
+        else:
+            last_modified = Thread.objects.get_last_activity_at()
+        request._sitemap_last_modified = last_modified
+    return request._sitemap_last_modified
+
+def get_sitemap_etag(request, sitemaps, section=None, page=None):
+    last_modified = get_sitemap_last_modified(request, sitemaps, section, page)
+    if last_modified is None:
+        return None
+    file_name = get_sitemap_file_name(request, sitemaps, section, page)
+    return md5_constructor(file_name + last_modified.isoformat()).hexdigest()
+
+@condition(etag_func=get_sitemap_etag, last_modified_func=get_sitemap_last_modified)
+def sitemap_index(request, sitemaps):
+    """sitemap index, listing the shards of all sitemaps"""
+    file_path = sitemap_utils.get_pregenerated_file_path(
+                                            sitemap_utils.INDEX_FILE_NAME
+                                        )
+    if file_path:
+        chunks = open(file_path)
+    else:
+        chunks = sitemap_utils.iter_sitemap_index(sitemaps)
+    return HttpResponse(chunks, mimetype='application/xml')
+
+@condition(etag_func=get_sitemap_etag, last_modified_func=get_sitemap_last_modified)
+def sitemap_shard(request, sitemaps, section=None, page=None):
+    """one shard of the sitemap, read from the pregenerated
+    file or streamed to the client as it is rendered"""
+    page = int(page)
+    file_path = sitemap_utils.get_pregenerated_file_path(
+                            sitemap_utils.get_shard_file_name(section, page)
+                        )
+    if file_path:
+        chunks = open(file_path)
+    else:
+        if section not in sitemaps:
+            raise Http404
+        sitemap = sitemaps[section]()
+        if page < 1 or page > sitemap_utils.get_shard_count(sitemap):
+            raise Http404
+        chunks = sitemap_utils.iter_sitemap_shard(sitemap, page)
+    return HttpResponse(chunks, mimetype='application/xml')
+
 @admins_only
 def list_suggested_tags(request):
     """moderators and administrators can list tags that are
@@ -8,6 +8,7 @@ allow adding new comments via Ajax form post.
 """
 import datetime
 import logging
+import math
 import urllib
 import operator
 from django.shortcuts import get_object_or_404
@@ -41,6 +42,7 @@ from askbot.utils import functions
 from askbot.utils.html import sanitize_html
 from askbot.utils.decorators import anonymous_forbidden, ajax_only, get_only
 from askbot.search.state_manager import SearchState, DummySearchState
+from askbot.search import keyset
 from askbot.templatetags import extra_tags
 from askbot.conf import settings as askbot_settings
 from askbot.views import context
@@ -89,11 +91,25 @@ def questions(request, **kwargs):
     if meta_data['non_existing_tags']:
         search_state = search_state.remove_tags(meta_data['non_existing_tags'])
 
-    paginator = Paginator(qs, page_size)
-    if paginator.num_pages < search_state.page:
-        search_state.page = 1
-    page = paginator.page(search_state.page)
-    page.object_list = list(page.object_list) # evaluate the queryset
+    if askbot_settings.QUESTIONS_KEYSET_PAGINATION_ENABLED \
+        and keyset.supports_sort_method(search_state.sort):
+        #"next" and "previous" pages are retrieved by the position
+        #in the list, while the total count is cached for a while
+        q_count = keyset.get_cached_count(qs, search_state, request.user)
+        page = keyset.KeysetPage(qs, search_state, page_size)
+        num_pages = int(math.ceil(float(q_count)/page_size))
+        #cached count may be stale
+        num_pages = max(num_pages, page.number)
+        if page.has_next():
+            num_pages = max(num_pages, page.next_page_number())
+    else:
+        paginator = Paginator(qs, page_size)
+        if paginator.num_pages < search_state.page:
+            search_state.page = 1
+        page = paginator.page(search_state.page)
+        page.object_list = list(page.object_list) # evaluate the queryset
+        q_count = paginator.count
+        num_pages = paginator.num_pages
 
     # INFO: Because for the time being we need question posts and thread authors
     #       down the pipeline, we have to precache them in thread objects
@@ -114,8 +130,8 @@ def questions(request, **kwargs):
                         )
 
     paginator_context = {
-        'is_paginated' : (paginator.count > page_size),
-        'pages': paginator.num_pages,
+        'is_paginated' : (num_pages > 1),
+        'pages': num_pages,
         'current_page_number': search_state.page,
         'page_object': page,
         'base_url' : search_state.query_string(),
@@ -144,12 +160,10 @@ def questions(request, **kwargs):
     reset_method_count = len(filter(None, [search_state.query, search_state.tags, meta_data.get('author_name', None)]))
 
     if request.is_ajax():
-        q_count = paginator.count
-
         question_counter = ungettext('%(q_num)s question', '%(q_num)s questions', q_count)
         question_counter = question_counter % {'q_num': humanize.intcomma(q_count),}
 
-        if q_count > page_size:
+        if num_pages > 1:
             paginator_tpl = get_template('main_page/paginator.html')
             paginator_html = paginator_tpl.render(
                 RequestContext(
@@ -215,7 +229,7 @@ def questions(request, **kwargs):
             'page_size': page_size,
             'query': search_state.query,
             'threads' : page,
-            'questions_count' : paginator.count,
+            'questions_count' : q_count,
             'reset_method_count': reset_method_count,
             'scope': search_state.scope,
             'show_sort_by_relevance': conf.should_show_sort_by_relevance(),
@@ -504,6 +518,8 @@ def question(request, id):#refactor - long subroutine. display question body, an
 
         request.session['question_view_times'][question_post.id] = \
                                                     datetime.datetime.now()
+        #the nested dictionary was changed in place
+        request.session.modified = True
 
         #2) run the slower jobs in a celery task
         from askbot import tasks
@@ -563,7 +579,10 @@ def question(request, id):#refactor - long subroutine. display question body, an
                     break
 
     data = {
-        'is_cacheable': False,#is_cacheable, #temporary, until invalidation fix
+        'is_cacheable': is_cacheable,
+        'content_cache_key': thread.get_content_cache_key(
+                                            answer_sort_method, request.user
+                                        ),
         'long_time': const.LONG_TIME,#"forever" caching
         'page_class': 'question-page',
         'active_tab': 'questions',
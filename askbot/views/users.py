@@ -42,6 +42,7 @@ from askbot import models
 from askbot import exceptions
 from askbot.models.badges import award_badges_signal
 from askbot.models.tag import format_personal_group_name
+from askbot.models import user_stats as user_stats_summary
 from askbot.search.state_manager import SearchState
 from askbot.utils import url_utils
 from askbot.utils.loading import load_module
@@ -131,29 +132,55 @@ def show_users(request, by_group=False, group_id=None, group_slug=None):
         page = 1
 
     search_query = request.GET.get('query',  "")
+    use_user_directory = models.user_directory.is_enabled()
+    if group:
+        group_id = group.id
+    else:
+        group_id = None
+
     if search_query == "":
-        if sortby == "newest":
-            order_by_parameter = '-date_joined'
-        elif sortby == "last":
-            order_by_parameter = 'date_joined'
-        elif sortby == "user":
-            order_by_parameter = 'username'
+        if sortby not in ('newest', 'last', 'user'):
+            sortby = 'reputation'
+
+        if use_user_directory:
+            #ids of the users in the order of the listing
+            objects_list = Paginator(
+                        models.user_directory.get_user_list(sortby, group_id),
+                        const.USERS_PAGE_SIZE
+                    )
         else:
-            # default
-            order_by_parameter = '-reputation'
+            if sortby == "newest":
+                order_by_parameter = '-date_joined'
+            elif sortby == "last":
+                order_by_parameter = 'date_joined'
+            elif sortby == "user":
+                order_by_parameter = 'username'
+            else:
+                # default
+                order_by_parameter = '-reputation'
 
-        objects_list = Paginator(
-                            users.order_by(order_by_parameter),
-                            const.USERS_PAGE_SIZE
-                        )
+            objects_list = Paginator(
+                                users.order_by(order_by_parameter),
+                                const.USERS_PAGE_SIZE
+                            )
         base_url = request.path + '?sort=%s&amp;' % sortby
     else:
         sortby = "reputation"
-        matching_users = models.get_users_by_text_query(search_query, users)
-        objects_list = Paginator(
-                            matching_users.order_by('-reputation'),
-                            const.USERS_PAGE_SIZE
-                        )
+        matching_ids = list()
+        if use_user_directory:
+            #users are found by the prefixes of the usernames,
+            #the profiles are searched if no username matches
+            matching_ids = models.user_directory.search(search_query, group_id)
+
+        if matching_ids:
+            objects_list = Paginator(matching_ids, const.USERS_PAGE_SIZE)
+        else:
+            use_user_directory = False
+            matching_users = models.get_users_by_text_query(search_query, users)
+            objects_list = Paginator(
+                                matching_users.order_by('-reputation'),
+                                const.USERS_PAGE_SIZE
+                            )
         base_url = request.path + '?name=%s&amp;sort=%s&amp;' % (search_query, sortby)
 
     try:
@@ -161,6 +188,11 @@ def show_users(request, by_group=False, group_id=None, group_slug=None):
     except (EmptyPage, InvalidPage):
         users_page = objects_list.page(objects_list.num_pages)
 
+    if use_user_directory:
+        users_page.object_list = models.user_directory.get_users(
+                                                    users_page.object_list
+                                                )
+
     paginator_data = {
         'is_paginated' : is_paginated,
         'pages': objects_list.num_pages,
@@ -400,23 +432,15 @@ def user_stats(request, user, context):
 
     top_answer_count = len(top_answers)
     #
-    # Votes
+    # Votes, tags and awards - cached summary
     #
-    up_votes = models.Vote.objects.get_up_vote_count_from_user(user)
-    down_votes = models.Vote.objects.get_down_vote_count_from_user(user)
-    votes_today = models.Vote.objects.get_votes_count_today_from_user(user)
+    summary = user_stats_summary.get_summary(user)
+    up_votes = summary.up_votes
+    down_votes = summary.down_votes
+    votes_today = summary.get_votes_today()
     votes_total = askbot_settings.MAX_VOTES_PER_USER_PER_DAY
 
-    #
-    # Tags
-    #
-    # INFO: There's bug in Django that makes the following query kind of broken (GROUP BY clause is problematic):
-    #       http://stackoverflow.com/questions/7973461/django-aggregation-does-excessive-group-by-clauses
-    #       Fortunately it looks like it returns correct results for the test data
-    user_tags = models.Tag.objects.filter(threads__posts__author=user).distinct().\
-                    annotate(user_tag_usage_count=Count('threads')).\
-                    order_by('-user_tag_usage_count')[:const.USER_VIEW_DATA_SIZE]
-    user_tags = list(user_tags) # evaluate
+    user_tags = user_stats_summary.get_top_tags(user)
 
     when = askbot_settings.MARKED_TAGS_ARE_PUBLIC_WHEN
     if when == 'always' or \
@@ -443,42 +467,11 @@ def user_stats(request, user, context):
 #    import ipdb; ipdb.set_trace()
 
     #
-    # Badges/Awards (TODO: refactor into Managers/QuerySets when a pattern emerges; Simplify when we get rid of Question&Answer models)
+    # Badges/Awards
     #
-    post_type = ContentType.objects.get_for_model(models.Post)
-
-    user_awards = models.Award.objects.filter(user=user).select_related('badge')
-
-    awarded_post_ids = []
-    for award in user_awards:
-        if award.content_type_id == post_type.id:
-            awarded_post_ids.append(award.object_id)
-
-    awarded_posts = models.Post.objects.filter(id__in=awarded_post_ids)\
-                    .select_related('thread') # select related to avoid additional queries in Post.get_absolute_url()
-
-    awarded_posts_map = {}
-    for post in awarded_posts:
-        awarded_posts_map[post.id] = post
-
     badges_dict = collections.defaultdict(list)
 
-    for award in user_awards:
-        # Fetch content object
-        if award.content_type_id == post_type.id:
-            #here we go around a possibility of awards
-            #losing the content objects when the content
-            #objects are deleted for some reason
-            awarded_post = awarded_posts_map.get(award.object_id, None)
-            if awarded_post is not None:
-                #protect from awards that are associated with deleted posts
-                award.content_object = awarded_post
-                award.content_object_is_post = True
-            else:
-                award.content_object_is_post = False
-        else:
-            award.content_object_is_post = False
-
+    for award in summary.awards:
         # "Assign" to its Badge
         badges_dict[award.badge].append(award)
 